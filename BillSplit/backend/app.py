@@ -1,64 +1,105 @@
 import os
 from flask import Flask, jsonify
 from flask_cors import CORS
-from backend.firebase_db import initialize_firebase_app
+from backend.config import DEFAULT_JWT_SECRET_KEY, DEFAULT_SECRET_KEY
+from backend.firebase_db import warm_up
 
 # Import blueprints
 from backend.routes.auth import auth_bp
 from backend.routes.groups import groups_bp
 from backend.routes.expenses import expenses_bp
 from backend.routes.settlements import settlements_bp
+from backend.routes.recurring import recurring_bp
+from backend.routes.jobs import jobs_bp
+from backend.routes.batch import batch_bp
+from backend.routes.profiling import init_profiling, profiles_bp
 
-app = Flask(__name__, instance_relative_config=True)
-CORS(app)
+def _check_local_id_tokens(app: Flask):
+    """Refuses LOCAL_ID_TOKENS (sign in as anyone) where it could reach real accounts."""
+    if not app.config.get('LOCAL_ID_TOKENS') or app.config.get('STORAGE_BACKEND') == 'memory':
+        return # The memory backend always accepts local tokens; it holds no real data
+    if app.config.get('STORAGE_BACKEND') != 'sqlite':
+        raise RuntimeError("LOCAL_ID_TOKENS is only allowed with STORAGE_BACKEND=sqlite or memory.")
+    if app.config.get('SECRET_KEY') == DEFAULT_SECRET_KEY or app.config.get('JWT_SECRET_KEY') == DEFAULT_JWT_SECRET_KEY:
+        raise RuntimeError("LOCAL_ID_TOKENS requires SECRET_KEY and JWT_SECRET_KEY to be set.")
 
-app.config.from_object('backend.config.Config')
-app.config.from_pyfile('instance/config.py', silent=True)
+def create_app(config_object: str = 'backend.config.Config') -> Flask:
+    """
+    Builds the Flask app. Storage is not touched here: the Firebase SDK is imported and the
+    client created on the first request that needs it, or earlier through the /warmup hook.
+    """
+    app = Flask(__name__, instance_relative_config=True)
+    CORS(app, expose_headers=['ETag', 'X-Group-Version', 'X-Profile-Id']) # Let browser clients read cache validators
 
+    app.config.from_object(config_object)
+    app.config.from_pyfile('instance/config.py', silent=True)
+    _check_local_id_tokens(app)
 
-# Initialize Firebase Admin SDK for Firestore.
-# This must happen within the Flask app context because it might read app.config.
-with app.app_context():
-    try:
-        # Call the initialization function
-        initialize_firebase_app()
-    except Exception as e:
-        app.logger.critical(f"Failed to initialize Firebase Admin SDK: {e}")
-        # Depending on criticality, you might want to exit or log heavily
+    # Register Blueprints
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(groups_bp, url_prefix='/api/groups')
+    app.register_blueprint(expenses_bp, url_prefix='/api/expenses')
+    app.register_blueprint(settlements_bp, url_prefix='/api/settlements')
+    app.register_blueprint(recurring_bp, url_prefix='/api/recurring')
+    app.register_blueprint(jobs_bp, url_prefix='/api/jobs')
+    app.register_blueprint(batch_bp, url_prefix='/api/batch')
+    app.register_blueprint(profiles_bp, url_prefix='/api/profiles')
+    init_profiling(app) # No hooks unless profiling is configured
 
-# Register Blueprints
-app.register_blueprint(auth_bp, url_prefix='/api/auth')
-app.register_blueprint(groups_bp, url_prefix='/api/groups')
-app.register_blueprint(expenses_bp, url_prefix='/api/expenses')
-app.register_blueprint(settlements_bp, url_prefix='/api/settlements')
+    @app.route('/')
+    def index():
+        return "BillSplit Backend Running!"
 
-@app.route('/')
-def index():
-    return "BillSplit Backend Running!"
+    @app.route('/warmup')
+    def warmup():
+        # Called by the orchestrator (startup probe / warm-up request) before real traffic arrives
+        try:
+            seconds = warm_up()
+            return jsonify({"status": "warm", "seconds": round(seconds, 3)}), 200
+        except Exception as e:
+            app.logger.error(f"Warm-up failed: {e}")
+            return jsonify({"status": "error", "message": "Storage is not available."}), 503
 
-# Error Handlers (Optional but Recommended)
-@app.errorhandler(400)
-def bad_request(error):
-    return jsonify({"message": "Bad request.", "error": str(error)}), 400
+    @app.route('/metrics/recurring')
+    def recurring_metrics():
+        # Materialization throughput and lag of this worker's recurring expense scheduler
+        from backend.services.recurring_service import get_scheduler
+        scheduler = get_scheduler()
+        if scheduler is None:
+            return jsonify({"enabled": False}), 200
+        return jsonify(dict(scheduler.metrics.snapshot(), enabled=True)), 200
 
-@app.errorhandler(401)
-def unauthorized(error):
-    return jsonify({"message": "Unauthorized access."}), 401
+    # Error Handlers (Optional but Recommended)
+    @app.errorhandler(400)
+    def bad_request(error):
+        return jsonify({"message": "Bad request.", "error": str(error)}), 400
 
-@app.errorhandler(403)
-def forbidden(error):
-    return jsonify({"message": "Forbidden access."}), 403
+    @app.errorhandler(401)
+    def unauthorized(error):
+        return jsonify({"message": "Unauthorized access."}), 401
 
-@app.errorhandler(404)
-def not_found(error):
-    return jsonify({"message": "Resource not found."}), 404
+    @app.errorhandler(403)
+    def forbidden(error):
+        return jsonify({"message": "Forbidden access."}), 403
 
-@app.errorhandler(500)
-def internal_server_error(error):
-    app.logger.exception('An internal server error occurred', exc_info=error)
-    return jsonify({"message": "An internal server error occurred."}), 500
+    @app.errorhandler(404)
+    def not_found(error):
+        return jsonify({"message": "Resource not found."}), 404
+
+    @app.errorhandler(500)
+    def internal_server_error(error):
+        app.logger.exception('An internal server error occurred', exc_info=error)
+        return jsonify({"message": "An internal server error occurred."}), 500
+
+    return app
+
+# Module-level app for `flask run`, WSGI servers pointing at backend.app:app and existing imports
+app = create_app()
 
 if __name__ == '__main__':
-    # To run: navigate to BillSplit/backend in terminal and run `flask run`
-    # Or, if you prefer, `python app.py` (ensure FLASK_APP and FLASK_DEBUG are set in env)
-    app.run(debug=True) # debug=True is good for development
\ No newline at end of file
+    # Development server only. To run: navigate to BillSplit/backend in terminal and run `flask run`
+    # Or, if you prefer, `python app.py` (set FLASK_DEBUG=True in env for the debugger and reloader)
+    # In production use the pre-forking server: gunicorn -c backend/gunicorn.conf.py backend.app:app
+    from backend.services.recurring_service import start_scheduler
+    start_scheduler(app)
+    app.run(debug=app.config['DEBUG'])
\ No newline at end of file
@@ -0,0 +1,513 @@
+"""
+Concurrency stress test of the expense and membership mutations.
+
+Seeds users and a few groups into a local backend (memory, or a temporary SQLite file), then runs
+--clients threads that each call the service layer --operations times with a randomized mix of
+operations (--mix), concentrated on a few hot groups so they interleave: add_member_to_group
+against remove_member_from_group, update_expense against update_expense and delete_expense on the
+same expense, add_expense against delete_group, and so on. Clients pick their targets from what
+they believe exists, so many calls find the group, expense or membership gone; those count as
+lost races, not errors.
+
+Reports throughput, per operation latency percentiles and outcomes (ok, lost race, rejected by
+validation, error), and the contention on storage transactions: how long callers waited for the
+memory backend's lock or SQLite's write lock before their transaction ran. Then checks invariants
+on the quiesced data:
+  orphaned_data               nothing left of deleted groups (expenses, members, rollups, tombstones)
+  balances_sum_to_zero        settlement balances of each group sum to zero (groups whose expenses
+                              involve removed members are skipped: their shares are left out by design;
+                              --stable-groups of the seeded groups are never deleted nor lose members, so they
+                              are always checked)
+  settlements_match_expenses  settlement balances equal the balances recomputed from the expenses
+  rollups_match_expenses      monthly analytics rollups equal the counts and totals of the expenses
+  sync_seq_within_version     no expense or member carries a sync_seq beyond its group's version
+and exits non-zero when one is violated.
+
+Run from the BillSplit directory:
+    python -m backend.benchmarks.concurrency_stress --clients 16 --operations 300
+    python -m backend.benchmarks.concurrency_stress --backend sqlite --stable-groups 6   # no member removals at all
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from backend.benchmarks.loadtest import _percentile
+from backend.benchmarks.settlement_phases import git_commit
+
+MIX = {
+    'add_expense': 30,
+    'update_expense': 20,
+    'delete_expense': 8,
+    'add_member': 10,
+    'remove_member': 8,
+    'create_group': 3,
+    'delete_group': 1,
+    'settlements': 20,
+}
+TOLERANCE = 0.011 # Balances and rollups are rounded to cents
+EXAMPLES = 5 # Violations listed per invariant
+
+
+class World:
+    """What the clients believe exists: group ids with their member ids, and expense ids. Goes stale by design."""
+
+    def __init__(self, users):
+        self.users = users # (user_id, firebase_uid)
+        self.lock = threading.Lock()
+        self.groups = {} # group_id -> set of member ids
+        self.all_groups = set() # Every group ever created, for the orphan check
+        self.stable = set() # Groups remove_member and delete_group leave alone, so their balances must sum to zero
+        self.expenses = [] # (expense_id, group_id)
+
+    def add_group(self, group_id, member_ids):
+        with self.lock:
+            self.groups[group_id] = set(member_ids)
+            self.all_groups.add(group_id)
+
+    def pick_group(self, rng, removable=False):
+        """A group id and its believed members; the first groups are the hot ones. removable skips the stable groups."""
+        with self.lock:
+            group_ids = sorted(set(self.groups) - self.stable if removable else self.groups)
+            if not group_ids:
+                return None, []
+            group_id = rng.choices(group_ids, weights=[1.0 / (rank + 1) for rank in range(len(group_ids))])[0]
+            return group_id, sorted(self.groups[group_id])
+
+    def members_of(self, group_id):
+        with self.lock:
+            return sorted(self.groups.get(group_id, ()))
+
+    def pick_expense(self, rng):
+        with self.lock:
+            return rng.choice(self.expenses) if self.expenses else (None, None)
+
+
+class Contention:
+    """Time callers waited before their storage transaction ran."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waits = []
+
+    def waited(self, seconds):
+        with self.lock:
+            self.waits.append(seconds)
+
+    def report(self):
+        if not self.waits:
+            return {'transactions': 0}
+        return {
+            'transactions': len(self.waits),
+            'wait_total_s': round(sum(self.waits), 3),
+            'wait_mean_ms': round(statistics.mean(self.waits) * 1e3, 3),
+            'wait_p95_ms': round(_percentile(self.waits, 95) * 1e3, 3),
+            'wait_max_ms': round(max(self.waits) * 1e3, 3),
+        }
+
+
+def instrument_transactions(db, contention):
+    """Times the wait for the memory backend's transaction lock or SQLite's BEGIN IMMEDIATE."""
+    if hasattr(db, 'run_transaction'):
+        run_transaction = db.run_transaction
+
+        def timed_run_transaction(function, *args, **kwargs):
+            called = time.perf_counter()
+
+            def timed(transaction, *inner_args, **inner_kwargs):
+                contention.waited(time.perf_counter() - called)
+                return function(transaction, *inner_args, **inner_kwargs)
+            return run_transaction(timed, *args, **kwargs)
+        db.run_transaction = timed_run_transaction
+    else:
+        transaction = db.transaction
+
+        @contextmanager
+        def timed_transaction(write=True):
+            called = time.perf_counter()
+            with transaction(write) as connection:
+                if write:
+                    contention.waited(time.perf_counter() - called)
+                yield connection
+        db.transaction = timed_transaction
+
+
+def seed(db, backend, users, groups, stable_groups, rng):
+    """Creates the users directly in storage and the groups through group_service; every other one is stable, up to stable_groups."""
+    created = []
+    for n in range(users):
+        data = {'firebase_uid': f"stress{n:05d}", 'email': f"stress{n}@example.test", 'username': f"Stress {n}",
+                'created_at': datetime.utcnow()}
+        if backend == 'sqlite':
+            user_id, _ = db.create_user(data)
+        else:
+            user_id = f"su{n:05d}"
+            db.collection('users').document(user_id).set(data)
+        created.append((user_id, data['firebase_uid']))
+    world = World(created)
+    for n in range(groups):
+        group = create_group(world, rng, name=f"Stress group {n}")
+        # Interleaved, so the hot groups include both kinds
+        if group is not None and n % 2 == 1 and len(world.stable) < stable_groups:
+            world.stable.add(group.id)
+    for group_id in sorted(world.groups):
+        if len(world.stable) >= stable_groups:
+            break
+        world.stable.add(group_id)
+    return world
+
+
+def create_group(world, rng, name=None):
+    from backend.models import GroupCreate
+    from backend.services import group_service
+    owner_id, _ = rng.choice(world.users)
+    member_uids = [firebase_uid for _, firebase_uid in rng.sample(world.users, min(len(world.users), rng.randint(3, 8)))]
+    group = group_service.create_group(GroupCreate(name=name or f"Group {rng.getrandbits(32):x}", member_uids=member_uids), owner_id)
+    if group is None:
+        return None
+    world.add_group(group.id, group.members)
+    return group
+
+
+def build_operations(world):
+    """operation name -> function(rng) returning the service call's result (None/False when a race was lost)."""
+    from backend.models import ExpenseCreate, ExpenseParticipantData, ExpenseUpdate
+    from backend.services import expense_service, group_service, settlement_service
+
+    def participants(rng, member_ids):
+        chosen = rng.sample(member_ids, rng.randint(1, min(4, len(member_ids))))
+        parts = [ExpenseParticipantData(user_id=user_id) for user_id in chosen]
+        if len(parts) > 1 and rng.random() < 0.3:
+            parts[0].share_amount = round(rng.uniform(1, 5), 2) # Mixed split
+        return parts
+
+    def add_expense(rng):
+        group_id, member_ids = world.pick_group(rng)
+        if not member_ids:
+            return None
+        expense = expense_service.add_expense(ExpenseCreate(
+            description=f"Stress {rng.getrandbits(24):x}", amount=round(rng.uniform(5, 200), 2),
+            payer_id=rng.choice(member_ids), group_id=group_id, participants=participants(rng, member_ids)))
+        if expense is not None:
+            with world.lock:
+                world.expenses.append((expense.id, group_id))
+        return expense
+
+    def update_expense(rng):
+        expense_id, group_id = world.pick_expense(rng)
+        if expense_id is None:
+            return None
+        fields = {'amount': round(rng.uniform(5, 200), 2)}
+        if rng.random() < 0.3:
+            member_ids = world.members_of(group_id)
+            if member_ids:
+                fields['participants'] = participants(rng, member_ids)
+        return expense_service.update_expense(expense_id, ExpenseUpdate(**fields))
+
+    def delete_expense(rng):
+        expense = world.pick_expense(rng)
+        if expense[0] is None:
+            return None
+        deleted = expense_service.delete_expense(expense[0])
+        with world.lock:
+            if expense in world.expenses:
+                world.expenses.remove(expense)
+        return deleted
+
+    def add_member(rng):
+        group_id, _ = world.pick_group(rng)
+        if group_id is None:
+            return None
+        user_id, _ = rng.choice(world.users)
+        added = group_service.add_member_to_group(group_id, user_id)
+        if added:
+            with world.lock:
+                world.groups.get(group_id, set()).add(user_id)
+        return added
+
+    def remove_member(rng):
+        group_id, member_ids = world.pick_group(rng, removable=True)
+        if len(member_ids) < 3:
+            return None # Keep groups big enough to split expenses
+        user_id = rng.choice(member_ids)
+        removed = group_service.remove_member_from_group(group_id, user_id)
+        if removed:
+            with world.lock:
+                world.groups.get(group_id, set()).discard(user_id)
+        return removed
+
+    def delete_group(rng):
+        with world.lock:
+            if len(set(world.groups) - world.stable) <= 2:
+                return None # Leave something to race on
+        group_id, _ = world.pick_group(rng, removable=True)
+        deleted = group_service.delete_group(group_id)
+        with world.lock:
+            world.groups.pop(group_id, None)
+        return deleted
+
+    def settlements(rng):
+        group_id, _ = world.pick_group(rng)
+        return settlement_service.calculate_settlements(group_id) if group_id else None
+
+    return {
+        'add_expense': add_expense,
+        'update_expense': update_expense,
+        'delete_expense': delete_expense,
+        'add_member': add_member,
+        'remove_member': remove_member,
+        'create_group': lambda rng: create_group(world, rng),
+        'delete_group': delete_group,
+        'settlements': settlements,
+    }
+
+
+def run_clients(app, operations, mix, clients, per_client, seed_value):
+    """Runs the clients; returns (wall seconds, {operation: [(outcome, seconds, error)]})."""
+    names = sorted(mix)
+    weights = [mix[name] for name in names]
+    results = {name: [] for name in names}
+    results_lock = threading.Lock()
+    start = threading.Barrier(clients)
+
+    def client(index):
+        rng = random.Random(seed_value * 1000 + index)
+        local = {name: [] for name in names}
+        with app.app_context():
+            start.wait()
+            for _ in range(per_client):
+                name = rng.choices(names, weights=weights)[0]
+                began = time.perf_counter()
+                error = None
+                try:
+                    outcome = 'ok' if operations[name](rng) not in (None, False) else 'lost_race'
+                except ValueError:
+                    outcome = 'rejected' # Validation saw the group, user or membership gone
+                except Exception as e:
+                    outcome, error = 'error', f"{type(e).__name__}: {e}"
+                local[name].append((outcome, time.perf_counter() - began, error))
+        with results_lock:
+            for name, outcomes in local.items():
+                results[name].extend(outcomes)
+
+    threads = [threading.Thread(target=client, args=(index,), name=f"stress-client-{index}") for index in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, results
+
+
+def summarize(outcomes):
+    latencies = [seconds for _, seconds, _ in outcomes]
+    counts = {outcome: sum(1 for o, _, _ in outcomes if o == outcome) for outcome in ('ok', 'lost_race', 'rejected', 'error')}
+    errors = {}
+    for _, _, error in outcomes:
+        if error:
+            errors[error] = errors.get(error, 0) + 1
+    summary = dict(calls=len(outcomes), **counts)
+    if latencies:
+        summary.update({
+            'p50_ms': round(_percentile(latencies, 50) * 1e3, 3),
+            'p95_ms': round(_percentile(latencies, 95) * 1e3, 3),
+            'p99_ms': round(_percentile(latencies, 99) * 1e3, 3),
+            'max_ms': round(max(latencies) * 1e3, 3),
+        })
+    if errors:
+        summary['errors'] = dict(sorted(errors.items(), key=lambda item: -item[1])[:EXAMPLES])
+    return summary
+
+
+def load_state(db, backend, all_groups):
+    """Group versions, members with their sync_seq, expense sync_seqs, and what is left of deleted groups."""
+    if backend == 'sqlite':
+        connection = db.connection()
+        versions = dict(connection.execute("SELECT id, version FROM groups").fetchall())
+        members = {}
+        for group_id, user_id, sync_seq in connection.execute("SELECT group_id, user_id, sync_seq FROM memberships"):
+            members.setdefault(group_id, {})[user_id] = sync_seq
+        expense_seqs = {expense_id: (group_id, sync_seq) for expense_id, group_id, sync_seq in
+                        connection.execute("SELECT id, group_id, sync_seq FROM expenses")}
+        leftovers = {}
+        for table in ('memberships', 'expenses', 'group_month_rollups', 'member_month_rollups', 'tombstones'):
+            for group_id, count in connection.execute(f"SELECT group_id, COUNT(*) FROM {table} "
+                                                      f"WHERE group_id NOT IN (SELECT id FROM groups) GROUP BY group_id"):
+                leftovers.setdefault(group_id, {})[table] = count
+        return versions, members, expense_seqs, leftovers
+
+    versions = {doc.id: doc.to_dict().get('version') or 0 for doc in db.collection('groups').stream()}
+    members = {group_id: {doc.id: doc.to_dict().get('sync_seq') for doc in db.collection(f"groups/{group_id}/members").stream()}
+               for group_id in versions}
+    expense_seqs = {doc.id: (data.get('group_id'), data.get('sync_seq'))
+                    for doc in db.collection('expenses').stream() for data in [doc.to_dict()]}
+    leftovers = {}
+    for group_id, _ in expense_seqs.values():
+        if group_id not in versions:
+            leftovers.setdefault(group_id, {}).setdefault('expenses', 0)
+            leftovers[group_id]['expenses'] += 1
+    for group_id in all_groups - set(versions):
+        for collection in ('members', 'monthly_rollups', 'member_rollups', 'tombstones'):
+            count = len(list(db.collection(f"groups/{group_id}/{collection}").stream()))
+            if count:
+                leftovers.setdefault(group_id, {})[collection] = count
+    return versions, members, expense_seqs, leftovers
+
+
+def check_invariants(db, backend, world):
+    """{invariant: {'checked': n, 'violations': n, 'examples': [...]}}"""
+    from backend.services import analytics_service, export_service, settlement_service
+    versions, members, expense_seqs, leftovers = load_state(db, backend, world.all_groups)
+    results = {name: {'checked': 0, 'violations': 0, 'examples': []} for name in
+               ('orphaned_data', 'balances_sum_to_zero', 'settlements_match_expenses', 'rollups_match_expenses', 'sync_seq_within_version')}
+
+    def check(name, ok, example):
+        results[name]['checked'] += 1
+        if not ok:
+            results[name]['violations'] += 1
+            if len(results[name]['examples']) < EXAMPLES:
+                results[name]['examples'].append(example)
+
+    for group_id in sorted(world.all_groups - set(versions)):
+        check('orphaned_data', group_id not in leftovers, {'group_id': group_id, 'left': leftovers.get(group_id)})
+    for group_id in sorted(set(leftovers) - world.all_groups):
+        check('orphaned_data', False, {'group_id': group_id, 'left': leftovers[group_id]})
+
+    for expense_id, (group_id, sync_seq) in sorted(expense_seqs.items()):
+        if group_id in versions and sync_seq is not None:
+            check('sync_seq_within_version', sync_seq <= versions[group_id],
+                  {'expense_id': expense_id, 'sync_seq': sync_seq, 'version': versions[group_id]})
+    for group_id, group_members in sorted(members.items()):
+        for user_id, sync_seq in sorted(group_members.items()):
+            if group_id in versions and sync_seq is not None:
+                check('sync_seq_within_version', sync_seq <= versions[group_id],
+                      {'group_id': group_id, 'member_id': user_id, 'sync_seq': sync_seq, 'version': versions[group_id]})
+
+    skipped = 0
+    for group_id in sorted(versions):
+        member_ids = set(members.get(group_id, {}))
+        expenses = [data for _, data in export_service.iter_group_expenses(group_id)]
+        # Balances as calculate_settlements defines them: expenses paid by non-members and shares of non-members are left out
+        expected = {user_id: 0.0 for user_id in member_ids}
+        involves_non_members = False
+        months = {}
+        for data in expenses:
+            month = months.setdefault(analytics_service.month_key(data['created_at']), [0, 0.0])
+            month[0] += 1
+            month[1] += data['amount']
+            deltas = settlement_service.expense_balance_deltas(data)
+            if data['payer_id'] not in member_ids or not member_ids.issuperset(deltas):
+                involves_non_members = True
+            if data['payer_id'] not in member_ids:
+                continue
+            for user_id, delta in deltas.items():
+                if user_id in member_ids:
+                    expected[user_id] += delta
+
+        balances = settlement_service.calculate_settlements(group_id).balances
+        mismatched = {user_id: (balances.get(user_id), round(expected.get(user_id, 0.0), 2)) for user_id in set(balances) | set(expected)
+                      if abs((balances.get(user_id) or 0.0) - expected.get(user_id, 0.0)) > TOLERANCE}
+        check('settlements_match_expenses', not mismatched, {'group_id': group_id, 'balance_vs_expected': mismatched})
+        if involves_non_members and group_id not in world.stable:
+            skipped += 1
+        else:
+            total = sum(balances.values())
+            check('balances_sum_to_zero', abs(total) <= TOLERANCE * max(1, len(balances)), {'group_id': group_id, 'sum': round(total, 4)})
+
+        rollups = {month.month: (month.expense_count, month.total_amount) for month in analytics_service.get_group_analytics(group_id).months}
+        recomputed = {month: (count, round(total, 2)) for month, (count, total) in months.items()}
+        check('rollups_match_expenses', set(rollups) == set(recomputed) and all(
+            rollups[month][0] == recomputed[month][0] and abs(rollups[month][1] - recomputed[month][1]) <= TOLERANCE for month in rollups),
+            {'group_id': group_id, 'rollups': rollups, 'expenses': recomputed})
+    results['balances_sum_to_zero']['stable_groups'] = len(world.stable & set(versions))
+    results['balances_sum_to_zero']['skipped_groups_with_removed_members'] = skipped
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--path', help='SQLite file (default: a new temporary file)')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--operations', type=int, default=200, help='operations per client')
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--groups', type=int, default=6, help='groups seeded; few groups means more interleaving')
+    parser.add_argument('--stable-groups', type=int, help='seeded groups that never lose members (default: half of --groups)')
+    parser.add_argument('--mix', action='append', default=[], metavar='NAME=WEIGHT',
+                        help=f"override operation weights, comma separated (defaults: {','.join(f'{k}={v}' for k, v in MIX.items())})")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="show the services' printed warnings (on stderr)")
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args()
+
+    mix = dict(MIX)
+    for item in ','.join(args.mix).split(','):
+        if item:
+            name, weight = item.split('=', 1)
+            if name not in MIX:
+                parser.error(f"unknown operation {name}; one of {', '.join(MIX)}")
+            mix[name] = float(weight)
+    mix = {name: weight for name, weight in mix.items() if weight > 0}
+
+    os.environ['STORAGE_BACKEND'] = args.backend
+    os.environ['RECURRING_SCHEDULER_ENABLED'] = 'False'
+    if args.backend == 'sqlite':
+        os.environ['SQLITE_PATH'] = os.path.abspath(args.path or os.path.join(tempfile.mkdtemp(), 'stress.sqlite3'))
+    from backend.app import app
+    from backend.firebase_db import get_store
+    import logging
+    app.logger.setLevel(logging.WARNING)
+
+    # The services print a warning per skipped non-member share and the like; keep stdout for the JSON report
+    quiet = contextlib.redirect_stdout(sys.stderr if args.verbose else open(os.devnull, 'w'))
+    with app.app_context(), quiet:
+        db = get_store()
+        rng = random.Random(args.seed)
+        stable_groups = args.groups // 2 if args.stable_groups is None else args.stable_groups
+        world = seed(db, args.backend, args.users, args.groups, stable_groups, rng)
+        contention = Contention()
+        instrument_transactions(db, contention)
+        if hasattr(db, 'stats'):
+            db.stats.reset()
+        print(f"Running {args.clients} clients x {args.operations} operations on {args.backend} ...", file=sys.stderr)
+        seconds, outcomes = run_clients(app, build_operations(world), mix, args.clients, args.operations, args.seed)
+        backend_totals = db.stats.snapshot() if hasattr(db, 'stats') else None
+        print("Checking invariants ...", file=sys.stderr)
+        invariants = check_invariants(db, args.backend, world)
+
+    calls = sum(len(results) for results in outcomes.values())
+    report = {
+        'commit': git_commit(), 'backend': args.backend, 'clients': args.clients, 'operations_per_client': args.operations,
+        'users': args.users, 'groups': args.groups, 'stable_groups': len(world.stable), 'mix': mix, 'seed': args.seed,
+        'seconds': round(seconds, 3),
+        'throughput_ops_per_s': round(calls / seconds, 1) if seconds else None,
+        'lost_races': sum(1 for results in outcomes.values() for outcome, _, _ in results if outcome in ('lost_race', 'rejected')),
+        'errors': sum(1 for results in outcomes.values() for outcome, _, _ in results if outcome == 'error'),
+        'operations': {name: summarize(results) for name, results in sorted(outcomes.items())},
+        'contention': contention.report(),
+        'backend_totals': backend_totals,
+        'invariants': invariants,
+    }
+    print(json.dumps(report, indent=2, default=str))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+    violated = [name for name, result in invariants.items() if result['violations']]
+    for name in violated:
+        print(f"VIOLATED {name}: {invariants[name]['violations']} of {invariants[name]['checked']} checks", file=sys.stderr)
+    if violated:
+        sys.exit(1)
+    print("All invariants hold.", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Parse throughput and memory of the expense representations used on the hot paths.
+
+Compares, for the same synthetic Firestore document dicts:
+  - pydantic: full validation into ExpenseInDB (what the API boundary does per returned expense)
+  - trusted:  ExpenseInDB.model_construct, skipping validation for documents we wrote ourselves
+  - columns:  ExpenseColumns (interned users, flat participant arrays), used by calculate_settlements
+
+Run from the BillSplit directory:
+    python -m backend.benchmarks.expense_parsing --expenses 10000 --members 20
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from backend.models import ExpenseInDB, ExpenseParticipantData
+from backend.services.expense_records import ExpenseColumns
+
+
+def make_documents(count, members, explicit_fraction=0.3, seed=42):
+    """Synthetic expense documents shaped like the ones add_expense stores."""
+    rng = random.Random(seed)
+    member_ids = [f"user{i:05d}" for i in range(members)]
+    start = datetime(2023, 1, 1)
+    documents = []
+    for n in range(count):
+        participants = rng.sample(member_ids, rng.randint(2, min(members, 8)))
+        amount = round(rng.uniform(5, 500), 2)
+        if rng.random() < explicit_fraction:
+            shares = [round(amount / len(participants), 2)] * len(participants)
+            parts = [{'user_id': u, 'share_amount': s} for u, s in zip(participants, shares)]
+        else:
+            parts = [{'user_id': u, 'share_amount': None} for u in participants]
+        documents.append((f"exp{n:08d}", {
+            'description': f"Expense {n}",
+            'amount': amount,
+            'payer_id': rng.choice(participants),
+            'group_id': 'group-1',
+            'participants': parts,
+            'created_at': start + timedelta(minutes=n),
+        }))
+    return member_ids, documents
+
+
+PATHS = {
+    'pydantic': lambda member_ids, docs: [ExpenseInDB(doc_id=doc_id, **data) for doc_id, data in docs],
+    'trusted': lambda member_ids, docs: [ExpenseInDB.model_construct(
+        id=doc_id, **dict(data, participants=[ExpenseParticipantData.model_construct(**p) for p in data['participants']]))
+        for doc_id, data in docs],
+    'columns': lambda member_ids, docs: ExpenseColumns.from_documents(docs, user_ids=member_ids),
+}
+
+
+def measure(path, member_ids, documents, repeats=3):
+    build = PATHS[path]
+    best = float('inf')
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        result = build(member_ids, documents)
+        best = min(best, time.perf_counter() - start)
+        del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = build(member_ids, documents)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    per_10k = 10000.0 / len(documents)
+    return {
+        'docs_per_second': round(len(documents) / best),
+        'seconds': round(best, 4),
+        'retained_mb_per_10k': round(retained * per_10k / 2**20, 3),
+        'peak_mb_per_10k': round(peak * per_10k / 2**20, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--expenses', type=int, default=10000)
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--paths', default=','.join(PATHS), help='comma separated subset of ' + ', '.join(PATHS))
+    args = parser.parse_args()
+
+    member_ids, documents = make_documents(args.expenses, args.members)
+    results = {'expenses': args.expenses, 'members': args.members, 'paths': {}}
+    for path in args.paths.split(','):
+        results['paths'][path] = measure(path, member_ids, documents, args.repeats)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
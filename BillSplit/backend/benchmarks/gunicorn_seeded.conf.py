@@ -0,0 +1,15 @@
+# Benchmark-only gunicorn config used by worker_scaling.py: the production config plus a
+# hook that seeds each worker's memory backend with the same deterministic dataset, since
+# STORAGE_BACKEND=memory keeps one independent store per worker process.
+import os
+
+_production_config = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gunicorn.conf.py')
+exec(compile(open(_production_config).read(), _production_config, 'exec'))
+
+def post_worker_init(worker):
+    from backend.benchmarks.loadtest import seed
+    from backend.firebase_db import get_store
+    with worker.wsgi.app_context():
+        seed(get_store(), int(os.environ['BENCH_USERS']), int(os.environ['BENCH_GROUPS']),
+             int(os.environ['BENCH_EXPENSES']), seed_value=int(os.environ.get('BENCH_SEED', '1')))
+    worker.log.info(f"Worker {worker.pid} seeded.")
@@ -0,0 +1,392 @@
+"""
+Synthetic-data load test for the whole API.
+
+Generates a realistic dataset (skewed group sizes, mixed equal/explicit splits) directly into
+the in-process memory backend, then drives every blueprint (auth, groups, expenses,
+settlements) through the Flask app and reports, per endpoint: throughput, p50/p95/p99
+latency and backend round trips per request. Results can be saved as a baseline and later
+runs compared against it; regressions make the command exit non-zero.
+
+Run from the BillSplit directory:
+    python -m backend.benchmarks.loadtest --scale small --save-baseline loadtest_baseline.json
+    python -m backend.benchmarks.loadtest --scale small --baseline loadtest_baseline.json
+
+--scale production is 100k users, 20k groups and 2M expenses; it needs several GB of RAM
+and the full-scan endpoints (GET /api/groups, GET /api/expenses/user/<id>) are slow at
+that size, so keep their request counts low (--requests-per-endpoint / --endpoint-requests).
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+SCALES = {
+    'tiny': dict(users=300, groups=60, expenses=3000),
+    'small': dict(users=2000, groups=400, expenses=40000),
+    'medium': dict(users=20000, groups=4000, expenses=400000),
+    'production': dict(users=100000, groups=20000, expenses=2000000),
+}
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Dataset:
+    """Ids of the seeded users, groups and expenses, for building requests."""
+
+    def __init__(self):
+        self.users = [] # (user_id, firebase_uid)
+        self.groups = [] # (group_id, owner_id, [member_ids])
+        self.group_weights = []
+        self.expenses_by_group = {}
+        self.lock = threading.Lock()
+        self.created_groups = [] # Groups created during the run, safe to mutate and delete
+        self.created_expenses = [] # (expense_id, payer_id)
+
+
+def seed(db, users, groups, expenses, seed_value=1):
+    """Writes the synthetic dataset through the memory backend's batch API."""
+    rng = random.Random(seed_value)
+    data = Dataset()
+    start = datetime(2023, 1, 1)
+    span_minutes = 2 * 365 * 24 * 60
+
+    batch = db.batch()
+
+    def write(reference, document):
+        nonlocal batch
+        batch.set(reference, document)
+        if len(batch) >= 500:
+            batch.commit()
+            batch = db.batch()
+
+    for n in range(users):
+        user_id = f"u{n:07d}"
+        firebase_uid = f"fb{n:07d}"
+        write(db.collection('users').document(user_id), {
+            'firebase_uid': firebase_uid, 'email': f"user{n}@example.test", 'username': f"User {n}",
+            'created_at': start,
+        })
+        data.users.append((user_id, firebase_uid))
+
+    # Skewed group sizes: most groups are 2-6 people, a long tail goes up to 250
+    user_ids = [user_id for user_id, _ in data.users]
+    for n in range(groups):
+        size = min(250, len(user_ids), 2 + int(rng.paretovariate(1.3)))
+        members = rng.sample(user_ids, size)
+        group_id = f"g{n:06d}"
+        write(db.collection('groups').document(group_id), {
+            'name': f"Group {n}", 'description': None, 'owner_id': members[0], 'created_at': start, 'version': 0,
+        })
+        for member_id in members:
+            write(db.collection('groups').document(group_id).collection('members').document(member_id), {'added_at': start})
+        data.groups.append((group_id, members[0], members))
+        # Bigger groups are more active, with extra skew between groups of the same size
+        data.group_weights.append(size * rng.paretovariate(1.5))
+
+    chosen = rng.choices(range(groups), weights=data.group_weights, k=expenses)
+    for n, group_index in enumerate(chosen):
+        group_id, _, members = data.groups[group_index]
+        participants = rng.sample(members, rng.randint(min(2, len(members)), min(len(members), 10)))
+        amount = round(rng.uniform(3, 400), 2)
+        if rng.random() < 0.3:
+            # Mixed split: one explicit share, the remainder split equally between the others
+            parts = [{'user_id': participants[0], 'share_amount': round(amount * rng.uniform(0.1, 0.6), 2)}]
+            parts += [{'user_id': user_id, 'share_amount': None} for user_id in participants[1:]]
+        else:
+            parts = [{'user_id': user_id, 'share_amount': None} for user_id in participants]
+        expense_id = f"e{n:08d}"
+        write(db.collection('expenses').document(expense_id), {
+            'description': f"Expense {n}", 'amount': amount, 'payer_id': rng.choice(participants),
+            'group_id': group_id, 'participants': parts,
+            'created_at': start + timedelta(minutes=rng.randrange(span_minutes)),
+        })
+        data.expenses_by_group.setdefault(group_id, []).append(expense_id)
+
+    batch.commit()
+    return data
+
+
+def build_scenarios(data: Dataset):
+    """endpoint name -> function(rng, token_for) returning (method, url, json_body, user_id)."""
+
+    def pick_group(rng):
+        return data.groups[rng.choices(range(len(data.groups)), weights=data.group_weights)[0]]
+
+    def pick_member(rng):
+        group_id, owner_id, members = pick_group(rng)
+        return group_id, owner_id, members, rng.choice(members)
+
+    def register(rng):
+        return 'POST', '/api/auth/register', {'idToken': f"local:new{rng.getrandbits(48):x}"}, None
+
+    def login(rng):
+        _, firebase_uid = rng.choice(data.users)
+        return 'POST', '/api/auth/login', {'idToken': f"local:{firebase_uid}"}, None
+
+    def me(rng):
+        return 'GET', '/api/auth/me', None, rng.choice(data.users)[0]
+
+    def create_group(rng):
+        owner_id, _ = rng.choice(data.users)
+        member_uids = [firebase_uid for _, firebase_uid in rng.sample(data.users, 2)]
+        return 'POST', '/api/groups', {'name': 'Load test group', 'member_uids': member_uids}, owner_id
+
+    def list_groups(rng):
+        return 'GET', '/api/groups', None, pick_member(rng)[3]
+
+    def get_group(rng):
+        group_id, _, _, user_id = pick_member(rng)
+        return 'GET', f"/api/groups/{group_id}", None, user_id
+
+    def update_group(rng):
+        group_id, owner_id, _ = pick_group(rng)
+        return 'PUT', f"/api/groups/{group_id}", {'description': f"updated {rng.random():.6f}"}, owner_id
+
+    def created_group(rng):
+        with data.lock:
+            return rng.choice(data.created_groups) if data.created_groups else None
+
+    def add_member(rng):
+        group = created_group(rng)
+        if group is None:
+            return None
+        user_id, firebase_uid = rng.choice(data.users)
+        with data.lock:
+            if user_id in group[2]:
+                return None
+            group[2].append(user_id)
+        return 'POST', f"/api/groups/{group[0]}/members", {'firebase_uid': firebase_uid}, group[1]
+
+    def remove_member(rng):
+        group = created_group(rng)
+        if group is None:
+            return None
+        with data.lock:
+            removable = [user_id for user_id in group[2] if user_id != group[1]]
+            if not removable:
+                return None
+            member_id = rng.choice(removable)
+            group[2].remove(member_id)
+        return 'DELETE', f"/api/groups/{group[0]}/members/{member_id}", None, group[1]
+
+    def delete_group(rng):
+        with data.lock:
+            group = data.created_groups.pop() if data.created_groups else None
+        if group is None:
+            return None
+        return 'DELETE', f"/api/groups/{group[0]}", None, group[1]
+
+    def create_expense(rng):
+        group_id, _, members, payer_id = pick_member(rng)
+        participants = rng.sample(members, min(len(members), rng.randint(2, 6)))
+        body = {'description': 'Load test expense', 'amount': round(rng.uniform(3, 200), 2), 'payer_id': payer_id,
+                'group_id': group_id, 'participants': [{'user_id': user_id} for user_id in participants]}
+        return 'POST', '/api/expenses', body, payer_id
+
+    def get_expense(rng):
+        group_id, _, members, user_id = pick_member(rng)
+        expense_ids = data.expenses_by_group.get(group_id)
+        if not expense_ids:
+            return None
+        return 'GET', f"/api/expenses/{rng.choice(expense_ids)}", None, user_id
+
+    def group_expenses(rng):
+        group_id, _, _, user_id = pick_member(rng)
+        return 'GET', f"/api/expenses/group/{group_id}", None, user_id
+
+    def user_expenses(rng):
+        user_id = pick_member(rng)[3]
+        return 'GET', f"/api/expenses/user/{user_id}", None, user_id
+
+    def update_expense(rng):
+        with data.lock:
+            expense = rng.choice(data.created_expenses) if data.created_expenses else None
+        if expense is None:
+            return None
+        return 'PUT', f"/api/expenses/{expense[0]}", {'description': f"edited {rng.random():.6f}"}, expense[1]
+
+    def delete_expense(rng):
+        with data.lock:
+            expense = data.created_expenses.pop() if data.created_expenses else None
+        if expense is None:
+            return None
+        return 'DELETE', f"/api/expenses/{expense[0]}", None, expense[1]
+
+    def settlements(rng):
+        group_id, _, _, user_id = pick_member(rng)
+        return 'GET', f"/api/settlements/{group_id}", None, user_id
+
+    # Order matters: creates run before the endpoints that mutate or delete what they created
+    return [
+        ('auth.register', register), ('auth.login', login), ('auth.me', me),
+        ('groups.create', create_group), ('groups.list', list_groups), ('groups.get', get_group),
+        ('groups.update', update_group), ('groups.add_member', add_member), ('groups.remove_member', remove_member),
+        ('expenses.create', create_expense), ('expenses.get', get_expense), ('expenses.group', group_expenses),
+        ('expenses.user', user_expenses), ('expenses.update', update_expense), ('expenses.delete', delete_expense),
+        ('settlements.get', settlements), ('groups.delete', delete_group),
+    ]
+
+
+def run_endpoint(app, db, data, name, make_request, requests, threads, tokens, seed_value):
+    client = app.test_client()
+    latencies, round_trips, errors = [], [], 0
+    lock = threading.Lock()
+
+    def one(index):
+        nonlocal errors
+        rng = random.Random(seed_value * 1000003 + index)
+        spec = make_request(rng)
+        if spec is None:
+            return
+        method, url, body, user_id = spec
+        headers = {'Authorization': f"Bearer {tokens(user_id)}"} if user_id else {}
+        with db.stats.track() as counters:
+            start = time.perf_counter()
+            response = client.open(url, method=method, json=body, headers=headers)
+            elapsed = time.perf_counter() - start
+        payload = response.get_json(silent=True) if response.status_code < 300 else None
+        with lock:
+            latencies.append(elapsed)
+            round_trips.append(counters.get('round_trips', 0))
+            if response.status_code >= 400:
+                errors += 1
+            if name == 'groups.create' and payload:
+                group_id = payload.get('doc_id') or payload.get('id')
+                data.created_groups.append((group_id, user_id, list(payload.get('members', []))))
+            if name == 'expenses.create' and payload:
+                data.created_expenses.append((payload.get('doc_id') or payload.get('id'), user_id))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - start
+
+    if not latencies:
+        return {'requests': 0}
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / wall, 1),
+        'p50_ms': round(_percentile(latencies, 50) * 1e3, 3),
+        'p95_ms': round(_percentile(latencies, 95) * 1e3, 3),
+        'p99_ms': round(_percentile(latencies, 99) * 1e3, 3),
+        'round_trips_mean': round(statistics.mean(round_trips), 2),
+        'round_trips_max': max(round_trips),
+    }
+
+
+def compare(results, baseline, latency_tolerance, round_trip_tolerance, latency_slack_ms=2.0):
+    """Returns human-readable regressions of results against a stored baseline."""
+    regressions = []
+    if baseline.get('dataset') != results['dataset']:
+        print(f"Warning: baseline dataset {baseline.get('dataset')} differs from this run {results['dataset']}", file=sys.stderr)
+    for name, current in results['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous or not current.get('requests') or not previous.get('requests'):
+            continue
+        # The absolute slack keeps sub-millisecond endpoints from flagging on scheduler noise
+        if current['p95_ms'] > previous['p95_ms'] * (1 + latency_tolerance) + latency_slack_ms:
+            regressions.append(f"{name}: p95 {current['p95_ms']}ms vs baseline {previous['p95_ms']}ms")
+        if current['round_trips_mean'] > previous['round_trips_mean'] * (1 + round_trip_tolerance) + 0.5:
+            regressions.append(f"{name}: {current['round_trips_mean']} round trips/request vs baseline {previous['round_trips_mean']}")
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{name}: {current['errors']} errors vs baseline {previous['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--groups', type=int)
+    parser.add_argument('--expenses', type=int)
+    parser.add_argument('--requests-per-endpoint', type=int, default=200)
+    parser.add_argument('--endpoint-requests', action='append', default=[], metavar='NAME=N',
+                        help='override the request count of one endpoint, e.g. groups.list=20')
+    parser.add_argument('--only', help='comma separated endpoint names to run')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='compare against this stored report')
+    parser.add_argument('--save-baseline', help='store this run as the baseline')
+    parser.add_argument('--latency-tolerance', type=float, default=0.5, help='allowed relative p95 increase')
+    parser.add_argument('--latency-slack-ms', type=float, default=2.0, help='allowed absolute p95 increase')
+    parser.add_argument('--round-trip-tolerance', type=float, default=0.0, help='allowed relative round-trip increase')
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    for key in ('users', 'groups', 'expenses'):
+        if getattr(args, key):
+            sizes[key] = getattr(args, key)
+    overrides = dict(item.split('=', 1) for item in args.endpoint_requests)
+
+    os.environ['STORAGE_BACKEND'] = 'memory'
+    from backend.app import app
+    from backend.firebase_db import get_store
+    from backend.services import auth_service
+    import logging
+    app.logger.setLevel(logging.WARNING)
+
+    with app.app_context():
+        db = get_store()
+        print(f"Seeding {sizes} ...", file=sys.stderr)
+        seed_start = time.perf_counter()
+        data = seed(db, seed_value=args.seed, **sizes)
+        print(f"Seeded in {time.perf_counter() - seed_start:.1f}s", file=sys.stderr)
+        db.stats.reset()
+
+        token_cache = {}
+        token_lock = threading.Lock()
+
+        def tokens(user_id):
+            with token_lock:
+                if user_id not in token_cache:
+                    with app.app_context(): # Called from the worker threads
+                        token_cache[user_id] = auth_service.generate_jwt_token(user_id)
+                return token_cache[user_id]
+
+        selected = set(args.only.split(',')) if args.only else None
+        results = {'dataset': sizes, 'threads': args.threads, 'endpoints': {}}
+        # The services print progress messages; keep stdout for the JSON report
+        with contextlib.redirect_stdout(sys.stderr):
+            for name, make_request in build_scenarios(data):
+                if selected and name not in selected:
+                    continue
+                requests = int(overrides.get(name, args.requests_per_endpoint))
+                print(f"{name}: {requests} requests", file=sys.stderr)
+                results['endpoints'][name] = run_endpoint(app, db, data, name, make_request, requests,
+                                                          args.threads, tokens, args.seed)
+        results['backend_totals'] = db.stats.snapshot()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.latency_tolerance, args.round_trip_tolerance, args.latency_slack_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against baseline.", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Before/after benchmark of field projections on the hot paths.
+
+Seeds one group into the memory backend (settlement_phases.seed_group), optionally pads every
+expense with a `notes` field standing in for notes and receipt metadata, then runs each hot
+path with QUERY_PROJECTIONS off (full documents) and on (projected fields only):
+  stream       the group's expense query alone, documents turned into dicts (transfer + parse)
+  settlements  calculate_settlements end to end
+  group        get_group (group document + member ids)
+  user         get_expenses_for_user (participants scan + matching documents)
+
+Reports bytes read, documents read and best wall time per path, and the after/before ratios.
+The memory backend counts bytes as the encoded size of the fields returned, so bytes_read is
+what Firestore would send. Its documents are already in process, so its times only cover
+copying the returned fields; against Firestore, transfer and protobuf decoding scale with
+bytes_read and dominate.
+
+Run from the BillSplit directory:
+    python -m backend.benchmarks.projections --expenses 1000,10000 --notes-bytes 0,512
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+
+from backend.benchmarks.settlement_phases import git_commit, measure, seed_group
+
+
+def pad_expenses(db, group_id, notes_bytes):
+    """Adds a notes field of roughly notes_bytes to every expense of the group."""
+    if not notes_bytes:
+        return
+    batch = db.batch()
+    for doc in db.collection('expenses').where('group_id', '==', group_id).select([]).stream():
+        batch.update(doc.reference, {'notes': 'x' * notes_bytes, 'receipt': {'content_type': 'image/jpeg', 'size': 120_000}})
+        if len(batch) >= 500:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+    db.stats.reset()
+
+
+def run_paths(app, db, group_id, user_id, projections, repeats):
+    from backend.services import expense_service, group_service, settlement_service
+    from backend.services.projections import SETTLEMENT_EXPENSE
+
+    app.config['QUERY_PROJECTIONS'] = projections
+    expenses = db.collection('expenses')
+    paths = {
+        'stream': lambda: list(SETTLEMENT_EXPENSE.stream(expenses.where('group_id', '==', group_id))),
+        'settlements': lambda: settlement_service.calculate_settlements(group_id),
+        'group': lambda: group_service.get_group(group_id),
+        'user': lambda: expense_service.get_expenses_for_user(user_id),
+    }
+    results = {}
+    for name, fn in paths.items():
+        with db.stats.track() as counters:
+            fn()
+        _, results[name] = measure(fn, repeats)
+        results[name]['bytes_read'] = counters.get('bytes_read', 0)
+        results[name]['reads'] = counters.get('reads', 0)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--expenses', default='1000,10000', help='comma separated expense counts')
+    parser.add_argument('--notes-bytes', default='0,512', help='comma separated sizes of the padding notes field')
+    parser.add_argument('--pattern', default='mixed')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help='write the JSON results here')
+    args = parser.parse_args()
+
+    os.environ['STORAGE_BACKEND'] = 'memory'
+    from backend.app import app
+    from backend.firebase_db import get_store
+
+    results = {'commit': git_commit(), 'members': args.members, 'results': []}
+    with app.app_context():
+        db = get_store()
+        for expenses in (int(e) for e in args.expenses.split(',')):
+            for notes_bytes in (int(n) for n in args.notes_bytes.split(',')):
+                print(f"expenses={expenses} notes_bytes={notes_bytes}", file=sys.stderr)
+                group_id = seed_group(db, args.members, expenses, args.pattern)
+                pad_expenses(db, group_id, notes_bytes)
+                # Settlement warnings go to stdout; keep them out of the results
+                with contextlib.redirect_stdout(io.StringIO()):
+                    before = run_paths(app, db, group_id, 'm00001', False, args.repeats)
+                    after = run_paths(app, db, group_id, 'm00001', True, args.repeats)
+                ratios = {
+                    name: {
+                        'bytes': round(after[name]['bytes_read'] / before[name]['bytes_read'], 3) if before[name]['bytes_read'] else None,
+                        'ms': round(after[name]['ms'] / before[name]['ms'], 3) if before[name]['ms'] else None,
+                    }
+                    for name in before
+                }
+                results['results'].append({'expenses': expenses, 'notes_bytes': notes_bytes,
+                                           'before': before, 'after': after, 'ratio': ratios})
+        app.config['QUERY_PROJECTIONS'] = True
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
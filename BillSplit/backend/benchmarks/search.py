@@ -0,0 +1,177 @@
+"""
+Latency of expense search (search_service.search_expenses) on a large seeded dataset.
+
+Seeds --expenses expenses spread over groups of --group-size expenses, with descriptions drawn
+from a skewed vocabulary (a few words like 'dinner' are in a large share of all expenses, most
+are rare), and a user who is a member of --user-groups of the groups. Then runs each query
+--repeats times as that user and reports p50/p95/max milliseconds, the matches found and, on
+the memory backend, the documents read (what the Firestore queries would read).
+
+  sqlite   seeded with bulk inserts; the FTS triggers index every row as in production
+  memory   seeded with the search_terms expense_service writes; slow to seed past ~200k expenses
+
+Run from the BillSplit directory:
+    python -m backend.benchmarks.search --backend sqlite --expenses 1000000
+    python -m backend.benchmarks.search --backend memory --expenses 100000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from backend.benchmarks.settlement_phases import git_commit
+
+COMMON = ['dinner', 'groceries', 'taxi', 'coffee', 'rent', 'lunch']
+PLACES = ['downtown', 'airport', 'market', 'station', 'beach', 'office', 'hotel', 'café', 'bakery', 'pharmacy']
+QUERIES = {
+    'common word': 'dinner',
+    'short prefix': 'gr',
+    'prefix': 'groc',
+    'two words': 'dinner downtown',
+    'rare word': 'w1234',
+    'no match': 'zzzz',
+}
+
+
+def make_description(rng):
+    words = [rng.choice(COMMON), rng.choice(PLACES)]
+    if rng.random() < 0.5:
+        words.append(f"w{rng.randrange(100000)}") # Rare words: a few matches each
+    return ' '.join(words)
+
+
+def seed_sqlite(store, expenses, group_size, user_groups, rng):
+    """Bulk-inserts users, groups, memberships and expenses; returns the searching user's id."""
+    start = datetime(2020, 1, 1)
+    groups = max(1, expenses // group_size)
+    with store.transaction() as connection:
+        connection.executemany("INSERT INTO users (id, firebase_uid, email, username, created_at) VALUES (?, ?, ?, ?, ?)",
+                               [(f"u{i}", f"uid{i}", f"u{i}@bench.test", f"user{i}", '2020-01-01 00:00:00.000000') for i in range(100)] +
+                               [('searcher', 'searcher', 's@bench.test', 'searcher', '2020-01-01 00:00:00.000000')])
+        connection.executemany("INSERT INTO groups (id, name, description, owner_id, created_at, version) VALUES (?, ?, ?, ?, ?, 0)",
+                               [(f"g{g}", f"Group {g}", None, f"u{g % 100}", '2020-01-01 00:00:00.000000') for g in range(groups)])
+        connection.executemany("INSERT INTO memberships (group_id, user_id, added_at) VALUES (?, ?, '2020-01-01 00:00:00.000000')",
+                               [(f"g{g}", f"u{g % 100}") for g in range(groups)])
+        connection.executemany("INSERT OR IGNORE INTO memberships (group_id, user_id, added_at) VALUES (?, 'searcher', '2020-01-01 00:00:00.000000')",
+                               [(f"g{g}",) for g in rng.sample(range(groups), min(user_groups, groups))])
+    for chunk in range(0, expenses, 50000):
+        rows, participants = [], []
+        for n in range(chunk, min(chunk + 50000, expenses)):
+            group = n % groups
+            created_at = (start + timedelta(minutes=n)).strftime('%Y-%m-%d %H:%M:%S.%f')
+            rows.append((f"e{n:07d}", f"g{group}", make_description(rng), round(rng.uniform(1, 300), 2), f"u{group % 100}", created_at, created_at))
+            participants.append((f"e{n:07d}", 0, f"u{group % 100}", None))
+        with store.transaction() as connection:
+            connection.executemany("INSERT INTO expenses (id, group_id, description, amount, payer_id, created_at, updated_at) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            connection.executemany("INSERT INTO expense_participants (expense_id, position, user_id, share_amount) VALUES (?, ?, ?, ?)", participants)
+        print(f"seeded {min(chunk + 50000, expenses)}", file=sys.stderr)
+    return 'searcher'
+
+
+def seed_memory(db, expenses, group_size, user_groups, rng):
+    """Adds the same data as seed_sqlite as documents; returns the searching user's id."""
+    from backend.services.search_service import search_terms
+
+    start = datetime(2020, 1, 1)
+    groups = max(1, expenses // group_size)
+    member_groups = set(rng.sample(range(groups), min(user_groups, groups)))
+    for g in range(groups):
+        group_ref = db.collection('groups').document(f"g{g}")
+        group_ref.set({'name': f"Group {g}", 'owner_id': f"u{g % 100}", 'created_at': start, 'version': 0})
+        group_ref.collection('members').document(f"u{g % 100}").set({'joined_at': start})
+        if g in member_groups:
+            group_ref.collection('members').document('searcher').set({'joined_at': start})
+    batch = db.batch()
+    for n in range(expenses):
+        group = n % groups
+        description = make_description(rng)
+        batch.set(db.collection('expenses').document(f"e{n:07d}"), {
+            'description': description, 'amount': round(rng.uniform(1, 300), 2), 'payer_id': f"u{group % 100}",
+            'group_id': f"g{group}", 'participants': [{'user_id': f"u{group % 100}", 'share_amount': None}],
+            'created_at': start + timedelta(minutes=n), 'search_terms': search_terms(description),
+        })
+        if len(batch) >= 500:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+    db.stats.reset()
+    return 'searcher'
+
+
+def run_queries(db, user_id, repeats, backend):
+    from backend.services import search_service
+
+    results = {}
+    for name, q in QUERIES.items():
+        times = []
+        page = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            page = search_service.search_expenses(user_id, q)
+            times.append((time.perf_counter() - start) * 1e3)
+        times.sort()
+        results[name] = {
+            'q': q,
+            'p50_ms': round(statistics.median(times), 3),
+            'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))], 3),
+            'max_ms': round(times[-1], 3),
+            'matches': page.total,
+            'complete': page.complete,
+        }
+        if backend == 'memory':
+            with db.stats.track() as counters:
+                search_service.search_expenses(user_id, q)
+            results[name]['reads'] = counters.get('reads', 0)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=('sqlite', 'memory'), default='sqlite')
+    parser.add_argument('--expenses', type=int, default=1000000)
+    parser.add_argument('--group-size', type=int, default=100, help='expenses per group')
+    parser.add_argument('--user-groups', type=int, default=20, help='groups the searching user is a member of')
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--path', help='SQLite file to seed (default: a temporary file); an existing file is searched as is')
+    parser.add_argument('--output', help='write the JSON results here')
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    os.environ['STORAGE_BACKEND'] = args.backend
+    if args.backend == 'sqlite':
+        path = args.path or os.path.join(tempfile.mkdtemp(), 'search.sqlite3')
+        os.environ['SQLITE_PATH'] = os.path.abspath(path)
+    from backend.app import app
+    from backend.firebase_db import get_store
+
+    with app.app_context():
+        db = get_store()
+        started = time.perf_counter()
+        if args.backend == 'sqlite':
+            if db.connection().execute("SELECT 1 FROM expenses LIMIT 1").fetchone():
+                user_id = 'searcher'
+            else:
+                user_id = seed_sqlite(db, args.expenses, args.group_size, args.user_groups, rng)
+        else:
+            user_id = seed_memory(db, args.expenses, args.group_size, args.user_groups, rng)
+        seed_seconds = round(time.perf_counter() - started, 1)
+        results = {
+            'commit': git_commit(), 'backend': args.backend, 'expenses': args.expenses, 'group_size': args.group_size,
+            'user_groups': args.user_groups, 'seed_seconds': seed_seconds,
+            'queries': run_queries(db, user_id, args.repeats, args.backend),
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Phase-by-phase microbenchmark of the settlement computation.
+
+calculate_settlements does I/O, parsing, balance accumulation, rounding and debt
+simplification in one call. This harness seeds one group per configuration into the memory
+backend and times each phase on its own, across member counts, expense counts and split
+patterns:
+  io         group doc, member ids, member names and the raw expense stream (backend round trips counted)
+  parse      ExpenseColumns.from_documents (what calculate_settlements uses)
+  pydantic   ExpenseInDB per document, for reference against the old parsing path
+  accumulate accumulate_balances
+  round      round_balances
+  simplify   simplify_debts (settlement transactions counted)
+  total      calculate_settlements end to end
+
+For every phase it reports the best wall time of --repeats runs and the tracemalloc peak and
+retained allocations of one extra run. Results are JSON (with the git commit) so runs can be
+compared between commits:
+    python -m backend.benchmarks.settlement_phases --output before.json
+    python -m backend.benchmarks.settlement_phases --compare before.json
+
+Run from the BillSplit directory.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+PATTERNS = ('equal', 'explicit', 'mixed', 'single_payer', 'everyone')
+
+
+def make_expense(rng, n, members, pattern, group_id, start):
+    if pattern == 'everyone':
+        participants = members
+    else:
+        participants = rng.sample(members, rng.randint(min(2, len(members)), min(len(members), 8)))
+    amount = round(rng.uniform(5, 500), 2)
+    if pattern == 'explicit':
+        # Shares rounded down to the cent so they never exceed the amount
+        share = math.floor(amount * 100 / len(participants)) / 100
+        parts = [{'user_id': user_id, 'share_amount': share} for user_id in participants]
+    elif pattern == 'mixed':
+        parts = [{'user_id': participants[0], 'share_amount': round(amount * rng.uniform(0.1, 0.6), 2)}]
+        parts += [{'user_id': user_id, 'share_amount': None} for user_id in participants[1:]]
+    else:
+        parts = [{'user_id': user_id, 'share_amount': None} for user_id in participants]
+    return {
+        'description': f"Expense {n}", 'amount': amount,
+        'payer_id': members[0] if pattern == 'single_payer' else rng.choice(participants),
+        'group_id': group_id, 'participants': parts, 'created_at': start + timedelta(minutes=n),
+    }
+
+
+def seed_group(db, members, expenses, pattern, seed=7):
+    rng = random.Random(seed)
+    db.clear()
+    group_id = 'bench-group'
+    start = datetime(2024, 1, 1)
+    member_ids = [f"m{i:05d}" for i in range(members)]
+    batch = db.batch()
+
+    def write(reference, document):
+        nonlocal batch
+        batch.set(reference, document)
+        if len(batch) >= 500:
+            batch.commit()
+            batch = db.batch()
+
+    write(db.collection('groups').document(group_id), {'name': 'Bench', 'owner_id': member_ids[0], 'created_at': start, 'version': 0})
+    for member_id in member_ids:
+        write(db.collection('users').document(member_id), {'username': f"Member {member_id}", 'email': f"{member_id}@example.test"})
+        write(db.collection('groups').document(group_id).collection('members').document(member_id), {'added_at': start})
+    for n in range(expenses):
+        write(db.collection('expenses').document(f"e{n:08d}"), make_expense(rng, n, member_ids, pattern, group_id, start))
+    batch.commit()
+    db.stats.reset()
+    return group_id
+
+
+def measure(fn, repeats):
+    """Best wall time of `repeats` runs, then tracemalloc peak/retained of one more run."""
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = fn()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {
+        'ms': round(best * 1e3, 3),
+        'peak_kb': round(peak / 1024, 1),
+        'retained_kb': round(retained / 1024, 1),
+    }
+
+
+def run_configuration(db, members, expenses, pattern, repeats):
+    from backend.models import ExpenseInDB
+    from backend.services import settlement_service
+    from backend.services.expense_records import ExpenseColumns
+
+    group_id = seed_group(db, members, expenses, pattern)
+    groups, users, expense_collection = db.collection('groups'), db.collection('users'), db.collection('expenses')
+    phases = {}
+
+    def io_phase():
+        groups.document(group_id).get()
+        member_ids = [doc.id for doc in groups.document(group_id).collection('members').stream()]
+        user_docs = db.get_all([users.document(member_id) for member_id in member_ids])
+        names = {doc.id: doc.to_dict().get('username') for doc in user_docs if doc.exists}
+        documents = [(doc.id, doc.to_dict()) for doc in expense_collection.where('group_id', '==', group_id).stream()]
+        return member_ids, names, documents
+
+    with db.stats.track() as counters:
+        io_phase()
+    (member_ids, names, documents), phases['io'] = measure(io_phase, repeats)
+    phases['io']['round_trips'] = counters.get('round_trips', 0)
+    phases['io']['bytes_read'] = counters.get('bytes_read', 0)
+
+    columns, phases['parse'] = measure(lambda: ExpenseColumns.from_documents(documents, user_ids=member_ids), repeats)
+    _, phases['pydantic'] = measure(lambda: [ExpenseInDB(doc_id=doc_id, **data) for doc_id, data in documents], repeats)
+    balances, phases['accumulate'] = measure(lambda: settlement_service.accumulate_balances(columns, len(member_ids)), repeats)
+    rounded, phases['round'] = measure(lambda: settlement_service.round_balances(balances), repeats)
+    transactions, phases['simplify'] = measure(lambda: settlement_service.simplify_debts(rounded, names), repeats)
+    phases['simplify']['transactions'] = len(transactions)
+
+    with db.stats.track() as counters:
+        settlement_service.calculate_settlements(group_id)
+    _, phases['total'] = measure(lambda: settlement_service.calculate_settlements(group_id), repeats)
+    phases['total']['round_trips'] = counters.get('round_trips', 0)
+
+    return {
+        'members': members, 'expenses': expenses, 'pattern': pattern,
+        'participants': sum(len(data['participants']) for _, data in documents),
+        'transactions': len(transactions),
+        'phases': phases,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """Prints the per-phase time ratio (current / previous) for configurations present in both runs."""
+    key = lambda row: (row['members'], row['expenses'], row['pattern'])
+    before = {key(row): row for row in previous['results']}
+    print(f"Compared with {previous.get('commit')}: ratio of ms (current / previous), >1 is slower", file=sys.stderr)
+    for row in results['results']:
+        old = before.get(key(row))
+        if not old:
+            continue
+        ratios = []
+        for phase, values in row['phases'].items():
+            old_ms = old['phases'].get(phase, {}).get('ms')
+            if old_ms:
+                ratios.append(f"{phase}={values['ms'] / old_ms:.2f}")
+        print(f"  members={row['members']:<5} expenses={row['expenses']:<7} {row['pattern']:<13} " + ' '.join(ratios), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--members', default='2,10,100,1000', help='comma separated member counts')
+    parser.add_argument('--expenses', default='10,100,1000,10000,100000', help='comma separated expense counts')
+    parser.add_argument('--patterns', default=','.join(PATTERNS), help='comma separated subset of ' + ', '.join(PATTERNS))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--max-participants', type=int, default=5_000_000,
+                        help='skip configurations whose participant rows would exceed this')
+    parser.add_argument('--output', help='write the JSON results here')
+    parser.add_argument('--compare', help='previous JSON results to compare against')
+    args = parser.parse_args()
+
+    os.environ['STORAGE_BACKEND'] = 'memory'
+    from backend.app import app
+    from backend.firebase_db import get_store
+
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'generated_at': datetime.utcnow().isoformat() + 'Z',
+        'results': [],
+    }
+    with app.app_context():
+        db = get_store()
+        for pattern in args.patterns.split(','):
+            for members in (int(m) for m in args.members.split(',')):
+                for expenses in (int(e) for e in args.expenses.split(',')):
+                    per_expense = members if pattern == 'everyone' else min(members, 5)
+                    if per_expense * expenses > args.max_participants:
+                        print(f"Skipping members={members} expenses={expenses} {pattern}: over --max-participants", file=sys.stderr)
+                        continue
+                    print(f"members={members} expenses={expenses} {pattern}", file=sys.stderr)
+                    # Settlement warnings go to stdout; keep them out of the timings' output
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        row = run_configuration(db, members, expenses, pattern, args.repeats)
+                    results['results'].append(row)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+Local fan-out harness for the live group event bus.
+
+Simulates hundreds of SSE subscribers (one thread each, like one request thread per stream)
+spread over a few groups, publishes expense events at a fixed rate and reports delivery
+latency, slow-consumer resyncs and reconnect replay behaviour.
+
+--check-route instead drives GET /api/groups/<id>/events through the app (memory backend) with
+HEAD requests and streams closed before their first chunk, and fails unless every connection
+slot is released afterwards.
+
+Run from the BillSplit directory:
+    python -m backend.benchmarks.sse_fanout --subscribers 500 --groups 5 --events 2000
+    python -m backend.benchmarks.sse_fanout --check-route
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import statistics
+import threading
+import time
+
+from backend.services.event_service import EventBus, TooManyConnections
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(subscribers=500, groups=5, events=2000, rate=1000.0, slow_fraction=0.02, slow_delay=0.05,
+        max_connections=None, queue_size=100, reconnect_fraction=0.1):
+    bus = EventBus(max_connections=max_connections or subscribers, max_queue=queue_size)
+    group_ids = [f"group-{i}" for i in range(groups)]
+    latencies = []
+    latencies_lock = threading.Lock()
+    stats = {'delivered': 0, 'resyncs': 0, 'rejected': 0, 'reconnects': 0, 'replayed': 0}
+    stats_lock = threading.Lock()
+    done = threading.Event()
+    ready = threading.Barrier(subscribers + 1, timeout=30)
+
+    def subscriber(index):
+        group_id = group_ids[index % groups]
+        slow = random.random() < slow_fraction
+        reconnecting = random.random() < reconnect_fraction
+        try:
+            subscription, _, _ = bus.subscribe(group_id)
+        except TooManyConnections:
+            with stats_lock:
+                stats['rejected'] += 1
+            ready.wait()
+            return
+        ready.wait()
+
+        last_id = None
+        local_latencies = []
+        delivered = 0
+        while not done.is_set():
+            event = subscription.get(timeout=0.1)
+            if subscription.overflowed:
+                # What the SSE route does: send a resync frame and close; the client reconnects
+                with stats_lock:
+                    stats['resyncs'] += 1
+                bus.unsubscribe(subscription)
+                subscription, _, _ = bus.subscribe(group_id)
+                continue
+            if event is None:
+                continue
+            delivered += 1
+            last_id = event.id
+            local_latencies.append(time.perf_counter() - event.data['published_at'])
+            if slow:
+                time.sleep(slow_delay)
+            if reconnecting and delivered % 200 == 0:
+                # Drop the connection and resume from the cursor, as EventSource does
+                bus.unsubscribe(subscription)
+                subscription, backlog, resync = bus.subscribe(group_id, last_id)
+                with stats_lock:
+                    stats['reconnects'] += 1
+                    stats['replayed'] += len(backlog)
+                    stats['resyncs'] += int(resync)
+                delivered += len(backlog)
+        bus.unsubscribe(subscription)
+        with latencies_lock:
+            latencies.extend(local_latencies)
+        with stats_lock:
+            stats['delivered'] += delivered
+
+    threads = [threading.Thread(target=subscriber, args=(i,), daemon=True) for i in range(subscribers)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+
+    interval = 1.0 / rate if rate else 0
+    start = time.perf_counter()
+    publish_times = []
+    for n in range(events):
+        group_id = group_ids[n % groups]
+        t0 = time.perf_counter()
+        bus.publish(group_id, 'expense_added', {'expense_id': f"e{n}", 'published_at': t0})
+        publish_times.append(time.perf_counter() - t0)
+        if interval:
+            sleep_for = start + (n + 1) * interval - time.perf_counter()
+            if sleep_for > 0:
+                time.sleep(sleep_for)
+    publish_elapsed = time.perf_counter() - start
+
+    time.sleep(0.5) # Let subscribers drain
+    done.set()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    return {
+        'subscribers': subscribers,
+        'groups': groups,
+        'events_published': events,
+        'publish_seconds': round(publish_elapsed, 3),
+        'publish_us_p50': round(statistics.median(publish_times) * 1e6, 1),
+        'publish_us_p99': round(_percentile(publish_times, 99) * 1e6, 1),
+        'expected_deliveries': events * (subscribers - stats['rejected']) // groups,
+        'delivered': stats['delivered'],
+        'delivery_ms_p50': round(_percentile(latencies, 50) * 1e3, 3) if latencies else None,
+        'delivery_ms_p95': round(_percentile(latencies, 95) * 1e3, 3) if latencies else None,
+        'delivery_ms_p99': round(_percentile(latencies, 99) * 1e3, 3) if latencies else None,
+        'slow_consumer_resyncs': stats['resyncs'],
+        'reconnects': stats['reconnects'],
+        'replayed_on_reconnect': stats['replayed'],
+        'rejected_connections': stats['rejected'],
+        'open_connections_after': bus.connection_count(),
+    }
+
+
+def check_route_release(requests=5):
+    """Open connection slots after HEAD requests and early-closed streams on the events route (should be 0)."""
+    os.environ['STORAGE_BACKEND'] = 'memory'
+    from datetime import datetime
+    from backend.app import app
+    from backend.firebase_db import get_store
+    from backend.models import GroupCreate
+    from backend.services import auth_service, event_service, group_service
+
+    with app.app_context():
+        get_store().collection('users').document('sse-check').set(
+            {'firebase_uid': 'sse-check', 'email': 'sse-check@example.test', 'username': 'SSE check', 'created_at': datetime.utcnow()})
+        group = group_service.create_group(GroupCreate(name='SSE check'), 'sse-check')
+        headers = {'Authorization': f"Bearer {auth_service.generate_jwt_token('sse-check')}"}
+        bus = event_service.get_event_bus()
+    client = app.test_client()
+    url = f"/api/groups/{group.id}/events"
+    result = {}
+    for method in ('HEAD', 'GET'):
+        for _ in range(requests):
+            response = client.open(url, method=method, headers=headers, buffered=False)
+            response.close() # Before reading any of the stream
+        result[f"open_after_{method.lower()}"] = bus.connection_count()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check-route', action='store_true', help='check that the events route releases its connection slots')
+    parser.add_argument('--subscribers', type=int, default=500)
+    parser.add_argument('--groups', type=int, default=5)
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=1000.0, help='events per second, 0 for unthrottled')
+    parser.add_argument('--slow-fraction', type=float, default=0.02, help='share of subscribers that consume slowly')
+    parser.add_argument('--slow-delay', type=float, default=0.05, help='seconds a slow subscriber spends per event')
+    parser.add_argument('--queue-size', type=int, default=100)
+    parser.add_argument('--max-connections', type=int, default=None, help='per-worker cap, defaults to --subscribers')
+    parser.add_argument('--reconnect-fraction', type=float, default=0.1)
+    args = parser.parse_args()
+    if args.check_route:
+        result = check_route_release()
+        print(json.dumps(result, indent=2))
+        if any(result.values()):
+            print("Connection slots leaked by the events route.", file=sys.stderr)
+            sys.exit(1)
+        return
+    result = run(subscribers=args.subscribers, groups=args.groups, events=args.events, rate=args.rate,
+                 slow_fraction=args.slow_fraction, slow_delay=args.slow_delay, queue_size=args.queue_size,
+                 max_connections=args.max_connections, reconnect_fraction=args.reconnect_fraction)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
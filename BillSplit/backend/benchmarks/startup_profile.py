@@ -0,0 +1,107 @@
+"""
+Cold-start profile of the backend.
+
+Starts a fresh interpreter with `-X importtime`, imports and builds the app, serves `/`, then
+calls the warm-up hook (the first storage access), and reports:
+  - wall time of each step: interpreter start to app import, create_app, first `/`, warm-up
+  - the slowest imports by cumulative and self time, from the importtime trace
+  - whether the Firebase SDK was already loaded before the first storage access
+
+Run from the BillSplit directory:
+    python -m backend.benchmarks.startup_profile
+    STORAGE_BACKEND=memory python -m backend.benchmarks.startup_profile --top 30 --output startup.json
+
+With STORAGE_BACKEND=firestore (the default) the warm-up step needs valid credentials;
+use --no-warmup to profile only up to the first `/` response.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+# Runs inside the profiled interpreter; prints one JSON line with the step timings
+CHILD = r"""
+import json, sys, time
+steps = {}
+t0 = time.perf_counter()
+from backend.app import create_app, app
+steps['import_app_s'] = time.perf_counter() - t0
+sdk_at_import = any(name.startswith(('firebase_admin', 'google.cloud.firestore')) for name in sys.modules)
+
+t = time.perf_counter()
+create_app()
+steps['create_app_s'] = time.perf_counter() - t
+
+client = app.test_client()
+t = time.perf_counter()
+client.get('/')
+steps['first_index_request_s'] = time.perf_counter() - t
+sdk_before_storage = any(name.startswith(('firebase_admin', 'google.cloud.firestore')) for name in sys.modules)
+
+if WARMUP:
+    t = time.perf_counter()
+    response = client.get('/warmup')
+    steps['warmup_request_s'] = time.perf_counter() - t
+    steps['warmup_status'] = response.status_code
+
+steps['total_s'] = time.perf_counter() - t0
+steps['sdk_loaded_at_import'] = sdk_at_import
+steps['sdk_loaded_before_storage'] = sdk_before_storage
+print('STARTUP_PROFILE ' + json.dumps(steps))
+"""
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(stderr):
+    """Returns [(module, self_us, cumulative_us, depth)] from -X importtime output."""
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=20, help='number of slowest imports to list')
+    parser.add_argument('--no-warmup', action='store_true', help='skip the warm-up (first storage access) step')
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args()
+
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+    child = f"WARMUP = {not args.no_warmup}\n" + CHILD
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', child], capture_output=True, text=True, env=environment)
+    steps_line = next((line for line in process.stdout.splitlines() if line.startswith('STARTUP_PROFILE ')), None)
+    if process.returncode != 0 or steps_line is None:
+        print(process.stderr[-4000:], file=sys.stderr)
+        sys.exit(process.returncode or 1)
+
+    imports = parse_importtime(process.stderr)
+    top_level = [entry for entry in imports if entry[3] == 0]
+    report = {
+        'storage_backend': os.environ.get('STORAGE_BACKEND', 'firestore'),
+        'steps': json.loads(steps_line[len('STARTUP_PROFILE '):]),
+        'modules_imported': len(imports),
+        'import_self_total_ms': round(sum(entry[1] for entry in imports) / 1e3, 1),
+        'slowest_top_level_imports_ms': [
+            {'module': module, 'cumulative_ms': round(cumulative / 1e3, 1)}
+            for module, _, cumulative, _ in sorted(top_level, key=lambda e: e[2], reverse=True)[:args.top]
+        ],
+        'slowest_self_imports_ms': [
+            {'module': module, 'self_ms': round(self_us / 1e3, 1)}
+            for module, self_us, _, _ in sorted(imports, key=lambda e: e[1], reverse=True)[:args.top]
+        ],
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
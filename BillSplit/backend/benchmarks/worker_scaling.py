@@ -0,0 +1,185 @@
+"""
+Throughput scaling of the production server with worker count.
+
+For each worker count, starts gunicorn with the production config (backend/gunicorn.conf.py,
+via gunicorn_seeded.conf.py) on the memory backend, seeds every worker with the same
+deterministic dataset, then drives a read-heavy request mix (group details, group expenses,
+settlements) from several client processes over keep-alive connections for a fixed duration.
+Reports requests/second, latency percentiles and speedup relative to the first worker count.
+
+Run from the BillSplit directory:
+    python -m backend.benchmarks.worker_scaling --workers 1,2,4,8 --threads 4 --duration 15
+
+Scaling is bounded by the machine's cores: on N cores expect roughly linear gains up to N
+workers for the CPU-bound settlement requests, and flat results beyond that.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import jwt
+
+from backend.benchmarks.loadtest import _percentile, seed
+from backend.config import Config
+from backend.memory_db import MemoryFirestore
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _token(user_id):
+    # Same claims as auth_service.generate_jwt_token, signed with the server's default key
+    now = datetime.utcnow()
+    return jwt.encode({'user_id': user_id, 'exp': now + timedelta(days=1), 'iat': now}, Config.JWT_SECRET_KEY, algorithm="HS256")
+
+
+def build_requests(users, groups, expenses, seed_value, count=2000):
+    """Precomputes (path, token) pairs from the same dataset the workers seed."""
+    data = seed(MemoryFirestore(), users, groups, expenses, seed_value=seed_value)
+    rng = random.Random(seed_value)
+    requests = []
+    for _ in range(count):
+        group_id, _, members = data.groups[rng.choices(range(len(data.groups)), weights=data.group_weights)[0]]
+        path = rng.choice([f"/api/groups/{group_id}", f"/api/expenses/group/{group_id}", f"/api/settlements/{group_id}"])
+        requests.append((path, _token(rng.choice(members))))
+    return requests
+
+
+def _client_process(port, requests, threads, duration, results):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def loop(offset):
+        nonlocal errors
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        local, local_errors, index = [], 0, offset
+        while time.perf_counter() < deadline:
+            path, token = requests[index % len(requests)]
+            index += threads
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path, headers={'Authorization': f"Bearer {token}"})
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    local_errors += 1
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                continue
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+
+    workers = [threading.Thread(target=loop, args=(random.randrange(len(requests)) + n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    results.put((latencies, errors))
+
+
+def run_server(workers, threads, port, sizes, seed_value):
+    environment = dict(os.environ, STORAGE_BACKEND='memory', WEB_WORKERS=str(workers), WEB_THREADS=str(threads),
+                       WEB_BIND=f"127.0.0.1:{port}", WEB_MAX_REQUESTS='0',
+                       BENCH_USERS=str(sizes['users']), BENCH_GROUPS=str(sizes['groups']),
+                       BENCH_EXPENSES=str(sizes['expenses']), BENCH_SEED=str(seed_value))
+    config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn_seeded.conf.py')
+    # Access logs would cost the workers more than some of the requests they log
+    command = [sys.executable, '-m', 'gunicorn', '-c', config, '--access-logfile', '/dev/null', 'backend.app:app']
+    log = open(os.devnull, 'w')
+    server = subprocess.Popen(command, env=environment, stdout=log, stderr=subprocess.PIPE, text=True)
+
+    seeded = 0
+    while seeded < workers:
+        line = server.stderr.readline()
+        if not line:
+            raise RuntimeError(f"gunicorn exited before all workers were ready (exit code {server.poll()})")
+        if 'seeded.' in line:
+            seeded += 1
+    # Keep draining stderr so the server never blocks on a full pipe
+    threading.Thread(target=lambda: [None for _ in server.stderr], daemon=True).start()
+    return server
+
+
+def measure(workers, threads, clients, client_threads, duration, sizes, seed_value, requests):
+    port = _free_port()
+    server = run_server(workers, threads, port, sizes, seed_value)
+    try:
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_client_process, args=(port, requests, client_threads, duration, results))
+                     for _ in range(clients)]
+        for process in processes:
+            process.start()
+        latencies, errors = [], 0
+        for _ in processes:
+            client_latencies, client_errors = results.get()
+            latencies.extend(client_latencies)
+            errors += client_errors
+        for process in processes:
+            process.join()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    return {
+        'workers': workers,
+        'threads': threads,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / duration, 1),
+        'p50_ms': round(_percentile(latencies, 50) * 1e3, 2) if latencies else None,
+        'p95_ms': round(_percentile(latencies, 95) * 1e3, 2) if latencies else None,
+        'p99_ms': round(_percentile(latencies, 99) * 1e3, 2) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2,4', help='comma separated worker counts')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker')
+    parser.add_argument('--clients', type=int, default=4, help='load generating processes')
+    parser.add_argument('--client-threads', type=int, default=8, help='connections per client process')
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds of load per worker count')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--groups', type=int, default=400)
+    parser.add_argument('--expenses', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON results here')
+    args = parser.parse_args()
+
+    sizes = {'users': args.users, 'groups': args.groups, 'expenses': args.expenses}
+    requests = build_requests(args.users, args.groups, args.expenses, args.seed)
+    results = {'cpu_count': os.cpu_count(), 'dataset': sizes, 'runs': []}
+    for workers in (int(w) for w in args.workers.split(',')):
+        print(f"{workers} worker(s) ...", file=sys.stderr)
+        results['runs'].append(measure(workers, args.threads, args.clients, args.client_threads,
+                                       args.duration, sizes, args.seed, requests))
+    base = results['runs'][0]['rps'] if results['runs'] and results['runs'][0]['rps'] else None
+    for run in results['runs']:
+        run['speedup'] = round(run['rps'] / base, 2) if base else None
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import gzip
+import json
+import mmap
+import os
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Columnar table files for the analytics snapshot (see services/snapshot_service.py and
+# snapshot_query.py). A table is a directory with one file per column plus meta.json:
+#
+#   <column>.bin       fixed-width little-endian values: f64, i64, i32 or i8, or for str columns
+#                      the int32 dictionary code of each value (-1 for None)
+#   <column>.dict.gz   str columns only: the distinct values as a gzip-compressed JSON list
+#
+# Fixed-width columns stay uncompressed so readers can memory-map them and scan them as typed
+# memoryviews without parsing or copying; the repetitive strings (ids, names) shrink to one int32
+# per row plus a compressed dictionary. Numeric columns have no nulls; timestamps are i64
+# microseconds since the epoch (UTC).
+
+FORMAT_VERSION = 1
+NULL_CODE = -1
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+_TYPECODES = {'f64': 'd', 'i64': 'q', 'i32': 'i', 'i8': 'b', 'str': 'i'}
+
+def to_micros(value: Optional[datetime]) -> int:
+    """A datetime (naive ones taken as UTC) as microseconds since the epoch; 0 for None."""
+    if value is None:
+        return 0
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - _EPOCH) // _MICROSECOND
+
+def _write_array(path: str, values: array):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    with open(path, 'wb') as f:
+        values.tofile(f)
+
+def write_table(directory: str, schema: Sequence[Tuple[str, str]], rows: Sequence[tuple]) -> int:
+    """Writes rows (tuples in schema order) as a table in directory, which must not exist. Returns the row count."""
+    os.makedirs(directory)
+    for position, (name, kind) in enumerate(schema):
+        if kind == 'str':
+            dictionary: Dict[str, int] = {}
+            codes = array('i', (NULL_CODE if row[position] is None else dictionary.setdefault(row[position], len(dictionary))
+                                for row in rows))
+            _write_array(os.path.join(directory, f"{name}.bin"), codes)
+            with gzip.open(os.path.join(directory, f"{name}.dict.gz"), 'wt', encoding='utf-8') as f:
+                json.dump(list(dictionary), f)
+        else:
+            _write_array(os.path.join(directory, f"{name}.bin"), array(_TYPECODES[kind], (row[position] for row in rows)))
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'format': FORMAT_VERSION, 'rows': len(rows), 'columns': [[name, kind] for name, kind in schema]}, f)
+    return len(rows)
+
+class Table:
+    """A table directory opened for reading; columns are memory-mapped on first use."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('format') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported table format {meta.get('format')} in {directory}.")
+        self.rows: int = meta['rows']
+        self.schema: List[Tuple[str, str]] = [(name, kind) for name, kind in meta['columns']]
+        self._kinds = dict(self.schema)
+        self._columns: Dict[str, Sequence] = {}
+        self._dictionaries: Dict[str, List[str]] = {}
+        self._maps: List[mmap.mmap] = []
+        self._views: List[memoryview] = [] # Untyped views of the maps, released before the maps close
+
+    def column(self, name: str) -> Sequence:
+        """The column's values (codes for str columns) as a typed memoryview over the mapped file."""
+        if name not in self._columns:
+            typecode = _TYPECODES[self._kinds[name]]
+            path = os.path.join(self.directory, f"{name}.bin")
+            if self.rows == 0:
+                self._columns[name] = array(typecode)
+            elif sys.byteorder != 'little':
+                values = array(typecode)
+                with open(path, 'rb') as f:
+                    values.frombytes(f.read())
+                values.byteswap()
+                self._columns[name] = values
+            else:
+                with open(path, 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps.append(mapped)
+                self._views.append(memoryview(mapped))
+                self._columns[name] = self._views[-1].cast(typecode)
+        return self._columns[name]
+
+    def dictionary(self, name: str) -> List[str]:
+        """The distinct values of a str column, indexed by code."""
+        if name not in self._dictionaries:
+            with gzip.open(os.path.join(self.directory, f"{name}.dict.gz"), 'rt', encoding='utf-8') as f:
+                self._dictionaries[name] = json.load(f)
+        return self._dictionaries[name]
+
+    def values(self, name: str) -> List[Optional[object]]:
+        """The column decoded into a list (str codes resolved, None for nulls)."""
+        column = self.column(name)
+        if self._kinds[name] != 'str':
+            return column.tolist()
+        dictionary = self.dictionary(name)
+        return [None if code == NULL_CODE else dictionary[code] for code in column]
+
+    def read_rows(self) -> List[tuple]:
+        """Every row as a tuple in schema order."""
+        if self.rows == 0:
+            return []
+        return list(zip(*(self.values(name) for name, _ in self.schema)))
+
+    def close(self):
+        for column in self._columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self._columns.clear()
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        for mapped in self._maps:
+            mapped.close()
+        self._maps.clear()
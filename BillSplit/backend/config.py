@@ -1,8 +1,81 @@
 import os
 
+DEFAULT_SECRET_KEY = 'your_super_secret_key_please_change_this_in_production'
+DEFAULT_JWT_SECRET_KEY = 'your_jwt_secret_key_please_change_this_in_production'
+
 class Config:
-    SECRET_KEY = os.environ.get('SECRET_KEY', 'your_super_secret_key_please_change_this_in_production')
-    DEBUG = os.environ.get('FLASK_DEBUG', 'True') == 'True'
+    SECRET_KEY = os.environ.get('SECRET_KEY', DEFAULT_SECRET_KEY)
+    DEBUG = os.environ.get('FLASK_DEBUG', 'False') == 'True' # Never enable in production
+    # 'firestore', 'sqlite' for self-hosted deployments, or 'memory' for the in-process stand-in used by load tests and local development
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firestore')
+    SQLITE_PATH = os.environ.get('SQLITE_PATH', 'instance/billsplit.sqlite3') # Relative to the backend directory, or absolute; shared by the workers of a host
+    SQLITE_BUSY_TIMEOUT_SECONDS = float(os.environ.get('SQLITE_BUSY_TIMEOUT_SECONDS', '10')) # How long a write waits for another worker's write
+    # Accept 'local:<uid>' test tokens instead of Firebase ID tokens, which lets anyone sign in as anyone (always on with
+    # the memory backend). Only for local SQLite setups: the app refuses to start with it on Firestore or with the default secrets
+    LOCAL_ID_TOKENS = os.environ.get('LOCAL_ID_TOKENS', 'False') == 'True'
     # Firebase Admin SDK Path (relative to project root or absolute)
     FIREBASE_ADMIN_SDK_PATH = os.environ.get('FIREBASE_ADMIN_SDK_PATH', 'instance/firebase_admin_key.json')
-    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your_jwt_secret_key_please_change_this_in_production')
\ No newline at end of file
+    STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE', 'False') == 'True' # Log how long lazy storage setup takes
+    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', DEFAULT_JWT_SECRET_KEY)
+    # Server-Sent Events (live group updates)
+    SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+    SSE_MAX_STREAM_SECONDS = int(os.environ.get('SSE_MAX_STREAM_SECONDS', '300'))
+    SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', '100')) # Events buffered per connection before it is resynced
+    SSE_REPLAY_BUFFER_SIZE = int(os.environ.get('SSE_REPLAY_BUFFER_SIZE', '256')) # Events kept per group for reconnects
+    SSE_FIRESTORE_LISTENERS = os.environ.get('SSE_FIRESTORE_LISTENERS', 'False') == 'True' # Also relay changes made by other workers
+    # Production server: gunicorn -c backend/gunicorn.conf.py backend.app:app (from the BillSplit directory)
+    WEB_BIND = os.environ.get('WEB_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+    WEB_WORKERS = int(os.environ.get('WEB_WORKERS', str(2 * (os.cpu_count() or 1) + 1))) # Processes
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', '8')) # Request threads per worker (each open SSE stream holds one)
+    SSE_RESERVED_THREADS = int(os.environ.get('SSE_RESERVED_THREADS', '2')) # Request threads per worker that streams may never take
+    # Streams per worker; more than WEB_THREADS - SSE_RESERVED_THREADS would starve ordinary requests (gunicorn.conf.py refuses to start)
+    SSE_MAX_CONNECTIONS_PER_WORKER = int(os.environ.get('SSE_MAX_CONNECTIONS_PER_WORKER', str(max(1, WEB_THREADS - SSE_RESERVED_THREADS))))
+    WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', '60')) # Seconds before a silent worker is killed and replaced
+    WEB_GRACEFUL_TIMEOUT = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', '30')) # Seconds a stopping worker gets to finish requests
+    WEB_MAX_REQUESTS = int(os.environ.get('WEB_MAX_REQUESTS', '5000')) # Recycle workers after this many requests, 0 to disable
+    WEB_MAX_REQUESTS_JITTER = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', '500')) # Spread recycling so workers don't restart together
+    WEB_KEEPALIVE = int(os.environ.get('WEB_KEEPALIVE', '5'))
+    # Admission control for expensive endpoints (per-user and global concurrent cost units)
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'True') == 'True'
+    ADMISSION_USER_LIMIT = int(os.environ.get('ADMISSION_USER_LIMIT', '4')) # Units one user may hold at once
+    ADMISSION_GLOBAL_LIMIT = int(os.environ.get('ADMISSION_GLOBAL_LIMIT', '16')) # Units for everyone, per worker or per host with sqlite
+    ADMISSION_COSTS = os.environ.get('ADMISSION_COSTS', 'expenses.user=2,settlements=2') # Endpoint weights, others cost 1
+    ADMISSION_BACKEND = os.environ.get('ADMISSION_BACKEND', 'memory') # 'memory' (per worker) or 'sqlite' (shared by the workers on a host)
+    ADMISSION_SQLITE_PATH = os.environ.get('ADMISSION_SQLITE_PATH', '/tmp/billsplit-admission.sqlite3')
+    ADMISSION_SLOT_TTL_SECONDS = int(os.environ.get('ADMISSION_SLOT_TTL_SECONDS', '300')) # Slots of killed workers stop counting after this
+    # Cold storage: expenses older than the horizon are compacted into monthly archive documents
+    ARCHIVE_HORIZON_DAYS = int(os.environ.get('ARCHIVE_HORIZON_DAYS', '365'))
+    ARCHIVE_MAX_RECORDS_PER_DOC = int(os.environ.get('ARCHIVE_MAX_RECORDS_PER_DOC', '1000')) # Keeps archive documents well under Firestore's 1 MiB limit
+    EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '500')) # Expenses read and sent per chunk of a streamed export
+    QUERY_PROJECTIONS = os.environ.get('QUERY_PROJECTIONS', 'True') == 'True' # Hot paths read only the fields they use
+    # Recurring expenses: in-process scheduler writing due occurrences (or run backend/maintenance/materialize_recurring.py from cron)
+    RECURRING_SCHEDULER_ENABLED = os.environ.get('RECURRING_SCHEDULER_ENABLED', 'True') == 'True'
+    # Under gunicorn the scheduler only starts in the workers when opted in; the default is one cron job for the deployment
+    RECURRING_SCHEDULER_IN_WORKERS = os.environ.get('RECURRING_SCHEDULER_IN_WORKERS', 'False') == 'True'
+    RECURRING_INTERVAL_SECONDS = int(os.environ.get('RECURRING_INTERVAL_SECONDS', '60'))
+    RECURRING_MAX_OCCURRENCES_PER_RUN = int(os.environ.get('RECURRING_MAX_OCCURRENCES_PER_RUN', '100')) # Per template; further catch-up continues next run
+    # Authorization cache of group owner + member ids per worker; other workers' membership changes show up after the TTL
+    GROUP_ACCESS_CACHE_TTL_SECONDS = float(os.environ.get('GROUP_ACCESS_CACHE_TTL_SECONDS', '5')) # 0 disables caching
+    GROUP_ACCESS_CACHE_MAX_ENTRIES = int(os.environ.get('GROUP_ACCESS_CACHE_MAX_ENTRIES', '10000'))
+    # Background jobs (?async=true on heavy endpoints, status at /api/jobs/<id>), run by a thread pool in each worker
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2')) # Job threads per worker process
+    JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', '100')) # Jobs waiting per worker before submissions are refused
+    JOB_MAX_PER_USER = int(os.environ.get('JOB_MAX_PER_USER', '2')) # Queued + running jobs one user may have, across all workers
+    JOB_HEARTBEAT_SECONDS = int(os.environ.get('JOB_HEARTBEAT_SECONDS', '15')) # Jobs not refreshed for 3 heartbeats (worker gone) read as failed
+    JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', '86400')) # Job records expire this long after they finish (see job_service)
+    JOB_MAX_RESULT_BYTES = int(os.environ.get('JOB_MAX_RESULT_BYTES', '262144')) # Results are stored in the job record; keep well under Firestore's 1 MiB
+    # Expense search (GET /api/expenses/search)
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '20'))
+    SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', '100'))
+    SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', '1000')) # Newest matches ranked per query (per 30 groups on Firestore)
+    BATCH_GET_MAX_IDS = int(os.environ.get('BATCH_GET_MAX_IDS', '100')) # Group + expense + user ids per POST /api/batch/get
+    # Request profiling: requests with an X-Profile-Token signed with the secret (backend/maintenance/profile_token.py)
+    # or picked at the sample rate get a sampling profiler; profiles are listed at /api/profiles. Off when both are unset.
+    PROFILING_SECRET = os.environ.get('PROFILING_SECRET', '') # Also required to read /api/profiles
+    PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0')) # Fraction of all requests, e.g. 0.001
+    PROFILING_INTERVAL_MS = float(os.environ.get('PROFILING_INTERVAL_MS', '5')) # Stack sampling interval
+    PROFILING_MAX_SECONDS = float(os.environ.get('PROFILING_MAX_SECONDS', '60')) # Sampling stops after this (long streams)
+    PROFILING_DIR = os.environ.get('PROFILING_DIR', '/tmp/billsplit-profiles') # Shared by the workers of a host
+    PROFILING_MAX_PROFILES = int(os.environ.get('PROFILING_MAX_PROFILES', '50')) # Older profiles are deleted
+    SYNC_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('SYNC_TOMBSTONE_RETENTION_DAYS', '30')) # Delta sync cursors older than this must resync in full
+    ANALYTICS_SNAPSHOT_DIR = os.environ.get('ANALYTICS_SNAPSHOT_DIR', '/tmp/billsplit-snapshot') # Columnar snapshot (backend/maintenance/snapshot_analytics.py)
@@ -1,21 +1,63 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
 from flask import current_app # Needed for app.config and root_path
+from typing import Iterable, Optional, Tuple
+
+# The Firebase SDK (firebase_admin, google.cloud.firestore, grpc) is imported inside
+# initialize_firebase_app, so importing the app stays cheap and only the first request
+# that touches storage (or the warm-up hook) pays for the SDK import and client setup.
 
 _db_instance = None # Use a private variable to hold the instance
+_init_lock = threading.Lock() # Concurrent first requests must not initialize twice
+
+WRITES_PER_BATCH = 450 # Below Firestore's 500-write batch limit
 
 def initialize_firebase_app():
     global _db_instance
     if _db_instance is not None:
         # Already initialized, return the existing instance
         return _db_instance
+    with _init_lock:
+        if _db_instance is None:
+            started = time.perf_counter()
+            _db_instance = _create_client()
+            if current_app.config.get('STARTUP_PROFILE'):
+                print(f"Storage client created in {time.perf_counter() - started:.3f}s.")
+    return _db_instance
+
+def _create_client():
+    """Builds the storage client for the configured backend."""
+    if using_memory_backend():
+        # In-process stand-in (load tests, local development), no credentials needed
+        from backend.memory_db import MemoryFirestore
+        return MemoryFirestore()
+    if using_sqlite_backend():
+        # Self-hosted storage in one database file, no Firebase project needed
+        from backend.sqlite_db import SqliteStore
+        path = os.path.join(current_app.root_path, current_app.config.get('SQLITE_PATH', 'instance/billsplit.sqlite3'))
+        store = SqliteStore(path, timeout=current_app.config.get('SQLITE_BUSY_TIMEOUT_SECONDS', 10))
+        print(f"SQLite storage opened at {path}.")
+        return store
+
+    from firebase_admin import firestore
+    initialize_default_app()
+    return firestore.client()
+
+def initialize_default_app():
+    """
+    Initializes the default Firebase app with the service account key, if not done yet.
+    Firestore needs it, and so does verifying Firebase ID tokens on the SQLite backend.
+    """
+    import firebase_admin
+    from firebase_admin import credentials
 
     if firebase_admin._apps:
-        if 'default' in firebase_admin._apps:
-            # App is already initialized, just get the client
-            _db_instance = firestore.client()
-            return _db_instance
+        if firebase_admin._DEFAULT_APP_NAME in firebase_admin._apps:
+            # App is already initialized
+            return
 
     try:
         # Path to your Firebase Admin SDK service account key
@@ -31,28 +73,103 @@ def initialize_firebase_app():
 
         cred = credentials.Certificate(cred_path)
         firebase_admin.initialize_app(cred)
-        _db_instance = firestore.client() # Assign to the private global
         print("Firebase Admin SDK initialized successfully.")
-        return _db_instance # Return the instance
     except Exception as e:
         print(f"Error initializing Firebase Admin SDK: {e}")
         # Re-raise the exception to clearly indicate failure
         raise
 
-def get_firestore_db():
-    """Provides the Firestore client instance, initializing if necessary."""
+def reset_after_fork():
+    """
+    Forgets the storage client inherited from the parent process. gRPC channels are not
+    fork-safe, so every pre-forked worker must create its own client after the fork.
+    """
+    global _db_instance, _init_lock
+    _db_instance = None
+    _init_lock = threading.Lock()
+    firebase_admin = sys.modules.get('firebase_admin')
+    if firebase_admin is not None:
+        # The default app caches its Firestore client; drop it without closing the parent's channels
+        firebase_admin._apps.pop(firebase_admin._DEFAULT_APP_NAME, None)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+def using_memory_backend() -> bool:
+    """True when the app is configured to use the in-process memory backend instead of Firestore."""
+    return current_app.config.get('STORAGE_BACKEND') == 'memory'
+
+def using_sqlite_backend() -> bool:
+    """True when the app is configured to store everything in a local SQLite database (sqlite_db.SqliteStore)."""
+    return current_app.config.get('STORAGE_BACKEND') == 'sqlite'
+
+def increment(amount):
+    """Firestore Increment transform, without importing the SDK at module import time."""
+    if using_memory_backend():
+        from backend.memory_db import Increment
+    else:
+        from google.cloud.firestore import Increment
+    return Increment(amount)
+
+def run_transaction(function, *args):
+    """
+    Runs function(transaction, *args) in a transaction and returns its result. Firestore retries
+    the function on contention, so it must only read through the transaction and write to it.
+    """
+    db = get_store()
+    if hasattr(db, 'run_transaction'): # Memory backend
+        return db.run_transaction(function, *args)
+    from google.cloud import firestore
+    return firestore.transactional(function)(db.transaction(), *args)
+
+def commit_in_batches(operations: Iterable[Tuple[str, tuple]], db=None) -> int:
+    """
+    Applies (method, args) write operations, e.g. ('set', (reference, document)), in batches of
+    WRITES_PER_BATCH, in order. Each batch is atomic, the whole is not. Returns the number applied.
+    """
+    db = db or get_store()
+    batch, pending, applied = db.batch(), 0, 0
+    for method, args in operations:
+        getattr(batch, method)(*args)
+        pending += 1
+        applied += 1
+        if pending >= WRITES_PER_BATCH:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+    return applied
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """A stored datetime as an aware UTC one: Firestore returns aware datetimes, the memory and SQLite backends naive UTC ones."""
+    return value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+
+def warm_up():
+    """
+    Creates the storage client ahead of the first real request and opens its connection with a
+    single one-document read. Meant to be called by the orchestrator (see the /warmup route)
+    once an instance starts. Returns the seconds spent.
+    """
+    started = time.perf_counter()
+    db = get_store()
+    if using_sqlite_backend():
+        db.ping() # Opens this thread's connection
+    else:
+        list(db.collection('users').limit(1).stream())
+    return time.perf_counter() - started
+
+def get_store():
+    """
+    Provides the storage client of the configured backend, initializing it if necessary: the
+    Firestore client (or memory_db.MemoryFirestore, which behaves like one) or sqlite_db.SqliteStore.
+    Services reach users, groups and expenses through backend.repositories instead.
+    """
     global _db_instance
     if _db_instance is None:
-        # Attempt to initialize if not already initialized
-        # This might be too late if app context isn't fully set up,
-        # so ensure initialize_firebase_app is called during Flask app startup.
+        # Initialized lazily on first use (or by warm_up); needs an app context for app.config
         try:
             _db_instance = initialize_firebase_app()
-        except Exception:
-            # If initialization fails here, it means app startup wasn't robust enough
+        except Exception as e:
+            current_app.logger.critical(f"Failed to initialize Firebase Admin SDK: {e}")
             raise RuntimeError("Firestore DB not initialized. Check Flask app setup.")
-    return _db_instance
-
-# Make sure db is imported as a function call
-# So, in other files, you'll call firebase_db.get_firestore_db()
-# or import `db = get_firestore_db()`
\ No newline at end of file
+    return _db_instance
\ No newline at end of file
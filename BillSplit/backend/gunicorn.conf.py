@@ -0,0 +1,53 @@
+# Production entry point. From the BillSplit directory:
+#     gunicorn -c backend/gunicorn.conf.py backend.app:app
+#
+# Pre-forking: the app is imported once in the master (preload_app) and forked into
+# WEB_WORKERS processes with WEB_THREADS request threads each. The storage client is never
+# created in the master (firebase_db initializes lazily), and post_fork makes sure every
+# worker starts without an inherited client, so each one opens its own gRPC channels.
+#
+# Graceful restarts: `kill -HUP <master pid>` starts new workers and lets the old ones finish
+# their requests (up to WEB_GRACEFUL_TIMEOUT); workers are also recycled after
+# WEB_MAX_REQUESTS (+ jitter) requests to bound memory growth.
+#
+# Live streams: with gthread every open SSE stream holds one of the WEB_THREADS request threads
+# for its whole life, so a worker serves at most SSE_MAX_CONNECTIONS_PER_WORKER streams and keeps
+# SSE_RESERVED_THREADS threads for everything else. More streams take more WEB_THREADS (or workers).
+#
+# Recurring expenses: run `python -m backend.maintenance.materialize_recurring` from cron (every
+# minute) on one host. RECURRING_SCHEDULER_IN_WORKERS=True starts the in-process scheduler in every
+# worker instead; write preconditions keep them from duplicating occurrences, but each worker then
+# scans the due templates every RECURRING_INTERVAL_SECONDS.
+from backend.config import Config
+
+if Config.SSE_MAX_CONNECTIONS_PER_WORKER > Config.WEB_THREADS - Config.SSE_RESERVED_THREADS:
+    raise RuntimeError(
+        f"SSE_MAX_CONNECTIONS_PER_WORKER ({Config.SSE_MAX_CONNECTIONS_PER_WORKER}) must leave SSE_RESERVED_THREADS "
+        f"({Config.SSE_RESERVED_THREADS}) of the WEB_THREADS ({Config.WEB_THREADS}) request threads free: "
+        f"raise WEB_THREADS or lower SSE_MAX_CONNECTIONS_PER_WORKER.")
+
+bind = Config.WEB_BIND
+workers = Config.WEB_WORKERS
+threads = Config.WEB_THREADS
+worker_class = 'gthread'
+timeout = Config.WEB_TIMEOUT
+graceful_timeout = Config.WEB_GRACEFUL_TIMEOUT
+keepalive = Config.WEB_KEEPALIVE
+max_requests = Config.WEB_MAX_REQUESTS
+max_requests_jitter = Config.WEB_MAX_REQUESTS_JITTER
+preload_app = True
+accesslog = '-'
+errorlog = '-'
+
+def post_fork(server, worker):
+    # firebase_db and event_service also reset themselves via os.register_at_fork;
+    # this keeps the guarantee explicit for the server we ship with.
+    from backend.firebase_db import reset_after_fork
+    reset_after_fork()
+    server.log.info(f"Worker {worker.pid} forked; storage client will be created on first use.")
+    if Config.RECURRING_SCHEDULER_IN_WORKERS:
+        from backend.services.recurring_service import start_scheduler
+        start_scheduler(worker.app.wsgi())
+
+def worker_exit(server, worker):
+    server.log.info(f"Worker {worker.pid} exited.")
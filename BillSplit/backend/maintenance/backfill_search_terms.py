@@ -0,0 +1,39 @@
+"""
+Makes existing expenses searchable: writes search_terms on expenses stored before search existed
+(or whose terms are out of date). On SQLite it rebuilds the full-text index instead, which is also
+what to run after a VACUUM.
+
+Run from the BillSplit directory:
+    python -m backend.maintenance.backfill_search_terms                 # every group
+    python -m backend.maintenance.backfill_search_terms --group <id>
+
+Safe to re-run after an interruption; expenses already up to date aren't written.
+"""
+import argparse
+import json
+import sys
+
+from backend.app import create_app
+from backend.firebase_db import using_sqlite_backend
+from backend import repositories
+from backend.services import search_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--group', action='append', help='group id (repeatable); default is every group')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if using_sqlite_backend():
+            search_service.rebuild_search_index()
+            print(json.dumps({'rebuilt': True}), file=sys.stdout)
+            return
+        group_ids = args.group or repositories.groups().all_ids()
+        for group_id in group_ids:
+            print(json.dumps(search_service.backfill_search_terms(group_id)), file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
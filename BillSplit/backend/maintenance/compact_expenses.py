@@ -0,0 +1,46 @@
+"""
+Compacts old expenses into monthly archive documents (cold storage), or restores them.
+
+Run from the BillSplit directory, e.g. nightly from cron:
+    python -m backend.maintenance.compact_expenses                      # every group, ARCHIVE_HORIZON_DAYS
+    python -m backend.maintenance.compact_expenses --group <id> --horizon-days 180
+    python -m backend.maintenance.compact_expenses --group <id> --restore [--month 2023-04]
+
+Both directions are safe to re-run after an interruption. Compaction exits with status 1 when
+a month couldn't be finished (an expense edited meanwhile); the next run retries it.
+"""
+import argparse
+import json
+import sys
+
+from backend.app import create_app
+from backend import repositories
+from backend.services import archive_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--group', action='append', help='group id (repeatable); default is every group')
+    parser.add_argument('--horizon-days', type=int, help='archive expenses older than this (default ARCHIVE_HORIZON_DAYS)')
+    parser.add_argument('--restore', action='store_true', help='move archived expenses back to live documents')
+    parser.add_argument('--month', help='with --restore, only this YYYY-MM month')
+    args = parser.parse_args()
+    if args.month and not args.restore:
+        parser.error('--month only applies to --restore')
+
+    app = create_app()
+    with app.app_context():
+        group_ids = args.group or repositories.groups().all_ids()
+        incomplete = False
+        for group_id in group_ids:
+            if args.restore:
+                result = archive_service.restore_group(group_id, month=args.month)
+            else:
+                result = archive_service.compact_group(group_id, horizon_days=args.horizon_days)
+            print(json.dumps(result), file=sys.stdout)
+            incomplete = incomplete or bool(result.get('failed'))
+    sys.exit(1 if incomplete else 0)
+
+
+if __name__ == '__main__':
+    main()
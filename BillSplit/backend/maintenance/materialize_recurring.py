@@ -0,0 +1,34 @@
+"""
+Writes all due recurring expense occurrences once, for deployments that run it from cron
+instead of the in-process scheduler. This is the default under gunicorn, whose workers only
+run the scheduler with RECURRING_SCHEDULER_IN_WORKERS=True (see gunicorn.conf.py).
+
+Run from the BillSplit directory:
+    python -m backend.maintenance.materialize_recurring
+
+From cron, on one host (a second one is harmless, it only conflicts):
+    * * * * * cd /srv/billsplit/BillSplit && python -m backend.maintenance.materialize_recurring
+"""
+import argparse
+import json
+import time
+
+from backend.app import create_app
+from backend.services import recurring_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-occurrences', type=int, help='per template (default RECURRING_MAX_OCCURRENCES_PER_RUN)')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        result = recurring_service.materialize_due(max_occurrences_per_template=args.max_occurrences)
+        result['seconds'] = round(time.perf_counter() - started, 3)
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
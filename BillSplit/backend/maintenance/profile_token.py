@@ -0,0 +1,32 @@
+"""
+Prints a profiling token (signed with PROFILING_SECRET) for profiling live requests:
+
+    curl -H "X-Profile-Token: $TOKEN" -H "Authorization: Bearer ..." https://.../api/settlements/<group id>
+
+The response carries X-Profile-Id. The same token lists and downloads the profiles:
+
+    curl -H "X-Profile-Token: $TOKEN" https://.../api/profiles
+    curl -H "X-Profile-Token: $TOKEN" https://.../api/profiles/<id> > profile.folded   # flamegraph.pl / speedscope
+
+Run from the BillSplit directory with the production PROFILING_SECRET set:
+    python -m backend.maintenance.profile_token --minutes 15
+"""
+import argparse
+import sys
+
+from backend.config import Config
+from backend.services.profiling_service import create_token
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=int, default=15, help='how long the token is valid')
+    args = parser.parse_args()
+
+    if not Config.PROFILING_SECRET:
+        sys.exit("PROFILING_SECRET is not set.")
+    print(create_token(Config.PROFILING_SECRET, args.minutes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Purges delta sync tombstones (deleted expenses, removed members) older than
+SYNC_TOMBSTONE_RETENTION_DAYS. Nothing else purges them: deletes only write their tombstone,
+so schedule this to keep the tombstones bounded. Clients whose cursor is older than a purged
+tombstone get 410 from GET /api/groups/<id>/changes and resync in full.
+
+Run from the BillSplit directory, e.g. daily from cron:
+    python -m backend.maintenance.purge_tombstones                     # every group
+    python -m backend.maintenance.purge_tombstones --group <id>
+
+Safe to re-run.
+"""
+import argparse
+import json
+import sys
+
+from backend.app import create_app
+from backend import repositories
+from backend.services import sync_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--group', action='append', help='group id (repeatable); default is every group')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        group_ids = args.group or repositories.groups().all_ids()
+        for group_id in group_ids:
+            purged = 0
+            while True:
+                count = sync_service.purge_tombstones(group_id)
+                purged += count
+                if count < sync_service.PURGE_BATCH:
+                    break
+            print(json.dumps({'group_id': group_id, 'purged': purged}), file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
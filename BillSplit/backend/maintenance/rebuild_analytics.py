@@ -0,0 +1,34 @@
+"""
+Recomputes the spending analytics rollups from the expenses (live and archived), to create
+them for expenses stored before analytics existed or to check them (expense writes update the
+rollups in the same transaction, so they shouldn't drift).
+
+Run from the BillSplit directory, preferably while the groups are quiet:
+    python -m backend.maintenance.rebuild_analytics                     # every group
+    python -m backend.maintenance.rebuild_analytics --group <id>
+
+Safe to re-run; each group's rollups are replaced as a whole.
+"""
+import argparse
+import json
+import sys
+
+from backend.app import create_app
+from backend import repositories
+from backend.services import analytics_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--group', action='append', help='group id (repeatable); default is every group')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        group_ids = args.group or repositories.groups().all_ids()
+        for group_id in group_ids:
+            print(json.dumps(analytics_service.rebuild_group_analytics(group_id)), file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Writes the analytics snapshot: users, groups, memberships and expenses as columnar files that
+backend/snapshot_query.py memory-maps for fast scans and aggregations, off the serving path.
+Runs are incremental: only groups that changed since the last run (delta sync cursors) are read;
+the users table is read in full every run. Cursors older than SYNC_TOMBSTONE_RETENTION_DAYS read
+their group in full, so run it more often than that.
+
+Run from the BillSplit directory, e.g. nightly from cron:
+    python -m backend.maintenance.snapshot_analytics                      # into ANALYTICS_SNAPSHOT_DIR
+    python -m backend.maintenance.snapshot_analytics --dir /data/snapshot --full
+
+Don't run two at once on one directory.
+"""
+import argparse
+import json
+import sys
+
+from backend.app import create_app
+from backend.services import snapshot_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', help='snapshot directory; default is ANALYTICS_SNAPSHOT_DIR')
+    parser.add_argument('--full', action='store_true', help='read everything instead of the changes since the last run')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        directory = args.dir or app.config.get('ANALYTICS_SNAPSHOT_DIR', '/tmp/billsplit-snapshot')
+        summary = snapshot_service.take_snapshot(directory, full=args.full)
+        print(json.dumps(dict(summary, dir=directory)), file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
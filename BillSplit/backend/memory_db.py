@@ -0,0 +1,908 @@
+import random
+import string
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# In-process stand-in for the subset of the Firestore client API the services use.
+# Selected with STORAGE_BACKEND=memory (see firebase_db.py); used by the load-test and
+# benchmark harnesses and for local development without Firebase credentials.
+#
+# Semantics follow Firestore where the services depend on them: documents ordered by id,
+# documents missing an order_by/inequality field excluded, naive datetimes stored as UTC,
+# Increment/ArrayUnion/ArrayRemove/DELETE_FIELD/SERVER_TIMESTAMP transforms, 500-write batches,
+# count/sum/avg aggregations. Writes never mutate stored dicts in place, so snapshots stay
+# consistent without copying on read. Every call that would be an RPC is counted in `stats`.
+
+try:
+    from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+except ImportError: # Firebase SDK not installed; the memory backend doesn't need it
+    class NotFound(Exception):
+        pass
+
+    class AlreadyExists(Exception):
+        pass
+
+    class FailedPrecondition(Exception):
+        pass
+
+MAX_BATCH_WRITES = 500
+_AUTO_ID_CHARS = string.ascii_letters + string.digits
+_UTC = timezone.utc
+
+class Increment:
+    """Increment transform for callers that don't want to import the SDK (see firebase_db.increment)."""
+    def __init__(self, value):
+        self.value = value
+
+def _auto_id() -> str:
+    return ''.join(random.choices(_AUTO_ID_CHARS, k=20))
+
+def _copy(value):
+    """Copies JSON-like document data (dicts/lists); leaves scalars shared."""
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+def _normalize(value):
+    """Stores values the way Firestore returns them: naive datetimes become UTC-aware, tuples become lists."""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=_UTC) if value.tzinfo is None else value.astimezone(_UTC)
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+def _size(value) -> int:
+    """Approximate stored size in bytes, following Firestore's storage size rules."""
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if isinstance(value, dict):
+        return sum(len(k) + 1 + _size(v) for k, v in value.items())
+    if isinstance(value, list):
+        return sum(_size(v) for v in value)
+    return 16
+
+def _transform_kind(value) -> Optional[str]:
+    """Recognizes Firestore transform sentinels by shape, so the SDK isn't needed to use this backend."""
+    name = type(value).__name__
+    if name == 'Increment':
+        return 'increment'
+    if name == 'ArrayUnion':
+        return 'array_union'
+    if name == 'ArrayRemove':
+        return 'array_remove'
+    if name == 'Sentinel':
+        description = getattr(value, 'description', '').lower()
+        return 'delete' if 'delete' in description else 'server_timestamp'
+    return None
+
+def _split_path(field_path: str) -> List[str]:
+    return field_path.split('.')
+
+def _get_field(data: dict, field_path: str, default=KeyError):
+    value = data
+    for part in _split_path(field_path):
+        if not isinstance(value, dict) or part not in value:
+            if default is KeyError:
+                raise KeyError(field_path)
+            return default
+        value = value[part]
+    return value
+
+_MISSING = object()
+
+def _apply_field(data: dict, field_path: str, value, commit_time: datetime):
+    """Sets one (possibly nested) field on a fresh copy path, applying transforms."""
+    parts = _split_path(field_path)
+    target = data
+    for part in parts[:-1]:
+        child = target.get(part)
+        child = dict(child) if isinstance(child, dict) else {}
+        target[part] = child
+        target = child
+    last = parts[-1]
+    kind = _transform_kind(value)
+    if kind is None:
+        target[last] = _normalize(value)
+    elif kind == 'delete':
+        target.pop(last, None)
+    elif kind == 'server_timestamp':
+        target[last] = commit_time
+    elif kind == 'increment':
+        current = target.get(last)
+        target[last] = (current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0) + value.value
+    elif kind == 'array_union':
+        current = list(target.get(last) or []) if isinstance(target.get(last), list) else []
+        for element in _normalize(list(value.values)):
+            if element not in current:
+                current.append(element)
+        target[last] = current
+    elif kind == 'array_remove':
+        removed = _normalize(list(value.values))
+        current = target.get(last) if isinstance(target.get(last), list) else []
+        target[last] = [element for element in current if element not in removed]
+
+def _merge_into(data: dict, updates: dict, commit_time: datetime, prefix: str = ''):
+    for key, value in updates.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict) and _transform_kind(value) is None:
+            existing = _get_field(data, path, None)
+            if not isinstance(existing, dict):
+                _apply_field(data, path, {}, commit_time)
+            _merge_into(data, value, commit_time, prefix=f"{path}.")
+        else:
+            _apply_field(data, path, value, commit_time)
+
+def _type_rank(value) -> int:
+    # Firestore cross-type ordering: null < bool < number < timestamp < string < bytes < reference < geo < array < map
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, list):
+        return 8
+    if isinstance(value, dict):
+        return 9
+    return 7
+
+def _sort_key(value):
+    rank = _type_rank(value)
+    if rank == 8:
+        return (rank, tuple(_sort_key(v) for v in value))
+    if rank == 9:
+        return (rank, tuple(sorted((k, _sort_key(v)) for k, v in value.items())))
+    return (rank, value)
+
+class _Reverse:
+    """Inverts ordering for descending sort keys."""
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+def _doc_id_of(value) -> str:
+    """__name__ filter/cursor values may be references, paths or bare ids."""
+    if hasattr(value, 'id') and hasattr(value, 'path'):
+        return value.id
+    return str(value).rsplit('/', 1)[-1]
+
+class MemoryStats:
+    """Counts RPC-equivalent calls, document reads/writes and bytes returned, globally and per thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.totals: Dict[str, int] = {}
+
+    def reset(self):
+        with self._lock:
+            self.totals = {}
+
+    def record(self, op: str, reads: int = 0, writes: int = 0, bytes_read: int = 0):
+        counters = (('round_trips', 1), (f"op:{op}", 1), ('reads', reads), ('writes', writes), ('bytes_read', bytes_read))
+        with self._lock:
+            for key, amount in counters:
+                if amount:
+                    self.totals[key] = self.totals.get(key, 0) + amount
+        local = getattr(self._local, 'counters', None)
+        if local is not None:
+            for key, amount in counters:
+                if amount:
+                    local[key] = local.get(key, 0) + amount
+
+    @contextmanager
+    def track(self):
+        """Collects the counters of calls made by the current thread inside the block."""
+        previous = getattr(self._local, 'counters', None)
+        counters: Dict[str, int] = {}
+        self._local.counters = counters
+        try:
+            yield counters
+        finally:
+            self._local.counters = previous
+            if previous is not None:
+                for key, amount in counters.items():
+                    previous[key] = previous.get(key, 0) + amount
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.totals)
+
+class WriteOption:
+    """Write precondition, as returned by write_option()."""
+    __slots__ = ('last_update_time', 'exists')
+
+    def __init__(self, last_update_time: Optional[datetime] = None, exists: Optional[bool] = None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+class WriteResult:
+    __slots__ = ('update_time',)
+
+    def __init__(self, update_time: datetime):
+        self.update_time = update_time
+
+class AggregationResult:
+    __slots__ = ('alias', 'value', 'read_time')
+
+    def __init__(self, alias: str, value, read_time: datetime):
+        self.alias = alias
+        self.value = value
+        self.read_time = read_time
+
+class _StoredDoc:
+    __slots__ = ('data', 'create_time', 'update_time', 'size', 'field_sizes')
+
+    def __init__(self, data: dict, create_time: datetime, update_time: datetime):
+        self.data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        # Per top-level field, so projected reads are accounted without re-measuring
+        self.field_sizes = {k: len(k) + 1 + _size(v) for k, v in data.items()}
+        self.size = sum(self.field_sizes.values())
+
+class DocumentSnapshot:
+    def __init__(self, reference: "DocumentReference", stored: Optional[_StoredDoc], read_time: datetime,
+                 field_paths: Optional[Iterable[str]] = None):
+        self.reference = reference
+        self.id = reference.id
+        self.read_time = read_time
+        self._stored = stored
+        self._field_paths = list(field_paths) if field_paths is not None else None
+
+    @property
+    def exists(self) -> bool:
+        return self._stored is not None
+
+    @property
+    def create_time(self):
+        return self._stored.create_time if self._stored else None
+
+    @property
+    def update_time(self):
+        return self._stored.update_time if self._stored else None
+
+    def to_dict(self) -> Optional[dict]:
+        if self._stored is None:
+            return None
+        if self._field_paths is None:
+            return _copy(self._stored.data)
+        projected: dict = {}
+        for field_path, value in self._projected_values():
+            if '.' not in field_path:
+                projected[field_path] = _copy(value)
+                continue
+            # Stored data is already normalized, so nested paths only need their parents rebuilt
+            *parents, last = _split_path(field_path)
+            target = projected
+            for part in parents:
+                target = target.setdefault(part, {})
+            target[last] = _copy(value)
+        return projected
+
+    def _projected_values(self) -> List[Tuple[str, object]]:
+        data = self._stored.data
+        values = []
+        for field_path in self._field_paths:
+            value = data.get(field_path, _MISSING) if '.' not in field_path else _get_field(data, field_path, _MISSING)
+            if value is not _MISSING:
+                values.append((field_path, value))
+        return values
+
+    def get(self, field_path: str):
+        if self._stored is None:
+            return None
+        return _copy(_get_field(self.to_dict(), field_path))
+
+    def _size(self) -> int:
+        if self._stored is None:
+            return 0
+        if self._field_paths is None:
+            return self._stored.size
+        field_sizes = self._stored.field_sizes
+        return sum(field_sizes[field_path] if field_path in field_sizes else len(field_path) + 1 + _size(value)
+                   for field_path, value in self._projected_values())
+
+class DocumentReference:
+    def __init__(self, db: "MemoryFirestore", collection_path: str, doc_id: str):
+        self._db = db
+        self._collection_path = collection_path
+        self.id = doc_id
+        self.path = f"{collection_path}/{doc_id}"
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f"<DocumentReference {self.path}>"
+
+    @property
+    def parent(self) -> "CollectionReference":
+        return CollectionReference(self._db, self._collection_path)
+
+    def collection(self, collection_id: str) -> "CollectionReference":
+        return CollectionReference(self._db, f"{self.path}/{collection_id}")
+
+    def collections(self) -> List["CollectionReference"]:
+        return self._db._subcollections(self.path)
+
+    def get(self, field_paths: Optional[Iterable[str]] = None, transaction=None) -> DocumentSnapshot:
+        snapshot = self._db._get(self, field_paths)
+        self._db.stats.record('get', reads=1, bytes_read=snapshot._size())
+        return snapshot
+
+    def create(self, document_data: dict) -> WriteResult:
+        result = self._db._commit([('create', self, document_data, None)])[0]
+        self._db.stats.record('create', writes=1)
+        return result
+
+    def set(self, document_data: dict, merge: bool = False) -> WriteResult:
+        result = self._db._commit([('set', self, document_data, merge)])[0]
+        self._db.stats.record('set', writes=1)
+        return result
+
+    def update(self, field_updates: dict, option: Optional[WriteOption] = None) -> WriteResult:
+        result = self._db._commit([('update', self, field_updates, option)])[0]
+        self._db.stats.record('update', writes=1)
+        return result
+
+    def delete(self, option: Optional[WriteOption] = None) -> datetime:
+        result = self._db._commit([('delete', self, option, None)])[0]
+        self._db.stats.record('delete', writes=1)
+        return result.update_time
+
+    def on_snapshot(self, callback):
+        raise NotImplementedError("Snapshot listeners are not supported by the memory backend.")
+
+class Query:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, db: "MemoryFirestore", collection_path: Optional[str], all_descendants: bool = False,
+                 filters: Tuple = (), orders: Tuple = (), limit: Optional[int] = None, limit_to_last: bool = False,
+                 offset: int = 0, projection: Optional[Tuple[str, ...]] = None, start=None, end=None):
+        self._db = db
+        self._collection_path = collection_path
+        self._all_descendants = all_descendants
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit
+        self._limit_to_last = limit_to_last
+        self._offset = offset
+        self._projection = projection
+        self._start = start # (values or snapshot, inclusive)
+        self._end = end
+
+    def _copy_with(self, **changes) -> "Query":
+        fields = dict(filters=self._filters, orders=self._orders, limit=self._limit, limit_to_last=self._limit_to_last,
+                      offset=self._offset, projection=self._projection, start=self._start, end=self._end)
+        fields.update(changes)
+        return Query(self._db, self._collection_path, self._all_descendants, **fields)
+
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None, value=None, *, filter=None) -> "Query":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string in ('in', 'not-in', 'array_contains_any'):
+            value = [_normalize(v) for v in value]
+        else:
+            value = _normalize(value)
+        return self._copy_with(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = ASCENDING) -> "Query":
+        return self._copy_with(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int) -> "Query":
+        return self._copy_with(limit=count, limit_to_last=False)
+
+    def limit_to_last(self, count: int) -> "Query":
+        return self._copy_with(limit=count, limit_to_last=True)
+
+    def offset(self, num_to_skip: int) -> "Query":
+        return self._copy_with(offset=num_to_skip)
+
+    def select(self, field_paths: Iterable[str]) -> "Query":
+        return self._copy_with(projection=tuple(f for f in field_paths if f != '__name__'))
+
+    def start_at(self, document_fields) -> "Query":
+        return self._copy_with(start=(document_fields, True))
+
+    def start_after(self, document_fields) -> "Query":
+        return self._copy_with(start=(document_fields, False))
+
+    def end_at(self, document_fields) -> "Query":
+        return self._copy_with(end=(document_fields, True))
+
+    def end_before(self, document_fields) -> "Query":
+        return self._copy_with(end=(document_fields, False))
+
+    def stream(self, transaction=None):
+        snapshots = self._db._run_query(self)
+        self._db.stats.record('query', reads=max(1, len(snapshots)), bytes_read=sum(s._size() for s in snapshots))
+        return iter(snapshots)
+
+    def get(self, transaction=None) -> List[DocumentSnapshot]:
+        return list(self.stream(transaction=transaction))
+
+    def count(self, alias: Optional[str] = None) -> "AggregationQuery":
+        return AggregationQuery(self).count(alias=alias)
+
+    def sum(self, field_ref: str, alias: Optional[str] = None) -> "AggregationQuery":
+        return AggregationQuery(self).sum(field_ref, alias=alias)
+
+    def avg(self, field_ref: str, alias: Optional[str] = None) -> "AggregationQuery":
+        return AggregationQuery(self).avg(field_ref, alias=alias)
+
+    def on_snapshot(self, callback):
+        raise NotImplementedError("Snapshot listeners are not supported by the memory backend.")
+
+class AggregationQuery:
+    def __init__(self, query: Query):
+        self._query = query
+        self._aggregations: List[Tuple[str, Optional[str], str]] = []
+
+    def _add(self, kind: str, field_ref: Optional[str], alias: Optional[str]) -> "AggregationQuery":
+        self._aggregations.append((kind, field_ref, alias or f"field_{len(self._aggregations) + 1}"))
+        return self
+
+    def count(self, alias: Optional[str] = None) -> "AggregationQuery":
+        return self._add('count', None, alias)
+
+    def sum(self, field_ref: str, alias: Optional[str] = None) -> "AggregationQuery":
+        return self._add('sum', field_ref, alias)
+
+    def avg(self, field_ref: str, alias: Optional[str] = None) -> "AggregationQuery":
+        return self._add('avg', field_ref, alias)
+
+    def get(self, transaction=None) -> List[List[AggregationResult]]:
+        db = self._query._db
+        matches = db._run_query(self._query._copy_with(projection=()))
+        read_time = db._now()
+        results = []
+        for kind, field_ref, alias in self._aggregations:
+            if kind == 'count':
+                value = len(matches)
+            else:
+                numbers = [n for n in (_get_field(s._stored.data, field_ref, None) for s in matches)
+                           if isinstance(n, (int, float)) and not isinstance(n, bool)]
+                if kind == 'sum':
+                    value = sum(numbers) if numbers else 0
+                else:
+                    value = sum(numbers) / len(numbers) if numbers else None
+            results.append(AggregationResult(alias, value, read_time))
+        # Billed like Firestore: one read per batch of up to 1000 index entries
+        db.stats.record('aggregate', reads=max(1, -(-len(matches) // 1000)))
+        return [results]
+
+    def stream(self, transaction=None):
+        return iter(self.get(transaction=transaction))
+
+class CollectionReference(Query):
+    def __init__(self, db: "MemoryFirestore", path: str):
+        super().__init__(db, path)
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self) -> Optional[DocumentReference]:
+        if '/' not in self.path:
+            return None
+        parent_path, _ = self.path.rsplit('/', 1)
+        collection_path, doc_id = parent_path.rsplit('/', 1)
+        return DocumentReference(self._db, collection_path, doc_id)
+
+    def document(self, document_id: Optional[str] = None) -> DocumentReference:
+        return DocumentReference(self._db, self.path, document_id or _auto_id())
+
+    def add(self, document_data: dict, document_id: Optional[str] = None) -> Tuple[datetime, DocumentReference]:
+        reference = self.document(document_id)
+        result = reference.create(document_data)
+        return result.update_time, reference
+
+    def list_documents(self) -> List[DocumentReference]:
+        return [self.document(doc_id) for doc_id in self._db._doc_ids(self.path)]
+
+class WriteBatch:
+    def __init__(self, db: "MemoryFirestore"):
+        self._db = db
+        self._writes: List[tuple] = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def _queue(self, write: tuple):
+        if len(self._writes) >= MAX_BATCH_WRITES:
+            raise ValueError(f"A batch can contain at most {MAX_BATCH_WRITES} writes.")
+        self._writes.append(write)
+
+    def create(self, reference: DocumentReference, document_data: dict):
+        self._queue(('create', reference, document_data, None))
+
+    def set(self, reference: DocumentReference, document_data: dict, merge: bool = False):
+        self._queue(('set', reference, document_data, merge))
+
+    def update(self, reference: DocumentReference, field_updates: dict, option: Optional[WriteOption] = None):
+        self._queue(('update', reference, field_updates, option))
+
+    def delete(self, reference: DocumentReference, option: Optional[WriteOption] = None):
+        self._queue(('delete', reference, option, None))
+
+    def commit(self) -> List[WriteResult]:
+        writes, self._writes = self._writes, []
+        results = self._db._commit(writes) if writes else []
+        self._db.stats.record('commit', writes=len(writes))
+        return results
+
+class Transaction(WriteBatch):
+    """Writes are buffered and applied at commit; the database lock is held for the whole transaction."""
+    pass
+
+class MemoryFirestore:
+    def __init__(self):
+        self.stats = MemoryStats()
+        self._lock = threading.RLock()
+        self._collections: Dict[str, Dict[str, _StoredDoc]] = {}
+        self._indexes: Dict[Tuple[str, str, str], Dict[Any, set]] = {} # (collection, field, eq|contains) -> value -> ids
+        self._indexed_fields: Dict[str, List[Tuple[str, str]]] = {}
+        self._last_time = datetime.now(_UTC)
+
+    # --- client API ---
+
+    def collection(self, path: str) -> CollectionReference:
+        return CollectionReference(self, path.strip('/'))
+
+    def document(self, path: str) -> DocumentReference:
+        collection_path, doc_id = path.strip('/').rsplit('/', 1)
+        return DocumentReference(self, collection_path, doc_id)
+
+    def collection_group(self, collection_id: str) -> Query:
+        return Query(self, collection_id, all_descendants=True)
+
+    def collections(self) -> List[CollectionReference]:
+        with self._lock:
+            return [CollectionReference(self, path) for path in self._collections if '/' not in path]
+
+    def batch(self) -> WriteBatch:
+        return WriteBatch(self)
+
+    def write_option(self, last_update_time: Optional[datetime] = None, exists: Optional[bool] = None) -> WriteOption:
+        return WriteOption(last_update_time=last_update_time, exists=exists)
+
+    def transaction(self) -> Transaction:
+        return Transaction(self)
+
+    def run_transaction(self, function, *args, **kwargs):
+        """Runs function(transaction, *args) serialized against all other writes, then commits its writes."""
+        with self._lock:
+            transaction = Transaction(self)
+            result = function(transaction, *args, **kwargs)
+            transaction.commit()
+            return result
+
+    def get_all(self, references: Iterable[DocumentReference], field_paths: Optional[Iterable[str]] = None, transaction=None):
+        references = list(references)
+        snapshots = [self._get(reference, field_paths) for reference in references]
+        self.stats.record('get_all', reads=max(1, len(snapshots)), bytes_read=sum(s._size() for s in snapshots))
+        return iter(snapshots)
+
+    def close(self):
+        pass
+
+    def clear(self):
+        with self._lock:
+            self._collections.clear()
+            self._indexes.clear()
+            self._indexed_fields.clear()
+        self.stats.reset()
+
+    # --- internals ---
+
+    def _now(self) -> datetime:
+        """Commit timestamps are unique and increasing, like Firestore update times."""
+        with self._lock:
+            now = datetime.now(_UTC)
+            if now <= self._last_time:
+                now = self._last_time + timedelta(microseconds=1)
+            self._last_time = now
+            return now
+
+    def _doc_ids(self, collection_path: str) -> List[str]:
+        with self._lock:
+            return list(self._collections.get(collection_path, ()))
+
+    def _subcollections(self, doc_path: str) -> List[CollectionReference]:
+        prefix = f"{doc_path}/"
+        with self._lock:
+            return [CollectionReference(self, path) for path, docs in self._collections.items()
+                    if path.startswith(prefix) and '/' not in path[len(prefix):] and docs]
+
+    def _get(self, reference: DocumentReference, field_paths=None) -> DocumentSnapshot:
+        with self._lock:
+            stored = self._collections.get(reference._collection_path, {}).get(reference.id)
+        return DocumentSnapshot(reference, stored, self._last_time, field_paths)
+
+    def _commit(self, writes: List[tuple]) -> List[WriteResult]:
+        with self._lock:
+            commit_time = self._now()
+            # Validate preconditions first so the batch applies atomically
+            for kind, reference, data, extra in writes:
+                stored = self._collections.get(reference._collection_path, {}).get(reference.id)
+                exists = stored is not None
+                if kind == 'create' and exists:
+                    raise AlreadyExists(f"Document already exists: {reference.path}")
+                if kind == 'update' and not exists:
+                    raise NotFound(f"No document to update: {reference.path}")
+                # Preconditions (WriteOption): the data of a delete, the extra of an update
+                option = data if kind == 'delete' else extra if kind == 'update' else None
+                if option is not None:
+                    if option.exists is not None and option.exists != exists:
+                        raise FailedPrecondition(f"Document existence precondition failed: {reference.path}")
+                    if option.last_update_time is not None and (not exists or stored.update_time != option.last_update_time):
+                        raise FailedPrecondition(f"Document was modified since it was read: {reference.path}")
+
+            results = []
+            for kind, reference, data, merge in writes:
+                docs = self._collections.setdefault(reference._collection_path, {})
+                previous = docs.get(reference.id)
+                if kind == 'delete':
+                    if previous is not None:
+                        del docs[reference.id]
+                        self._unindex(reference._collection_path, reference.id, previous.data)
+                    results.append(WriteResult(commit_time))
+                    continue
+
+                if kind == 'update':
+                    new_data = dict(previous.data)
+                    for field_path, value in data.items():
+                        _apply_field(new_data, field_path, value, commit_time)
+                elif kind == 'set' and merge and previous is not None:
+                    new_data = dict(previous.data)
+                    _merge_into(new_data, data, commit_time)
+                else:
+                    new_data = {}
+                    _merge_into(new_data, data, commit_time)
+
+                create_time = previous.create_time if previous is not None else commit_time
+                if previous is not None:
+                    self._unindex(reference._collection_path, reference.id, previous.data)
+                docs[reference.id] = _StoredDoc(new_data, create_time, commit_time)
+                self._index(reference._collection_path, reference.id, new_data)
+                results.append(WriteResult(commit_time))
+            return results
+
+    def _index_values(self, data: dict, field_path: str, kind: str):
+        value = _get_field(data, field_path, _MISSING)
+        if value is _MISSING:
+            return ()
+        values = value if kind == 'contains' else (value,)
+        if kind == 'contains' and not isinstance(value, list):
+            return ()
+        hashable = []
+        for v in values:
+            try:
+                hash(v)
+                hashable.append(v)
+            except TypeError:
+                pass
+        return hashable
+
+    def _index(self, collection_path: str, doc_id: str, data: dict):
+        for field_path, kind in self._indexed_fields.get(collection_path, ()):
+            index = self._indexes[(collection_path, field_path, kind)]
+            for value in self._index_values(data, field_path, kind):
+                index.setdefault(value, set()).add(doc_id)
+
+    def _unindex(self, collection_path: str, doc_id: str, data: dict):
+        for field_path, kind in self._indexed_fields.get(collection_path, ()):
+            index = self._indexes[(collection_path, field_path, kind)]
+            for value in self._index_values(data, field_path, kind):
+                ids = index.get(value)
+                if ids is not None:
+                    ids.discard(doc_id)
+                    if not ids:
+                        del index[value]
+
+    def _ensure_index(self, collection_path: str, field_path: str, kind: str) -> Dict[Any, set]:
+        key = (collection_path, field_path, kind)
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._indexes[key] = {}
+            self._indexed_fields.setdefault(collection_path, []).append((field_path, kind))
+            for doc_id, stored in self._collections.get(collection_path, {}).items():
+                for value in self._index_values(stored.data, field_path, kind):
+                    index.setdefault(value, set()).add(doc_id)
+        return index
+
+    def _candidates(self, query: Query) -> List[Tuple[str, str, _StoredDoc]]:
+        """(collection_path, doc_id, stored) for docs that may match, narrowed by an equality index when possible."""
+        if query._all_descendants:
+            return [(path, doc_id, stored) for path, docs in self._collections.items()
+                    if path.rsplit('/', 1)[-1] == query._collection_path
+                    for doc_id, stored in docs.items()]
+
+        docs = self._collections.get(query._collection_path, {})
+        for field_path, op, value in query._filters:
+            if field_path == '__name__':
+                if op == '==':
+                    doc_id = _doc_id_of(value)
+                    return [(query._collection_path, doc_id, docs[doc_id])] if doc_id in docs else []
+                if op == 'in':
+                    ids = {_doc_id_of(v) for v in value}
+                    return [(query._collection_path, doc_id, docs[doc_id]) for doc_id in ids if doc_id in docs]
+                continue
+            try:
+                if op == '==':
+                    ids = self._ensure_index(query._collection_path, field_path, 'eq').get(value, ())
+                elif op == 'in':
+                    index = self._ensure_index(query._collection_path, field_path, 'eq')
+                    ids = set().union(*(index.get(v, ()) for v in value)) if value else ()
+                elif op == 'array_contains':
+                    ids = self._ensure_index(query._collection_path, field_path, 'contains').get(value, ())
+                else:
+                    continue
+            except TypeError: # Unhashable filter value: fall back to a scan
+                continue
+            return [(query._collection_path, doc_id, docs[doc_id]) for doc_id in ids]
+        return [(query._collection_path, doc_id, stored) for doc_id, stored in docs.items()]
+
+    @staticmethod
+    def _matches(doc_id: str, data: dict, filters) -> bool:
+        for field_path, op, expected in filters:
+            if field_path == '__name__':
+                actual = doc_id
+                expected = [_doc_id_of(v) for v in expected] if op in ('in', 'not-in') else _doc_id_of(expected)
+            else:
+                actual = _get_field(data, field_path, _MISSING)
+                if actual is _MISSING:
+                    return False # Firestore never matches documents missing the filtered field
+            if op == '==':
+                if actual != expected or _type_rank(actual) != _type_rank(expected):
+                    return False
+            elif op == '!=':
+                if actual == expected or actual is None:
+                    return False
+            elif op == 'in':
+                if actual not in expected:
+                    return False
+            elif op == 'not-in':
+                if actual in expected or actual is None:
+                    return False
+            elif op == 'array_contains':
+                if not isinstance(actual, list) or expected not in actual:
+                    return False
+            elif op == 'array_contains_any':
+                if not isinstance(actual, list) or not any(v in actual for v in expected):
+                    return False
+            elif op in ('<', '<=', '>', '>='):
+                if _type_rank(actual) != _type_rank(expected):
+                    return False
+                if op == '<' and not actual < expected:
+                    return False
+                if op == '<=' and not actual <= expected:
+                    return False
+                if op == '>' and not actual > expected:
+                    return False
+                if op == '>=' and not actual >= expected:
+                    return False
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+        return True
+
+    def _effective_orders(self, query: Query) -> List[Tuple[str, str]]:
+        orders = list(query._orders)
+        # Firestore orders first by the inequality field, and always breaks ties by document name
+        if not orders:
+            for field_path, op, _ in query._filters:
+                if op in ('<', '<=', '>', '>=', '!=', 'not-in') and field_path != '__name__':
+                    orders.append((field_path, Query.ASCENDING))
+                    break
+        if not any(field_path == '__name__' for field_path, _ in orders):
+            orders.append(('__name__', orders[-1][1] if orders else Query.ASCENDING))
+        return orders
+
+    @staticmethod
+    def _order_value(doc_path: str, doc_id: str, data: dict, field_path: str):
+        return doc_path if field_path == '__name__' else _get_field(data, field_path, _MISSING)
+
+    def _cursor_values(self, cursor, orders, collection_path: str) -> List:
+        if isinstance(cursor, DocumentSnapshot):
+            data = cursor._stored.data if cursor._stored else {}
+            return [cursor.reference.path if f == '__name__' else _get_field(data, f, None) for f, _ in orders]
+        if isinstance(cursor, dict):
+            values = []
+            for field_path, _ in orders[:len(cursor)]:
+                value = cursor[field_path] if field_path in cursor else _get_field(cursor, field_path)
+                values.append(value)
+            cursor = values
+        values = list(cursor)
+        for i, (field_path, _) in enumerate(orders[:len(values)]):
+            if field_path == '__name__':
+                value = values[i]
+                values[i] = value.path if isinstance(value, DocumentReference) else f"{collection_path}/{_doc_id_of(value)}"
+            else:
+                values[i] = _normalize(values[i])
+        return values
+
+    @staticmethod
+    def _compare(key: List, cursor: List, orders) -> int:
+        for value, bound, (_, direction) in zip(key, cursor, orders):
+            a, b = _sort_key(value), _sort_key(bound)
+            if a == b:
+                continue
+            result = -1 if a < b else 1
+            return -result if direction == Query.DESCENDING else result
+        return 0
+
+    def _run_query(self, query: Query) -> List[DocumentSnapshot]:
+        with self._lock:
+            candidates = self._candidates(query)
+            matches = [(path, doc_id, stored) for path, doc_id, stored in candidates
+                       if self._matches(doc_id, stored.data, query._filters)]
+            read_time = self._last_time
+
+        needs_order = query._orders or query._start or query._end or query._limit is not None or query._offset
+        if needs_order or any(op in ('<', '<=', '>', '>=') for _, op, _ in query._filters):
+            orders = self._effective_orders(query)
+            keyed = []
+            for path, doc_id, stored in matches:
+                key = [self._order_value(f"{path}/{doc_id}", doc_id, stored.data, f) for f, _ in orders]
+                if any(value is _MISSING for value in key):
+                    continue # Documents without an order_by field are not returned
+                keyed.append((key, path, doc_id, stored))
+            keyed.sort(key=lambda item: [(_Reverse(_sort_key(v)) if d == Query.DESCENDING else _sort_key(v))
+                                         for v, (_, d) in zip(item[0], orders)])
+            collection_path = query._collection_path
+            if query._start is not None:
+                bound, inclusive = query._start
+                bound = self._cursor_values(bound, orders, collection_path)
+                keyed = [item for item in keyed if self._compare(item[0], bound, orders) > (-1 if inclusive else 0)]
+            if query._end is not None:
+                bound, inclusive = query._end
+                bound = self._cursor_values(bound, orders, collection_path)
+                keyed = [item for item in keyed if self._compare(item[0], bound, orders) < (1 if inclusive else 0)]
+            matches = [(path, doc_id, stored) for _, path, doc_id, stored in keyed]
+            if query._offset:
+                matches = matches[query._offset:]
+            if query._limit is not None:
+                matches = matches[-query._limit:] if query._limit_to_last else matches[:query._limit]
+
+        return [DocumentSnapshot(DocumentReference(self, path, doc_id), stored, read_time, query._projection)
+                for path, doc_id, stored in matches]
+
+def verify_local_id_token(id_token: str) -> dict:
+    """
+    Stand-in for firebase_admin.auth.verify_id_token used with the memory backend.
+    Accepts 'local:<uid>[:<email>[:<name>]]' tokens. Never enable the memory backend in production.
+    """
+    parts = id_token.split(':') if id_token else []
+    if len(parts) < 2 or parts[0] != 'local' or not parts[1]:
+        raise ValueError("Invalid local ID token.")
+    decoded = {'uid': parts[1], 'email': parts[2] if len(parts) > 2 and parts[2] else f"{parts[1]}@example.test"}
+    if len(parts) > 3 and parts[3]:
+        decoded['name'] = parts[3]
+    return decoded
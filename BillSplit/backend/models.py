@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional, Dict
+from typing import Any, List, Literal, Optional, Dict
 from pydantic import BaseModel, Field
 
 # Base model for common fields like ID and creation timestamp
@@ -36,6 +36,7 @@ class GroupUpdate(BaseModel):
 
 class GroupInDB(GroupBase, PyBaseModel): # <--- GroupInDB still inherits GroupBase
     members: List[str] = []
+    version: int = 0 # Change version, also used by clients as a cache key
 
 # Expense Models
 class ExpenseParticipantData(BaseModel):
@@ -61,6 +62,103 @@ class ExpenseUpdate(BaseModel):
 class ExpenseInDB(ExpenseBase, PyBaseModel):
     pass
 
+# Recurring Expense Models (templates the scheduler turns into expenses)
+class RecurringExpenseBase(BaseModel):
+    description: str
+    amount: float
+    payer_id: str
+    group_id: str
+    participants: List[ExpenseParticipantData]
+    frequency: Literal['daily', 'weekly', 'monthly']
+    interval: int = Field(1, ge=1) # Every `interval` days/weeks/months
+    start_at: datetime # First occurrence; monthly occurrences keep its day, clamped to short months
+    end_at: Optional[datetime] = None # No occurrences after this
+
+class RecurringExpenseCreate(RecurringExpenseBase):
+    pass
+
+class RecurringExpenseInDB(RecurringExpenseBase, PyBaseModel):
+    created_by: Optional[str] = None
+    active: bool = True
+    next_index: int = 0 # Occurrences before this one have been written
+    next_run_at: Optional[datetime] = None # Due time of occurrence next_index
+
+class GroupExpenseStats(BaseModel):
+    group_id: str
+    expense_count: int
+    total_amount: float
+    average_amount: Optional[float] = None # None when no expenses match
+    payer_id: Optional[str] = None # Filters the figures were computed with
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+class ExpenseSearchPage(BaseModel):
+    expenses: List[ExpenseInDB] # Best matches first
+    total: int # Matches found; a lower bound when complete is False
+    complete: bool = True # False when the search stopped at SEARCH_MAX_CANDIDATES
+    offset: int = 0
+    next_offset: Optional[int] = None # None on the last page
+
+# Spending analytics (monthly rollups, see services/analytics_service.py)
+class MemberMonthSpending(BaseModel):
+    user_id: str
+    paid: float # Amounts of the expenses they paid
+    owed: float # Their shares of the expenses they take part in
+    expense_count: int # Expenses they paid or take part in
+
+class MonthSpending(BaseModel):
+    month: str # YYYY-MM (UTC)
+    expense_count: int
+    total_amount: float
+    members: List[MemberMonthSpending]
+
+class GroupAnalytics(BaseModel):
+    group_id: str
+    start_month: Optional[str] = None # Range the months were read for, inclusive
+    end_month: Optional[str] = None
+    months: List[MonthSpending] # Months with expenses, oldest first
+
+# Background Job Models (see services/job_service.py)
+class JobInDB(PyBaseModel):
+    user_id: str # Who submitted it; only they can see or cancel it
+    kind: str # The service function run, e.g. 'group_service.delete_group'
+    status: Literal['queued', 'running', 'done', 'failed', 'cancelled']
+    progress: Optional[float] = None # 0..1 when the job reports it
+    message: Optional[str] = None # Latest progress message
+    result: Any = None # The function's return value as JSON, once done
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = None # Refreshed while the job is queued or running
+
+# Batch multi-get (POST /api/batch/get)
+class BatchGetRequest(BaseModel):
+    groups: List[str] = []
+    expenses: List[str] = []
+    users: List[str] = []
+
+class BatchItem(BaseModel):
+    status: int # HTTP status the single-item endpoint would answer with
+    data: Optional[Dict[str, Any]] = None # The group, expense or user, when status is 200
+    message: Optional[str] = None # Why not, otherwise
+
+class BatchGetResult(BaseModel):
+    groups: Dict[str, BatchItem] = {}
+    expenses: Dict[str, BatchItem] = {}
+    users: Dict[str, BatchItem] = {}
+
+# Delta sync (GET /api/groups/<id>/changes, see services/sync_service.py)
+class GroupChanges(BaseModel):
+    group_id: str
+    cursor: str # Pass as ?since= on the next request
+    full: bool # No since was given: this is the whole group, replace the local copy
+    group: Optional[GroupInDB] = None # When full, or the group's name/description changed
+    expenses: List[ExpenseInDB] = [] # Created or updated since the cursor
+    deleted_expense_ids: List[str] = []
+    member_ids: List[str] = [] # Added since the cursor (every member when full)
+    removed_member_ids: List[str] = []
+
 # Settlement Models
 class SettlementTransaction(BaseModel):
     payer_id: str # User who owes
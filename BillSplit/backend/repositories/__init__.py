@@ -0,0 +1,21 @@
+# Storage of the core aggregates (users, groups with their members, expenses), one repository
+# per aggregate with a Firestore implementation (also used by the memory backend) and a SQLite
+# one. Services call users(), groups() and expenses() instead of branching on the backend.
+# Feature services with backend-specific storage (archives, search, rollups, jobs, ...) still
+# talk to get_store() themselves.
+from backend.firebase_db import using_sqlite_backend
+from backend.repositories.expense_repository import ExpenseRepository, FirestoreExpenseRepository, SqliteExpenseRepository
+from backend.repositories.group_repository import FirestoreGroupRepository, GroupRepository, SqliteGroupRepository
+from backend.repositories.user_repository import FirestoreUserRepository, SqliteUserRepository, UserRepository
+
+_FIRESTORE = (FirestoreUserRepository(), FirestoreGroupRepository(), FirestoreExpenseRepository())
+_SQLITE = (SqliteUserRepository(), SqliteGroupRepository(), SqliteExpenseRepository())
+
+def users() -> UserRepository:
+    return (_SQLITE if using_sqlite_backend() else _FIRESTORE)[0]
+
+def groups() -> GroupRepository:
+    return (_SQLITE if using_sqlite_backend() else _FIRESTORE)[1]
+
+def expenses() -> ExpenseRepository:
+    return (_SQLITE if using_sqlite_backend() else _FIRESTORE)[2]
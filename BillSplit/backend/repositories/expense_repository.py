@@ -0,0 +1,195 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from backend.firebase_db import get_store
+from backend.services import analytics_service, search_service, sync_service
+from backend.services.projections import EXPENSE_PARTICIPANTS
+from datetime import datetime
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference, DocumentReference
+
+expenses_ref: CollectionReference = lambda: get_store().collection('expenses')
+
+class ExpenseRepository(ABC):
+    """
+    Live expense documents {group_id, description, amount, payer_id, participants, created_at}.
+    Writes advance the group's version and update the analytics rollups in the same transaction.
+    Archived expenses are not covered (see archive_service).
+    """
+
+    @abstractmethod
+    def get(self, expense_id: str) -> Optional[dict]:
+        """The live expense document, or None."""
+
+    @abstractmethod
+    def list_for_group(self, group_id: str) -> List[Tuple[str, dict]]:
+        """(expense id, document) of the group's live expenses."""
+
+    @abstractmethod
+    def list_for_user(self, user_id: str) -> List[Tuple[str, dict]]:
+        """(expense id, document) of the expenses the user paid or participates in."""
+
+    @abstractmethod
+    def stats(self, group_id: str, payer_id: Optional[str] = None,
+              start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[int, float]:
+        """(count, total amount) of a group's expenses, optionally of one payer and with created_at in [start, end)."""
+
+    @abstractmethod
+    def add(self, expense_data: dict) -> Optional[Tuple[str, dict, str]]:
+        """
+        Stores a new expense; returns (expense id, stored document, change tag), or None if the
+        group was deleted meanwhile. The tag identifies this write for event deduplication.
+        """
+
+    @abstractmethod
+    def update(self, expense_id: str, group_id: str, fields: dict) -> Optional[Tuple[dict, dict, str]]:
+        """
+        Applies the given fields; returns (document before, document after, change tag), or None
+        if the expense (or its group) was deleted meanwhile.
+        """
+
+    @abstractmethod
+    def delete(self, expense_id: str, group_id: str) -> Optional[dict]:
+        """Deletes the expense, leaving a tombstone for delta sync; returns the deleted document, or None."""
+
+class FirestoreExpenseRepository(ExpenseRepository):
+    # Participants are stored within the expense document, with search_terms for search_service
+
+    def get(self, expense_id: str) -> Optional[dict]:
+        expense_doc = expenses_ref().document(expense_id).get()
+        return expense_doc.to_dict() if expense_doc.exists else None
+
+    def list_for_group(self, group_id: str) -> List[Tuple[str, dict]]:
+        return [(doc.id, doc.to_dict()) for doc in expenses_ref().where('group_id', '==', group_id).stream()]
+
+    def list_for_user(self, user_id: str) -> List[Tuple[str, dict]]:
+        # Get expenses where user is the payer
+        user_expenses = [(doc.id, doc.to_dict()) for doc in expenses_ref().where('payer_id', '==', user_id).stream()]
+        seen_ids = {expense_id for expense_id, _ in user_expenses}
+
+        # Get expenses where user is a participant (requires iterating or a specific query)
+        # Firestore doesn't directly support querying array elements for specific values efficiently in all cases.
+        # For 'participants' array, you'd typically need to fetch all and filter client-side,
+        # or use array-contains if you're looking for exact matches of complete participant objects.
+        # A better approach for this query might be to have a separate 'user_expense_involvements'
+        # collection or a more complex query setup.
+        # For now, let's assume we iterate and filter for demonstration: the scan reads only the
+        # participants field, then the full documents of the matches are fetched in one batch.
+        matching_ids = [
+            doc_id for doc_id, data in EXPENSE_PARTICIPANTS.stream(expenses_ref()) # Can be inefficient for many expenses
+            if doc_id not in seen_ids and any(p.get('user_id') == user_id for p in data.get('participants') or ())
+        ]
+        if matching_ids:
+            for doc in get_store().get_all([expenses_ref().document(doc_id) for doc_id in matching_ids]):
+                if doc.exists:
+                    user_expenses.append((doc.id, doc.to_dict()))
+        return user_expenses
+
+    def stats(self, group_id: str, payer_id: Optional[str] = None,
+              start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[int, float]:
+        # Server-side aggregation query, no expense documents are transferred
+        query = expenses_ref().where('group_id', '==', group_id)
+        if payer_id:
+            query = query.where('payer_id', '==', payer_id)
+        if start:
+            query = query.where('created_at', '>=', start)
+        if end:
+            query = query.where('created_at', '<', end)
+
+        aggregation = query.count(alias='expense_count').sum('amount', alias='total_amount')
+        results = {result.alias: result.value for result in aggregation.get()[0]}
+        return results.get('expense_count') or 0, results.get('total_amount') or 0.0
+
+    def add(self, expense_data: dict) -> Optional[Tuple[str, dict, str]]:
+        expense_data = dict(expense_data, search_terms=search_service.search_terms(expense_data['description']))
+        doc_ref: DocumentReference = expenses_ref().document()
+
+        def create(transaction, seq):
+            transaction.create(doc_ref, dict(expense_data, sync_seq=seq))
+            analytics_service.stage_expense_change(transaction, None, expense_data)
+            return True
+
+        if not sync_service.commit_change(expense_data['group_id'], create):
+            return None # The group was deleted meanwhile
+
+        created_expense_doc = doc_ref.get()
+        if not created_expense_doc.exists:
+            return None
+        return doc_ref.id, created_expense_doc.to_dict(), str(created_expense_doc.update_time)
+
+    def update(self, expense_id: str, group_id: str, fields: dict) -> Optional[Tuple[dict, dict, str]]:
+        expense_ref: DocumentReference = expenses_ref().document(expense_id)
+        if 'description' in fields:
+            fields = dict(fields, search_terms=search_service.search_terms(fields['description']))
+
+        def update(transaction, seq):
+            # Read through the transaction: an expense deleted since it was last read is not recreated
+            expense_snapshot = expense_ref.get(transaction=transaction)
+            if not expense_snapshot.exists:
+                return None
+            transaction.update(expense_ref, dict(fields, sync_seq=seq))
+            before = expense_snapshot.to_dict()
+            after = dict(before, **fields, sync_seq=seq)
+            analytics_service.stage_expense_change(transaction, before, after)
+            return before, after
+
+        changed = sync_service.commit_change(group_id, update)
+        if changed is None:
+            return None # Deleted concurrently, or its group was
+        before_data, updated_data = changed
+
+        updated_expense_doc = expense_ref.get()
+        if updated_expense_doc.exists and updated_expense_doc.to_dict().get('sync_seq') == updated_data['sync_seq']:
+            return before_data, updated_expense_doc.to_dict(), str(updated_expense_doc.update_time)
+        return before_data, updated_data, f"seq{updated_data['sync_seq']}" # Changed again since; that change publishes its own event
+
+    def delete(self, expense_id: str, group_id: str) -> Optional[dict]:
+        expense_ref: DocumentReference = expenses_ref().document(expense_id)
+
+        def delete(transaction, seq):
+            expense_snapshot = expense_ref.get(transaction=transaction)
+            if not expense_snapshot.exists:
+                return None # Deleted concurrently
+            transaction.delete(expense_ref)
+            # Delta sync reports the delete until the tombstone expires
+            transaction.set(sync_service.tombstones_ref(group_id).document(sync_service.tombstone_id('expense', expense_id)),
+                            sync_service.tombstone('expense', expense_id, seq))
+            deleted = expense_snapshot.to_dict()
+            analytics_service.stage_expense_change(transaction, deleted, None)
+            return deleted
+
+        return sync_service.commit_change(group_id, delete)
+
+class SqliteExpenseRepository(ExpenseRepository):
+    # Participants are a table; the store writes the tombstones and passes the rollup deltas through
+
+    def get(self, expense_id: str) -> Optional[dict]:
+        return get_store().get_expense(expense_id)
+
+    def list_for_group(self, group_id: str) -> List[Tuple[str, dict]]:
+        return get_store().get_group_expenses(group_id)
+
+    def list_for_user(self, user_id: str) -> List[Tuple[str, dict]]:
+        # Through the payer and participant indexes, no scan
+        return get_store().get_user_expenses(user_id)
+
+    def stats(self, group_id: str, payer_id: Optional[str] = None,
+              start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[int, float]:
+        # COUNT/SUM over the (group_id, created_at) or (group_id, payer_id, created_at) index
+        return get_store().expense_stats(group_id, payer_id=payer_id, start=start, end=end)
+
+    def add(self, expense_data: dict) -> Optional[Tuple[str, dict, str]]:
+        expense_id = get_store().add_expense(expense_data, rollups=analytics_service.rollup_deltas)
+        if expense_id is None:
+            return None # The group was deleted meanwhile
+        created_data = get_store().get_expense(expense_id)
+        if created_data is None:
+            return None
+        return expense_id, created_data, 'created'
+
+    def update(self, expense_id: str, group_id: str, fields: dict) -> Optional[Tuple[dict, dict, str]]:
+        return get_store().update_expense(expense_id, fields, rollups=analytics_service.rollup_deltas)
+
+    def delete(self, expense_id: str, group_id: str) -> Optional[dict]:
+        return get_store().delete_expense(expense_id, rollups=analytics_service.rollup_deltas)
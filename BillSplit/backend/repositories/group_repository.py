@@ -0,0 +1,298 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from backend.firebase_db import get_store, increment
+from backend.services import sync_service
+from backend.services.job_service import report_progress
+from backend.services.projections import DOCUMENT_ID, GROUP_OWNER
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference, DocumentReference
+
+groups_ref: CollectionReference = lambda: get_store().collection('groups')
+users_ref: CollectionReference = lambda: get_store().collection('users')
+
+class GroupRepository(ABC):
+    """
+    Group documents {name, description, owner_id, created_at, version} and their members.
+    Documents are returned with the member ids under 'members'.
+    """
+
+    @abstractmethod
+    def exists(self, group_id: str) -> bool:
+        """Whether the group exists."""
+
+    @abstractmethod
+    def create(self, group_data: dict, owner_id: str, member_firebase_uids: Iterable[str]) -> Optional[Tuple[str, List[str]]]:
+        """
+        Stores the group with the owner and the users with the given Firebase UIDs as members.
+        Returns (group id, UIDs that matched no user), or None if the owner doesn't exist.
+        """
+
+    @abstractmethod
+    def get(self, group_id: str) -> Optional[dict]:
+        """The group document with its member ids, or None."""
+
+    @abstractmethod
+    def get_access(self, group_id: str) -> Optional[Tuple[str, List[str]]]:
+        """(owner id, member ids), or None if the group doesn't exist."""
+
+    @abstractmethod
+    def get_accesses(self, group_ids: List[str]) -> Dict[str, Tuple[str, List[str]]]:
+        """group id -> (owner id, member ids) for the groups that exist."""
+
+    @abstractmethod
+    def get_version(self, group_id: str) -> Optional[Tuple[str, int]]:
+        """(owner id, version), or None if the group doesn't exist."""
+
+    @abstractmethod
+    def bump_version(self, group_id: str):
+        """Advances the group's version, invalidating cached views of it."""
+
+    @abstractmethod
+    def list_for_user(self, user_id: str) -> List[Tuple[str, dict]]:
+        """(group id, document) of every group the user is a member of."""
+
+    @abstractmethod
+    def ids_for_user(self, user_id: str) -> List[str]:
+        """Ids of the groups the user is a member of."""
+
+    @abstractmethod
+    def all_ids(self) -> List[str]:
+        """Ids of every group, for the maintenance scripts."""
+
+    @abstractmethod
+    def memberships(self, group_id: str, user_ids: Iterable[str]) -> Tuple[Set[str], Set[str]]:
+        """(ids of the given users that exist, ids of those that are members of the group)."""
+
+    @abstractmethod
+    def update(self, group_id: str, fields: dict) -> bool:
+        """Sets the given name/description and advances the version; False if the group doesn't exist."""
+
+    @abstractmethod
+    def delete(self, group_id: str) -> bool:
+        """Deletes the group with its members, expenses and everything else stored for it; False if it doesn't exist."""
+
+    @abstractmethod
+    def add_member(self, group_id: str, user_id: str) -> bool:
+        """False if the user already is a member (or the group is gone)."""
+
+    @abstractmethod
+    def remove_member(self, group_id: str, user_id: str) -> bool:
+        """False if the user isn't a member (or the group is gone)."""
+
+class FirestoreGroupRepository(GroupRepository):
+    # Members are a subcollection (groups/{id}/members/{user_id}); changes go through
+    # sync_service.commit_change, which advances the version in the same transaction.
+
+    def exists(self, group_id: str) -> bool:
+        return DOCUMENT_ID.exists(groups_ref().document(group_id))
+
+    def _member_ids(self, group_id: str) -> List[str]:
+        # Ids only, not the member documents
+        return DOCUMENT_ID.ids(groups_ref().document(group_id).collection('members'))
+
+    def create(self, group_data: dict, owner_id: str, member_firebase_uids: Iterable[str]) -> Optional[Tuple[str, List[str]]]:
+        owner_doc = users_ref().document(owner_id).get()
+        if not owner_doc.exists:
+            return None
+
+        # Add the group document
+        update_time, doc_ref = groups_ref().add(group_data)
+        group_id = doc_ref.id
+
+        # Add owner as the first member
+        initial_members_firebase_uids = list(set(list(member_firebase_uids) + [owner_doc.to_dict().get('firebase_uid')]))
+
+        # Add members to a 'members' subcollection
+        group_members_subcollection: CollectionReference = groups_ref().document(group_id).collection('members')
+        missing_uids = []
+        for firebase_uid in initial_members_firebase_uids:
+            user_query = users_ref().where('firebase_uid', '==', firebase_uid).limit(1).get()
+            if user_query:
+                group_members_subcollection.document(user_query[0].id).set({'added_at': datetime.utcnow()})
+            else:
+                missing_uids.append(firebase_uid)
+        return group_id, missing_uids
+
+    def get(self, group_id: str) -> Optional[dict]:
+        group_doc = groups_ref().document(group_id).get()
+        if not group_doc.exists:
+            return None
+        return dict(group_doc.to_dict(), members=self._member_ids(group_id))
+
+    def get_access(self, group_id: str) -> Optional[Tuple[str, List[str]]]:
+        group = GROUP_OWNER.get(groups_ref().document(group_id))
+        if group is None:
+            return None
+        return group.get('owner_id'), self._member_ids(group_id)
+
+    def get_accesses(self, group_ids: List[str]) -> Dict[str, Tuple[str, List[str]]]:
+        # Owners in one batched read; member ids need a query per existing group
+        owners = dict(GROUP_OWNER.get_all(groups_ref().document(group_id) for group_id in group_ids))
+        return {group_id: (group.get('owner_id'), self._member_ids(group_id)) for group_id, group in owners.items()}
+
+    def get_version(self, group_id: str) -> Optional[Tuple[str, int]]:
+        group_doc = groups_ref().document(group_id).get(field_paths=['version', 'owner_id'])
+        if not group_doc.exists:
+            return None
+        group_data = group_doc.to_dict() or {}
+        return group_data.get('owner_id'), group_data.get('version', 0)
+
+    def bump_version(self, group_id: str):
+        groups_ref().document(group_id).update({'version': increment(1)})
+
+    def list_for_user(self, user_id: str) -> List[Tuple[str, dict]]:
+        # Firestore doesn't directly support querying subcollections across documents.
+        # The common pattern is to query all groups and then filter members.
+        # For efficiency for large numbers of groups/users, a dedicated 'group_memberships'
+        # collection might be better where each document represents a user's membership to a group.
+        # For now, we iterate through groups and check membership.
+        user_groups = []
+        for group_doc in groups_ref().stream():
+            group_id = group_doc.id
+            # Check if user_id is present in the 'members' subcollection of this group
+            if DOCUMENT_ID.exists(groups_ref().document(group_id).collection('members').document(user_id)):
+                user_groups.append((group_id, dict(group_doc.to_dict(), members=self._member_ids(group_id))))
+        return user_groups
+
+    def ids_for_user(self, user_id: str) -> List[str]:
+        return [group_id for group_id in DOCUMENT_ID.ids(groups_ref())
+                if DOCUMENT_ID.exists(groups_ref().document(group_id).collection('members').document(user_id))]
+
+    def all_ids(self) -> List[str]:
+        return DOCUMENT_ID.ids(groups_ref())
+
+    def memberships(self, group_id: str, user_ids: Iterable[str]) -> Tuple[Set[str], Set[str]]:
+        user_ids = list(dict.fromkeys(user_ids))
+        members_ref = groups_ref().document(group_id).collection('members')
+        existing = {user_id for user_id in user_ids if DOCUMENT_ID.exists(users_ref().document(user_id))}
+        return existing, {user_id for user_id in existing if DOCUMENT_ID.exists(members_ref.document(user_id))}
+
+    def update(self, group_id: str, fields: dict) -> bool:
+        # Stamped with the new version for delta sync
+        return sync_service.commit_change(group_id, lambda transaction, seq: True, group_fields=fields) is not None
+
+    def delete(self, group_id: str) -> bool:
+        group_ref: DocumentReference = groups_ref().document(group_id)
+        group_doc = group_ref.get()
+        if not group_doc.exists:
+            return False
+
+        # Recurring templates first, so a scheduler run racing with the deletion fails its
+        # precondition on the template instead of writing occurrences into the deleted group
+        for doc in get_store().collection('recurring_expenses').where('group_id', '==', group_id).stream():
+            doc.reference.delete()
+
+        # Then the group document: expense and member writes check it in their transaction (see
+        # sync_service.commit_change), so none lands after this, and the cascade below removes
+        # everything written before. If the cascade is interrupted its leftovers stay orphaned.
+        group_ref.delete()
+
+        # Delete subcollections (Firestore doesn't do this recursively)
+        # Delete members subcollection
+        members_snapshot = group_ref.collection('members').stream()
+        for doc in members_snapshot:
+            doc.reference.delete()
+        report_progress(0.1, message="Members deleted") # When run as a background job
+
+        # Delete expenses related to this group (assuming expenses are in a top-level collection
+        # but also have a group_id field that can be queried).
+        # If expenses were a subcollection, delete them similarly.
+        expenses_in_group = get_store().collection('expenses').where('group_id', '==', group_id).stream()
+        for exp_doc in expenses_in_group:
+            exp_doc.reference.delete()
+        report_progress(0.8, message="Expenses deleted")
+
+        # Delete archived (compacted) expenses and their index entries
+        for archive_doc in group_ref.collection('expense_archives').stream():
+            for expense_id in archive_doc.to_dict().get('expenses') or {}:
+                get_store().collection('expense_archive_index').document(expense_id).delete()
+            archive_doc.reference.delete()
+
+        # Delete the spending analytics rollups and the delta sync tombstones
+        for collection in ('monthly_rollups', 'member_rollups', 'tombstones'):
+            for doc in group_ref.collection(collection).stream():
+                doc.reference.delete()
+        return True
+
+    def add_member(self, group_id: str, user_id: str) -> bool:
+        member_ref: DocumentReference = groups_ref().document(group_id).collection('members').document(user_id)
+
+        def add(transaction, seq):
+            if member_ref.get([], transaction=transaction).exists:
+                return None # User is already a member
+            transaction.set(member_ref, {'added_at': datetime.utcnow(), 'sync_seq': seq})
+            # A member removed earlier and added back is no longer reported as removed
+            transaction.delete(sync_service.tombstones_ref(group_id).document(sync_service.tombstone_id('member', user_id)))
+            return True
+
+        return bool(sync_service.commit_change(group_id, add))
+
+    def remove_member(self, group_id: str, user_id: str) -> bool:
+        member_ref: DocumentReference = groups_ref().document(group_id).collection('members').document(user_id)
+
+        def remove(transaction, seq):
+            if not member_ref.get([], transaction=transaction).exists:
+                return None # User is not a member
+            transaction.delete(member_ref)
+            transaction.set(sync_service.tombstones_ref(group_id).document(sync_service.tombstone_id('member', user_id)),
+                            sync_service.tombstone('member', user_id, seq))
+            return True
+
+        return bool(sync_service.commit_change(group_id, remove))
+
+class SqliteGroupRepository(GroupRepository):
+    # Memberships are a table; the store advances the version in each write's transaction
+
+    def exists(self, group_id: str) -> bool:
+        return get_store().group_exists(group_id)
+
+    def create(self, group_data: dict, owner_id: str, member_firebase_uids: Iterable[str]) -> Optional[Tuple[str, List[str]]]:
+        # Group and memberships are inserted in one transaction
+        if not get_store().user_exists(owner_id):
+            return None
+        return get_store().create_group(group_data, owner_id, member_firebase_uids)
+
+    def get(self, group_id: str) -> Optional[dict]:
+        return get_store().get_group(group_id)
+
+    def get_access(self, group_id: str) -> Optional[Tuple[str, List[str]]]:
+        return get_store().get_group_access(group_id)
+
+    def get_accesses(self, group_ids: List[str]) -> Dict[str, Tuple[str, List[str]]]:
+        return get_store().get_group_accesses(group_ids)
+
+    def get_version(self, group_id: str) -> Optional[Tuple[str, int]]:
+        return get_store().get_group_version(group_id)
+
+    def bump_version(self, group_id: str):
+        get_store().bump_group_version(group_id)
+
+    def list_for_user(self, user_id: str) -> List[Tuple[str, dict]]:
+        # Through the memberships index; member ids of all of them come with one more query
+        return get_store().get_user_groups(user_id)
+
+    def ids_for_user(self, user_id: str) -> List[str]:
+        return get_store().get_user_group_ids(user_id)
+
+    def all_ids(self) -> List[str]:
+        return get_store().get_group_ids()
+
+    def memberships(self, group_id: str, user_ids: Iterable[str]) -> Tuple[Set[str], Set[str]]:
+        # Existence and membership of everyone in one query
+        return get_store().memberships(group_id, user_ids)
+
+    def update(self, group_id: str, fields: dict) -> bool:
+        return get_store().update_group(group_id, fields)
+
+    def delete(self, group_id: str) -> bool:
+        # Memberships, expenses and recurring templates are removed by ON DELETE CASCADE
+        return get_store().delete_group(group_id)
+
+    def add_member(self, group_id: str, user_id: str) -> bool:
+        return get_store().add_member(group_id, user_id, datetime.utcnow())
+
+    def remove_member(self, group_id: str, user_id: str) -> bool:
+        return get_store().remove_member(group_id, user_id)
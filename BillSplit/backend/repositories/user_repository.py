@@ -0,0 +1,58 @@
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from backend.firebase_db import get_store
+from backend.services.projections import DOCUMENT_ID
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference
+
+users_ref: CollectionReference = lambda: get_store().collection('users')
+
+class UserRepository(ABC):
+    """User documents: {firebase_uid, email, username, created_at}, keyed by the internal user id."""
+
+    @abstractmethod
+    def get(self, user_id: str) -> Optional[dict]:
+        """The user document, or None."""
+
+    @abstractmethod
+    def exists(self, user_id: str) -> bool:
+        """Whether the user exists."""
+
+    @abstractmethod
+    def find_by_firebase_uid(self, firebase_uid: str) -> Optional[Tuple[str, dict]]:
+        """(internal user id, user document) of the user with this Firebase UID, or None."""
+
+    @abstractmethod
+    def create(self, user_data: dict) -> Tuple[str, dict]:
+        """Stores a new user; returns (user id, stored document)."""
+
+class FirestoreUserRepository(UserRepository):
+    def get(self, user_id: str) -> Optional[dict]:
+        user_doc = users_ref().document(user_id).get()
+        return user_doc.to_dict() if user_doc.exists else None
+
+    def exists(self, user_id: str) -> bool:
+        return DOCUMENT_ID.exists(users_ref().document(user_id))
+
+    def find_by_firebase_uid(self, firebase_uid: str) -> Optional[Tuple[str, dict]]:
+        user_query = users_ref().where('firebase_uid', '==', firebase_uid).limit(1).get()
+        return (user_query[0].id, user_query[0].to_dict()) if user_query else None
+
+    def create(self, user_data: dict) -> Tuple[str, dict]:
+        update_time, doc_ref = users_ref().add(user_data)
+        return doc_ref.id, user_data
+
+class SqliteUserRepository(UserRepository):
+    def get(self, user_id: str) -> Optional[dict]:
+        return get_store().get_user(user_id)
+
+    def exists(self, user_id: str) -> bool:
+        return get_store().user_exists(user_id)
+
+    def find_by_firebase_uid(self, firebase_uid: str) -> Optional[Tuple[str, dict]]:
+        return get_store().find_user_by_firebase_uid(firebase_uid)
+
+    def create(self, user_data: dict) -> Tuple[str, dict]:
+        return get_store().create_user(user_data)
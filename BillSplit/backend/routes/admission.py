@@ -0,0 +1,86 @@
+from flask import current_app, jsonify, request
+from backend.services.admission_service import AdmissionRejected, get_admission_controller
+from backend.services.job_service import check_cancelled
+from contextlib import contextmanager
+from functools import wraps
+import sqlite3
+import time
+
+def _release(controller, endpoint: str, ticket, started: float):
+    try:
+        controller.release(endpoint, ticket, started)
+    except sqlite3.Error as e:
+        # The slot expires after ADMISSION_SLOT_TTL_SECONDS; the call itself succeeded
+        current_app.logger.warning(f"Admission control unavailable, could not release slot: {e}")
+
+@contextmanager
+def admission(endpoint: str):
+    """
+    Holds an admission slot of the endpoint for the current user during the block. Yields None
+    when admitted, or the 429 response (with Retry-After) to return when a limit is reached.
+    Use it inside a view to admit only the calls that do the expensive work, e.g. after a 304 check.
+    """
+    if not current_app.config.get('ADMISSION_ENABLED', True):
+        yield None
+        return
+
+    controller = get_admission_controller()
+    try:
+        ticket, started = controller.acquire(request.user_id, endpoint)
+    except AdmissionRejected as e:
+        response = jsonify({"message": "Too many expensive requests in progress. Please retry shortly.", "scope": e.scope})
+        response.headers['Retry-After'] = str(e.retry_after)
+        yield response, 429
+        return
+    except sqlite3.Error as e:
+        # The shared backend is an optimization; never turn its failures into outages
+        current_app.logger.warning(f"Admission control unavailable, admitting request: {e}")
+        yield None
+        return
+
+    try:
+        yield None
+    finally:
+        _release(controller, endpoint, ticket, started)
+
+def admission_controlled(endpoint: str):
+    """
+    Limits concurrent calls of an expensive endpoint per user and overall, answering 429 with
+    Retry-After when a limit is reached. Apply below jwt_required, which sets request.user_id.
+    The endpoint name selects the cost weight from ADMISSION_COSTS.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with admission(endpoint) as rejected:
+                return rejected if rejected is not None else f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def admitted_job(endpoint: str, function):
+    """
+    function wrapped to hold an admission slot of the endpoint for the current user while it runs
+    as a background job; the job waits for a slot (staying cancellable) instead of failing.
+    """
+    user_id = request.user_id
+
+    @wraps(function)
+    def run(*args, **kwargs):
+        if not current_app.config.get('ADMISSION_ENABLED', True):
+            return function(*args, **kwargs)
+        controller = get_admission_controller()
+        while True:
+            try:
+                ticket, started = controller.acquire(user_id, endpoint)
+                break
+            except AdmissionRejected as e:
+                check_cancelled()
+                time.sleep(e.retry_after)
+            except sqlite3.Error as e:
+                current_app.logger.warning(f"Admission control unavailable, admitting job: {e}")
+                return function(*args, **kwargs)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _release(controller, endpoint, ticket, started)
+    return run
@@ -0,0 +1,33 @@
+from flask import Blueprint, request, jsonify, current_app
+from backend.services import batch_service
+from backend.routes.auth import jwt_required
+from backend.models import BatchGetRequest
+from pydantic import ValidationError
+
+batch_bp = Blueprint('batch', __name__)
+
+@batch_bp.route('/get', methods=['POST'])
+@jwt_required
+def batch_get():
+    """
+    Groups, expenses and users by id: {"groups": [...], "expenses": [...], "users": [...]}.
+    Answers 200 with each id mapped to {status, data} or {status, message}.
+    """
+    user_id = request.user_id
+    data = request.get_json()
+    if not data:
+        return jsonify({"message": "No input data provided."}), 400
+
+    try:
+        batch_request = BatchGetRequest(**data)
+        max_ids = current_app.config.get('BATCH_GET_MAX_IDS', 100)
+        count = len(batch_request.groups) + len(batch_request.expenses) + len(batch_request.users)
+        if count > max_ids:
+            return jsonify({"message": f"Too many ids ({count}); at most {max_ids} per batch."}), 400
+
+        result = batch_service.get_many(user_id, batch_request)
+        return jsonify(result.model_dump()), 200
+    except ValidationError as e:
+        return jsonify({"message": "Validation error", "errors": e.errors()}), 400
+    except Exception as e:
+        return jsonify({"message": f"An error occurred: {e}"}), 500
@@ -0,0 +1,36 @@
+from flask import request, make_response
+from backend.services import group_service
+
+# Conditional GET helpers for group-scoped resources.
+# Every mutation of a group, its members or its expenses bumps the group's change version,
+# so (resource, group_id, version) identifies the exact payload we would send.
+
+def group_etag(resource: str, group_id: str, version: int) -> str:
+    """Builds the strong ETag for a group-scoped resource at a given change version."""
+    return f"{resource}-{group_id}-v{version}"
+
+def check_not_modified(resource: str, group_id: str, user_id: str):
+    """
+    Runs the cheap version check for a conditional GET.
+    Returns (etag, not_modified_response). The response is a ready-made 304 when the
+    client's If-None-Match matches, otherwise None and the route builds the full payload.
+    etag is None when the cheap check can't authorize the user; the route's normal
+    access checks then produce the 403/404.
+    """
+    version = group_service.get_group_version(group_id, user_id)
+    if version is None:
+        return None, None
+
+    etag = group_etag(resource, group_id, version)
+    if request.if_none_match.contains_weak(etag):
+        return etag, with_version_headers(make_response('', 304), etag)
+    return etag, None
+
+def with_version_headers(response, etag: str):
+    """Attaches the ETag and group version headers to a response."""
+    if etag is None:
+        return response
+    response.set_etag(etag)
+    response.headers['X-Group-Version'] = etag.rsplit('-v', 1)[1]
+    response.headers['Cache-Control'] = 'private, no-cache' # Always revalidate, the 304 is cheap
+    return response
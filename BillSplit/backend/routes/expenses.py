@@ -1,17 +1,20 @@
 from flask import Blueprint, request, jsonify
-from backend.services import expense_service, group_service # Import group_service to validate group access
+from backend.services import expense_service, group_service, search_service # Import group_service to validate group access
 from backend.routes.auth import jwt_required
+from backend.routes.conditional import check_not_modified, with_version_headers
+from backend.routes.admission import admission_controlled
 from backend.models import ExpenseCreate, ExpenseUpdate
 from pydantic import ValidationError
+from datetime import datetime
 
 expenses_bp = Blueprint('expenses', __name__)
 
-# Helper to check if user has access to a group
+# Helper to check if user has access to a group (cached owner/member ids, not the full group)
 def _user_can_access_group(user_id, group_id):
-    group = group_service.get_group(group_id)
-    if not group:
+    access = group_service.get_group_access(group_id, user_id)
+    if not access:
         return False, "Group not found."
-    if user_id not in group.members and user_id != group.owner_id:
+    if not access.allows(user_id):
         return False, "Access denied. Not a member of this group."
     return True, None
 
@@ -40,11 +43,13 @@ def add_expense():
             # If payer is different, verify requesting user has permission (e.g., group owner, or admin)
             # For simplicity, let's assume only the logged-in user can add expenses on their behalf initially.
             # Or, if adding on behalf of another member, the requesting user must be a member too.
-            if expense_create_data.payer_id not in group_service.get_group(group_id).members:
+            if expense_create_data.payer_id not in group_service.get_group_access(group_id, expense_create_data.payer_id).members:
                  return jsonify({"message": "Payer must be a member of the group."}), 403
             # If allowing user to create expense for others, consider more robust authorization here.
 
         new_expense = expense_service.add_expense(expense_create_data)
+        if new_expense is None:
+            return jsonify({"message": "Group not found."}), 404 # Deleted after the access check
         return jsonify(new_expense.model_dump(by_alias=True)), 201
     except ValidationError as e:
         return jsonify({"message": "Validation error", "errors": e.errors()}), 400
@@ -53,6 +58,44 @@ def add_expense():
     except Exception as e:
         return jsonify({"message": f"An error occurred: {e}"}), 500
 
+@expenses_bp.route('/search', methods=['GET'])
+@jwt_required
+def search_expenses():
+    """
+    Expenses of the user's groups whose description matches ?q= (every word, as a word or word prefix), best first.
+    Optional ?group_id=, ?from= and ?to= (ISO 8601, to is exclusive), ?min_amount=, ?max_amount=, ?limit= and ?offset=.
+    """
+    user_id = request.user_id
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({"message": "q is required."}), 400
+    try:
+        start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+        min_amount = float(request.args['min_amount']) if request.args.get('min_amount') else None
+        max_amount = float(request.args['max_amount']) if request.args.get('max_amount') else None
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        offset = int(request.args.get('offset') or 0)
+    except ValueError:
+        return jsonify({"message": "from and to must be ISO 8601 dates; min_amount, max_amount, limit and offset numbers."}), 400
+    if (limit is not None and limit < 1) or offset < 0:
+        return jsonify({"message": "limit must be positive and offset not negative."}), 400
+
+    try:
+        group_id = request.args.get('group_id') or None
+        if group_id:
+            can_access, msg = _user_can_access_group(user_id, group_id)
+            if not can_access:
+                return jsonify({"message": msg}), 403
+
+        page = search_service.search_expenses(user_id, q, group_id=group_id, start=start, end=end,
+                                              min_amount=min_amount, max_amount=max_amount, limit=limit, offset=offset)
+        return jsonify(page.model_dump(by_alias=True)), 200
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"message": f"An error occurred: {e}"}), 500
+
 @expenses_bp.route('/<string:expense_id>', methods=['GET'])
 @jwt_required
 def get_expense_details(expense_id):
@@ -76,17 +119,22 @@ def get_expense_details(expense_id):
 def get_expenses_by_group(group_id):
     user_id = request.user_id
     try:
+        etag, not_modified = check_not_modified('expenses', group_id, user_id)
+        if not_modified:
+            return not_modified
+
         can_access, msg = _user_can_access_group(user_id, group_id)
         if not can_access:
             return jsonify({"message": msg}), 403
 
         expenses = expense_service.get_expenses_for_group(group_id)
-        return jsonify([exp.model_dump(by_alias=True) for exp in expenses]), 200
+        return with_version_headers(jsonify([exp.model_dump(by_alias=True) for exp in expenses]), etag), 200
     except Exception as e:
         return jsonify({"message": f"An error occurred: {e}"}), 500
 
 @expenses_bp.route('/user/<string:user_to_query_id>', methods=['GET'])
 @jwt_required
+@admission_controlled('expenses.user')
 def get_expenses_by_user(user_to_query_id):
     current_user_id = request.user_id
     
@@ -128,7 +176,7 @@ def update_expense(expense_id):
             return jsonify({"message": "Expense not found."}), 404
 
         # Only the payer or group owner can update an expense
-        group = group_service.get_group(existing_expense.group_id)
+        group = group_service.get_group_access(existing_expense.group_id)
         if not group: # Should not happen if expense exists
             return jsonify({"message": "Associated group not found."}), 404
 
@@ -157,7 +205,7 @@ def delete_expense(expense_id):
             return jsonify({"message": "Expense not found."}), 404
 
         # Only the payer or group owner can delete an expense
-        group = group_service.get_group(existing_expense.group_id)
+        group = group_service.get_group_access(existing_expense.group_id)
         if not group:
             return jsonify({"message": "Associated group not found."}), 404
 
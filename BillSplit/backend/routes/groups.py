@@ -1,8 +1,14 @@
-from flask import Blueprint, request, jsonify, current_app
-from backend.services import group_service, auth_service
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from backend.services import group_service, auth_service, event_service, expense_service, export_service, analytics_service, sync_service
 from backend.routes.auth import jwt_required
+from backend.routes.conditional import check_not_modified, with_version_headers
+from backend.routes.jobs import submit_job, wants_async
 from backend.models import GroupCreate, GroupUpdate
 from pydantic import ValidationError # Ensure this is imported
+from datetime import datetime
+import hashlib
+import json
+import time
 
 groups_bp = Blueprint('groups', __name__)
 
@@ -57,6 +63,10 @@ def get_user_groups():
 def get_group_details(group_id):
     user_id = request.user_id
     try:
+        etag, not_modified = check_not_modified('group', group_id, user_id)
+        if not_modified:
+            return not_modified
+
         group = group_service.get_group(group_id)
         if not group:
             return jsonify({"message": "Group not found."}), 404
@@ -65,10 +75,140 @@ def get_group_details(group_id):
         if user_id not in group.members and user_id != group.owner_id:
             return jsonify({"message": "Access denied. Not a member of this group."}), 403
 
-        return jsonify(group.model_dump(by_alias=True)), 200
+        return with_version_headers(jsonify(group.model_dump(by_alias=True)), etag), 200
     except Exception as e:
         return jsonify({"message": f"An error occurred: {e}"}), 500
 
+@groups_bp.route('/<string:group_id>/stats', methods=['GET'])
+@jwt_required
+def get_group_stats(group_id):
+    """Expense count, total and average for a group, optionally ?payer_id=, ?from= and ?to= (ISO 8601, to is exclusive)."""
+    user_id = request.user_id
+    try:
+        payer_id = request.args.get('payer_id') or None
+        start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({"message": "from and to must be ISO 8601 dates."}), 400
+
+    try:
+        # Each filter combination is its own representation of the group's stats
+        resource = f"stats.{hashlib.sha1(request.query_string).hexdigest()[:10]}" if request.query_string else 'stats'
+        etag, not_modified = check_not_modified(resource, group_id, user_id)
+        if not_modified:
+            return not_modified
+
+        access = group_service.get_group_access(group_id, user_id)
+        if not access:
+            return jsonify({"message": "Group not found."}), 404
+        if not access.allows(user_id):
+            return jsonify({"message": "Access denied. Not a member of this group."}), 403
+
+        stats = expense_service.get_group_expense_stats(group_id, payer_id=payer_id, start=start, end=end)
+        return with_version_headers(jsonify(stats.model_dump()), etag), 200
+    except Exception as e:
+        current_app.logger.error(f"Error computing stats for group {group_id}: {e}", exc_info=True)
+        return jsonify({"message": f"An error occurred: {e}"}), 500
+
+@groups_bp.route('/<string:group_id>/analytics', methods=['GET'])
+@jwt_required
+def get_group_analytics(group_id):
+    """Spending per month of the group and each member, optionally for ?from= and ?to= months (YYYY-MM or ISO 8601, both inclusive)."""
+    user_id = request.user_id
+    try:
+        start_month = analytics_service.parse_month(request.args['from']) if request.args.get('from') else None
+        end_month = analytics_service.parse_month(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({"message": "from and to must be months (YYYY-MM) or ISO 8601 dates."}), 400
+
+    try:
+        # Each range is its own representation of the group's analytics
+        resource = f"analytics.{hashlib.sha1(request.query_string).hexdigest()[:10]}" if request.query_string else 'analytics'
+        etag, not_modified = check_not_modified(resource, group_id, user_id)
+        if not_modified:
+            return not_modified
+
+        access = group_service.get_group_access(group_id, user_id)
+        if not access:
+            return jsonify({"message": "Group not found."}), 404
+        if not access.allows(user_id):
+            return jsonify({"message": "Access denied. Not a member of this group."}), 403
+
+        analytics = analytics_service.get_group_analytics(group_id, start_month, end_month)
+        return with_version_headers(jsonify(analytics.model_dump()), etag), 200
+    except Exception as e:
+        current_app.logger.error(f"Error reading analytics for group {group_id}: {e}", exc_info=True)
+        return jsonify({"message": f"An error occurred: {e}"}), 500
+
+@groups_bp.route('/<string:group_id>/changes', methods=['GET'])
+@jwt_required
+def get_group_changes(group_id):
+    """
+    Delta sync: the expenses created or updated, expenses deleted and members added or removed
+    since ?since=<cursor>, plus the cursor for the next call. Without since, the whole group.
+    410 when the cursor is older than the change history kept: sync again without since.
+    """
+    user_id = request.user_id
+    try:
+        since = sync_service.parse_cursor(request.args.get('since'))
+    except ValueError:
+        return jsonify({"message": "since must be a cursor returned by this endpoint."}), 400
+
+    try:
+        access = group_service.get_group_access(group_id, user_id)
+        if not access:
+            return jsonify({"message": "Group not found."}), 404
+        if not access.allows(user_id):
+            return jsonify({"message": "Access denied. Not a member of this group."}), 403
+
+        changes = sync_service.get_changes(group_id, since)
+        if changes is None:
+            return jsonify({"message": "Group not found."}), 404
+        return jsonify(changes.model_dump(by_alias=True)), 200
+    except sync_service.ResyncRequired:
+        return jsonify({"message": "Full resync required: the cursor is older than the change history kept.",
+                        "resync_required": True}), 410
+    except Exception as e:
+        current_app.logger.error(f"Error reading changes of group {group_id}: {e}", exc_info=True)
+        return jsonify({"message": f"An error occurred: {e}"}), 500
+
+@groups_bp.route('/<string:group_id>/export', methods=['GET'])
+@jwt_required
+def export_group_expenses(group_id):
+    """
+    Streams the group's full expense history as ?format=csv (default) or jsonl, one row per
+    participant. ?cursor= resumes an interrupted download (see export_service).
+    """
+    user_id = request.user_id
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'jsonl'):
+        return jsonify({"message": "format must be csv or jsonl."}), 400
+
+    try:
+        access = group_service.get_group_access(group_id, user_id)
+        if not access:
+            return jsonify({"message": "Group not found."}), 404
+        if not access.allows(user_id):
+            return jsonify({"message": "Access denied. Not a member of this group."}), 403
+
+        cursor = request.args.get('cursor') or None
+        if cursor:
+            export_service.decode_cursor(cursor) # Reject bad cursors before the 200 goes out
+        pages = export_service.iter_group_export_rows(group_id, cursor=cursor)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"message": f"An error occurred: {e}"}), 500
+
+    if export_format == 'csv':
+        body, mimetype = export_service.stream_csv(pages), 'text/csv'
+    else:
+        body, mimetype = export_service.stream_jsonl(pages), 'application/x-ndjson'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="group-{group_id}.{export_format}"'
+    response.headers['X-Accel-Buffering'] = 'no' # Let proxies pass chunks through as they are produced
+    return response
+
 @groups_bp.route('/<string:group_id>', methods=['PUT'])
 @jwt_required
 def update_group(group_id):
@@ -79,7 +219,7 @@ def update_group(group_id):
 
     try:
         # Before updating, check if user is the owner
-        existing_group = group_service.get_group(group_id)
+        existing_group = group_service.get_group_access(group_id)
         if not existing_group:
             return jsonify({"message": "Group not found."}), 404
         if existing_group.owner_id != user_id:
@@ -101,12 +241,14 @@ def delete_group(group_id):
     user_id = request.user_id
     try:
         # Before deleting, check if user is the owner
-        existing_group = group_service.get_group(group_id)
+        existing_group = group_service.get_group_access(group_id)
         if not existing_group:
             return jsonify({"message": "Group not found."}), 404
         if existing_group.owner_id != user_id:
             return jsonify({"message": "Access denied. Only the owner can delete this group."}), 403
 
+        if wants_async():
+            return submit_job(group_service.delete_group, group_id)
         success = group_service.delete_group(group_id)
         if success:
             return jsonify({"message": "Group deleted successfully."}), 204 # No Content
@@ -125,18 +267,18 @@ def add_group_member(group_id):
 
     try:
         # Check if requesting user is the owner of the group
-        existing_group = group_service.get_group(group_id)
+        existing_group = group_service.get_group_access(group_id)
         if not existing_group:
             return jsonify({"message": "Group not found."}), 404
         if existing_group.owner_id != user_id:
             return jsonify({"message": "Access denied. Only the owner can add members."}), 403
         
         # Find the internal user_id from the firebase_uid
-        member_user = auth_service.db.collection('users').where('firebase_uid', '==', member_user_firebase_uid).limit(1).get()
+        member_user = auth_service.find_user_by_firebase_uid(member_user_firebase_uid)
         if not member_user:
             return jsonify({"message": "Member user not found with provided Firebase UID."}), 404
         
-        member_internal_id = member_user[0].id
+        member_internal_id = member_user[0]
 
         added = group_service.add_member_to_group(group_id, member_internal_id)
         if added:
@@ -153,7 +295,7 @@ def remove_group_member(group_id, member_id):
     user_id = request.user_id # User making the request
     try:
         # Check if requesting user is the owner of the group
-        existing_group = group_service.get_group(group_id)
+        existing_group = group_service.get_group_access(group_id)
         if not existing_group:
             return jsonify({"message": "Group not found."}), 404
         if existing_group.owner_id != user_id:
@@ -166,4 +308,68 @@ def remove_group_member(group_id, member_id):
     except ValueError as e:
         return jsonify({"message": str(e)}), 400
     except Exception as e:
-        return jsonify({"message": f"An error occurred: {e}"}), 500
\ No newline at end of file
+        return jsonify({"message": f"An error occurred: {e}"}), 500
+
+@groups_bp.route('/<string:group_id>/events', methods=['GET'])
+@jwt_required
+def stream_group_events(group_id):
+    """
+    Server-Sent Events stream of expense and balance changes in a group.
+    Reconnecting clients send Last-Event-ID (or ?cursor=) to replay what they missed;
+    a 'resync' event means the cursor is too old and the client should refetch.
+    """
+    user_id = request.user_id
+    try:
+        access = group_service.get_group_access(group_id, user_id)
+        if not access:
+            return jsonify({"message": "Group not found."}), 404
+        if not access.allows(user_id):
+            return jsonify({"message": "Access denied. Not a member of this group."}), 403
+
+        bus = event_service.get_event_bus()
+        cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+        subscription, backlog, resync = bus.subscribe(group_id, cursor)
+    except event_service.TooManyConnections:
+        response = jsonify({"message": "Too many live connections on this server, retry later."})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    except Exception as e:
+        return jsonify({"message": f"An error occurred: {e}"}), 500
+
+    heartbeat_seconds = current_app.config['SSE_HEARTBEAT_SECONDS']
+    max_stream_seconds = current_app.config['SSE_MAX_STREAM_SECONDS']
+
+    def resync_frame(reason):
+        last_id = bus.last_event_id(group_id)
+        id_line = f"id: {last_id}\n" if last_id else ""
+        return f"{id_line}event: resync\ndata: {json.dumps({'group_id': group_id, 'reason': reason})}\n\n"
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n" # Client reconnect delay in ms
+            if resync:
+                yield resync_frame('cursor_expired')
+            for event in backlog:
+                yield event.encode()
+
+            # Streams are recycled periodically so workers rebalance; clients reconnect with their cursor
+            deadline = time.monotonic() + max_stream_seconds
+            while time.monotonic() < deadline:
+                event = subscription.get(timeout=heartbeat_seconds)
+                if subscription.overflowed:
+                    yield resync_frame('client_too_slow')
+                    return
+                if event is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield event.encode()
+        finally:
+            bus.unsubscribe(subscription)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    # HEAD requests and streams closed before the first chunk never run generate's finally; the
+    # connection slot is released when the server closes the response (unsubscribe is idempotent)
+    response.call_on_close(lambda: bus.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Disable proxy buffering (nginx)
+    return response
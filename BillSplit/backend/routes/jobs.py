@@ -0,0 +1,54 @@
+from flask import Blueprint, request, jsonify
+from backend.services import job_service
+from backend.routes.auth import jwt_required
+
+jobs_bp = Blueprint('jobs', __name__)
+
+def wants_async() -> bool:
+    """True when the client asked for a background job (?async=true) instead of waiting for the result."""
+    return request.args.get('async', '').lower() in ('1', 'true')
+
+def submit_job(function, *args, **kwargs):
+    """Submits function as a job of the current user; 202 with the job record, or 429 over the job limits."""
+    try:
+        job = job_service.submit_job(request.user_id, function, *args, **kwargs)
+    except job_service.JobLimitExceeded as e:
+        message = "Too many jobs in progress. Please wait for one to finish." if e.scope == 'user' else "Job queue is full. Please retry shortly."
+        response = jsonify({"message": message, "scope": e.scope})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    response = jsonify(job.model_dump(by_alias=True))
+    response.headers['Location'] = f"/api/jobs/{job.id}"
+    return response, 202
+
+def _owned_job(job_id):
+    job = job_service.get_job(job_id)
+    # Other users' jobs are reported as missing, not forbidden
+    if job is None or job.user_id != request.user_id:
+        return None
+    return job
+
+
+@jobs_bp.route('/<string:job_id>', methods=['GET'])
+@jwt_required
+def get_job(job_id):
+    try:
+        job = _owned_job(job_id)
+        if not job:
+            return jsonify({"message": "Job not found."}), 404
+        return jsonify(job.model_dump(by_alias=True)), 200
+    except Exception as e:
+        return jsonify({"message": f"An error occurred: {e}"}), 500
+
+@jobs_bp.route('/<string:job_id>', methods=['DELETE'])
+@jwt_required
+def cancel_job(job_id):
+    try:
+        job = _owned_job(job_id)
+        if not job:
+            return jsonify({"message": "Job not found."}), 404
+        if not job_service.cancel_job(job_id):
+            return jsonify({"message": f"Job already {job.status}."}), 409
+        return jsonify({"message": "Cancellation requested."}), 202
+    except Exception as e:
+        return jsonify({"message": f"An error occurred: {e}"}), 500
@@ -0,0 +1,111 @@
+from flask import Blueprint, Flask, Response, current_app, g, jsonify, request
+from backend.services import profiling_service
+from functools import wraps
+from datetime import datetime
+import random
+import threading
+import time
+
+profiles_bp = Blueprint('profiles', __name__)
+
+TOKEN_HEADER = 'X-Profile-Token'
+
+def _store() -> profiling_service.ProfileStore:
+    config = current_app.config
+    return profiling_service.ProfileStore(config.get('PROFILING_DIR', '/tmp/billsplit-profiles'),
+                                          config.get('PROFILING_MAX_PROFILES', 50))
+
+def init_profiling(app: Flask):
+    """
+    Registers the request hooks that profile requests carrying a profiling token or picked at
+    PROFILING_SAMPLE_RATE. Without PROFILING_SECRET and a sample rate nothing is registered.
+    """
+    secret = app.config.get('PROFILING_SECRET')
+    sample_rate = app.config.get('PROFILING_SAMPLE_RATE', 0.0)
+    if not secret and sample_rate <= 0:
+        return
+
+    @app.before_request
+    def start_profiling():
+        if request.blueprint == profiles_bp.name:
+            return # Reading profiles isn't what's being profiled
+        token = request.headers.get(TOKEN_HEADER)
+        if token and profiling_service.verify_token(secret, token):
+            trigger = 'token'
+        elif sample_rate > 0 and random.random() < sample_rate:
+            trigger = 'sample'
+        else:
+            return
+        profiler = profiling_service.SamplingProfiler(threading.get_ident(),
+                                                      interval=app.config.get('PROFILING_INTERVAL_MS', 5) / 1000.0,
+                                                      max_seconds=app.config.get('PROFILING_MAX_SECONDS', 60))
+        g.profiling = (profiler, trigger, time.perf_counter(), time.thread_time())
+        profiler.start()
+
+    @app.after_request
+    def finish_profiling(response):
+        profiling = g.pop('profiling', None)
+        if profiling is None:
+            return response
+        profiler, trigger, started, cpu_started = profiling
+        stacks = profiler.stop()
+        view_args = request.view_args or {}
+        record = {
+            'route': request.url_rule.rule if request.url_rule else None,
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'group_id': view_args.get('group_id') or request.args.get('group_id'),
+            'user_id': getattr(request, 'user_id', None),
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - started) * 1e3, 3),
+            'cpu_ms': round((time.thread_time() - cpu_started) * 1e3, 3),
+            'samples': profiler.samples,
+            'interval_ms': round(profiler.interval * 1e3, 3),
+            'trigger': trigger,
+            'created_at': datetime.utcnow().isoformat(),
+        }
+        try:
+            response.headers['X-Profile-Id'] = _store().save(record, stacks)
+        except OSError as e:
+            current_app.logger.warning(f"Could not store the profile of {request.method} {request.path}: {e}")
+        return response
+
+    @app.teardown_request
+    def stop_profiling(error=None):
+        # Requests that ended without a response (e.g. a client disconnect) still stop their sampler
+        profiling = g.pop('profiling', None)
+        if profiling is not None:
+            profiling[0].stop()
+
+def profiling_token_required(f):
+    """Only callers with a valid profiling token may list and download profiles."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not profiling_service.verify_token(current_app.config.get('PROFILING_SECRET'), request.headers.get(TOKEN_HEADER)):
+            return jsonify({"message": "A valid profiling token is required."}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@profiles_bp.route('', methods=['GET'])
+@profiling_token_required
+def list_profiles():
+    """Recent profiles, newest first (?limit=, default 50)."""
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({"message": "limit must be an integer."}), 400
+    return jsonify({"profiles": _store().list(limit=max(0, limit))}), 200
+
+@profiles_bp.route('/<string:profile_id>', methods=['GET'])
+@profiling_token_required
+def get_profile(profile_id):
+    """The profile's stacks in folded format (feed to flamegraph.pl or speedscope); ?format=json for the whole record."""
+    record = _store().get(profile_id)
+    if record is None:
+        return jsonify({"message": "Profile not found."}), 404
+    if request.args.get('format') == 'json':
+        return jsonify(record), 200
+    return Response(record.get('folded', ''), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename="profile-{profile_id}.folded"'})
@@ -0,0 +1,74 @@
+from flask import Blueprint, request, jsonify
+from backend.services import group_service, recurring_service
+from backend.routes.auth import jwt_required
+from backend.models import RecurringExpenseCreate
+from pydantic import ValidationError
+
+recurring_bp = Blueprint('recurring', __name__)
+
+def _user_can_access_group(user_id, group_id):
+    access = group_service.get_group_access(group_id, user_id)
+    if not access:
+        return None, ("Group not found.", 404)
+    if not access.allows(user_id):
+        return None, ("Access denied. Not a member of this group.", 403)
+    return access, None
+
+
+@recurring_bp.route('', methods=['POST'])
+@jwt_required
+def create_recurring_expense():
+    user_id = request.user_id
+    data = request.get_json()
+    if not data:
+        return jsonify({"message": "No input data provided."}), 400
+
+    try:
+        recurring_data = RecurringExpenseCreate(**data)
+        _, error = _user_can_access_group(user_id, recurring_data.group_id)
+        if error:
+            return jsonify({"message": error[0]}), error[1]
+
+        recurring = recurring_service.create_recurring_expense(recurring_data, user_id)
+        return jsonify(recurring.model_dump(by_alias=True)), 201
+    except ValidationError as e:
+        return jsonify({"message": "Validation error", "errors": e.errors()}), 400
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"message": f"An error occurred: {e}"}), 500
+
+@recurring_bp.route('/group/<string:group_id>', methods=['GET'])
+@jwt_required
+def get_recurring_expenses_by_group(group_id):
+    user_id = request.user_id
+    try:
+        _, error = _user_can_access_group(user_id, group_id)
+        if error:
+            return jsonify({"message": error[0]}), error[1]
+
+        recurring = recurring_service.get_group_recurring_expenses(group_id)
+        return jsonify([r.model_dump(by_alias=True) for r in recurring]), 200
+    except Exception as e:
+        return jsonify({"message": f"An error occurred: {e}"}), 500
+
+@recurring_bp.route('/<string:recurring_id>', methods=['DELETE'])
+@jwt_required
+def delete_recurring_expense(recurring_id):
+    user_id = request.user_id
+    try:
+        recurring = recurring_service.get_recurring_expense(recurring_id)
+        if not recurring:
+            return jsonify({"message": "Recurring expense not found."}), 404
+
+        # Only whoever set it up, the payer or the group owner can stop a schedule
+        group, error = _user_can_access_group(user_id, recurring.group_id)
+        if error:
+            return jsonify({"message": error[0]}), error[1]
+        if user_id not in (recurring.created_by, recurring.payer_id, group.owner_id):
+            return jsonify({"message": "Access denied. Only the creator, payer or group owner can stop this schedule."}), 403
+
+        recurring_service.delete_recurring_expense(recurring_id)
+        return jsonify({"message": "Recurring expense stopped."}), 200
+    except Exception as e:
+        return jsonify({"message": f"An error occurred: {e}"}), 500
@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
-from backend.services import settlement_service, group_service, auth_service
+from backend.services import settlement_service, group_service
 from backend.routes.auth import jwt_required # Import the decorator
+from backend.routes.conditional import check_not_modified, with_version_headers
+from backend.routes.admission import admission, admitted_job
+from backend.routes.jobs import submit_job, wants_async
 
 settlements_bp = Blueprint('settlements', __name__)
 
@@ -9,34 +12,30 @@ settlements_bp = Blueprint('settlements', __name__)
 def get_group_settlements(group_id):
     user_id = request.user_id # User making the request
     try:
+        etag, not_modified = check_not_modified('settlements', group_id, user_id)
+        if not_modified:
+            return not_modified
+
         # Check if the user is a member of the group
-        group = group_service.get_group(group_id)
-        if not group:
+        access = group_service.get_group_access(group_id, user_id)
+        if not access:
             return jsonify({"message": "Group not found."}), 404
         
-        if user_id not in group.members and user_id != group.owner_id:
+        if not access.allows(user_id):
             return jsonify({"message": "Access denied. You are not a member of this group."}), 403
 
-        settlement_result = settlement_service.calculate_settlements(group_id)
-
-        # Enhance transaction list with user names for frontend display
-        # Fetch user details for all involved users
-        all_involved_user_ids = set()
-        for transaction in settlement_result.transactions:
-            all_involved_user_ids.add(transaction.payer_id)
-            all_involved_user_ids.add(transaction.receiver_id)
-        
-        users_map = {}
-        if all_involved_user_ids: # Avoid empty query
-            user_docs = auth_service.users_ref().where('__name__', 'in', list(all_involved_user_ids)).get()
-            users_map = {doc.id: auth_service.UserInDB(doc_id=doc.id, **doc.to_dict()) for doc in user_docs}
+        if wants_async():
+            # The job takes its admission slot when it runs
+            return submit_job(admitted_job('settlements', settlement_service.calculate_settlements), group_id)
 
-        # Update transaction objects with names
-        for transaction in settlement_result.transactions:
-            transaction.payer_name = users_map.get(transaction.payer_id).username if transaction.payer_id in users_map else f"User {transaction.payer_id}"
-            transaction.receiver_name = users_map.get(transaction.receiver_id).username if transaction.receiver_id in users_map else f"User {transaction.receiver_id}"
+        # Admitted only now: 304s and refused requests don't take a slot
+        with admission('settlements') as rejected:
+            if rejected is not None:
+                return rejected
+            # Transactions come back with payer/receiver names already resolved for frontend display
+            settlement_result = settlement_service.calculate_settlements(group_id)
 
-        return jsonify(settlement_result.model_dump(by_alias=True)), 200
+        return with_version_headers(jsonify(settlement_result.model_dump(by_alias=True)), etag), 200
     except ValueError as e:
         return jsonify({"message": str(e)}), 400
     except Exception as e:
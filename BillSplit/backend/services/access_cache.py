@@ -0,0 +1,120 @@
+from collections import OrderedDict
+from flask import current_app
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional
+import os
+import threading
+import time
+
+# Process-wide cache of who may access a group (owner + member ids), for authorization checks.
+# group_service invalidates an entry whenever this process changes the group's membership;
+# changes made by other workers show up after GROUP_ACCESS_CACHE_TTL_SECONDS.
+# A cached entry that denies a user is re-read (at most once a second per group), so someone
+# just added on another worker isn't turned away for the whole TTL.
+
+class GroupAccess:
+    __slots__ = ('group_id', 'owner_id', 'members', 'loaded_at')
+
+    def __init__(self, group_id: str, owner_id: Optional[str], members: FrozenSet[str]):
+        self.group_id = group_id
+        self.owner_id = owner_id
+        self.members = members
+        self.loaded_at = time.monotonic()
+
+    def allows(self, user_id: str) -> bool:
+        return user_id == self.owner_id or user_id in self.members
+
+class GroupAccessCache:
+    def __init__(self, ttl: float = 5.0, max_entries: int = 10000, min_refresh: float = 1.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.min_refresh = min_refresh
+        self._entries: "OrderedDict[str, GroupAccess]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0 # Bumped by invalidations, so a load racing one isn't stored
+
+    def _lookup(self, group_id: str, now: float, user_id: Optional[str]) -> Optional[GroupAccess]:
+        # Called with the lock held
+        entry = self._entries.get(group_id)
+        if entry is not None and now - entry.loaded_at < self.ttl:
+            if user_id is None or entry.allows(user_id) or now - entry.loaded_at < self.min_refresh:
+                self._entries.move_to_end(group_id)
+                return entry
+        return None
+
+    def _store(self, group_id: str, access: Optional[GroupAccess]):
+        # Called with the lock held
+        if access is None:
+            self._entries.pop(group_id, None) # Missing groups aren't cached
+        elif self.ttl > 0:
+            self._entries[group_id] = access
+            self._entries.move_to_end(group_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, group_id: str, loader: Callable[[str], Optional[GroupAccess]], user_id: Optional[str] = None) -> Optional[GroupAccess]:
+        """Cached access for the group, loaded with loader(group_id) when missing or expired. None if the group doesn't exist."""
+        with self._lock:
+            entry = self._lookup(group_id, time.monotonic(), user_id)
+            if entry is not None:
+                return entry
+            generation = self._generation
+
+        access = loader(group_id)
+        with self._lock:
+            if generation != self._generation:
+                return access # Invalidated while loading; don't cache what may be stale
+            self._store(group_id, access)
+        return access
+
+    def get_many(self, group_ids: Iterable[str], loader: Callable[[List[str]], Dict[str, Optional[GroupAccess]]],
+                 user_id: Optional[str] = None) -> Dict[str, Optional[GroupAccess]]:
+        """Like get for several groups; the ones not cached are loaded together with loader(group_ids)."""
+        accesses: Dict[str, Optional[GroupAccess]] = {}
+        with self._lock:
+            now = time.monotonic()
+            for group_id in dict.fromkeys(group_ids):
+                accesses[group_id] = self._lookup(group_id, now, user_id)
+            generation = self._generation
+        missing = [group_id for group_id, access in accesses.items() if access is None]
+        if not missing:
+            return accesses
+
+        loaded = loader(missing)
+        with self._lock:
+            for group_id in missing:
+                accesses[group_id] = loaded.get(group_id)
+                if generation == self._generation:
+                    self._store(group_id, accesses[group_id])
+        return accesses
+
+    def invalidate(self, group_id: str):
+        with self._lock:
+            self._entries.pop(group_id, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+def _reset_after_fork():
+    global _cache_instance, _cache_lock
+    _cache_instance = None
+    _cache_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_access_cache() -> GroupAccessCache:
+    """Provides the process-wide access cache, configured from app.config on first use."""
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                config = current_app.config
+                _cache_instance = GroupAccessCache(ttl=config.get('GROUP_ACCESS_CACHE_TTL_SECONDS', 5),
+                                                   max_entries=config.get('GROUP_ACCESS_CACHE_MAX_ENTRIES', 10000))
+    return _cache_instance
@@ -0,0 +1,174 @@
+from flask import current_app
+from typing import Dict, Tuple
+import math
+import os
+import sqlite3
+import threading
+import time
+
+# Admission control for expensive endpoints.
+# Each admitted call holds `cost` units until it finishes; a call is rejected when it would
+# push its user past ADMISSION_USER_LIMIT units or everyone past ADMISSION_GLOBAL_LIMIT.
+# The in-process backend limits each worker on its own; the SQLite backend shares the
+# counters between all workers on a host through a local database file.
+
+class AdmissionRejected(Exception):
+    """Raised when a call would exceed the user's or the global limit."""
+
+    def __init__(self, scope: str, retry_after: int):
+        super().__init__(f"Admission limit reached ({scope}).")
+        self.scope = scope # 'user' or 'global'
+        self.retry_after = retry_after # Seconds
+
+class InProcessAdmission:
+    def __init__(self, user_limit: int, global_limit: int):
+        self.user_limit = user_limit
+        self.global_limit = global_limit
+        self._lock = threading.Lock()
+        self._by_user: Dict[str, int] = {}
+        self._total = 0
+
+    def acquire(self, user_id: str, cost: int):
+        """Reserves cost units for the user and returns a ticket for release(); raises AdmissionRejected over a limit."""
+        with self._lock:
+            used = self._by_user.get(user_id, 0)
+            if used + cost > self.user_limit:
+                raise AdmissionRejected('user', 0)
+            if self._total + cost > self.global_limit:
+                raise AdmissionRejected('global', 0)
+            self._by_user[user_id] = used + cost
+            self._total += cost
+        return (user_id, cost)
+
+    def release(self, ticket):
+        user_id, cost = ticket
+        with self._lock:
+            remaining = self._by_user.get(user_id, 0) - cost
+            if remaining > 0:
+                self._by_user[user_id] = remaining
+            else:
+                self._by_user.pop(user_id, None)
+            self._total = max(0, self._total - cost)
+
+class SqliteAdmission:
+    """
+    Shared counters for several worker processes on one host. Every admitted call is a row;
+    rows older than slot_ttl (left behind by a killed worker) stop counting.
+    """
+
+    def __init__(self, path: str, user_limit: int, global_limit: int, slot_ttl: float = 300.0):
+        self.path = path
+        self.user_limit = user_limit
+        self.global_limit = global_limit
+        self.slot_ttl = slot_ttl
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS admission_slots ("
+                               "id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, cost INTEGER NOT NULL, acquired_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS admission_slots_user ON admission_slots (user_id)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            # One connection per thread and process; autocommit mode, transactions are explicit
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def acquire(self, user_id: str, cost: int):
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM admission_slots WHERE acquired_at < ?", (now - self.slot_ttl,))
+            used, total = connection.execute(
+                "SELECT COALESCE(SUM(CASE WHEN user_id = ? THEN cost END), 0), COALESCE(SUM(cost), 0) FROM admission_slots",
+                (user_id,)).fetchone()
+            if used + cost > self.user_limit:
+                raise AdmissionRejected('user', 0)
+            if total + cost > self.global_limit:
+                raise AdmissionRejected('global', 0)
+            ticket = connection.execute("INSERT INTO admission_slots (user_id, cost, acquired_at) VALUES (?, ?, ?)",
+                                        (user_id, cost, now)).lastrowid
+            connection.execute("COMMIT")
+            return ticket
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def release(self, ticket):
+        self._connection().execute("DELETE FROM admission_slots WHERE id = ?", (ticket,))
+
+class AdmissionController:
+    """Wraps a backend with per-endpoint costs and Retry-After estimates from recent call durations."""
+
+    def __init__(self, backend, costs: Dict[str, int], default_cost: int = 1, min_retry_after: int = 1):
+        self.backend = backend
+        self.costs = costs
+        self.default_cost = default_cost
+        self.min_retry_after = min_retry_after
+        self._durations: Dict[str, float] = {} # Moving average of seconds per call, per endpoint
+        self._lock = threading.Lock()
+
+    def cost(self, endpoint: str) -> int:
+        return self.costs.get(endpoint, self.default_cost)
+
+    def retry_after(self, endpoint: str) -> int:
+        """Roughly how long until a slot frees up: the typical duration of this endpoint."""
+        with self._lock:
+            duration = self._durations.get(endpoint, 0.0)
+        return max(self.min_retry_after, math.ceil(duration))
+
+    def acquire(self, user_id: str, endpoint: str) -> Tuple[object, float]:
+        try:
+            ticket = self.backend.acquire(user_id, self.cost(endpoint))
+        except AdmissionRejected as e:
+            raise AdmissionRejected(e.scope, self.retry_after(endpoint))
+        return ticket, time.perf_counter()
+
+    def release(self, endpoint: str, ticket, started: float):
+        self.backend.release(ticket)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            previous = self._durations.get(endpoint)
+            self._durations[endpoint] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+
+def parse_costs(spec: str) -> Dict[str, int]:
+    """Parses 'expenses.user=3,settlements=2' into {'expenses.user': 3, 'settlements': 2}."""
+    costs = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            endpoint, weight = item.split('=', 1)
+            costs[endpoint.strip()] = int(weight)
+    return costs
+
+_controller_instance = None
+_controller_lock = threading.Lock()
+
+def _reset_after_fork():
+    global _controller_instance, _controller_lock
+    _controller_instance = None
+    _controller_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_admission_controller() -> AdmissionController:
+    """Provides the process-wide admission controller, configured from app.config on first use."""
+    global _controller_instance
+    if _controller_instance is None:
+        with _controller_lock:
+            if _controller_instance is None:
+                config = current_app.config
+                user_limit = config.get('ADMISSION_USER_LIMIT', 4)
+                global_limit = config.get('ADMISSION_GLOBAL_LIMIT', 16)
+                if config.get('ADMISSION_BACKEND') == 'sqlite':
+                    backend = SqliteAdmission(config.get('ADMISSION_SQLITE_PATH'), user_limit, global_limit,
+                                              slot_ttl=config.get('ADMISSION_SLOT_TTL_SECONDS', 300))
+                else:
+                    backend = InProcessAdmission(user_limit, global_limit)
+                _controller_instance = AdmissionController(backend, parse_costs(config.get('ADMISSION_COSTS', '')))
+    return _controller_instance
@@ -0,0 +1,169 @@
+from __future__ import annotations
+from backend.firebase_db import commit_in_batches, get_store, increment, using_sqlite_backend
+from backend.models import GroupAnalytics, MemberMonthSpending, MonthSpending
+from backend.services import export_service, settlement_service
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference, DocumentReference
+
+# Spending analytics: per group and month the expense count and total, and per member the amount
+# paid, the amount owed (their shares) and their expense count. Answered from rollups maintained on
+# every expense write, so reading a range costs one document per month (plus one per member and
+# month) instead of streaming the group's expenses:
+#   groups/{group_id}/monthly_rollups/{YYYY-MM}            {month, expense_count, total_amount}
+#   groups/{group_id}/member_rollups/{YYYY-MM}_{user_id}   {month, user_id, paid, owed, expense_count}
+# (group_month_rollups / member_month_rollups tables on SQLite).
+#
+# Writes apply the difference between an expense before and after the change with Increment, so
+# concurrent writers don't overwrite each other. The difference is taken from the documents read in
+# the expense write's own transaction (or batch, for recurring occurrences) and staged in it, so the
+# rollups change exactly when the expense does: not for a write that found the expense or its group
+# gone, and never for a group deleted meanwhile. SQLite does the same inside the store's transaction
+# (see rollup_deltas). backend/maintenance/rebuild_analytics.py recomputes rollups from the expenses,
+# for expenses stored before analytics existed. Compaction moves expenses to the archive without
+# changing them, so archived expenses stay counted.
+
+monthly_rollups_ref: CollectionReference = lambda group_id: get_store().collection('groups').document(group_id).collection('monthly_rollups')
+member_rollups_ref: CollectionReference = lambda group_id: get_store().collection('groups').document(group_id).collection('member_rollups')
+
+def month_key(value: datetime) -> str:
+    """The UTC month (YYYY-MM) an expense created at value counts in."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime('%Y-%m')
+
+def parse_month(value: str) -> str:
+    """YYYY-MM of a 'YYYY-MM' or ISO 8601 date string; raises ValueError otherwise."""
+    try:
+        return datetime.strptime(value, '%Y-%m').strftime('%Y-%m')
+    except ValueError:
+        return month_key(datetime.fromisoformat(value))
+
+class _Rollups:
+    """Accumulated rollup changes: (group, month) -> [count, total] and (group, month, user) -> [paid, owed, count]."""
+    __slots__ = ('groups', 'members')
+
+    def __init__(self):
+        self.groups: Dict[Tuple[str, str], list] = {}
+        self.members: Dict[Tuple[str, str, str], list] = {}
+
+    def add(self, data: dict, sign: int):
+        group_id, created_at = data.get('group_id'), data.get('created_at')
+        if not group_id or created_at is None:
+            return
+        month = month_key(created_at)
+        amount = data.get('amount') or 0.0
+        group = self.groups.setdefault((group_id, month), [0, 0.0])
+        group[0] += sign
+        group[1] += sign * amount
+
+        involved: Dict[str, list] = {}
+        payer_id = data.get('payer_id')
+        if payer_id:
+            involved[payer_id] = [amount, 0.0]
+        for user_id, share in settlement_service.expense_shares(data).items():
+            involved.setdefault(user_id, [0.0, 0.0])[1] += share
+        for user_id, (paid, owed) in involved.items():
+            member = self.members.setdefault((group_id, month, user_id), [0.0, 0.0, 0])
+            member[0] += sign * paid
+            member[1] += sign * owed
+            member[2] += sign
+
+    def prune(self):
+        """Drops entries an update left unchanged (e.g. a description edit)."""
+        self.groups = {key: value for key, value in self.groups.items() if value[0] or abs(value[1]) > 1e-9}
+        self.members = {key: value for key, value in self.members.items() if value[2] or abs(value[0]) > 1e-9 or abs(value[1]) > 1e-9}
+
+def _changed_rollups(changes: Iterable[Tuple[Optional[dict], Optional[dict]]]) -> _Rollups:
+    rollups = _Rollups()
+    for before, after in changes:
+        if before is not None:
+            rollups.add(before, -1)
+        if after is not None:
+            rollups.add(after, 1)
+    rollups.prune()
+    return rollups
+
+def rollup_increments(changes: Iterable[Tuple[Optional[dict], Optional[dict]]]) -> List[Tuple[DocumentReference, dict]]:
+    """
+    The rollup writes, as (reference, fields to set with merge), for (before, after) expense documents
+    (None before for a new expense, None after for a deleted one).
+    """
+    rollups = _changed_rollups(changes)
+    operations = []
+    for (group_id, month), (count, total) in rollups.groups.items():
+        operations.append((monthly_rollups_ref(group_id).document(month),
+                           {'month': month, 'expense_count': increment(count), 'total_amount': increment(total)}))
+    for (group_id, month, user_id), (paid, owed, count) in rollups.members.items():
+        operations.append((member_rollups_ref(group_id).document(f"{month}_{user_id}"),
+                           {'month': month, 'user_id': user_id, 'paid': increment(paid), 'owed': increment(owed), 'expense_count': increment(count)}))
+    return operations
+
+def stage_expense_change(writer, before: Optional[dict], after: Optional[dict]):
+    """Adds the rollup writes of one expense change to a Firestore transaction or batch, after its reads."""
+    for reference, fields in rollup_increments([(before, after)]):
+        writer.set(reference, fields, merge=True)
+
+def rollup_deltas(before: Optional[dict], after: Optional[dict]) -> Tuple[Dict[Tuple[str, str], list], Dict[Tuple[str, str, str], list]]:
+    """
+    (group_id, month) -> [count, total] and (group_id, month, user_id) -> [paid, owed, count] for one
+    expense change; the SQLite store calls it with the documents it read in its write transaction.
+    """
+    rollups = _changed_rollups([(before, after)])
+    return rollups.groups, rollups.members
+
+def get_group_analytics(group_id: str, start_month: Optional[str] = None, end_month: Optional[str] = None) -> GroupAnalytics:
+    """Monthly spending of the group and its members for the months in [start_month, end_month] (YYYY-MM)."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    if using_sqlite_backend():
+        group_rows, member_rows = get_store().get_rollups(group_id, start_month, end_month)
+    else:
+        group_query, member_query = monthly_rollups_ref(group_id), member_rollups_ref(group_id)
+        if start_month:
+            group_query, member_query = group_query.where('month', '>=', start_month), member_query.where('month', '>=', start_month)
+        if end_month:
+            group_query, member_query = group_query.where('month', '<=', end_month), member_query.where('month', '<=', end_month)
+        group_rows = [(data['month'], data.get('expense_count', 0), data.get('total_amount', 0.0))
+                      for data in (doc.to_dict() for doc in group_query.stream())]
+        member_rows = [(data['month'], data['user_id'], data.get('paid', 0.0), data.get('owed', 0.0), data.get('expense_count', 0))
+                       for data in (doc.to_dict() for doc in member_query.stream())]
+
+    members: Dict[str, list] = {}
+    for month, user_id, paid, owed, count in member_rows:
+        if count > 0:
+            members.setdefault(month, []).append(MemberMonthSpending(user_id=user_id, paid=round(paid, 2), owed=round(owed, 2), expense_count=count))
+    months = [MonthSpending(month=month, expense_count=count, total_amount=round(total, 2),
+                            members=sorted(members.get(month, []), key=lambda member: member.user_id))
+              for month, count, total in sorted(group_rows) if count > 0] # Months whose expenses were all deleted read as empty
+    return GroupAnalytics(group_id=group_id, start_month=start_month, end_month=end_month, months=months)
+
+def rebuild_group_analytics(group_id: str) -> dict:
+    """
+    Recomputes the group's rollups from its live and archived expenses and replaces the stored ones.
+    Expense writes to the group while it runs can be lost from the result; run it when the group is quiet.
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    rollups = _Rollups()
+    expenses = 0
+    for _, data in export_service.iter_group_expenses(group_id):
+        rollups.add(data, 1)
+        expenses += 1
+
+    if using_sqlite_backend():
+        get_store().replace_rollups(group_id, rollups.groups, rollups.members)
+    else:
+        operations = [('delete', (doc.reference,)) for doc in monthly_rollups_ref(group_id).select([]).stream()]
+        operations += [('delete', (doc.reference,)) for doc in member_rollups_ref(group_id).select([]).stream()]
+        for (_, month), (count, total) in rollups.groups.items():
+            operations.append(('set', (monthly_rollups_ref(group_id).document(month),
+                                       {'month': month, 'expense_count': count, 'total_amount': total})))
+        for (_, month, user_id), (paid, owed, count) in rollups.members.items():
+            operations.append(('set', (member_rollups_ref(group_id).document(f"{month}_{user_id}"),
+                                       {'month': month, 'user_id': user_id, 'paid': paid, 'owed': owed, 'expense_count': count})))
+        # Deletes come first, so a rollup that is both deleted and rewritten ends up written
+        commit_in_batches(operations)
+    return {'group_id': group_id, 'expenses': expenses, 'months': len(rollups.groups)}
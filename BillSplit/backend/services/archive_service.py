@@ -0,0 +1,287 @@
+from __future__ import annotations
+from backend.firebase_db import as_utc, commit_in_batches, get_store, run_transaction, using_sqlite_backend
+from backend.services import group_service, search_service, settlement_service
+from backend.services.job_service import check_cancelled, report_progress
+from flask import current_app
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Container, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference
+
+# Cold storage for old expenses.
+# Expenses older than the horizon are rolled up into monthly archive documents under
+# groups/{group_id}/expense_archives/{YYYY-MM}_{part}. Each archive holds the compacted
+# expense records (keyed by expense id), the per-user balance deltas they add up to and the
+# users involved, so settlements read one document per month instead of every expense.
+# Reading a user's archived expenses queries the users field across groups, which needs the
+# collection group index
+#   expense_archives (collection group): users (array-contains)
+# expense_archive_index/{expense_id} points archived expenses at their month, for lookups
+# and edits by id. Editing or deleting an archived expense first moves it back (unarchive).
+#
+# Compaction writes the archive before deleting the live documents and restore writes the
+# live documents before deleting the archive, so an interrupted run can leave an expense in
+# both places. Readers then use the live copy (see settlement_service.calculate_settlements),
+# and re-running the job finishes the move.
+#
+# On the SQLite backend there is nothing to compact: old expenses stay in the expenses table,
+# whose (group_id, created_at) index keeps reads of recent and old months equally cheap.
+
+expenses_ref: CollectionReference = lambda: get_store().collection('expenses')
+groups_ref: CollectionReference = lambda: get_store().collection('groups')
+archive_index_ref: CollectionReference = lambda: get_store().collection('expense_archive_index')
+archives_ref = lambda group_id: groups_ref().document(group_id).collection('expense_archives')
+
+def _month_key(created_at: datetime) -> str:
+    return created_at.strftime('%Y-%m')
+
+_NOT_ARCHIVED = ('group_id', 'search_terms') # Implied by the archive's location / rebuilt on restore
+
+def _record(data: dict) -> dict:
+    """The compacted form of an expense document: every field except those in _NOT_ARCHIVED."""
+    return {field: value for field, value in data.items() if field not in _NOT_ARCHIVED}
+
+def record_to_document(group_id: str, record: dict) -> dict:
+    """Turns an archived record back into an expense document."""
+    return dict(record, group_id=group_id)
+
+def _live_document(group_id: str, record: dict) -> dict:
+    """The expense document written when an archived record goes live again (searchable again too)."""
+    return dict(record_to_document(group_id, record), search_terms=search_service.search_terms(record.get('description')))
+
+def _build_parts(group_id: str, month: str, records: Dict[str, dict], max_records: int) -> List[Tuple[str, dict]]:
+    """Splits a month's records into archive documents of at most max_records (Firestore caps documents at 1 MiB)."""
+    ordered = sorted(records.items(), key=lambda item: (item[1].get('created_at') or datetime.min.replace(tzinfo=timezone.utc), item[0]))
+    parts = []
+    for part, start in enumerate(range(0, len(ordered), max_records)):
+        chunk = dict(ordered[start:start + max_records])
+        deltas: Dict[str, float] = {}
+        users = set()
+        for record in chunk.values():
+            for user_id, delta in settlement_service.expense_balance_deltas(record).items():
+                deltas[user_id] = deltas.get(user_id, 0.0) + delta
+            users.add(record.get('payer_id'))
+            users.update(p['user_id'] for p in record['participants'])
+        parts.append((f"{month}_{part}", {
+            'group_id': group_id,
+            'month': month,
+            'part': part,
+            'expenses': chunk,
+            'expense_count': len(chunk),
+            'total_amount': round(sum(record.get('amount') or 0.0 for record in chunk.values()), 2),
+            'balance_deltas': deltas,
+            'users': sorted(u for u in users if u),
+            'archived_at': datetime.utcnow(),
+        }))
+    return parts
+
+def _read_month(group_id: str, month: str, transaction=None) -> Tuple[Dict[str, dict], List[str]]:
+    """Returns the records and archive document ids currently stored for a month."""
+    records: Dict[str, dict] = {}
+    part_ids = []
+    for doc in archives_ref(group_id).where('month', '==', month).stream(transaction=transaction):
+        records.update(doc.to_dict().get('expenses') or {})
+        part_ids.append(doc.id)
+    return records, part_ids
+
+def _write_month(writer, group_id: str, month: str, records: Dict[str, dict], old_part_ids: Iterable[str]):
+    """Queues the month's archive documents (and removal of parts no longer needed) on a batch or transaction."""
+    parts = _build_parts(group_id, month, records, current_app.config.get('ARCHIVE_MAX_RECORDS_PER_DOC', 1000)) if records else []
+    for part_id, document in parts:
+        writer.set(archives_ref(group_id).document(part_id), document)
+    for part_id in set(old_part_ids) - {part_id for part_id, _ in parts}:
+        writer.delete(archives_ref(group_id).document(part_id))
+
+def compact_group(group_id: str, horizon_days: Optional[int] = None) -> dict:
+    """
+    Moves the group's expenses created before now - horizon_days into monthly archives.
+    Idempotent: re-running merges newly old expenses into existing months. Months that couldn't
+    be finished are listed under 'failed'; the next run retries them.
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+    if using_sqlite_backend():
+        return {'group_id': group_id, 'archived': 0, 'months': [], 'failed': []}
+
+    horizon_days = current_app.config.get('ARCHIVE_HORIZON_DAYS', 365) if horizon_days is None else horizon_days
+    cutoff = datetime.utcnow() - timedelta(days=horizon_days)
+    old_expenses = expenses_ref().where('group_id', '==', group_id).where('created_at', '<', cutoff).stream()
+
+    by_month: Dict[str, list] = {}
+    for doc in old_expenses:
+        data = doc.to_dict()
+        by_month.setdefault(_month_key(data['created_at']), []).append(doc)
+
+    db = get_store()
+    archived = 0
+    failed = []
+    for done, (month, docs) in enumerate(sorted(by_month.items())):
+        # Between months a background compaction can stop cleanly
+        check_cancelled()
+        report_progress(done, len(by_month), message=f"Archiving {month}")
+        records, part_ids = _read_month(group_id, month)
+        for doc in docs:
+            records[doc.id] = _record(doc.to_dict())
+
+        # 1. Archive first; 2. then index and delete the live documents, each delete conditional on
+        # the document not having changed since it was read
+        batch = db.batch()
+        _write_month(batch, group_id, month, records, part_ids)
+        batch.commit()
+
+        operations = []
+        for doc in docs:
+            operations.append(('set', (archive_index_ref().document(doc.id), {'group_id': group_id, 'month': month})))
+            operations.append(('delete', (doc.reference, db.write_option(last_update_time=doc.update_time))))
+        try:
+            commit_in_batches(operations)
+        except Exception as e:
+            # Most likely an expense edited while we ran: its live copy stays authoritative
+            # and the next run archives the edited version
+            current_app.logger.warning(f"Could not finish archiving {month} of group {group_id}: {e}")
+            failed.append(month)
+            continue
+        archived += len(docs)
+
+    if archived:
+        group_service.bump_group_version(group_id)
+    return {'group_id': group_id, 'archived': archived, 'months': sorted(by_month), 'failed': failed}
+
+def restore_group(group_id: str, month: Optional[str] = None) -> dict:
+    """Reverses compaction: moves archived expenses (all, or one YYYY-MM month) back to live documents."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+    if using_sqlite_backend():
+        return {'group_id': group_id, 'restored': 0, 'months': []}
+
+    query = archives_ref(group_id)
+    if month:
+        query = query.where('month', '==', month)
+    restored = 0
+    months = set()
+    for doc in query.stream():
+        archive = doc.to_dict()
+        records = archive.get('expenses') or {}
+        # A live copy left by an interrupted run or a conflicting edit is newer; keep it
+        live_ids = {snapshot.id for snapshot in get_store().get_all([expenses_ref().document(i) for i in records]) if snapshot.exists}
+        operations = []
+        for expense_id, record in records.items():
+            if expense_id not in live_ids:
+                operations.append(('set', (expenses_ref().document(expense_id), _live_document(group_id, record))))
+            operations.append(('delete', (archive_index_ref().document(expense_id),)))
+        operations.append(('delete', (doc.reference,))) # Last, so an interrupted restore can be re-run
+        commit_in_batches(operations)
+        restored += archive.get('expense_count', 0)
+        months.add(archive.get('month'))
+
+    if restored:
+        group_service.bump_group_version(group_id)
+    return {'group_id': group_id, 'restored': restored, 'months': sorted(months)}
+
+def unarchive_expense(expense_id: str) -> Optional[str]:
+    """
+    Moves one archived expense back to a live document (before it is edited or deleted) and
+    rebuilds its month's archive. Returns the group id, or None if the expense isn't archived.
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+    if using_sqlite_backend():
+        return None
+
+    def unarchive(transaction, expense_id):
+        index_ref = archive_index_ref().document(expense_id)
+        index_doc = index_ref.get(transaction=transaction)
+        if not index_doc.exists:
+            return None
+        location = index_doc.to_dict()
+        group_id, month = location['group_id'], location['month']
+        live_exists = expenses_ref().document(expense_id).get(transaction=transaction).exists
+        records, part_ids = _read_month(group_id, month, transaction=transaction)
+        record = records.pop(expense_id, None)
+        if record is not None:
+            _write_month(transaction, group_id, month, records, part_ids)
+            if not live_exists:
+                transaction.set(expenses_ref().document(expense_id), _live_document(group_id, record))
+        transaction.delete(index_ref)
+        return group_id
+
+    return run_transaction(unarchive, expense_id)
+
+def get_archived_expense(expense_id: str) -> Optional[dict]:
+    """Returns an archived expense as an expense document dict, or None."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+    if using_sqlite_backend():
+        return None
+
+    index_doc = archive_index_ref().document(expense_id).get()
+    if not index_doc.exists:
+        return None
+    location = index_doc.to_dict()
+    records, _ = _read_month(location['group_id'], location['month'])
+    record = records.get(expense_id)
+    return record_to_document(location['group_id'], record) if record is not None else None
+
+def get_group_archives(group_id: str) -> List[dict]:
+    """All archive documents of a group (one read per archived month)."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+    if using_sqlite_backend():
+        return []
+
+    return [doc.to_dict() for doc in archives_ref(group_id).stream()]
+
+def get_user_archived_expenses(user_id: str, exclude: Container = ()) -> List[Tuple[str, dict]]:
+    """(expense_id, expense document dict) of the archived expenses a user paid or participates in, skipping ids in exclude."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+    if using_sqlite_backend():
+        return []
+
+    # Only the archives the user appears in, across all groups
+    user_expenses = []
+    for doc in get_store().collection_group('expense_archives').where('users', 'array_contains', user_id).stream():
+        archive = doc.to_dict()
+        for expense_id, data in iter_archived_documents([archive], archive.get('group_id'), exclude=exclude):
+            if data.get('payer_id') == user_id or any(p.get('user_id') == user_id for p in data.get('participants') or ()):
+                user_expenses.append((expense_id, data))
+    return user_expenses
+
+def archive_totals(group_id: str, payer_id: Optional[str] = None,
+                   start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[int, float]:
+    """
+    (expense count, total amount) of a group's archived expenses, with the same filters as
+    expense_service.get_group_expense_stats. Unfiltered totals only read the per-archive sums.
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+    if using_sqlite_backend():
+        return 0, 0.0
+
+    if not (payer_id or start or end):
+        count, total = 0, 0.0
+        for doc in archives_ref(group_id).select(['expense_count', 'total_amount']).stream():
+            data = doc.to_dict()
+            count += data.get('expense_count') or 0
+            total += data.get('total_amount') or 0.0
+        return count, total
+
+    query = archives_ref(group_id)
+    if start:
+        query = query.where('month', '>=', _month_key(start))
+    if end:
+        query = query.where('month', '<=', _month_key(end))
+    count, total = 0, 0.0
+    for doc in query.stream():
+        for record in (doc.to_dict().get('expenses') or {}).values():
+            created_at = record.get('created_at')
+            if payer_id and record.get('payer_id') != payer_id:
+                continue
+            if start and (created_at is None or as_utc(created_at) < as_utc(start)):
+                continue
+            if end and (created_at is None or as_utc(created_at) >= as_utc(end)):
+                continue
+            count += 1
+            total += record.get('amount') or 0.0
+    return count, total
+
+def iter_archived_documents(archives: Iterable[dict], group_id: str, exclude: Container = ()):
+    """Yields (expense_id, expense document dict) for the records in the given archives, skipping ids in exclude."""
+    for archive in archives:
+        for expense_id, record in (archive.get('expenses') or {}).items():
+            if expense_id not in exclude:
+                yield expense_id, record_to_document(group_id, record)
@@ -1,14 +1,31 @@
-import firebase_admin
-from firebase_admin import auth
-from firebase_admin.exceptions import FirebaseError
-from backend.firebase_db import get_firestore_db
+from backend.firebase_db import get_store, initialize_default_app, using_memory_backend, using_sqlite_backend
 from backend.models import UserInDB, UserBase
+from backend import repositories
 import jwt
 import os
 from datetime import datetime, timedelta
 from flask import current_app
+from typing import Optional, Tuple
 
-users_ref = lambda: get_firestore_db().collection('users')
+class IdTokenError(Exception):
+    """A Firebase ID token was rejected by Firebase Authentication."""
+
+def _verify_id_token(id_token: str) -> dict:
+    """Verifies a Firebase ID token (local test tokens on the memory backend, or on SQLite with LOCAL_ID_TOKENS)."""
+    if using_memory_backend() or (using_sqlite_backend() and current_app.config.get('LOCAL_ID_TOKENS')):
+        from backend.memory_db import verify_local_id_token
+        return verify_local_id_token(id_token)
+    # Imported here so processes that never verify a token don't load the Firebase SDK
+    if using_sqlite_backend():
+        initialize_default_app() # Storage is local, but sign-in still goes through Firebase Authentication
+    else:
+        get_store() # Makes sure the default Firebase app is initialized
+    from firebase_admin import auth
+    from firebase_admin.exceptions import FirebaseError
+    try:
+        return auth.verify_id_token(id_token)
+    except FirebaseError as e:
+        raise IdTokenError(str(e)) from e
 
 def generate_jwt_token(user_id: str):
     """Generates a JWT for the Flask API."""
@@ -24,43 +41,41 @@ def decode_jwt_token(token: str):
     # Ensure current_app is imported from flask
     return jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
 
+def find_user_by_firebase_uid(firebase_uid: str) -> Optional[Tuple[str, dict]]:
+    """Returns (internal user id, user document dict) of the user with this Firebase UID, or None."""
+    return repositories.users().find_by_firebase_uid(firebase_uid)
 
 def register_user_and_get_token(id_token: str):
     """Registers user in Firebase (implicitly) and your Firestore, then returns JWT."""
     try:
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = _verify_id_token(id_token)
         firebase_uid = decoded_token['uid']
         email = decoded_token.get('email')
         username = decoded_token.get('name', email.split('@')[0] if email else firebase_uid) # Default username
 
         # Check if user already exists in Firestore by firebase_uid
-        user_query = users_ref().where('firebase_uid', '==', firebase_uid).limit(1).get()
+        existing_user = find_user_by_firebase_uid(firebase_uid)
         user_doc_id = None
         user_data = {}
 
-        if user_query:
+        if existing_user:
             # User already exists in your Firestore, retrieve their internal ID
-            user_doc = user_query[0]
-            user_doc_id = user_doc.id
-            user_data = user_doc.to_dict()
+            user_doc_id, user_data = existing_user
             print(f"User with Firebase UID {firebase_uid} already exists in Firestore. ID: {user_doc_id}")
         else:
             # Create a new user document in Firestore
-            new_user_data = {
+            user_doc_id, user_data = repositories.users().create({
                 'firebase_uid': firebase_uid,
                 'email': email,
                 'username': username,
                 'created_at': datetime.utcnow()
-            }
-            update_time, doc_ref = users_ref().add(new_user_data)
-            user_doc_id = doc_ref.id
-            user_data = new_user_data # For JWT creation and return
-            print(f"New user created in Firestore. ID: {user_doc_id}")
+            })
+            print(f"New user created. ID: {user_doc_id}")
 
         jwt_token = generate_jwt_token(user_doc_id)
         return jwt_token, UserInDB(doc_id=user_doc_id, **user_data)
 
-    except FirebaseError as e:
+    except IdTokenError as e:
         print(f"Firebase Authentication error during registration: {e}")
         raise ValueError("Firebase authentication failed. Invalid token or user details.")
     except Exception as e:
@@ -70,22 +85,20 @@ def register_user_and_get_token(id_token: str):
 def login_user_and_get_token(id_token: str):
     """Logs in user via Firebase, verifies their existence in Firestore, then returns JWT."""
     try:
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = _verify_id_token(id_token)
         firebase_uid = decoded_token['uid']
 
         # Find user in Firestore by firebase_uid
-        user_query = users_ref().where('firebase_uid', '==', firebase_uid).limit(1).get()
-        if not user_query:
+        existing_user = find_user_by_firebase_uid(firebase_uid)
+        if not existing_user:
             raise ValueError("User not found in database. Please register first.")
 
-        user_doc = user_query[0]
-        user_doc_id = user_doc.id
-        user_data = user_doc.to_dict()
+        user_doc_id, user_data = existing_user
 
         jwt_token = generate_jwt_token(user_doc_id)
         return jwt_token, UserInDB(doc_id=user_doc_id, **user_data)
 
-    except FirebaseError as e:
+    except IdTokenError as e:
         print(f"Firebase Authentication error during login: {e}")
         raise ValueError("Firebase authentication failed. Invalid token.")
     except Exception as e:
@@ -95,10 +108,8 @@ def login_user_and_get_token(id_token: str):
 def get_current_user_from_db(user_id: str):
     """Retrieves user details from Firestore using internal user_id."""
     try:
-        user_doc = users_ref().document(user_id).get()
-        if user_doc.exists:
-            return UserInDB(doc_id=user_doc.id, **user_doc.to_dict())
-        return None
+        user_data = repositories.users().get(user_id)
+        return UserInDB(doc_id=user_id, **user_data) if user_data is not None else None
     except Exception as e:
         print(f"Error fetching user {user_id} from Firestore: {e}")
         return None
\ No newline at end of file
@@ -0,0 +1,86 @@
+from __future__ import annotations
+from backend.firebase_db import get_store, using_sqlite_backend
+from backend.models import BatchGetRequest, BatchGetResult, BatchItem, ExpenseInDB, GroupInDB, UserInDB
+from backend.services import archive_service, group_service
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference
+
+# Batch multi-get: groups, expenses and users by id in one request, for list views that would
+# otherwise call the single-item endpoints many times in parallel (each verifying the token,
+# loading the group for the access check and reading one document).
+#
+# All documents are read with one multi-get (one transaction on SQLite), and every group involved
+# (the requested ones and those of the requested expenses) is authorized with one access lookup,
+# through the access cache with the groups not cached loaded together. Each item carries the
+# status its single-item endpoint would answer with. A user is visible to the caller when it is
+# the caller or belongs to one of the groups or expenses the caller may see in the same batch.
+
+groups_ref: CollectionReference = lambda: get_store().collection('groups')
+expenses_ref: CollectionReference = lambda: get_store().collection('expenses')
+users_ref: CollectionReference = lambda: get_store().collection('users')
+
+def _read_documents(group_ids: List[str], expense_ids: List[str], user_ids: List[str]) -> Tuple[Dict[str, dict], Dict[str, dict], Dict[str, dict]]:
+    """Existing group (without member ids), expense and user documents by id."""
+    if using_sqlite_backend():
+        return get_store().get_many(group_ids, expense_ids, user_ids)
+
+    references = ([groups_ref().document(i) for i in group_ids] + [expenses_ref().document(i) for i in expense_ids]
+                  + [users_ref().document(i) for i in user_ids])
+    documents: Dict[str, Dict[str, dict]] = {'groups': {}, 'expenses': {}, 'users': {}}
+    if references:
+        for doc in get_store().get_all(references):
+            if doc.exists:
+                documents[doc.reference.parent.id][doc.id] = doc.to_dict()
+    # Expenses moved to the archive by compaction are still served, like GET /api/expenses/<id>
+    for expense_id in expense_ids:
+        if expense_id not in documents['expenses']:
+            archived = archive_service.get_archived_expense(expense_id)
+            if archived is not None:
+                documents['expenses'][expense_id] = archived
+    return documents['groups'], documents['expenses'], documents['users']
+
+def get_many(user_id: str, request: BatchGetRequest) -> BatchGetResult:
+    """The requested groups, expenses and users the user may see, each with a per-item status."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    group_ids, expense_ids, user_ids = (list(dict.fromkeys(ids)) for ids in (request.groups, request.expenses, request.users))
+    groups, expenses, users = _read_documents(group_ids, expense_ids, user_ids)
+    accesses = group_service.get_group_accesses(list(groups) + [data['group_id'] for data in expenses.values()], user_id)
+
+    result = BatchGetResult()
+    visible_users: Set[str] = {user_id}
+    for group_id in group_ids:
+        access = accesses.get(group_id) if group_id in groups else None
+        if access is None:
+            result.groups[group_id] = BatchItem(status=404, message="Group not found.")
+        elif not access.allows(user_id):
+            result.groups[group_id] = BatchItem(status=403, message="Access denied. Not a member of this group.")
+        else:
+            # Member ids come with the access check (on Firestore they aren't part of the group document)
+            data = dict(groups[group_id], members=sorted(access.members))
+            result.groups[group_id] = BatchItem(status=200, data=GroupInDB(doc_id=group_id, **data).model_dump(by_alias=True))
+            visible_users.update(access.members)
+            visible_users.add(access.owner_id)
+
+    for expense_id in expense_ids:
+        data = expenses.get(expense_id)
+        access = accesses.get(data['group_id']) if data is not None else None
+        if access is None:
+            result.expenses[expense_id] = BatchItem(status=404, message="Expense not found.")
+        elif not access.allows(user_id):
+            result.expenses[expense_id] = BatchItem(status=403, message="Access denied. Not a member of this group.")
+        else:
+            result.expenses[expense_id] = BatchItem(status=200, data=ExpenseInDB(doc_id=expense_id, **data).model_dump(by_alias=True))
+            visible_users.add(data.get('payer_id'))
+            visible_users.update(participant['user_id'] for participant in data.get('participants') or ())
+
+    for requested_id in user_ids:
+        if requested_id not in users:
+            result.users[requested_id] = BatchItem(status=404, message="User not found.")
+        elif requested_id not in visible_users:
+            result.users[requested_id] = BatchItem(status=403, message="Access denied. Request a group or expense you share with this user in the same batch.")
+        else:
+            result.users[requested_id] = BatchItem(status=200, data=UserInDB(doc_id=requested_id, **users[requested_id]).model_dump(by_alias=True))
+    return result
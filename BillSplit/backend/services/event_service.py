@@ -0,0 +1,257 @@
+from backend.firebase_db import get_store
+from backend.models import ExpenseInDB
+from backend.services.settlement_service import expense_balance_deltas
+from flask import current_app
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+import queue
+import threading
+import uuid
+
+# In-process pub/sub for live group updates (served as Server-Sent Events).
+# Mutation paths in expense_service publish here; optionally, Firestore snapshot listeners
+# feed in changes made by other workers. Each process has its own bus, identified by an
+# epoch, so reconnect cursors from another process fall back to a resync.
+
+class TooManyConnections(Exception):
+    """Raised when a worker already holds its maximum number of live streams."""
+    pass
+
+class Event:
+    __slots__ = ('id', 'seq', 'group_id', 'type', 'data')
+
+    def __init__(self, id: str, seq: int, group_id: str, type: str, data: dict):
+        self.id = id
+        self.seq = seq
+        self.group_id = group_id
+        self.type = type
+        self.data = data
+
+    def encode(self) -> str:
+        """Formats the event as an SSE frame."""
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, default=str)}\n\n"
+
+class Subscription:
+    """One live connection. Bounded queue: a slow consumer is marked overflowed instead of blocking publishers."""
+
+    def __init__(self, group_id: str, max_queue: int):
+        self.group_id = group_id
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize=max_queue)
+
+    def deliver(self, event: Event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout: float) -> Optional[Event]:
+        """Waits for the next event, returns None on timeout (time to send a heartbeat)."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class EventBus:
+    def __init__(self, max_connections: int = 200, max_queue: int = 100, replay_size: int = 256,
+                 replay_groups: int = 1000, listener_factory=None):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.max_connections = max_connections
+        self.max_queue = max_queue
+        self.replay_size = replay_size
+        self.replay_groups = replay_groups
+        self._last_seq = 0
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, set] = {}
+        self._replay: "OrderedDict[str, deque]" = OrderedDict() # LRU of per-group replay buffers
+        self._evicted_through: Dict[str, int] = {} # Highest seq pushed out of each group's buffer
+        self._dropped_through = 0 # Highest seq of any buffer dropped from the LRU
+        self._connections = 0
+        self._recent_keys: deque = deque(maxlen=4096) # Dedupe keys of locally published changes
+        self._recent_key_set = set()
+        self._listener_factory = listener_factory # group_id -> unsubscribe callable
+        self._listeners: Dict[str, object] = {}
+
+    def connection_count(self) -> int:
+        return self._connections
+
+    def last_event_id(self, group_id: str) -> Optional[str]:
+        with self._lock:
+            buffer = self._replay.get(group_id)
+            return buffer[-1].id if buffer else None
+
+    def publish(self, group_id: str, event_type: str, data: dict, dedupe_key: Optional[str] = None) -> Optional[Event]:
+        """Publishes an event to every subscriber of the group. Never blocks on slow consumers."""
+        with self._lock:
+            if dedupe_key is not None:
+                if dedupe_key in self._recent_key_set:
+                    return None
+                if len(self._recent_keys) == self._recent_keys.maxlen:
+                    self._recent_key_set.discard(self._recent_keys[0])
+                self._recent_keys.append(dedupe_key)
+                self._recent_key_set.add(dedupe_key)
+
+            self._last_seq += 1
+            seq = self._last_seq
+            event = Event(f"{self.epoch}-{seq}", seq, group_id, event_type, data)
+
+            buffer = self._replay.get(group_id)
+            if buffer is None:
+                buffer = self._replay[group_id] = deque(maxlen=self.replay_size)
+                while len(self._replay) > self.replay_groups:
+                    dropped_group, dropped = self._replay.popitem(last=False)
+                    self._evicted_through.pop(dropped_group, None)
+                    if dropped:
+                        self._dropped_through = max(self._dropped_through, dropped[-1].seq)
+            else:
+                self._replay.move_to_end(group_id)
+            if len(buffer) == buffer.maxlen:
+                self._evicted_through[group_id] = buffer[0].seq
+            buffer.append(event)
+            subscribers = list(self._subscribers.get(group_id, ()))
+
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return event
+
+    def subscribe(self, group_id: str, cursor: Optional[str] = None) -> Tuple[Subscription, List[Event], bool]:
+        """
+        Registers a new live connection for a group.
+        Returns (subscription, backlog, resync): backlog holds buffered events after the cursor,
+        resync is True when the cursor can't be served from the replay buffer and the client
+        must refetch state.
+        """
+        subscription = Subscription(group_id, self.max_queue)
+        start_listener = False
+        with self._lock:
+            if self._connections >= self.max_connections:
+                raise TooManyConnections()
+            self._connections += 1
+            subscribers = self._subscribers.setdefault(group_id, set())
+            start_listener = not subscribers and self._listener_factory is not None
+            subscribers.add(subscription)
+            backlog, resync = self._replay_after(group_id, cursor)
+
+        if start_listener:
+            self._start_listener(group_id)
+        return subscription, backlog, resync
+
+    def unsubscribe(self, subscription: Subscription):
+        stop_listener = None
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.group_id)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self._connections -= 1
+                if not subscribers:
+                    del self._subscribers[subscription.group_id]
+                    stop_listener = self._listeners.pop(subscription.group_id, None)
+        if stop_listener is not None:
+            stop_listener()
+
+    def _replay_after(self, group_id: str, cursor: Optional[str]) -> Tuple[List[Event], bool]:
+        if not cursor:
+            return [], False
+        epoch, _, seq = cursor.partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return [], True
+        seq = int(seq)
+        if seq < self._evicted_through.get(group_id, 0) or seq < self._dropped_through:
+            return [], True # Events after the cursor may have been evicted from the buffer
+        buffer = self._replay.get(group_id, ())
+        return [event for event in buffer if event.seq > seq], False
+
+    def _start_listener(self, group_id: str):
+        try:
+            unsubscribe = self._listener_factory(self, group_id)
+        except Exception as e:
+            print(f"Warning: Could not start change listener for group {group_id}: {e}")
+            return
+        with self._lock:
+            if group_id in self._subscribers and group_id not in self._listeners:
+                self._listeners[group_id] = unsubscribe
+                return
+        unsubscribe() # Last subscriber left while the listener was starting
+
+def publish_expense_change(group_id: str, expense_id: str, before: Optional[dict], after: Optional[dict],
+                           dedupe_key: Optional[str] = None, bus: Optional[EventBus] = None):
+    """
+    Publishes the events for one expense mutation: expense_added/updated/deleted, followed by
+    balance_changed carrying each member's balance delta.
+    before/after are the stored expense documents (None when created/deleted).
+    """
+    bus = bus or get_event_bus()
+    if after is not None:
+        event_type = 'expense_updated' if before is not None else 'expense_added'
+        payload = ExpenseInDB(doc_id=expense_id, **after).model_dump(mode='json', by_alias=True)
+    else:
+        event_type = 'expense_deleted'
+        payload = {'doc_id': expense_id, 'group_id': group_id}
+
+    if bus.publish(group_id, event_type, payload, dedupe_key=dedupe_key) is None:
+        return # Already published (change echoed back by a snapshot listener)
+
+    deltas: Dict[str, float] = {}
+    for sign, data in ((1, after), (-1, before)):
+        if data is None:
+            continue
+        for user_id, delta in expense_balance_deltas(data).items():
+            deltas[user_id] = deltas.get(user_id, 0.0) + sign * delta
+    deltas = {user_id: round(delta, 2) for user_id, delta in deltas.items() if abs(delta) > 0.005}
+    if deltas:
+        bus.publish(group_id, 'balance_changed', {'group_id': group_id, 'expense_id': expense_id, 'deltas': deltas})
+
+def firestore_listener_factory(bus: EventBus, group_id: str):
+    """Watches the group's expenses in Firestore so changes made by other workers reach local subscribers."""
+    known_docs: Dict[str, dict] = {}
+    initial = [True]
+
+    def on_snapshot(doc_snapshots, changes, read_time):
+        if initial[0]:
+            # First callback lists the current state, not changes
+            initial[0] = False
+            known_docs.update({doc.id: doc.to_dict() for doc in doc_snapshots})
+            return
+        for change in changes:
+            doc = change.document
+            before = known_docs.get(doc.id)
+            if change.type.name == 'REMOVED':
+                known_docs.pop(doc.id, None)
+                publish_expense_change(group_id, doc.id, before, None, dedupe_key=f"{doc.id}@deleted", bus=bus)
+            else:
+                after = doc.to_dict()
+                known_docs[doc.id] = after
+                publish_expense_change(group_id, doc.id, before, after, dedupe_key=f"{doc.id}@{doc.update_time}", bus=bus)
+
+    watch = get_store().collection('expenses').where('group_id', '==', group_id).on_snapshot(on_snapshot)
+    return watch.unsubscribe
+
+_bus_instance = None
+_bus_lock = threading.Lock()
+
+def _reset_after_fork():
+    # Subscriptions and listener threads don't survive a fork; each worker builds its own bus
+    global _bus_instance, _bus_lock
+    _bus_instance = None
+    _bus_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_event_bus() -> EventBus:
+    """Provides the process-wide event bus, configured from app.config on first use."""
+    global _bus_instance
+    if _bus_instance is None:
+        with _bus_lock:
+            if _bus_instance is None:
+                config = current_app.config
+                _bus_instance = EventBus(
+                    max_connections=config.get('SSE_MAX_CONNECTIONS_PER_WORKER', 200),
+                    max_queue=config.get('SSE_QUEUE_SIZE', 100),
+                    replay_size=config.get('SSE_REPLAY_BUFFER_SIZE', 256),
+                    # SQLite has no change feed to listen to; streams then relay this worker's own changes only
+                    listener_factory=firestore_listener_factory if config.get('SSE_FIRESTORE_LISTENERS') and config.get('STORAGE_BACKEND') != 'sqlite' else None,
+                )
+    return _bus_instance
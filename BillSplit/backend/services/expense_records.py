@@ -0,0 +1,58 @@
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Compact internal representation of stored expenses for the hot paths.
+# Documents we wrote ourselves were already validated on the way in, so paths that only
+# compute over expenses (settlements) build columns straight from document dicts instead
+# of one ExpenseInDB plus nested participant models per document.
+# Pydantic models are only built at the API boundary, for the expenses actually returned,
+# by validation: on pydantic 2.7 that is faster than model_construct (see
+# benchmarks/expense_parsing.py).
+
+NO_SHARE = float('nan') # Marks participants without an explicit share_amount in ExpenseColumns
+
+class ExpenseColumns:
+    """
+    Columnar view of a group's expenses for balance computation.
+    Users are interned to indexes; participants are stored flat with per-expense offsets,
+    so 10k expenses cost a handful of arrays instead of 10k models plus their participants.
+    """
+    __slots__ = ('user_ids', 'user_index', 'expense_ids', 'payer', 'amount', 'offsets', 'participant', 'share')
+
+    def __init__(self, user_ids: Optional[List[str]] = None):
+        self.user_ids: List[str] = list(user_ids or [])
+        self.user_index: Dict[str, int] = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        self.expense_ids: List[str] = []
+        self.payer = array('i')
+        self.amount = array('d')
+        self.offsets = array('i', [0]) # participants of expense i are [offsets[i], offsets[i+1])
+        self.participant = array('i')
+        self.share = array('d') # NO_SHARE for an equal split of the remainder
+
+    def __len__(self) -> int:
+        return len(self.expense_ids)
+
+    def _intern(self, user_id: str) -> int:
+        index = self.user_index.get(user_id)
+        if index is None:
+            index = self.user_index[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+        return index
+
+    def append(self, doc_id: str, data: dict):
+        self.expense_ids.append(doc_id)
+        self.payer.append(self._intern(data.get('payer_id')))
+        self.amount.append(float(data.get('amount') or 0.0))
+        for p in data.get('participants') or ():
+            self.participant.append(self._intern(p['user_id']))
+            share = p.get('share_amount')
+            self.share.append(NO_SHARE if share is None else float(share))
+        self.offsets.append(len(self.participant))
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Tuple[str, dict]], user_ids: Optional[List[str]] = None) -> "ExpenseColumns":
+        """Builds columns from (doc_id, document dict) pairs, e.g. a Firestore stream."""
+        columns = cls(user_ids)
+        for doc_id, data in documents:
+            columns.append(doc_id, data)
+        return columns
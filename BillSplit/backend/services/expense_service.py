@@ -1,115 +1,117 @@
-from backend.firebase_db import get_firestore_db
-from backend.models import ExpenseInDB, ExpenseCreate, ExpenseUpdate, ExpenseParticipantData
-from firebase_admin.firestore import CollectionReference, DocumentReference
+from __future__ import annotations
+from backend.firebase_db import get_store
+from backend import repositories
+from backend.services import event_service, archive_service
+from backend.models import ExpenseInDB, ExpenseCreate, ExpenseUpdate, ExpenseParticipantData, GroupExpenseStats
 from datetime import datetime
-from typing import List, Optional
-
-expenses_ref: CollectionReference = lambda: get_firestore_db().collection('expenses')
-groups_ref: CollectionReference = lambda: get_firestore_db().collection('groups')
-users_ref: CollectionReference = lambda: get_firestore_db().collection('users')
+from typing import Optional
 
 
 def _validate_expense_data(expense_data: ExpenseCreate):
     """Helper to validate existence of group, payer, and participants."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
 
     # Validate group exists
-    group_doc = groups_ref.document(expense_data.group_id).get()
-    if not group_doc.exists:
+    if not repositories.groups().exists(expense_data.group_id):
         raise ValueError(f"Group with ID {expense_data.group_id} not found.")
 
+    user_ids = [expense_data.payer_id] + [participant.user_id for participant in expense_data.participants]
+    existing_users, members = repositories.groups().memberships(expense_data.group_id, user_ids)
+
     # Validate payer exists and is a member of the group
-    payer_doc = users_ref.document(expense_data.payer_id).get()
-    if not payer_doc.exists:
+    if expense_data.payer_id not in existing_users:
         raise ValueError(f"Payer user with ID {expense_data.payer_id} not found.")
     
-    group_member_doc = groups_ref.document(expense_data.group_id).collection('members').document(expense_data.payer_id).get()
-    if not group_member_doc.exists:
+    if expense_data.payer_id not in members:
         raise ValueError(f"Payer user with ID {expense_data.payer_id} is not a member of group {expense_data.group_id}.")
 
     # Validate all participants exist and are members of the group
     for participant in expense_data.participants:
-        user_doc = users_ref.document(participant.user_id).get()
-        if not user_doc.exists:
+        if participant.user_id not in existing_users:
             raise ValueError(f"Participant user with ID {participant.user_id} not found.")
         
-        group_member_doc = groups_ref.document(expense_data.group_id).collection('members').document(participant.user_id).get()
-        if not group_member_doc.exists:
+        if participant.user_id not in members:
             raise ValueError(f"Participant user with ID {participant.user_id} is not a member of group {expense_data.group_id}.")
 
 def add_expense(expense_data: ExpenseCreate):
     """Adds a new expense to Firestore."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
 
     _validate_expense_data(expense_data)
 
     expense_dict = expense_data.model_dump()
     expense_dict['created_at'] = datetime.utcnow()
 
-    # Store participants directly within the expense document for simplicity
-    # For very large number of participants or complex participant data, a subcollection might be considered.
-    update_time, doc_ref = expenses_ref.add(expense_dict)
-    expense_id = doc_ref.id
-
-    created_expense_doc = expenses_ref.document(expense_id).get()
-    if created_expense_doc.exists:
-        return ExpenseInDB(doc_id=created_expense_doc.id, **created_expense_doc.to_dict())
-    return None
+    created = repositories.expenses().add(expense_dict)
+    if created is None:
+        return None # The group was deleted meanwhile
+    expense_id, created_data, change_tag = created
+    event_service.publish_expense_change(expense_data.group_id, expense_id, None, created_data,
+                                         dedupe_key=f"{expense_id}@{change_tag}")
+    return ExpenseInDB(doc_id=expense_id, **created_data)
 
 def get_expense(expense_id: str):
     """Retrieves a single expense by ID."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
 
-    expense_doc = expenses_ref.document(expense_id).get()
-    if expense_doc.exists:
-        return ExpenseInDB(doc_id=expense_doc.id, **expense_doc.to_dict())
-    return None
+    expense_data = repositories.expenses().get(expense_id)
+    if expense_data is None:
+        expense_data = archive_service.get_archived_expense(expense_id)
+    return ExpenseInDB(doc_id=expense_id, **expense_data) if expense_data is not None else None
 
 def get_expenses_for_group(group_id: str):
-    """Retrieves all expenses for a specific group."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
-
-    expenses_snapshot = expenses_ref.where('group_id', '==', group_id).stream()
-    expenses = []
-    for doc in expenses_snapshot:
-        expenses.append(ExpenseInDB(doc_id=doc.id, **doc.to_dict()))
-    return expenses
+    """Retrieves all expenses for a specific group, archived months first."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    live_expenses = [ExpenseInDB(doc_id=expense_id, **data) for expense_id, data in repositories.expenses().list_for_group(group_id)]
+    live_ids = {expense.id for expense in live_expenses}
+    archived = archive_service.iter_archived_documents(archive_service.get_group_archives(group_id), group_id, exclude=live_ids)
+    return [ExpenseInDB(doc_id=expense_id, **data) for expense_id, data in archived] + live_expenses
+
+def get_group_expense_stats(group_id: str, payer_id: Optional[str] = None,
+                            start: Optional[datetime] = None, end: Optional[datetime] = None) -> GroupExpenseStats:
+    """
+    Counts and sums a group's expenses with server-side aggregation queries, so no expense
+    documents are transferred. Optionally limited to one payer and to created_at in [start, end).
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    live_count, live_total = repositories.expenses().stats(group_id, payer_id=payer_id, start=start, end=end)
+
+    # Plus the expenses compacted into monthly archives
+    archived_count, archived_total = archive_service.archive_totals(group_id, payer_id=payer_id, start=start, end=end)
+    expense_count = live_count + archived_count
+    total_amount = live_total + archived_total
+    return GroupExpenseStats(
+        group_id=group_id,
+        expense_count=expense_count,
+        total_amount=round(total_amount, 2),
+        average_amount=round(total_amount / expense_count, 2) if expense_count else None,
+        payer_id=payer_id, start=start, end=end,
+    )
 
 def get_expenses_for_user(user_id: str):
     """Retrieves all expenses where a user is either the payer or a participant."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
-
-    user_expenses = []
-
-    # Get expenses where user is the payer
-    payer_expenses_snapshot = expenses_ref.where('payer_id', '==', user_id).stream()
-    for doc in payer_expenses_snapshot:
-        user_expenses.append(ExpenseInDB(doc_id=doc.id, **doc.to_dict()))
-
-    # Get expenses where user is a participant (requires iterating or a specific query)
-    # Firestore doesn't directly support querying array elements for specific values efficiently in all cases.
-    # For 'participants' array, you'd typically need to fetch all and filter client-side,
-    # or use array-contains if you're looking for exact matches of complete participant objects.
-    # A better approach for this query might be to have a separate 'user_expense_involvements'
-    # collection or a more complex query setup.
-    # For now, let's assume we iterate and filter for demonstration.
-    all_expenses_snapshot = expenses_ref.stream() # Can be inefficient for many expenses
-    for doc in all_expenses_snapshot:
-        expense = ExpenseInDB(doc_id=doc.id, **doc.to_dict())
-        for participant in expense.participants:
-            if participant.user_id == user_id and expense.id not in [e.id for e in user_expenses]:
-                user_expenses.append(expense)
-                break
-    
-    return user_expenses
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    user_expenses = [ExpenseInDB(doc_id=expense_id, **data) for expense_id, data in repositories.expenses().list_for_user(user_id)]
+    seen_ids = {expense.id for expense in user_expenses}
+    archived = archive_service.get_user_archived_expenses(user_id, exclude=seen_ids)
+    return user_expenses + [ExpenseInDB(doc_id=expense_id, **data) for expense_id, data in archived]
+
+def _get_live_expense(expense_id: str) -> Optional[dict]:
+    """The live expense document; archived expenses are moved back to a live document first."""
+    expense_data = repositories.expenses().get(expense_id)
+    if expense_data is None and archive_service.unarchive_expense(expense_id) is not None:
+        expense_data = repositories.expenses().get(expense_id)
+    return expense_data
 
 def update_expense(expense_id: str, expense_data: ExpenseUpdate):
     """Updates an existing expense."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
 
-    expense_ref: DocumentReference = expenses_ref.document(expense_id)
-    expense_doc = expense_ref.get()
-    if not expense_doc.exists:
+    current_expense_data = _get_live_expense(expense_id)
+    if current_expense_data is None:
         return None
 
     update_dict = expense_data.model_dump(exclude_unset=True)
@@ -117,28 +119,38 @@ def update_expense(expense_id: str, expense_data: ExpenseUpdate):
     # If participants are updated, ensure they are validated
     if 'participants' in update_dict and update_dict['participants'] is not None:
         # Re-fetch the current group_id to validate participants
-        current_expense_data = expense_doc.to_dict()
         current_group_id = current_expense_data.get('group_id')
         
         # Create a temporary ExpenseCreate object for validation
         temp_expense_data = ExpenseCreate(
-            description="temp", amount=1.0, payer_id="temp", group_id=current_group_id,
+            description="temp", amount=1.0, group_id=current_group_id,
+            payer_id=update_dict.get('payer_id') or current_expense_data.get('payer_id'),
             participants=update_dict['participants']
         )
         _validate_expense_data(temp_expense_data) # Validate participants against group membership
 
-    if update_dict:
-        expense_ref.update(update_dict)
+    if not update_dict:
+        return get_expense(expense_id)
 
-    return get_expense(expense_id)
+    updated = repositories.expenses().update(expense_id, current_expense_data.get('group_id'), update_dict)
+    if updated is None:
+        return None # Deleted concurrently, or its group was
+    before_data, updated_data, change_tag = updated
+    event_service.publish_expense_change(before_data.get('group_id'), expense_id, before_data, updated_data,
+                                         dedupe_key=f"{expense_id}@{change_tag}")
+    return ExpenseInDB(doc_id=expense_id, **updated_data)
 
 def delete_expense(expense_id: str):
     """Deletes an expense."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
 
-    expense_ref: DocumentReference = expenses_ref.document(expense_id)
-    if not expense_ref.get().exists:
+    current_expense_data = _get_live_expense(expense_id)
+    if current_expense_data is None:
         return False
-    
-    expense_ref.delete()
-    return True
\ No newline at end of file
+
+    deleted_data = repositories.expenses().delete(expense_id, current_expense_data.get('group_id'))
+    if deleted_data is None:
+        return False # Deleted concurrently
+    event_service.publish_expense_change(deleted_data.get('group_id'), expense_id, deleted_data, None,
+                                         dedupe_key=f"{expense_id}@deleted")
+    return True
@@ -0,0 +1,181 @@
+from __future__ import annotations
+from backend.firebase_db import as_utc, get_store, using_sqlite_backend
+from backend.services import archive_service
+from flask import current_app
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+import base64
+import csv
+import heapq
+import io
+import json
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference
+
+# Streaming export of a group's full expense history (live and archived), one row per
+# participant, ordered by (created_at, expense id). Rows are produced page by page, so memory
+# stays flat however long the history is and the first bytes go out before the last page is read.
+#
+# Every row carries the cursor of its expense. A cursor is an inclusive starting point: to resume
+# an interrupted download, drop the rows carrying the last cursor received and request again
+# with ?cursor=<that cursor>.
+
+expenses_ref: CollectionReference = lambda: get_store().collection('expenses')
+users_ref: CollectionReference = lambda: get_store().collection('users')
+
+EXPORT_COLUMNS = ['expense_id', 'created_at', 'description', 'amount', 'payer_id', 'payer_name',
+                  'participant_id', 'participant_name', 'share_amount', 'cursor']
+
+_NAMES_PER_READ = 100 # Users resolved per batched get_all
+
+def encode_cursor(created_at: datetime, expense_id: str) -> str:
+    raw = json.dumps([as_utc(created_at).isoformat(), expense_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Returns (created_at, expense_id); raises ValueError for anything that isn't a cursor we issued."""
+    try:
+        created_at, expense_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), str(expense_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid export cursor.") from e
+
+def _sort_key(item: Tuple[str, dict]):
+    expense_id, data = item
+    created_at = data.get('created_at')
+    return (as_utc(created_at) if created_at else datetime.min.replace(tzinfo=timezone.utc), expense_id)
+
+def _iter_live(group_id: str, start: Optional[Tuple[datetime, str]], page_size: int) -> Iterator[Tuple[str, dict]]:
+    """Live expenses in (created_at, id) order, read page_size documents at a time."""
+    if using_sqlite_backend():
+        yield from get_store().iter_group_expenses(group_id, start, page_size)
+        return
+    query = expenses_ref().where('group_id', '==', group_id).order_by('created_at').order_by('__name__').limit(page_size)
+    page = query.start_at({'created_at': start[0], '__name__': start[1]}) if start else query
+    while True:
+        docs = list(page.stream())
+        for doc in docs:
+            yield doc.id, doc.to_dict()
+        if len(docs) < page_size:
+            return
+        page = query.start_after(docs[-1])
+
+def _iter_archived(group_id: str, start: Optional[Tuple[datetime, str]]) -> Iterator[Tuple[str, dict]]:
+    """Archived expenses in (created_at, id) order, one archive document in memory at a time."""
+    if using_sqlite_backend():
+        return # Nothing is archived on SQLite
+    parts_by_month: Dict[str, List[Tuple[int, str]]] = {}
+    for doc in archive_service.archives_ref(group_id).select(['month', 'part']).stream():
+        data = doc.to_dict()
+        parts_by_month.setdefault(data['month'], []).append((data.get('part', 0), doc.id))
+    if not parts_by_month:
+        return
+
+    # Archived expenses that also have a live copy (edited while compaction ran) are exported from the live side
+    last_month = max(parts_by_month)
+    year, month = int(last_month[:4]), int(last_month[5:7])
+    boundary = datetime(year + month // 12, month % 12 + 1, 1)
+    live_ids = {doc.id for doc in expenses_ref().where('group_id', '==', group_id).where('created_at', '<', boundary).select([]).stream()}
+
+    start_key = (as_utc(start[0]), start[1]) if start else None
+    for month_key in sorted(parts_by_month):
+        if start_key and month_key < start_key[0].strftime('%Y-%m'):
+            continue
+        # Parts of a month hold consecutive runs of its records, so numeric part order is record order
+        for _, part_id in sorted(parts_by_month[month_key]):
+            archive_doc = archive_service.archives_ref(group_id).document(part_id).get()
+            if not archive_doc.exists:
+                continue
+            items = archive_service.iter_archived_documents([archive_doc.to_dict()], group_id, exclude=live_ids)
+            for item in sorted(items, key=_sort_key):
+                if start_key and _sort_key(item) < start_key:
+                    continue
+                yield item
+
+def _resolve_names(user_ids: Iterable[str], names: Dict[str, Optional[str]]):
+    """Adds usernames for the ids not yet in names, with batched reads of just the username field."""
+    missing = [user_id for user_id in dict.fromkeys(user_ids) if user_id and user_id not in names]
+    if using_sqlite_backend():
+        found = get_store().get_usernames(missing)
+        names.update({user_id: found.get(user_id) for user_id in missing})
+        return
+    for i in range(0, len(missing), _NAMES_PER_READ):
+        chunk = missing[i:i + _NAMES_PER_READ]
+        for doc in get_store().get_all([users_ref().document(user_id) for user_id in chunk], field_paths=['username']):
+            names[doc.id] = doc.to_dict().get('username') if doc.exists else None
+        for user_id in chunk:
+            names.setdefault(user_id, None)
+
+def _rows(expense_id: str, data: dict, names: Dict[str, Optional[str]]) -> Iterator[dict]:
+    """Flattens one expense into a row per participant, with each participant's effective share."""
+    amount = data.get('amount') or 0.0
+    participants = data.get('participants') or []
+    explicit_total = sum(p['share_amount'] for p in participants if p.get('share_amount') is not None)
+    implicit_count = sum(1 for p in participants if p.get('share_amount') is None)
+    implicit_share = (amount - explicit_total) / implicit_count if implicit_count else 0.0
+    created_at = data.get('created_at')
+    base = {
+        'expense_id': expense_id,
+        'created_at': as_utc(created_at).isoformat() if created_at else None,
+        'description': data.get('description'),
+        'amount': amount,
+        'payer_id': data.get('payer_id'),
+        'payer_name': names.get(data.get('payer_id')),
+        'cursor': encode_cursor(created_at, expense_id) if created_at else None,
+    }
+    for participant in participants or [{}]:
+        share = participant.get('share_amount')
+        yield dict(base,
+                   participant_id=participant.get('user_id'),
+                   participant_name=names.get(participant.get('user_id')),
+                   share_amount=round(share if share is not None else implicit_share, 2) if participant else None)
+
+def iter_group_expenses(group_id: str, start: Optional[Tuple[datetime, str]] = None,
+                        page_size: Optional[int] = None) -> Iterator[Tuple[str, dict]]:
+    """The group's live and archived expenses as (id, document) in (created_at, id) order, from start (inclusive)."""
+    page_size = page_size or current_app.config.get('EXPORT_PAGE_SIZE', 500)
+    return heapq.merge(_iter_archived(group_id, start), _iter_live(group_id, start, page_size), key=_sort_key)
+
+def iter_group_export_rows(group_id: str, cursor: Optional[str] = None, page_size: Optional[int] = None) -> Iterator[List[dict]]:
+    """
+    Yields the group's export rows in pages (lists of row dicts), starting at cursor if given.
+    Display names are resolved once per page for the users not seen before.
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    start = decode_cursor(cursor) if cursor else None
+    page_size = page_size or current_app.config.get('EXPORT_PAGE_SIZE', 500)
+    merged = iter_group_expenses(group_id, start, page_size)
+
+    names: Dict[str, Optional[str]] = {}
+    page: List[Tuple[str, dict]] = []
+    for item in merged:
+        page.append(item)
+        if len(page) >= page_size:
+            yield _flush(page, names)
+            page = []
+    if page:
+        yield _flush(page, names)
+
+def _flush(page: List[Tuple[str, dict]], names: Dict[str, Optional[str]]) -> List[dict]:
+    _resolve_names((user_id for _, data in page
+                    for user_id in [data.get('payer_id')] + [p.get('user_id') for p in data.get('participants') or ()]), names)
+    return [row for expense_id, data in page for row in _rows(expense_id, data, names)]
+
+def stream_csv(pages: Iterable[List[dict]]) -> Iterator[str]:
+    """CSV text, header first, then one chunk per page."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    yield buffer.getvalue()
+    for rows in pages:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+def stream_jsonl(pages: Iterable[List[dict]]) -> Iterator[str]:
+    """JSON Lines, one object per row, one chunk per page."""
+    for rows in pages:
+        yield ''.join(json.dumps(row) + '\n' for row in rows)
@@ -1,172 +1,141 @@
-from backend.firebase_db import get_firestore_db
+from __future__ import annotations
+from backend.firebase_db import get_store
 from backend.models import GroupInDB, GroupCreate, GroupUpdate, UserInDB
-from firebase_admin.firestore import CollectionReference, DocumentReference
+from backend import repositories
+from backend.services.access_cache import GroupAccess, get_access_cache
 from datetime import datetime
-from typing import List, Optional
-
-# Firestore collection references
-groups_ref: CollectionReference = lambda: get_firestore_db().collection('groups')
-users_ref: CollectionReference = lambda: get_firestore_db().collection('users')
+from typing import Dict, Iterable, List, Optional
 
 def create_group(group_data: GroupCreate, owner_id: str):
     """Creates a new group in Firestore."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
-
-    # Validate owner_id exists
-    owner_doc = users_ref().document(owner_id).get()
-    if not owner_doc.exists:
-        raise ValueError(f"Owner user with ID {owner_id} does not exist.")
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
 
     group_dict = group_data.model_dump(exclude={'member_uids'}) # Exclude member_uids from main doc
     group_dict['owner_id'] = owner_id
     group_dict['created_at'] = datetime.utcnow()
+    group_dict['version'] = 0 # Change version, bumped by every mutation of the group or its expenses
 
-    # Add the group document
-    update_time, doc_ref = groups_ref().add(group_dict)
-    group_id = doc_ref.id
-
-    # Add owner as the first member
-    initial_members_firebase_uids = list(set(group_data.member_uids + [owner_doc.to_dict().get('firebase_uid')]))
-
-    # Add members to a 'members' subcollection
-    group_members_subcollection: CollectionReference = groups_ref().document(group_id).collection('members')
-    added_member_ids = []
-    for firebase_uid in initial_members_firebase_uids:
-        user_query = users_ref().where('firebase_uid', '==', firebase_uid).limit(1).get()
-        if user_query:
-            member_doc_id = user_query[0].id
-            group_members_subcollection.document(member_doc_id).set({'added_at': datetime.utcnow()})
-            added_member_ids.append(member_doc_id)
-        else:
-            print(f"Warning: User with Firebase UID {firebase_uid} not found when adding to group {group_id}")
+    # The owner is added as the first member
+    created = repositories.groups().create(group_dict, owner_id, group_data.member_uids)
+    if created is None:
+        raise ValueError(f"Owner user with ID {owner_id} does not exist.")
+    group_id, missing_uids = created
+    for firebase_uid in missing_uids:
+        print(f"Warning: User with Firebase UID {firebase_uid} not found when adding to group {group_id}")
 
     # Fetch the created group to return consistent data
-    created_group_doc = groups_ref().document(group_id).get()
-    if created_group_doc.exists:
-        # Construct GroupInDB with fetched member IDs
-        group_data = created_group_doc.to_dict()
-        group_data['members'] = added_member_ids # Add actual Firestore member IDs
-        return GroupInDB(doc_id=created_group_doc.id, **group_data)
-    return None
+    return get_group(group_id)
 
 def get_group(group_id: str):
     """Retrieves a group and its members from Firestore."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
-
-    group_doc = groups_ref().document(group_id).get()
-    if not group_doc.exists:
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    group_data = repositories.groups().get(group_id)
+    return GroupInDB(doc_id=group_id, **group_data) if group_data is not None else None
+
+def _load_group_access(group_id: str) -> Optional[GroupAccess]:
+    access = repositories.groups().get_access(group_id)
+    return GroupAccess(group_id, access[0], frozenset(access[1])) if access is not None else None
+
+def _load_group_accesses(group_ids: List[str]) -> Dict[str, Optional[GroupAccess]]:
+    accesses = repositories.groups().get_accesses(group_ids)
+    return {group_id: GroupAccess(group_id, owner_id, frozenset(members)) for group_id, (owner_id, members) in accesses.items()}
+
+def get_group_accesses(group_ids: Iterable[str], user_id: Optional[str] = None) -> Dict[str, Optional[GroupAccess]]:
+    """get_group_access for several groups, loading the ones not cached together. None for groups that don't exist."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    return get_access_cache().get_many(group_ids, _load_group_accesses, user_id=user_id)
+
+def get_group_access(group_id: str, user_id: Optional[str] = None) -> Optional[GroupAccess]:
+    """
+    Owner and member ids of a group for authorization, from the process-wide cache
+    (see access_cache). Pass the user being checked so a stale denial is re-read.
+    Returns None if the group doesn't exist.
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    return get_access_cache().get(group_id, _load_group_access, user_id=user_id)
+
+def get_group_version(group_id: str, user_id: str) -> Optional[int]:
+    """
+    Returns the group's change version if the user can access the group.
+    Only reads the group's version/owner fields (membership comes from the access cache),
+    so it is cheap enough to answer conditional requests before loading members or expenses.
+    Returns None if the group doesn't exist or the user isn't a member.
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    row = repositories.groups().get_version(group_id)
+    if row is None:
         return None
+    owner_id, version = row
 
-    group_data = group_doc.to_dict()
-    # Fetch members from the subcollection
-    members_snapshot = groups_ref().document(group_id).collection('members').stream()
-    member_ids = [doc.id for doc in members_snapshot]
+    if owner_id != user_id:
+        access = get_group_access(group_id, user_id)
+        if access is None or not access.allows(user_id):
+            return None
+    return version
 
-    group_data['members'] = member_ids
-    return GroupInDB(doc_id=group_doc.id, **group_data)
+def bump_group_version(group_id: str):
+    """Increments the group's change version so cached group/expense/settlement responses go stale."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    repositories.groups().bump_version(group_id)
 
 def get_user_groups(user_id: str):
     """Retrieves all groups a user is a member of."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
-
-    # Find groups where the user is a member in the subcollection
-    # Firestore doesn't directly support querying subcollections across documents.
-    # The common pattern is to query all groups and then filter members.
-    # For efficiency for large numbers of groups/users, a dedicated 'group_memberships'
-    # collection might be better where each document represents a user's membership to a group.
-    # For now, we iterate through groups and check membership.
-
-    all_groups_snapshot = groups_ref().stream()
-    user_groups = []
-    for group_doc in all_groups_snapshot:
-        group_id = group_doc.id
-        # Check if user_id is present in the 'members' subcollection of this group
-        member_doc = groups_ref().document(group_id).collection('members').document(user_id).get()
-        if member_doc.exists:
-            group_data = group_doc.to_dict()
-            # Fetch all members for the complete GroupInDB object
-            members_snapshot = groups_ref().document(group_id).collection('members').stream()
-            group_data['members'] = [m_doc.id for m_doc in members_snapshot]
-            user_groups.append(GroupInDB(doc_id=group_id, **group_data))
-    return user_groups
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    return [GroupInDB(doc_id=group_id, **group_data) for group_id, group_data in repositories.groups().list_for_user(user_id)]
+
+def get_user_group_ids(user_id: str) -> List[str]:
+    """Ids of the groups a user is a member of, without loading the groups."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    return repositories.groups().ids_for_user(user_id)
 
 def update_group(group_id: str, group_data: GroupUpdate):
     """Updates an existing group in Firestore."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
-
-    group_ref: DocumentReference = groups_ref().document(group_id)
-    group_doc = group_ref.get()
-    if not group_doc.exists:
-        return None
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
 
     update_dict = group_data.model_dump(exclude_unset=True) # Only update fields provided
     if update_dict:
-        group_ref.update(update_dict)
+        if not repositories.groups().update(group_id, update_dict):
+            return None
+        get_access_cache().invalidate(group_id)
 
     # Fetch updated group
     return get_group(group_id)
 
 def delete_group(group_id: str):
-    """Deletes a group and its subcollections (members, expenses)."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
-
-    group_ref: DocumentReference = groups_ref().document(group_id)
-    group_doc = group_ref.get()
-    if not group_doc.exists:
-        return False
-
-    # Delete subcollections first (Firestore doesn't do this recursively)
-    # Delete members subcollection
-    members_snapshot = group_ref().collection('members').stream()
-    for doc in members_snapshot:
-        doc.reference.delete()
-
-    # Delete expenses related to this group (assuming expenses are in a top-level collection
-    # but also have a group_id field that can be queried).
-    # If expenses were a subcollection, delete them similarly.
-    expenses_in_group = get_firestore_db().collection('expenses').where('group_id', '==', group_id).stream()
-    for exp_doc in expenses_in_group:
-        # Delete expense participants subcollection if it exists for this expense
-        exp_doc.reference.collection('participants').stream() # Assuming no participants subcollection, directly delete
-        exp_doc.reference.delete()
-
-
-    group_ref.delete()
-    return True
+    """Deletes a group and its subcollections (members, expenses), and its recurring templates."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    deleted = repositories.groups().delete(group_id)
+    get_access_cache().invalidate(group_id)
+    return deleted
 
 def add_member_to_group(group_id: str, user_id: str):
     """Adds a user as a member to a group."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
 
-    group_ref: DocumentReference = groups_ref().document(group_id)
-    user_ref: DocumentReference = users_ref().document(user_id)
-
-    if not group_ref.get().exists:
+    if not repositories.groups().exists(group_id):
         raise ValueError(f"Group with ID {group_id} not found.")
-    if not user_ref.get().exists:
+    if not repositories.users().exists(user_id):
         raise ValueError(f"User with ID {user_id} not found.")
-
-    member_subcollection: CollectionReference = group_ref.collection('members')
-    member_doc = member_subcollection.document(user_id).get()
-
-    if member_doc.exists:
+    if not repositories.groups().add_member(group_id, user_id):
         return False # User is already a member
-
-    member_subcollection.document(user_id).set({'added_at': datetime.utcnow()})
+    get_access_cache().invalidate(group_id)
     return True
 
 def remove_member_from_group(group_id: str, user_id: str):
     """Removes a user from a group's members."""
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
-
-    group_ref: DocumentReference = groups_ref().document(group_id)
-    member_subcollection: CollectionReference = group_ref.collection('members')
-    member_doc = member_subcollection.document(user_id).get()
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
 
-    if not group_ref.get().exists:
+    if not repositories.groups().exists(group_id):
         raise ValueError(f"Group with ID {group_id} not found.")
-    if not member_doc.exists:
+    if not repositories.groups().remove_member(group_id, user_id):
         return False # User is not a member
-
-    member_subcollection.document(user_id).delete()
-    return True
\ No newline at end of file
+    get_access_cache().invalidate(group_id)
+    return True
@@ -0,0 +1,332 @@
+from __future__ import annotations
+from backend.firebase_db import as_utc, commit_in_batches, get_store, run_transaction, using_sqlite_backend
+from backend.models import JobInDB
+from flask import current_app
+from pydantic import BaseModel
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Callable, Dict, Optional
+import json
+import os
+import queue
+import threading
+import time
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference
+    from flask import Flask
+
+# Background jobs.
+# Heavy operations (deleting a big group, settlements over a long history, ...) can be submitted
+# instead of run in the request thread: the route answers 202 with the job record, a small pool
+# of threads in the same worker process runs the service function in an app context, and the
+# client polls GET /api/jobs/<id>. No broker is involved; the queue lives in the worker.
+#
+# Job records are stored with the rest of the data (jobs/{id}, or the jobs table on SQLite), so
+# any worker can answer status requests. Queued and running jobs get a heartbeat from the worker
+# that holds them; a job whose heartbeat stops (the worker was stopped or killed) reads as failed.
+# The per-user limit (JOB_MAX_PER_USER) counts the user's live queued and running records in the
+# same transaction that creates the new one, so it holds across workers and abandoned jobs don't
+# count. Records expire JOB_RETENTION_SECONDS after they finish: SQLite deletes expired rows when a
+# job is created, and every Firestore submission deletes a few expired documents. A Firestore TTL
+# policy on jobs.expires_at removes them without those reads and can replace the purge.
+#
+# Any service function can be submitted. Functions that want to can call report_progress() and
+# check_cancelled() while they run; both do nothing outside a job. Cancellation is cooperative:
+# a queued job is dropped, a running one stops at its next check_cancelled(), and a function that
+# never checks runs to completion.
+
+jobs_ref: CollectionReference = lambda: get_store().collection('jobs')
+
+FINISHED = ('done', 'failed', 'cancelled')
+_PURGE_PER_SUBMIT = 20 # Expired Firestore job records deleted per submission
+_PROGRESS_WRITE_SECONDS = 1.0 # Progress is persisted at most this often per job (and with every heartbeat)
+
+class JobLimitExceeded(Exception):
+    """The user already has the maximum number of jobs, or this worker's queue is full."""
+    def __init__(self, scope: str):
+        super().__init__(f"Job limit reached ({scope}).")
+        self.scope = scope # 'user' or 'queue'
+
+class JobCancelled(Exception):
+    """Raised by check_cancelled() inside a job whose cancellation was requested."""
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _to_json(value):
+    """The function's return value as JSON-compatible data for the job record."""
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode='json', by_alias=True)
+    return json.loads(json.dumps(value, default=str))
+
+# Storage of job records
+
+def _alive_since() -> datetime:
+    """Queued and running jobs whose last heartbeat is older were abandoned by their worker."""
+    return _utcnow() - timedelta(seconds=3 * current_app.config.get('JOB_HEARTBEAT_SECONDS', 15))
+
+def _create_record(record: dict, user_limit: int) -> Optional[str]:
+    """Stores the record; None instead if the user already has user_limit live queued or running jobs."""
+    alive_since = _alive_since()
+    if using_sqlite_backend():
+        return get_store().create_job(record, user_limit=user_limit, alive_since=alive_since)
+    doc_ref = jobs_ref().document()
+
+    def create(transaction):
+        # Read through the transaction, so submissions through other workers can't both take the last slot
+        active = jobs_ref().where('user_id', '==', record['user_id']).where('status', 'in', ['queued', 'running'])
+        live = sum(1 for doc in active.stream(transaction=transaction)
+                   if (as_utc(doc.to_dict().get('heartbeat_at')) or alive_since) >= alive_since)
+        if live >= user_limit:
+            return None
+        transaction.create(doc_ref, record)
+        return doc_ref.id
+
+    return run_transaction(create)
+
+def _purge_expired():
+    """Deletes some job records past their expires_at (SQLite clears them in create_job)."""
+    if using_sqlite_backend():
+        return
+    expired = jobs_ref().where('expires_at', '<', _utcnow()).limit(_PURGE_PER_SUBMIT).select([]).stream()
+    commit_in_batches(('delete', (doc.reference,)) for doc in expired)
+
+def _read_record(job_id: str) -> Optional[dict]:
+    if using_sqlite_backend():
+        return get_store().get_job(job_id)
+    doc = jobs_ref().document(job_id).get()
+    return doc.to_dict() if doc.exists else None
+
+def _update_record(job_id: str, fields: dict):
+    if using_sqlite_backend():
+        get_store().update_job(job_id, fields)
+    else:
+        jobs_ref().document(job_id).update(fields)
+
+class _Job:
+    """A job this process holds (queued or running)."""
+    __slots__ = ('id', 'user_id', 'function', 'args', 'kwargs', 'cancelled', 'progress', 'message', 'progress_written_at')
+
+    def __init__(self, job_id: str, user_id: str, function: Callable, args: tuple, kwargs: dict):
+        self.id = job_id
+        self.user_id = user_id
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = threading.Event()
+        self.progress: Optional[float] = None
+        self.message: Optional[str] = None
+        self.progress_written_at = 0.0
+
+_current = threading.local() # The job running in this thread, for report_progress/check_cancelled
+
+def report_progress(done: float, total: Optional[float] = None, message: Optional[str] = None):
+    """Reports how far the job running in this thread is (done out of total, or a 0..1 fraction)."""
+    job: Optional[_Job] = getattr(_current, 'job', None)
+    if job is None:
+        return
+    job.progress = max(0.0, min(1.0, done / total if total else done))
+    if message is not None:
+        job.message = message
+    if time.monotonic() - job.progress_written_at >= _PROGRESS_WRITE_SECONDS:
+        job.progress_written_at = time.monotonic()
+        _update_record(job.id, {'progress': job.progress, 'message': job.message})
+
+def check_cancelled():
+    """Raises JobCancelled if cancellation of the job running in this thread was requested."""
+    job: Optional[_Job] = getattr(_current, 'job', None)
+    if job is not None and job.cancelled.is_set():
+        raise JobCancelled()
+
+class JobRunner:
+    """Bounded queue plus a pool of job threads for one worker process."""
+
+    def __init__(self, app: Flask, workers: int = 2, queue_size: int = 100, user_limit: int = 2,
+                 heartbeat: float = 15.0, retention: float = 86400.0, max_result_bytes: int = 262144):
+        self.app = app
+        self.workers = workers
+        self.user_limit = user_limit
+        self.heartbeat = heartbeat
+        self.retention = retention
+        self.max_result_bytes = max_result_bytes
+        self._queue: "queue.Queue[_Job]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, _Job] = {} # Queued and running
+        self._started = False
+
+    def _start(self):
+        # Threads start with the first job, so workers that never run one don't keep idle threads
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True).start()
+        threading.Thread(target=self._beat, name='job-heartbeat', daemon=True).start()
+        self._started = True
+
+    def submit(self, user_id: str, function: Callable, *args, **kwargs) -> JobInDB:
+        """Queues function(*args, **kwargs) as a job of the user; raises JobLimitExceeded when over a limit."""
+        with self._lock:
+            if self._queue.full():
+                raise JobLimitExceeded('queue')
+            if not self._started:
+                self._start()
+
+        now = _utcnow()
+        record = {
+            'user_id': user_id,
+            'kind': f"{function.__module__.rsplit('.', 1)[-1]}.{function.__name__}",
+            'status': 'queued',
+            'progress': None,
+            'message': None,
+            'result': None,
+            'error': None,
+            'cancel_requested': False,
+            'created_at': now,
+            'started_at': None,
+            'finished_at': None,
+            'heartbeat_at': now,
+            'expires_at': None,
+        }
+        job_id = _create_record(record, self.user_limit)
+        if job_id is None:
+            raise JobLimitExceeded('user')
+        try:
+            _purge_expired()
+        except Exception as e:
+            print(f"Warning: Could not purge expired job records: {e}")
+        job = _Job(job_id, user_id, function, args, kwargs)
+        with self._lock:
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            # Lost the race for the last slot
+            self._finish(job, {'status': 'failed', 'error': "Job queue is full."})
+            raise JobLimitExceeded('queue')
+        return JobInDB(doc_id=job_id, **record)
+
+    def cancel(self, job_id: str) -> bool:
+        """Flags a job held by this process; False if it runs elsewhere (its heartbeat picks the flag up)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancelled.set()
+        return True
+
+    def _finish(self, job: _Job, fields: dict):
+        now = _utcnow()
+        fields.update({'finished_at': now, 'heartbeat_at': now, 'expires_at': now + timedelta(seconds=self.retention)})
+        try:
+            _update_record(job.id, fields)
+        finally:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self.app.app_context():
+                try:
+                    self._run(job)
+                except Exception as e:
+                    print(f"Warning: Could not record the outcome of job {job.id}: {e}")
+
+    def _run(self, job: _Job):
+        record = _read_record(job.id) or {}
+        if job.cancelled.is_set() or record.get('cancel_requested'):
+            self._finish(job, {'status': 'cancelled'})
+            return
+
+        _update_record(job.id, {'status': 'running', 'started_at': _utcnow(), 'heartbeat_at': _utcnow()})
+        _current.job = job
+        try:
+            result = _to_json(job.function(*job.args, **job.kwargs))
+        except JobCancelled:
+            self._finish(job, {'status': 'cancelled', 'progress': job.progress, 'message': job.message})
+            return
+        except Exception as e:
+            self._finish(job, {'status': 'failed', 'error': str(e) or type(e).__name__, 'progress': job.progress, 'message': job.message})
+            return
+        finally:
+            _current.job = None
+
+        size = len(json.dumps(result))
+        if size > self.max_result_bytes:
+            self._finish(job, {'status': 'failed', 'error': f"Result of {size} bytes is too large to store."})
+            return
+        self._finish(job, {'status': 'done', 'result': result, 'progress': 1.0, 'message': job.message})
+
+    def _beat(self):
+        # Keeps this worker's jobs from reading as abandoned and picks up cancellations made through other workers
+        while True:
+            time.sleep(self.heartbeat)
+            with self._lock:
+                jobs = list(self._jobs.values())
+            if not jobs:
+                continue
+            with self.app.app_context():
+                for job in jobs:
+                    try:
+                        record = _read_record(job.id)
+                        if record is not None and record.get('cancel_requested'):
+                            job.cancelled.set()
+                        if record is not None and record.get('status') not in FINISHED:
+                            _update_record(job.id, {'heartbeat_at': _utcnow(), 'progress': job.progress, 'message': job.message})
+                    except Exception as e:
+                        print(f"Warning: Job heartbeat failed for {job.id}: {e}")
+
+_runner_instance: Optional[JobRunner] = None
+_runner_lock = threading.Lock()
+
+def _reset_after_fork():
+    # Job threads don't survive a fork; each worker runs its own pool
+    global _runner_instance, _runner_lock
+    _runner_instance = None
+    _runner_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_job_runner() -> JobRunner:
+    """Provides this process's job runner, configured from app.config on first use."""
+    global _runner_instance
+    if _runner_instance is None:
+        with _runner_lock:
+            if _runner_instance is None:
+                config = current_app.config
+                _runner_instance = JobRunner(current_app._get_current_object(),
+                                             workers=config.get('JOB_WORKERS', 2),
+                                             queue_size=config.get('JOB_QUEUE_SIZE', 100),
+                                             user_limit=config.get('JOB_MAX_PER_USER', 2),
+                                             heartbeat=config.get('JOB_HEARTBEAT_SECONDS', 15),
+                                             retention=config.get('JOB_RETENTION_SECONDS', 86400),
+                                             max_result_bytes=config.get('JOB_MAX_RESULT_BYTES', 262144))
+    return _runner_instance
+
+def submit_job(user_id: str, function: Callable, *args, **kwargs) -> JobInDB:
+    """Runs function(*args, **kwargs) in the background as a job of the user."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    return get_job_runner().submit(user_id, function, *args, **kwargs)
+
+def get_job(job_id: str) -> Optional[JobInDB]:
+    """The job record; queued/running jobs whose worker stopped heartbeating are reported as failed."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    record = _read_record(job_id)
+    if record is None:
+        return None
+    heartbeat_at = as_utc(record.get('heartbeat_at'))
+    if record.get('status') not in FINISHED and heartbeat_at is not None and heartbeat_at < _alive_since():
+        record = dict(record, status='failed', error="The worker running this job stopped.")
+    return JobInDB(doc_id=job_id, **record)
+
+def cancel_job(job_id: str) -> bool:
+    """Requests cancellation. False if the job had already finished."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    job = get_job(job_id)
+    if job is None or job.status in FINISHED:
+        return False
+    _update_record(job_id, {'cancel_requested': True})
+    get_job_runner().cancel(job_id)
+    return True
@@ -0,0 +1,151 @@
+from __future__ import annotations
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+import json
+import os
+import random
+import string
+import sys
+import threading
+import jwt
+
+# On-demand profiling of single live requests.
+# A profiled request gets a sampling profiler: a thread that every PROFILING_INTERVAL_MS reads the
+# request thread's current stack (sys._current_frames) and counts it. The request itself runs
+# unmodified (no tracing hooks), so the cost is the sampler waking up, and only for that request.
+# Stacks are stored in the folded format (one "root;caller;callee count" line per distinct stack)
+# that flamegraph.pl, speedscope and most flamegraph viewers read.
+#
+# A request is profiled when it carries a profiling token (X-Profile-Token, a JWT signed with
+# PROFILING_SECRET; see backend/maintenance/profile_token.py) or is picked at PROFILING_SAMPLE_RATE.
+# With neither configured the app registers no hooks at all. Profiles are files in PROFILING_DIR,
+# shared by the workers of a host; the newest PROFILING_MAX_PROFILES are kept.
+
+_ID_CHARS = string.ascii_letters + string.digits
+_TOKEN_SCOPE = 'profiling'
+
+def _new_id() -> str:
+    return ''.join(random.choices(_ID_CHARS, k=12))
+
+def create_token(secret: str, minutes: int = 15) -> str:
+    """A profiling token valid for minutes: profiles the requests sending it and opens /api/profiles."""
+    now = datetime.now(timezone.utc)
+    return jwt.encode({'scope': _TOKEN_SCOPE, 'iat': now, 'exp': now + timedelta(minutes=minutes)}, secret, algorithm="HS256")
+
+def verify_token(secret: Optional[str], token: Optional[str]) -> bool:
+    if not secret or not token:
+        return False
+    try:
+        return jwt.decode(token, secret, algorithms=["HS256"]).get('scope') == _TOKEN_SCOPE
+    except jwt.PyJWTError:
+        return False
+
+def _label(code) -> str:
+    # Per function (first line), not per current line, so samples of one call aggregate
+    filename = code.co_filename.replace('\\', '/')
+    marker = filename.rfind('/backend/')
+    filename = filename[marker + 1:] if marker >= 0 else os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+def fold_stack(frame) -> str:
+    """The stack of frame, outermost call first, as one folded-format line (without the count)."""
+    labels = []
+    while frame is not None:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+class SamplingProfiler:
+    """Samples one thread's stack every interval seconds, for at most max_seconds."""
+
+    def __init__(self, thread_id: int, interval: float = 0.005, max_seconds: float = 60.0):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_samples = max(1, int(max_seconds / interval))
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval) and self.samples < self.max_samples:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return # The thread ended
+            self.stacks[fold_stack(frame)] += 1
+            self.samples += 1
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        return self.stacks
+
+def folded(stacks: Counter) -> str:
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+class ProfileStore:
+    """Profiles as JSON files in one directory, the newest max_profiles kept."""
+
+    def __init__(self, directory: str, max_profiles: int = 50):
+        self.directory = directory
+        self.max_profiles = max_profiles
+
+    def _path(self, profile_id: str) -> Optional[str]:
+        if not profile_id or any(c not in _ID_CHARS for c in profile_id):
+            return None
+        for name in self._names():
+            if name.endswith(f"-{profile_id}.json"):
+                return os.path.join(self.directory, name)
+        return None
+
+    def _names(self) -> List[str]:
+        try:
+            # Names start with the creation time, so they sort oldest first
+            return sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        except FileNotFoundError:
+            return []
+
+    def save(self, record: dict, stacks: Counter) -> str:
+        profile_id = _new_id()
+        os.makedirs(self.directory, exist_ok=True)
+        record = dict(record, id=profile_id, folded=folded(stacks))
+        name = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}-{profile_id}.json"
+        temporary = os.path.join(self.directory, f".{name}.tmp")
+        with open(temporary, 'w') as f:
+            json.dump(record, f, default=str)
+        os.replace(temporary, os.path.join(self.directory, name)) # Readers never see a partial file
+        for old in self._names()[:-self.max_profiles]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:
+                pass # Pruned by another worker
+        return profile_id
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        path = self._path(profile_id)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def list(self, limit: Optional[int] = None) -> List[dict]:
+        """Metadata of the stored profiles (without the stacks), newest first."""
+        records = []
+        for name in reversed(self._names()):
+            if limit is not None and len(records) >= limit:
+                break
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    record = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            record.pop('folded', None)
+            records.append(record)
+        return records
@@ -0,0 +1,101 @@
+from __future__ import annotations
+from backend.firebase_db import get_store
+from flask import current_app
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Tuple
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import DocumentReference, Query
+
+# Field projections for hot paths.
+# A hot path declares the fields it reads as a Projection and reads through it, so Firestore
+# sends only those fields (query.select / field_paths) instead of whole documents with their
+# descriptions, notes and anything added later.
+#
+# Projected documents come back as PartialRecord, not dict. Reading a field outside the
+# projection raises ProjectionError instead of quietly returning None, and a PartialRecord
+# can't be expanded into a model (`ExpenseInDB(**record)` raises), so partially loaded data
+# can't end up in an API response. Paths that build models keep reading full documents.
+
+class ProjectionError(Exception):
+    """A field outside the projection was read, or a partial record was used as a full document."""
+
+class PartialRecord:
+    """Read-only view of the projected fields of one document."""
+    __slots__ = ('_data', 'projection')
+
+    def __init__(self, data: Optional[dict], projection: "Projection"):
+        self._data = data or {}
+        self.projection = projection
+
+    def _check(self, field: str):
+        if field not in self.projection.fields:
+            raise ProjectionError(f"Field '{field}' is not in projection '{self.projection.name}'.")
+
+    def __getitem__(self, field: str):
+        self._check(field)
+        return self._data[field]
+
+    def get(self, field: str, default=None):
+        self._check(field)
+        return self._data.get(field, default)
+
+    def __contains__(self, field: str) -> bool:
+        self._check(field)
+        return field in self._data
+
+    def keys(self):
+        # Called by **record; models must be built from full documents
+        raise ProjectionError(f"Partial record from projection '{self.projection.name}' can't be used as a full document.")
+
+    def __repr__(self) -> str:
+        return f"PartialRecord({self.projection.name}, {self._data!r})"
+
+class Projection:
+    """A named set of top-level fields a hot path reads. No fields means ids / existence only."""
+
+    def __init__(self, name: str, fields: Iterable[str] = ()):
+        self.name = name
+        self.fields: Tuple[str, ...] = tuple(fields)
+
+    @staticmethod
+    def enabled() -> bool:
+        # QUERY_PROJECTIONS=False reads full documents everywhere (before/after comparisons)
+        return current_app.config.get('QUERY_PROJECTIONS', True)
+
+    def stream(self, query: Query) -> Iterator[Tuple[str, PartialRecord]]:
+        """Runs the query selecting only the projected fields; yields (doc_id, PartialRecord)."""
+        if self.enabled():
+            query = query.select(list(self.fields))
+        for doc in query.stream():
+            yield doc.id, PartialRecord(doc.to_dict(), self)
+
+    def ids(self, query: Query) -> list:
+        """Document ids matching the query (with no fields projected, nothing but the ids is sent)."""
+        if self.enabled():
+            query = query.select(list(self.fields))
+        return [doc.id for doc in query.stream()]
+
+    def get(self, reference: DocumentReference) -> Optional[PartialRecord]:
+        """One document's projected fields, or None if it doesn't exist."""
+        doc = reference.get(field_paths=list(self.fields)) if self.enabled() else reference.get()
+        return PartialRecord(doc.to_dict(), self) if doc.exists else None
+
+    def exists(self, reference: DocumentReference) -> bool:
+        return self.get(reference) is not None
+
+    def get_all(self, references: Iterable[DocumentReference]) -> Iterator[Tuple[str, PartialRecord]]:
+        """Batched read of several documents; yields (doc_id, PartialRecord) for those that exist."""
+        references = list(references)
+        if not references:
+            return
+        field_paths = list(self.fields) if self.enabled() else None
+        for doc in get_store().get_all(references, field_paths=field_paths):
+            if doc.exists:
+                yield doc.id, PartialRecord(doc.to_dict(), self)
+
+# The projections used by the hot paths
+SETTLEMENT_EXPENSE = Projection('settlement_expense', ('payer_id', 'amount', 'participants'))
+EXPENSE_PARTICIPANTS = Projection('expense_participants', ('participants',))
+USER_NAME = Projection('user_name', ('username',))
+GROUP_OWNER = Projection('group_owner', ('owner_id',))
+DOCUMENT_ID = Projection('document_id') # Membership checks, member lists, existence
@@ -0,0 +1,403 @@
+from __future__ import annotations
+from backend.firebase_db import as_utc, get_store, using_sqlite_backend, WRITES_PER_BATCH
+from backend.models import ExpenseCreate, RecurringExpenseCreate, RecurringExpenseInDB
+from backend import repositories
+from backend.services import analytics_service, event_service, expense_service, search_service, sync_service
+from flask import current_app
+from calendar import monthrange
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+import os
+import random
+import threading
+import time
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference
+    from flask import Flask
+
+# Recurring expenses.
+# A template (recurring_expenses/{id}) holds an expense plus a schedule. The scheduler looks up
+# every active template whose next occurrence is due and writes the missing occurrences
+# (catching up after downtime) as ordinary expenses, many templates per batched write.
+#
+# Occurrence n of template t is stored as expenses/{t}-{n:05d}, and the batch that writes it
+# also advances the template's next_index, on the precondition that the template hasn't
+# changed since it was read. A second scheduler (another worker, a cron run) racing on the
+# same template fails that precondition and writes nothing, so occurrences are never duplicated.
+# On SQLite the same holds with the template update conditional on the next_index that was read.
+# The batch can't take part in the group's sequence (see sync_service), so the occurrences get their
+# sync_seq right after it, in one transaction per group, which is also what bumps the group's version.
+# Before planning, each due template is checked against its group: a template left behind by a
+# deleted group is removed, one whose payer or participants are no longer members is deactivated.
+
+recurring_ref: CollectionReference = lambda: get_store().collection('recurring_expenses')
+expenses_ref: CollectionReference = lambda: get_store().collection('expenses')
+
+def occurrence_at(start_at: datetime, frequency: str, interval: int, index: int) -> datetime:
+    """Due time of the index-th occurrence (0 is start_at)."""
+    if frequency == 'daily':
+        return start_at + timedelta(days=index * interval)
+    if frequency == 'weekly':
+        return start_at + timedelta(weeks=index * interval)
+    months = start_at.month - 1 + index * interval
+    year, month = start_at.year + months // 12, months % 12 + 1
+    return start_at.replace(year=year, month=month, day=min(start_at.day, monthrange(year, month)[1]))
+
+def occurrence_id(recurring_id: str, index: int) -> str:
+    """Expense id of an occurrence; doubles as its idempotency key."""
+    return f"{recurring_id}-{index:05d}"
+
+def create_recurring_expense(recurring_data: RecurringExpenseCreate, created_by: str) -> RecurringExpenseInDB:
+    """Validates the template like a new expense (payer and participants must be members) and stores it."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    if recurring_data.end_at and recurring_data.end_at < recurring_data.start_at:
+        raise ValueError("end_at must not be before start_at.")
+    expense_service._validate_expense_data(ExpenseCreate(
+        description=recurring_data.description, amount=recurring_data.amount, payer_id=recurring_data.payer_id,
+        group_id=recurring_data.group_id, participants=recurring_data.participants))
+
+    recurring_dict = recurring_data.model_dump()
+    recurring_dict.update({
+        'created_by': created_by,
+        'created_at': datetime.utcnow(),
+        'active': True,
+        'next_index': 0,
+        'next_run_at': recurring_data.start_at,
+    })
+    if using_sqlite_backend():
+        recurring_id = get_store().add_recurring(recurring_dict)
+        return RecurringExpenseInDB(doc_id=recurring_id, **get_store().get_recurring(recurring_id))
+    _, doc_ref = recurring_ref().add(recurring_dict)
+    return RecurringExpenseInDB(doc_id=doc_ref.id, **doc_ref.get().to_dict())
+
+def get_recurring_expense(recurring_id: str) -> Optional[RecurringExpenseInDB]:
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    if using_sqlite_backend():
+        recurring = get_store().get_recurring(recurring_id)
+        return RecurringExpenseInDB(doc_id=recurring_id, **recurring) if recurring is not None else None
+    doc = recurring_ref().document(recurring_id).get()
+    return RecurringExpenseInDB(doc_id=doc.id, **doc.to_dict()) if doc.exists else None
+
+def get_group_recurring_expenses(group_id: str) -> List[RecurringExpenseInDB]:
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    if using_sqlite_backend():
+        return [RecurringExpenseInDB(doc_id=recurring_id, **data) for recurring_id, data in get_store().get_group_recurring(group_id)]
+    return [RecurringExpenseInDB(doc_id=doc.id, **doc.to_dict()) for doc in recurring_ref().where('group_id', '==', group_id).stream()]
+
+def delete_recurring_expense(recurring_id: str) -> bool:
+    """Stops a schedule. Occurrences already written stay as ordinary expenses."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    if using_sqlite_backend():
+        return get_store().delete_recurring(recurring_id)
+    doc_ref = recurring_ref().document(recurring_id)
+    if not doc_ref.get().exists:
+        return False
+    doc_ref.delete()
+    return True
+
+class SchedulerMetrics:
+    """Materialization counters of this process, for /metrics/recurring."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.templates = 0 # Templates advanced
+        self.occurrences = 0 # Expenses written
+        self.conflicts = 0 # Templates skipped because another scheduler got there first
+        self.retired = 0 # Templates removed (group deleted) or deactivated (payer or participant left)
+        self.errors = 0 # Failed runs
+        self.last_run_at: Optional[datetime] = None
+        self.last_run_seconds = 0.0
+        self.last_run_occurrences = 0
+        self.last_run_max_lag_seconds = 0.0 # How late the most overdue occurrence was written
+
+    def record_run(self, started_at: datetime, seconds: float, result: dict):
+        with self._lock:
+            self.runs += 1
+            self.templates += result['templates']
+            self.occurrences += result['occurrences']
+            self.conflicts += result['conflicts']
+            self.retired += result['removed'] + result['deactivated']
+            self.last_run_at = started_at
+            self.last_run_seconds = seconds
+            self.last_run_occurrences = result['occurrences']
+            self.last_run_max_lag_seconds = result['max_lag_seconds']
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'templates': self.templates,
+                'occurrences': self.occurrences,
+                'conflicts': self.conflicts,
+                'retired': self.retired,
+                'errors': self.errors,
+                'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+                'last_run_seconds': round(self.last_run_seconds, 4),
+                'last_run_occurrences': self.last_run_occurrences,
+                'last_run_occurrences_per_second': round(self.last_run_occurrences / self.last_run_seconds, 1) if self.last_run_seconds else None,
+                'last_run_max_lag_seconds': round(self.last_run_max_lag_seconds, 3),
+            }
+
+def _plan(recurring_id: str, template: dict, now: datetime, max_occurrences: int):
+    """Returns (occurrence writes, template update) for one due template."""
+    start_at, frequency, interval = as_utc(template['start_at']), template['frequency'], template.get('interval') or 1
+    end_at = as_utc(template['end_at']) if template.get('end_at') else None
+    index = template.get('next_index', 0)
+
+    occurrences = []
+    terms = search_service.search_terms(template['description'])
+    due = occurrence_at(start_at, frequency, interval, index)
+    while due <= now and (end_at is None or due <= end_at) and len(occurrences) < max_occurrences:
+        occurrences.append((occurrence_id(recurring_id, index), due, {
+            'description': template['description'],
+            'amount': template['amount'],
+            'payer_id': template['payer_id'],
+            'group_id': template['group_id'],
+            'participants': template['participants'],
+            'created_at': due, # Dated when due, also when written late
+            'recurring_id': recurring_id,
+            'search_terms': terms,
+        }))
+        index += 1
+        due = occurrence_at(start_at, frequency, interval, index)
+
+    update = {'next_index': index, 'next_run_at': due, 'last_materialized_at': now}
+    if end_at is not None and due > end_at:
+        update['active'] = False
+    return occurrences, update
+
+def _group_member_ids(group_id: str) -> Optional[Set[str]]:
+    """The group's member ids, or None if the group doesn't exist."""
+    access = repositories.groups().get_access(group_id)
+    return None if access is None else set(access[1])
+
+def _unplannable(template: dict, members_by_group: Dict[str, Optional[Set[str]]]) -> Optional[str]:
+    """
+    Why the template can't be materialized: 'group' when its group is gone, 'members' when its payer
+    or a participant left the group; None when it can. members_by_group caches lookups for one run.
+    """
+    group_id = template['group_id']
+    if group_id not in members_by_group:
+        members_by_group[group_id] = _group_member_ids(group_id)
+    member_ids = members_by_group[group_id]
+    if member_ids is None:
+        return 'group'
+    involved = {template['payer_id'], *(p['user_id'] for p in template['participants'])}
+    return None if involved <= member_ids else 'members'
+
+def materialize_due(now: Optional[datetime] = None, max_occurrences_per_template: Optional[int] = None) -> dict:
+    """
+    Writes every due occurrence of every active template, in chunked batches.
+    A template further behind than max_occurrences_per_template continues on the next run.
+    Templates of deleted groups are removed and templates involving former members deactivated,
+    without writing occurrences.
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    db = get_store()
+    now = as_utc(now or datetime.utcnow())
+    max_occurrences = max_occurrences_per_template or current_app.config.get('RECURRING_MAX_OCCURRENCES_PER_RUN', 100)
+    max_occurrences = min(max_occurrences, WRITES_PER_BATCH - 1) # A template's writes fit one batch (with its rollups, see below)
+
+    result = {'templates': 0, 'occurrences': 0, 'conflicts': 0, 'removed': 0, 'deactivated': 0, 'max_lag_seconds': 0.0}
+    written: List[tuple] = [] # (group_id, expense_id, data)
+    members_by_group: Dict[str, Optional[Set[str]]] = {}
+    last_conflict = [None]
+    pending: List[tuple] = [] # (template snapshot, occurrences, update, rollup increments)
+
+    def queue(batch, doc, occurrences, update, increments):
+        for expense_id, _, data in occurrences:
+            batch.set(expenses_ref().document(expense_id), data)
+        # The rollups count the occurrences in the same batch, so only when they are written
+        for reference, fields in increments:
+            batch.set(reference, fields, merge=True)
+        batch.update(doc.reference, update, option=db.write_option(last_update_time=doc.update_time))
+
+    def applied(items):
+        for item in items:
+            occurrences = item[1]
+            result['templates'] += 1
+            for expense_id, due, data in occurrences:
+                result['occurrences'] += 1
+                result['max_lag_seconds'] = max(result['max_lag_seconds'], (now - due).total_seconds())
+                written.append((data['group_id'], expense_id, data))
+
+    def flush():
+        if not pending:
+            return
+        batch = db.batch()
+        for item in pending:
+            queue(batch, *item)
+        try:
+            batch.commit()
+            applied(pending)
+        except Exception:
+            # One conflicting template fails the whole batch; redo them one by one
+            for item in pending:
+                single = db.batch()
+                queue(single, *item)
+                try:
+                    single.commit()
+                    applied([item])
+                except Exception as e:
+                    # Usually another scheduler advanced the template first; it is retried next run either way
+                    result['conflicts'] += 1
+                    last_conflict[0] = f"{item[0].id}: {e}"
+        pending.clear()
+
+    if using_sqlite_backend():
+        # One transaction per chunk of templates; a template advanced elsewhere is skipped, not retried
+        due_templates, deactivations = [], []
+        for recurring_id, template in get_store().get_due_recurring(now):
+            # Templates of deleted groups are gone with them (ON DELETE CASCADE); only former members remain to check
+            if _unplannable(template, members_by_group) is None:
+                due_templates.append((recurring_id, template))
+            else:
+                index = template.get('next_index', 0)
+                deactivations.append((recurring_id, index, [], {'next_index': index, 'next_run_at': template['next_run_at'],
+                                                                 'last_materialized_at': now, 'active': False}))
+        if deactivations:
+            done, skipped = get_store().materialize_recurring(deactivations)
+            result['deactivated'] += len(done)
+            result['conflicts'] += len(skipped)
+        for i in range(0, len(due_templates), WRITES_PER_BATCH):
+            plans = [(recurring_id, template.get('next_index', 0), *_plan(recurring_id, template, now, max_occurrences))
+                     for recurring_id, template in due_templates[i:i + WRITES_PER_BATCH]]
+            done, skipped = get_store().materialize_recurring(plans, rollups=analytics_service.rollup_deltas)
+            applied([plan[1:] for plan in done])
+            result['conflicts'] += len(skipped)
+            if skipped:
+                last_conflict[0] = f"{skipped[0][0]}: advanced by another scheduler"
+    else:
+        due_templates = recurring_ref().where('active', '==', True).where('next_run_at', '<=', now).stream()
+        pending_writes = 0
+        for doc in due_templates:
+            template = doc.to_dict()
+            reason = _unplannable(template, members_by_group)
+            if reason is not None:
+                # Rare: retired one at a time, on the same precondition as the batches
+                option = db.write_option(last_update_time=doc.update_time)
+                try:
+                    if reason == 'group':
+                        doc.reference.delete(option=option)
+                        result['removed'] += 1
+                    else:
+                        doc.reference.update({'active': False, 'last_materialized_at': now}, option=option)
+                        result['deactivated'] += 1
+                except Exception as e:
+                    result['conflicts'] += 1
+                    last_conflict[0] = f"{doc.id}: {e}"
+                continue
+            occurrences, update = _plan(doc.id, template, now, max_occurrences)
+            increments = analytics_service.rollup_increments((None, data) for _, _, data in occurrences)
+            while occurrences and len(occurrences) + len(increments) + 1 > WRITES_PER_BATCH:
+                # Many months of a large group: catch up over more runs so a template's writes fit one batch
+                occurrences, update = _plan(doc.id, template, now, len(occurrences) // 2)
+                increments = analytics_service.rollup_increments((None, data) for _, _, data in occurrences)
+            writes = len(occurrences) + len(increments) + 1
+            if pending_writes + writes > WRITES_PER_BATCH:
+                flush()
+                pending_writes = 0
+            pending.append((doc, occurrences, update, increments))
+            pending_writes += writes
+        flush()
+    if result['conflicts']:
+        print(f"Warning: Skipped {result['conflicts']} recurring expense(s) this run, e.g. {last_conflict[0]}")
+
+    # Cached responses go stale once per group (the SQLite store bumps the version as it writes);
+    # live subscribers see each new expense
+    if not using_sqlite_backend():
+        _stamp_occurrences(written)
+    for group_id, expense_id, data in written:
+        event_service.publish_expense_change(group_id, expense_id, None, data, dedupe_key=f"{expense_id}@created")
+    return result
+
+def _stamp_occurrences(written: List[tuple]):
+    """Stamps the occurrences written to each group with the group's next sync sequence."""
+    by_group = {}
+    for group_id, expense_id, _ in written:
+        by_group.setdefault(group_id, []).append(expenses_ref().document(expense_id))
+    for group_id, references in by_group.items():
+        for i in range(0, len(references), WRITES_PER_BATCH):
+            def stamp(transaction, seq, references=references[i:i + WRITES_PER_BATCH]):
+                # Occurrences deleted in the meantime are skipped
+                for doc in get_store().get_all(references, field_paths=[], transaction=transaction):
+                    if doc.exists:
+                        transaction.update(doc.reference, {'sync_seq': seq})
+                return True
+            try:
+                sync_service.commit_change(group_id, stamp)
+            except Exception as e:
+                # The occurrences are written; delta sync misses them until they are edited
+                print(f"Warning: Could not stamp recurring expenses of group {group_id} for delta sync: {e}")
+
+class RecurringScheduler:
+    """Background thread running materialize_due every interval seconds, in an app context."""
+
+    def __init__(self, app: Flask, interval: float):
+        self.app = app
+        self.interval = interval
+        self.metrics = SchedulerMetrics()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='recurring-scheduler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self) -> dict:
+        started_at, started = datetime.utcnow(), time.perf_counter()
+        with self.app.app_context():
+            result = materialize_due()
+        self.metrics.record_run(started_at, time.perf_counter() - started, result)
+        return result
+
+    def _run(self):
+        # Spread the workers' runs out instead of having all of them query at once
+        if self._stop.wait(random.uniform(0, self.interval)):
+            return
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.metrics.record_error()
+                print(f"Warning: Recurring expense run failed: {e}")
+            self._stop.wait(self.interval)
+
+_scheduler_instance: Optional[RecurringScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def _reset_after_fork():
+    # The scheduler thread doesn't survive a fork; workers start their own when opted in (gunicorn.conf.py)
+    global _scheduler_instance, _scheduler_lock
+    _scheduler_instance = None
+    _scheduler_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def start_scheduler(app: Flask) -> Optional[RecurringScheduler]:
+    """Starts this process's scheduler unless RECURRING_SCHEDULER_ENABLED is off; safe to call more than once."""
+    global _scheduler_instance
+    if not app.config.get('RECURRING_SCHEDULER_ENABLED', True):
+        return None
+    with _scheduler_lock:
+        if _scheduler_instance is None:
+            _scheduler_instance = RecurringScheduler(app, app.config.get('RECURRING_INTERVAL_SECONDS', 60))
+            _scheduler_instance.start()
+    return _scheduler_instance
+
+def get_scheduler() -> Optional[RecurringScheduler]:
+    return _scheduler_instance
@@ -0,0 +1,145 @@
+from __future__ import annotations
+from backend.firebase_db import as_utc, commit_in_batches, get_store, using_sqlite_backend
+from backend.models import ExpenseInDB, ExpenseSearchPage
+from backend.services import group_service
+from flask import current_app
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, List, Optional, Tuple
+import re
+import unicodedata
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference
+
+# Full-text search over expense descriptions.
+# Every expense document carries search_terms: the normalized words of its description (lower case,
+# accents removed) plus their prefixes, written by expense_service whenever the description is.
+# A search picks its most selective word, finds the candidates with one array_contains query per
+# 30 groups of the caller (newest first, at most SEARCH_MAX_CANDIDATES), keeps those where every
+# query word starts a word of the description, and ranks them: whole-word matches before prefix
+# matches, then newest first. Needs the composite index
+#   expenses: search_terms (array-contains), group_id, created_at (descending)
+#
+# On SQLite, an FTS5 table with prefix indexes over expenses.description, kept current by triggers,
+# answers the query and ranks with bm25 (see sqlite_db). Archived expenses aren't searchable.
+# Existing expenses get their search_terms from backend/maintenance/backfill_search_terms.py.
+
+expenses_ref: CollectionReference = lambda: get_store().collection('expenses')
+
+MIN_PREFIX = 2 # Shorter prefixes would match most expenses
+MAX_PREFIX = 12 # Longer query words are looked up by their first MAX_PREFIX characters, then checked in full
+MAX_QUERY_WORDS = 8
+_IN_LIMIT = 30 # Values per Firestore 'in' filter
+_WORD = re.compile(r"[^\W_]+") # Letters and digits, as SQLite's unicode61 tokenizer splits them
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lower-case words of text without accents, in order."""
+    if not text:
+        return []
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return _WORD.findall(text.lower())
+
+def search_terms(description: Optional[str]) -> List[str]:
+    """The index terms of a description: every word and its prefixes of MIN_PREFIX to MAX_PREFIX characters."""
+    terms = {}
+    for word in tokenize(description):
+        terms[word] = None
+        for length in range(MIN_PREFIX, min(len(word), MAX_PREFIX) + 1):
+            terms[word[:length]] = None
+    return list(terms)
+
+def _score(query_words: List[str], description_words: List[str]) -> int:
+    """2 per query word that is a whole word of the description, 1 per prefix; 0 if any query word doesn't match."""
+    words = set(description_words)
+    score = 0
+    for query_word in query_words:
+        if query_word in words:
+            score += 2
+        elif any(word.startswith(query_word) for word in words):
+            score += 1
+        else:
+            return 0
+    return score
+
+def _search_documents(query_words: List[str], group_ids: List[str], start: Optional[datetime], end: Optional[datetime],
+                      min_amount: Optional[float], max_amount: Optional[float], max_candidates: int) -> Tuple[List[Tuple[str, dict]], bool]:
+    """Ranked (expense id, document) matches in the groups, and whether every candidate was examined."""
+    # The longest word is usually the rarest, so its term narrows the candidates most
+    anchor = max(query_words, key=len)[:MAX_PREFIX]
+    ranked: List[Tuple[int, datetime, str, dict]] = []
+    complete = True
+    for i in range(0, len(group_ids), _IN_LIMIT):
+        query = expenses_ref().where('search_terms', 'array_contains', anchor).where('group_id', 'in', group_ids[i:i + _IN_LIMIT])
+        if start:
+            query = query.where('created_at', '>=', start)
+        if end:
+            query = query.where('created_at', '<', end)
+        docs = list(query.order_by('created_at', direction='DESCENDING').limit(max_candidates).stream())
+        complete = complete and len(docs) < max_candidates
+        for doc in docs:
+            data = doc.to_dict()
+            amount = data.get('amount') or 0.0
+            if (min_amount is not None and amount < min_amount) or (max_amount is not None and amount > max_amount):
+                continue
+            score = _score(query_words, tokenize(data.get('description')))
+            if score:
+                ranked.append((score, as_utc(data.get('created_at')) or datetime.min.replace(tzinfo=timezone.utc), doc.id, data))
+    ranked.sort(key=lambda item: (-item[0], -item[1].timestamp(), item[2]))
+    return [(expense_id, data) for _, _, expense_id, data in ranked], complete
+
+def search_expenses(user_id: str, q: str, group_id: Optional[str] = None,
+                    start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+                    limit: Optional[int] = None, offset: int = 0) -> ExpenseSearchPage:
+    """
+    Expenses of the user's groups (or of group_id, whose access the caller has checked) whose
+    description contains every word of q (as a word or word prefix), best matches first.
+    Optionally limited to created_at in [start, end) and amount in [min_amount, max_amount].
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    query_words = list(dict.fromkeys(tokenize(q)))[:MAX_QUERY_WORDS]
+    if not query_words:
+        raise ValueError("Search query must contain at least one word.")
+    config = current_app.config
+    limit = min(limit or config.get('SEARCH_PAGE_SIZE', 20), config.get('SEARCH_MAX_PAGE_SIZE', 100))
+    max_candidates = config.get('SEARCH_MAX_CANDIDATES', 1000)
+
+    if using_sqlite_backend():
+        matches, total, complete = get_store().search_expenses(
+            query_words, user_id=user_id, group_id=group_id, start=start, end=end,
+            min_amount=min_amount, max_amount=max_amount, limit=limit, offset=offset, max_matches=max_candidates)
+    else:
+        group_ids = [group_id] if group_id else group_service.get_user_group_ids(user_id)
+        ranked, complete = _search_documents(query_words, group_ids, start, end, min_amount, max_amount, max_candidates) if group_ids else ([], True)
+        matches, total = ranked[offset:offset + limit], len(ranked)
+
+    return ExpenseSearchPage(
+        expenses=[ExpenseInDB(doc_id=expense_id, **data) for expense_id, data in matches],
+        total=total, complete=complete, offset=offset,
+        next_offset=offset + limit if offset + limit < total else None,
+    )
+
+def backfill_search_terms(group_id: str) -> dict:
+    """Writes search_terms on the group's expenses that lack them or have stale ones; safe to re-run."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+    if using_sqlite_backend():
+        return {'group_id': group_id, 'updated': 0} # The FTS triggers index every write; see rebuild_search_index()
+
+    def updates():
+        for doc in expenses_ref().where('group_id', '==', group_id).select(['description', 'search_terms']).stream():
+            data = doc.to_dict()
+            terms = search_terms(data.get('description'))
+            if data.get('search_terms') != terms:
+                yield 'update', (doc.reference, {'search_terms': terms})
+
+    updated = commit_in_batches(updates())
+    return {'group_id': group_id, 'updated': updated}
+
+def rebuild_search_index() -> bool:
+    """Rebuilds the SQLite full-text index from the expenses table (after a VACUUM). False on other backends."""
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+    if not using_sqlite_backend():
+        return False
+    get_store().rebuild_search_index()
+    return True
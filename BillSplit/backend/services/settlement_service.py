@@ -1,86 +1,115 @@
-from backend.firebase_db import get_firestore_db
-from backend.models import SettlementResult, SettlementTransaction, UserInDB, ExpenseInDB
-from firebase_admin.firestore import CollectionReference
-from typing import Dict, List, Tuple
+from __future__ import annotations
+from backend.firebase_db import get_store, using_sqlite_backend
+from backend.models import SettlementResult, SettlementTransaction
+from backend.services import archive_service
+from backend.services.projections import DOCUMENT_ID, SETTLEMENT_EXPENSE, USER_NAME
+from backend.services.expense_records import ExpenseColumns
+from typing import TYPE_CHECKING, Dict, List, Tuple
 import math
 
-expenses_ref: CollectionReference = lambda: get_firestore_db().collection('expenses')
-groups_ref: CollectionReference = lambda: get_firestore_db().collection('groups')
-users_ref: CollectionReference = lambda: get_firestore_db().collection('users')
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference
 
-def calculate_settlements(group_id: str) -> SettlementResult:
+expenses_ref: CollectionReference = lambda: get_store().collection('expenses')
+groups_ref: CollectionReference = lambda: get_store().collection('groups')
+users_ref: CollectionReference = lambda: get_store().collection('users')
+
+def expense_shares(expense_data: dict) -> Dict[str, float]:
     """
-    Calculates the minimum number of transactions to settle debts within a group.
+    Returns what each participant of a single stored expense owes: the explicit share, or an
+    equal part of what the explicit shares leave, as in calculate_settlements.
     """
-    if not get_firestore_db(): raise ConnectionError("Firestore not initialized.")
-
-    group_doc = groups_ref.document(group_id).get()
-    if not group_doc.exists:
-        raise ValueError(f"Group with ID {group_id} not found.")
-
-    # 1. Get all members of the group
-    members_snapshot = groups_ref.document(group_id).collection('members').stream()
-    member_ids = [doc.id for doc in members_snapshot]
-    if not member_ids:
-        return SettlementResult(balances={}, transactions=[])
-
-    # Fetch user details for names later
-    user_docs = users_ref.where('__name__', 'in', member_ids).get()
-    users_map: Dict[str, UserInDB] = {doc.id: UserInDB(doc_id=doc.id, **doc.to_dict()) for doc in user_docs}
-
-    # Initialize balances for all members to 0
-    balances: Dict[str, float] = {member_id: 0.0 for member_id in member_ids}
-
-    # 2. Get all expenses for the group
-    expenses_snapshot = expenses_ref.where('group_id', '==', group_id).stream()
-
-    for exp_doc in expenses_snapshot:
-        expense = ExpenseInDB(doc_id=exp_doc.id, **exp_doc.to_dict())
+    shares: Dict[str, float] = {}
+    amount = expense_data.get('amount') or 0.0
+    participants = expense_data.get('participants') or []
+    if not participants:
+        return shares
+
+    total_explicit_share_amount = sum(p['share_amount'] for p in participants if p.get('share_amount') is not None)
+    num_implicit_participants = sum(1 for p in participants if p.get('share_amount') is None)
+    implicit_share_per_person = 0.0
+    if num_implicit_participants > 0:
+        implicit_share_per_person = (amount - total_explicit_share_amount) / num_implicit_participants
+
+    for participant in participants:
+        share = participant['share_amount'] if participant.get('share_amount') is not None else implicit_share_per_person
+        shares[participant['user_id']] = shares.get(participant['user_id'], 0.0) + share
+    return shares
+
+def expense_balance_deltas(expense_data: dict) -> Dict[str, float]:
+    """
+    Returns how a single stored expense moves each user's balance
+    (payer +amount, each participant -share), using the same split rules as calculate_settlements.
+    """
+    deltas: Dict[str, float] = {}
+    payer_id = expense_data.get('payer_id')
+    if payer_id:
+        deltas[payer_id] = expense_data.get('amount') or 0.0
+    for user_id, share in expense_shares(expense_data).items():
+        deltas[user_id] = deltas.get(user_id, 0.0) - share
+    return deltas
+
+def accumulate_balances(columns: ExpenseColumns, num_members: int) -> Dict[str, float]:
+    """
+    Sums each member's balance over columnar expenses (paid minus owed).
+    The first num_members interned users of the columns are the group's members;
+    expenses paid by, and shares owed by, anyone else are skipped.
+    """
+    user_ids = columns.user_ids
+    expense_ids = columns.expense_ids
+    payer, amount, offsets, participant, share = columns.payer, columns.amount, columns.offsets, columns.participant, columns.share
+    totals = [0.0] * len(user_ids)
 
+    for i in range(len(expense_ids)):
+        payer_index = payer[i]
         # Ensure payer is a valid member
-        if expense.payer_id not in balances:
-            print(f"Warning: Payer {expense.payer_id} for expense {expense.id} is not a valid group member. Skipping.")
+        if payer_index >= num_members:
+            print(f"Warning: Payer {user_ids[payer_index]} for expense {expense_ids[i]} is not a valid group member. Skipping.")
             continue
 
-        # Add the amount paid by the payer
-        balances[expense.payer_id] += expense.amount
+        expense_amount = amount[i]
+        totals[payer_index] += expense_amount # Add the amount paid by the payer
 
-        # Calculate share for each participant
-        num_participants = len(expense.participants)
-        if num_participants == 0:
+        start, end = offsets[i], offsets[i + 1]
+        if start == end:
             continue # No one to split with, payer gets full amount back from no one
 
-        # If any participant has a specific share_amount, use that.
-        # Otherwise, divide evenly among participants.
-        total_explicit_share_amount = sum(p.share_amount for p in expense.participants if p.share_amount is not None)
-        num_implicit_participants = sum(1 for p in expense.participants if p.share_amount is None)
+        # Explicit shares are used as-is, the remainder is divided evenly among the others
+        total_explicit_share_amount = 0.0
+        num_implicit_participants = 0
+        for j in range(start, end):
+            share_amount = share[j]
+            if share_amount != share_amount: # NaN: no explicit share
+                num_implicit_participants += 1
+            else:
+                total_explicit_share_amount += share_amount
 
-        if total_explicit_share_amount > expense.amount:
-             # This means explicit shares exceed total amount. Handle as an error or adjust.
-             # For simplicity, we'll just log and continue, or raise an error in a real app.
-             print(f"Warning: Explicit participant shares for expense {expense.id} exceed total amount. Adjusting.")
-             # Optionally, proportionally scale down explicit shares, or redistribute remaining.
-             pass # For now, let's assume valid data for this simple calc.
+        if total_explicit_share_amount > expense_amount:
+            print(f"Warning: Explicit participant shares for expense {expense_ids[i]} exceed total amount. Adjusting.")
 
-        remaining_amount_for_implicit = expense.amount - total_explicit_share_amount
         implicit_share_per_person = 0.0
         if num_implicit_participants > 0:
-            implicit_share_per_person = remaining_amount_for_implicit / num_implicit_participants
+            implicit_share_per_person = (expense_amount - total_explicit_share_amount) / num_implicit_participants
 
-        for participant in expense.participants:
-            # Ensure participant is a valid member
-            if participant.user_id not in balances:
-                print(f"Warning: Participant {participant.user_id} for expense {expense.id} is not a valid group member. Skipping.")
+        for j in range(start, end):
+            participant_index = participant[j]
+            if participant_index >= num_members:
+                print(f"Warning: Participant {user_ids[participant_index]} for expense {expense_ids[i]} is not a valid group member. Skipping.")
                 continue
+            share_amount = share[j]
+            totals[participant_index] -= implicit_share_per_person if share_amount != share_amount else share_amount
 
-            share = participant.share_amount if participant.share_amount is not None else implicit_share_per_person
-            balances[participant.user_id] -= share # Each participant owes their share
+    return {user_ids[i]: totals[i] for i in range(num_members)}
 
-    # Round balances to avoid floating point inaccuracies
-    for user_id in balances:
-        balances[user_id] = round(balances[user_id], 2)
+def round_balances(balances: Dict[str, float]) -> Dict[str, float]:
+    """Rounds balances to cents to avoid floating point inaccuracies."""
+    return {user_id: round(balance, 2) for user_id, balance in balances.items()}
 
-    # 3. Simplify transactions (Min-cash-flow algorithm)
+def simplify_debts(balances: Dict[str, float], user_names: Dict[str, str]) -> List[SettlementTransaction]:
+    """
+    Turns rounded balances into settlement transactions (greedy min-cash-flow:
+    the largest debtor pays the largest creditor until one of them is settled).
+    """
     transactions: List[SettlementTransaction] = []
 
     # Filter out users with zero balance and separate debtors/creditors
@@ -101,8 +130,8 @@ def calculate_settlements(group_id: str) -> SettlementResult:
             payer_id=debtor_id,
             receiver_id=creditor_id,
             amount=round(settle_amount, 2),
-            payer_name=users_map.get(debtor_id, UserInDB(id=debtor_id, username=f"User {debtor_id}", email="")).username, # Fallback name
-            receiver_name=users_map.get(creditor_id, UserInDB(id=creditor_id, username=f"User {creditor_id}", email="")).username
+            payer_name=user_names.get(debtor_id) or f"User {debtor_id}", # Fallback name
+            receiver_name=user_names.get(creditor_id) or f"User {creditor_id}"
         ))
 
         # Update balances
@@ -115,4 +144,64 @@ def calculate_settlements(group_id: str) -> SettlementResult:
         if round(creditors[0][1], 2) <= 0:
             creditors.pop(0)
 
+    return transactions
+
+def calculate_settlements(group_id: str) -> SettlementResult:
+    """
+    Calculates the minimum number of transactions to settle debts within a group.
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    if using_sqlite_backend():
+        # Balances are summed by the database (see sqlite_db), only one row per member comes back
+        balances = get_store().group_balances(group_id)
+        if balances is None:
+            raise ValueError(f"Group with ID {group_id} not found.")
+        if not balances:
+            return SettlementResult(balances={}, transactions=[])
+        balances = round_balances(balances)
+        user_names = get_store().get_usernames(balances)
+        return SettlementResult(balances=balances, transactions=simplify_debts(balances, user_names))
+
+    if not DOCUMENT_ID.exists(groups_ref().document(group_id)):
+        raise ValueError(f"Group with ID {group_id} not found.")
+
+    # 1. Get all members of the group
+    member_ids = DOCUMENT_ID.ids(groups_ref().document(group_id).collection('members'))
+    if not member_ids:
+        return SettlementResult(balances={}, transactions=[])
+
+    # Fetch user names for later (one batched read of just the username field)
+    user_docs = USER_NAME.get_all([users_ref().document(member_id) for member_id in member_ids])
+    user_names: Dict[str, str] = {user_id: user.get('username') for user_id, user in user_docs}
+
+    # 2. Get all expenses for the group, only the fields balances need, straight into compact columns
+    live_documents = list(SETTLEMENT_EXPENSE.stream(expenses_ref().where('group_id', '==', group_id)))
+    live_ids = {doc_id for doc_id, _ in live_documents}
+    columns = ExpenseColumns(member_ids)
+
+    # Archived months are one document each. Their precomputed deltas are used as-is when everyone
+    # involved is still a member and none of their expenses also has a (newer) live copy;
+    # otherwise their records are accumulated like live expenses.
+    member_set = set(member_ids)
+    archived_deltas: Dict[str, float] = {}
+    for archive in archive_service.get_group_archives(group_id):
+        if member_set.issuperset(archive.get('users') or ()) and live_ids.isdisjoint(archive.get('expenses') or ()):
+            for user_id, delta in (archive.get('balance_deltas') or {}).items():
+                archived_deltas[user_id] = archived_deltas.get(user_id, 0.0) + delta
+        else:
+            for expense_id, data in archive_service.iter_archived_documents([archive], group_id, exclude=live_ids):
+                columns.append(expense_id, data)
+
+    for doc_id, data in live_documents:
+        columns.append(doc_id, data)
+    balances: Dict[str, float] = accumulate_balances(columns, len(member_ids))
+    for user_id, delta in archived_deltas.items():
+        balances[user_id] += delta
+
+    balances = round_balances(balances)
+
+    # 3. Simplify transactions (Min-cash-flow algorithm)
+    transactions = simplify_debts(balances, user_names)
+
     return SettlementResult(balances=balances, transactions=transactions)
\ No newline at end of file
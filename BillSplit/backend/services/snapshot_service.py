@@ -0,0 +1,201 @@
+from __future__ import annotations
+from backend.columnar import Table, to_micros, write_table
+from backend.firebase_db import get_store, using_sqlite_backend
+from backend.models import ExpenseInDB, GroupChanges
+from backend.services import sync_service
+from backend.services.settlement_service import expense_shares
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+import json
+import os
+import shutil
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference
+
+# Analytics snapshot: users, groups, memberships and expenses (one row per participant too) as
+# columnar files (see columnar.py) that backend/snapshot_query.py memory-maps for scans and
+# aggregations, so analytics never query the serving database. Written by
+# backend/maintenance/snapshot_analytics.py, off the request path.
+#
+# A directory holds one run per snapshot plus manifest.json naming the current one:
+#   {format, run_id, created_at, tables: {name: rows}, groups: {group_id: cursor}}
+# Runs are incremental: groups whose version still equals their cursor are copied from the
+# previous run, the others are read through delta sync (sync_service.get_changes) from their
+# cursor. Groups whose cursor fell behind the tombstone retention window, new groups and --full
+# runs are read whole. The users table is rebuilt on every run: users have no version to sync
+# from, and reading three fields per user is cheap next to the expenses, so renames show up too. Each run writes a new run
+# directory and then replaces the manifest, so readers see either snapshot, never a mix. Don't run
+# two snapshots of one directory at once.
+
+groups_ref: CollectionReference = lambda: get_store().collection('groups')
+users_ref: CollectionReference = lambda: get_store().collection('users')
+
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+
+USERS = [('user_id', 'str'), ('username', 'str'), ('created_at', 'i64')] # No email: keep contact data out of analytics
+GROUPS = [('group_id', 'str'), ('name', 'str'), ('owner_id', 'str'), ('created_at', 'i64')]
+MEMBERSHIPS = [('group_id', 'str'), ('user_id', 'str')]
+EXPENSES = [('expense_id', 'str'), ('group_id', 'str'), ('payer_id', 'str'), ('amount', 'f64'), ('created_at', 'i64'),
+            ('split_type', 'str'), ('participant_count', 'i32'), ('description', 'str')]
+EXPENSE_PARTICIPANTS = [('expense_id', 'str'), ('group_id', 'str'), ('user_id', 'str'), ('share', 'f64'),
+                        ('explicit', 'i8'), ('created_at', 'i64')]
+
+class _GroupRows:
+    """One group's rows: the group row, its member ids and its expenses with their participant rows."""
+
+    def __init__(self):
+        self.group: Optional[tuple] = None
+        self.members: Set[str] = set()
+        self.expenses: Dict[str, Tuple[tuple, List[tuple]]] = {}
+
+def read_manifest(directory: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _split_type(expense: ExpenseInDB) -> str:
+    explicit = sum(1 for p in expense.participants if p.share_amount is not None)
+    if explicit == 0:
+        return 'equal'
+    return 'exact' if explicit == len(expense.participants) else 'mixed'
+
+def _expense_rows(expense: ExpenseInDB) -> Tuple[tuple, List[tuple]]:
+    created_at = to_micros(expense.created_at)
+    row = (expense.id, expense.group_id, expense.payer_id, expense.amount, created_at,
+           _split_type(expense), len(expense.participants), expense.description)
+    explicit = {p.user_id for p in expense.participants if p.share_amount is not None}
+    shares = expense_shares(expense.model_dump())
+    participants = [(expense.id, expense.group_id, user_id, share, int(user_id in explicit), created_at)
+                    for user_id, share in shares.items()]
+    return row, participants
+
+def _load_previous(directory: str, manifest: dict) -> Dict[str, _GroupRows]:
+    """The previous run's rows by group."""
+    run = os.path.join(directory, manifest['run_id'])
+    tables = {name: Table(os.path.join(run, name)) for name in manifest['tables'] if name != 'users'}
+    try:
+        groups: Dict[str, _GroupRows] = {}
+        for row in tables['groups'].read_rows():
+            groups.setdefault(row[0], _GroupRows()).group = row
+        for group_id, user_id in tables['memberships'].read_rows():
+            groups.setdefault(group_id, _GroupRows()).members.add(user_id)
+        participants: Dict[str, List[tuple]] = {}
+        for row in tables['expense_participants'].read_rows():
+            participants.setdefault(row[0], []).append(row)
+        for row in tables['expenses'].read_rows():
+            groups.setdefault(row[1], _GroupRows()).expenses[row[0]] = (row, participants.get(row[0], []))
+    finally:
+        for table in tables.values():
+            table.close()
+    return groups
+
+def _group_versions() -> Dict[str, int]:
+    if using_sqlite_backend():
+        return get_store().get_group_versions()
+    return {doc.id: (doc.to_dict() or {}).get('version') or 0 for doc in groups_ref().select(['version']).stream()}
+
+def _user_rows() -> List[tuple]:
+    if using_sqlite_backend():
+        rows = get_store().get_user_profiles()
+    else:
+        rows = [(doc.id, data.get('username'), data.get('created_at'))
+                for doc in users_ref().select(['username', 'created_at']).stream() for data in [doc.to_dict()]]
+    return [(user_id, username, to_micros(created_at)) for user_id, username, created_at in rows]
+
+def _apply(rows: _GroupRows, changes: GroupChanges):
+    if changes.full:
+        rows.members = set()
+        rows.expenses = {}
+    if changes.group is not None:
+        group = changes.group
+        rows.group = (changes.group_id, group.name, group.owner_id, to_micros(group.created_at))
+    rows.members.update(changes.member_ids)
+    rows.members.difference_update(changes.removed_member_ids)
+    for expense in changes.expenses: # Upserts before deletions
+        rows.expenses[expense.id] = _expense_rows(expense)
+    for expense_id in changes.deleted_expense_ids:
+        rows.expenses.pop(expense_id, None)
+
+def take_snapshot(directory: str, full: bool = False) -> dict:
+    """
+    Writes a new snapshot run into directory, incrementally from the current one unless full or
+    there is none, makes it current and removes older runs. Returns what it did.
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    started = datetime.utcnow()
+    manifest = None if full else read_manifest(directory)
+    if manifest is not None and manifest.get('format') != FORMAT_VERSION:
+        manifest = None # Written by another version: start over
+    if manifest is not None:
+        groups = _load_previous(directory, manifest)
+        cursors: Dict[str, int] = manifest['groups']
+    else:
+        groups, cursors = {}, {}
+
+    summary = {'incremental': manifest is not None, 'groups_read': 0, 'groups_read_in_full': 0, 'groups_deleted': 0,
+               'expenses_upserted': 0, 'expenses_deleted': 0, 'users_read': 0}
+    versions = _group_versions()
+    for group_id in [group_id for group_id in groups if group_id not in versions]:
+        del groups[group_id]
+        summary['groups_deleted'] += 1
+    new_cursors: Dict[str, int] = {}
+    for group_id, version in versions.items():
+        since = cursors.get(group_id) if group_id in groups else None
+        if since == version:
+            new_cursors[group_id] = since
+            continue
+        try:
+            changes = sync_service.get_changes(group_id, since)
+        except sync_service.ResyncRequired:
+            changes = sync_service.get_changes(group_id, None)
+        if changes is None: # Deleted since the versions were listed
+            if groups.pop(group_id, None) is not None:
+                summary['groups_deleted'] += 1
+            continue
+        _apply(groups.setdefault(group_id, _GroupRows()), changes)
+        new_cursors[group_id] = int(changes.cursor)
+        summary['groups_read'] += 1
+        summary['groups_read_in_full'] += changes.full
+        summary['expenses_upserted'] += len(changes.expenses)
+        summary['expenses_deleted'] += len(changes.deleted_expense_ids)
+
+    users = _user_rows()
+    summary['users_read'] = len(users)
+
+    live = [rows for rows in groups.values() if rows.group is not None]
+    expenses = [expense for rows in live for expense in rows.expenses.values()]
+    tables = {
+        'users': (USERS, sorted(users, key=lambda row: (row[2], row[0]))),
+        'groups': (GROUPS, sorted(rows.group for rows in live)),
+        'memberships': (MEMBERSHIPS, sorted((rows.group[0], user_id) for rows in live for user_id in rows.members)),
+        'expenses': (EXPENSES, sorted((row for row, _ in expenses), key=lambda row: (row[4], row[0]))),
+        'expense_participants': (EXPENSE_PARTICIPANTS,
+                                 sorted((p for _, participants in expenses for p in participants), key=lambda row: (row[5], row[0], row[2]))),
+    }
+
+    run_id = started.strftime('%Y%m%dT%H%M%S%f')
+    run = os.path.join(directory, run_id)
+    os.makedirs(run)
+    counts = {name: write_table(os.path.join(run, name), schema, rows) for name, (schema, rows) in tables.items()}
+    new_manifest = {
+        'format': FORMAT_VERSION,
+        'run_id': run_id,
+        'created_at': started.isoformat(),
+        'tables': counts,
+        'groups': new_cursors,
+    }
+    temporary = os.path.join(directory, f".{MANIFEST}.tmp")
+    with open(temporary, 'w') as f:
+        json.dump(new_manifest, f)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+    for name in os.listdir(directory):
+        # Readers that still have an older run mapped keep reading it until they close it
+        if name != run_id and name[:8].isdigit() and os.path.isdir(os.path.join(directory, name)):
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    summary.update(run_id=run_id, tables=counts)
+    return summary
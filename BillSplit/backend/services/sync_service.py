@@ -0,0 +1,156 @@
+from __future__ import annotations
+from backend.firebase_db import get_store, run_transaction, using_sqlite_backend
+from backend.models import ExpenseInDB, GroupChanges, GroupInDB
+from backend.services import export_service
+from flask import current_app
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    from firebase_admin.firestore import CollectionReference
+
+# Delta sync: GET /api/groups/<id>/changes?since=<cursor> answers with what changed in the group
+# since the client's cursor instead of the whole group.
+#
+# The group's version is the sequence. Every change a client syncs (an expense created, updated or
+# deleted, a member added or removed, the group renamed) runs in a transaction that reads the
+# version, writes the change stamped with sync_seq = version + 1 and stores that as the new version.
+# A version a reader sees therefore covers every change up to it, and the version is the cursor.
+# Deleted expenses and removed members leave a tombstone with the sequence of the delete:
+#   groups/{group_id}/tombstones/{kind}_{id}   {kind: 'expense' | 'member', item_id, seq, deleted_at}
+# (the tombstones table on SQLite). Needs the composite index
+#   expenses: group_id, sync_seq
+#
+# Tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS are purged by backend/maintenance/purge_tombstones.py
+# (not by the deletes themselves, which stay one transaction), and the group's sync_horizon
+# records the highest sequence purged: a cursor below it may have missed deletes, so the client
+# gets ResyncRequired (410) and starts over without since. Documents written before delta sync
+# existed have no sync_seq and only come with a full sync.
+
+groups_ref: CollectionReference = lambda: get_store().collection('groups')
+expenses_ref: CollectionReference = lambda: get_store().collection('expenses')
+tombstones_ref: CollectionReference = lambda group_id: groups_ref().document(group_id).collection('tombstones')
+
+PURGE_BATCH = 100 # Expired tombstones removed per purge call
+
+class ResyncRequired(Exception):
+    """The cursor is older than the tombstone retention window (or from another history); sync without since."""
+
+def tombstone_id(kind: str, item_id: str) -> str:
+    return f"{kind}_{item_id}"
+
+def tombstone(kind: str, item_id: str, seq: int) -> dict:
+    return {'kind': kind, 'item_id': item_id, 'seq': seq, 'deleted_at': datetime.utcnow()}
+
+def commit_change(group_id: str, write: Callable, group_fields: Optional[dict] = None):
+    """
+    Runs write(transaction, seq) in a transaction that advances the group's version to seq; the
+    writes it makes should carry sync_seq = seq. write reads (through the transaction) before it
+    writes, and returns None when it decided not to write, which leaves the version alone.
+    group_fields are set on the group document along with the version (and sync_seq).
+    Returns write's result, or None if the group doesn't exist.
+    """
+    def change(transaction, group_id):
+        group_ref = groups_ref().document(group_id)
+        group_doc = group_ref.get(['version'], transaction=transaction)
+        if not group_doc.exists:
+            return None
+        seq = (group_doc.to_dict().get('version') or 0) + 1
+        result = write(transaction, seq)
+        if result is None:
+            return None
+        fields = {'version': seq}
+        if group_fields:
+            fields.update(group_fields, sync_seq=seq)
+        transaction.update(group_ref, fields)
+        return result
+
+    return run_transaction(change, group_id)
+
+def purge_tombstones(group_id: str, now: Optional[datetime] = None) -> int:
+    """
+    Removes up to PURGE_BATCH of the group's tombstones older than the retention window, raising
+    the group's sync_horizon first so no client skips their deletes. Returns how many were removed.
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    cutoff = (now or datetime.utcnow()) - timedelta(days=current_app.config.get('SYNC_TOMBSTONE_RETENTION_DAYS', 30))
+    if using_sqlite_backend():
+        return get_store().purge_tombstones(group_id, cutoff, PURGE_BATCH)
+
+    expired = list(tombstones_ref(group_id).where('deleted_at', '<', cutoff).limit(PURGE_BATCH).stream())
+    if not expired:
+        return 0
+    horizon = max(doc.to_dict().get('seq', 0) for doc in expired)
+
+    def raise_horizon(transaction, group_id):
+        group_ref = groups_ref().document(group_id)
+        group_doc = group_ref.get(['sync_horizon'], transaction=transaction)
+        if group_doc.exists and (group_doc.to_dict().get('sync_horizon') or 0) < horizon:
+            transaction.update(group_ref, {'sync_horizon': horizon})
+
+    run_transaction(raise_horizon, group_id)
+    batch = get_store().batch()
+    for doc in expired:
+        batch.delete(doc.reference)
+    batch.commit()
+    return len(expired)
+
+def parse_cursor(value: Optional[str]) -> Optional[int]:
+    """The sequence in a cursor string; raises ValueError if it isn't one."""
+    if value is None or value == '':
+        return None
+    seq = int(value)
+    if seq < 0:
+        raise ValueError("Cursor must not be negative.")
+    return seq
+
+def _check_cursor(group: dict, since: Optional[int]):
+    if since is not None and not group.get('sync_horizon', 0) <= since <= group.get('version', 0):
+        raise ResyncRequired()
+
+def get_changes(group_id: str, since: Optional[int] = None) -> Optional[GroupChanges]:
+    """
+    The group's changes after sequence since, or the whole group when since is None. Apply the
+    upserts before the deletions. None if the group doesn't exist; raises ResyncRequired when the
+    cursor is behind the tombstone retention window or ahead of the group.
+    """
+    if not get_store(): raise ConnectionError("Firestore not initialized.")
+
+    if using_sqlite_backend():
+        changes = get_store().get_changes(group_id, since)
+        if changes is None:
+            return None
+        group, expenses, member_ids, tombstones = changes
+        _check_cursor(group, since)
+    else:
+        group_ref = groups_ref().document(group_id)
+        # The version is read first: every change up to it is written, later ones may show up too
+        group_doc = group_ref.get()
+        if not group_doc.exists:
+            return None
+        group = group_doc.to_dict()
+        _check_cursor(group, since)
+        if since is None:
+            expenses = list(export_service.iter_group_expenses(group_id))
+            member_ids = [doc.id for doc in group_ref.collection('members').select([]).stream()]
+            tombstones = []
+        else:
+            expenses = [(doc.id, doc.to_dict()) for doc in
+                        expenses_ref().where('group_id', '==', group_id).where('sync_seq', '>', since).stream()]
+            member_ids = [doc.id for doc in group_ref.collection('members').where('sync_seq', '>', since).select([]).stream()]
+            tombstones = [doc.to_dict() for doc in tombstones_ref(group_id).where('seq', '>', since).stream()]
+        if since is None or (group.get('sync_seq') or 0) > since:
+            group['members'] = member_ids if since is None else [doc.id for doc in group_ref.collection('members').select([]).stream()]
+
+    group_changed = since is None or (group.get('sync_seq') or 0) > since
+    return GroupChanges(
+        group_id=group_id,
+        cursor=str(group.get('version', 0)),
+        full=since is None,
+        group=GroupInDB(doc_id=group_id, **group) if group_changed else None,
+        expenses=[ExpenseInDB(doc_id=expense_id, **data) for expense_id, data in expenses],
+        deleted_expense_ids=sorted(t['item_id'] for t in tombstones if t['kind'] == 'expense'),
+        member_ids=member_ids,
+        removed_member_ids=sorted(t['item_id'] for t in tombstones if t['kind'] == 'member'),
+    )
@@ -0,0 +1,136 @@
+"""
+Ad-hoc queries over the analytics snapshot written by backend/maintenance/snapshot_analytics.py,
+without touching the API or the database. Tables are memory-mapped columns (see columnar.py):
+
+    users                 user_id, username, created_at
+    groups                group_id, name, owner_id, created_at
+    memberships           group_id, user_id
+    expenses              expense_id, group_id, payer_id, amount, created_at, split_type,
+                          participant_count, description
+    expense_participants  expense_id, group_id, user_id, share, explicit, created_at
+                          (one row per participant; share is what they owe)
+
+From Python:
+    with Snapshot('/tmp/billsplit-snapshot') as snapshot:
+        aggregate(snapshot.table('expenses'), 'payer_id', 'amount')
+
+From the shell (from the BillSplit directory):
+    python -m backend.snapshot_query --dir /tmp/billsplit-snapshot top-spenders --limit 20 --from 2026-01-01
+    python -m backend.snapshot_query --dir /tmp/billsplit-snapshot split-types
+    python -m backend.snapshot_query --dir /tmp/billsplit-snapshot aggregate expense_participants user_id share
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from backend.columnar import Table, to_micros
+
+MANIFEST = 'manifest.json'
+
+class Snapshot:
+    """The current snapshot in a directory; tables are opened on first use and stay valid until close()."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as f:
+            self.manifest: dict = json.load(f)
+        self._tables: Dict[str, Table] = {}
+
+    @property
+    def created_at(self) -> datetime:
+        return datetime.fromisoformat(self.manifest['created_at'])
+
+    def table(self, name: str) -> Table:
+        if name not in self._tables:
+            if name not in self.manifest['tables']:
+                raise KeyError(f"No table '{name}' in the snapshot.")
+            self._tables[name] = Table(os.path.join(self.directory, self.manifest['run_id'], name))
+        return self._tables[name]
+
+    def close(self):
+        for table in self._tables.values():
+            table.close()
+        self._tables.clear()
+
+    def __enter__(self) -> "Snapshot":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def aggregate(table: Table, by: str, value: Optional[str] = None,
+              start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[Optional[str], dict]:
+    """
+    Row count and (with value) sum of value per distinct value of the str column by, optionally
+    for created_at in [start, end). One pass over the mapped columns, accumulating by dictionary code.
+    """
+    codes = table.column(by)
+    keys = table.dictionary(by)
+    counts = [0] * (len(keys) + 1) # The last slot collects nulls
+    sums = [0.0] * (len(keys) + 1)
+    values = table.column(value) if value else None
+    if start is None and end is None:
+        rows = range(table.rows)
+    else:
+        low, high = to_micros(start) if start else -2**63, to_micros(end) if end else 2**63 - 1
+        created_at = table.column('created_at')
+        rows = (i for i in range(table.rows) if low <= created_at[i] < high)
+    for i in rows:
+        code = codes[i]
+        counts[code] += 1 # NULL_CODE (-1) indexes the last slot
+        if values is not None:
+            sums[code] += values[i]
+    result = {}
+    for code, count in enumerate(counts):
+        if count:
+            key = keys[code] if code < len(keys) else None
+            result[key] = {'count': count, 'sum': round(sums[code], 2)} if values is not None else {'count': count}
+    return result
+
+def _usernames(snapshot: Snapshot) -> Dict[str, Optional[str]]:
+    users = snapshot.table('users')
+    return dict(zip(users.values('user_id'), users.values('username')))
+
+def top_spenders(snapshot: Snapshot, limit: int = 10, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+    """Users who paid the most (sum of expense amounts as payer), with their expense counts."""
+    totals = aggregate(snapshot.table('expenses'), 'payer_id', 'amount', start, end)
+    names = _usernames(snapshot)
+    ranked = sorted(((user_id, total) for user_id, total in totals.items() if user_id is not None), key=lambda item: -item[1]['sum'])
+    return [{'user_id': user_id, 'username': names.get(user_id), 'paid': total['sum'], 'expenses': total['count']}
+            for user_id, total in ranked[:limit]]
+
+def split_type_distribution(snapshot: Snapshot, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, dict]:
+    """Expense count, amount and share of expenses per split type ('equal', 'exact', 'mixed')."""
+    totals = aggregate(snapshot.table('expenses'), 'split_type', 'amount', start, end)
+    expenses = sum(total['count'] for total in totals.values())
+    return {split_type: dict(total, fraction=round(total['count'] / expenses, 4)) for split_type, total in sorted(totals.items())}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dir', default=os.environ.get('ANALYTICS_SNAPSHOT_DIR', '/tmp/billsplit-snapshot'))
+    parser.add_argument('--from', dest='start', type=datetime.fromisoformat, help='created_at from (inclusive)')
+    parser.add_argument('--to', dest='end', type=datetime.fromisoformat, help='created_at until (exclusive)')
+    queries = parser.add_subparsers(dest='query', required=True)
+    spenders = queries.add_parser('top-spenders')
+    spenders.add_argument('--limit', type=int, default=10)
+    queries.add_parser('split-types')
+    generic = queries.add_parser('aggregate', help='count (and sum) per value of a str column')
+    generic.add_argument('table')
+    generic.add_argument('by')
+    generic.add_argument('value', nargs='?')
+    args = parser.parse_args()
+
+    with Snapshot(args.dir) as snapshot:
+        if args.query == 'top-spenders':
+            result = top_spenders(snapshot, args.limit, args.start, args.end)
+        elif args.query == 'split-types':
+            result = split_type_distribution(snapshot, args.start, args.end)
+        else:
+            result = aggregate(snapshot.table(args.table), args.by, args.value, args.start, args.end)
+        print(json.dumps({'snapshot': snapshot.manifest['created_at'], 'result': result}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
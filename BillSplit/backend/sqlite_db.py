@@ -0,0 +1,921 @@
+import json
+import os
+import random
+import sqlite3
+import string
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# SQLite storage for self-hosted deployments where Firestore isn't an option.
+# Selected with STORAGE_BACKEND=sqlite (see firebase_db.py). Users, groups and expenses are reached
+# through the Sqlite* repositories (see backend.repositories); the feature services branch on
+# using_sqlite_backend() and call the store methods below, returning the same models.
+#
+# The schema is normalized (users, groups, memberships, expenses, expense_participants, plus the
+# recurring expense templates) with an index for every lookup the services make, so nothing scans a
+# table. The database runs in WAL mode: readers never block the single writer and each other.
+# Every thread of every worker process gets its own connection, and sqlite3 keeps each connection's
+# prepared statements in a per-connection cache keyed by SQL text, which is why all statements are
+# module constants with ? parameters (id lists are passed as one JSON array and read with json_each).
+#
+# Datetimes are stored as naive UTC text of fixed width, so text order is time order, and are read
+# back as UTC-aware datetimes like Firestore's. Document dicts returned by the store have the same
+# fields as the Firestore documents (participants as a list of {'user_id', 'share_amount'}).
+
+_AUTO_ID_CHARS = string.ascii_letters + string.digits
+_UTC = timezone.utc
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    firebase_uid TEXT NOT NULL UNIQUE,
+    email TEXT,
+    username TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_created ON users (created_at);
+CREATE TABLE IF NOT EXISTS groups (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    owner_id TEXT NOT NULL REFERENCES users (id),
+    created_at TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    sync_seq INTEGER,
+    sync_horizon INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS memberships (
+    group_id TEXT NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+    user_id TEXT NOT NULL REFERENCES users (id),
+    added_at TEXT NOT NULL,
+    sync_seq INTEGER,
+    PRIMARY KEY (group_id, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS memberships_user ON memberships (user_id, group_id);
+CREATE TABLE IF NOT EXISTS expenses (
+    id TEXT PRIMARY KEY,
+    group_id TEXT NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+    description TEXT NOT NULL,
+    amount REAL NOT NULL,
+    payer_id TEXT NOT NULL REFERENCES users (id),
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    recurring_id TEXT,
+    sync_seq INTEGER
+);
+CREATE INDEX IF NOT EXISTS expenses_group_created ON expenses (group_id, created_at, id);
+CREATE INDEX IF NOT EXISTS expenses_group_payer_created ON expenses (group_id, payer_id, created_at);
+CREATE INDEX IF NOT EXISTS expenses_payer ON expenses (payer_id);
+CREATE TABLE IF NOT EXISTS expense_participants (
+    expense_id TEXT NOT NULL REFERENCES expenses (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    user_id TEXT NOT NULL REFERENCES users (id),
+    share_amount REAL,
+    PRIMARY KEY (expense_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS expense_participants_user ON expense_participants (user_id, expense_id);
+CREATE TABLE IF NOT EXISTS recurring_expenses (
+    id TEXT PRIMARY KEY,
+    group_id TEXT NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+    description TEXT NOT NULL,
+    amount REAL NOT NULL,
+    payer_id TEXT NOT NULL REFERENCES users (id),
+    participants TEXT NOT NULL,
+    frequency TEXT NOT NULL,
+    interval INTEGER NOT NULL,
+    start_at TEXT NOT NULL,
+    end_at TEXT,
+    created_by TEXT,
+    created_at TEXT NOT NULL,
+    active INTEGER NOT NULL,
+    next_index INTEGER NOT NULL,
+    next_run_at TEXT,
+    last_materialized_at TEXT
+);
+CREATE INDEX IF NOT EXISTS recurring_expenses_due ON recurring_expenses (active, next_run_at);
+CREATE INDEX IF NOT EXISTS recurring_expenses_group ON recurring_expenses (group_id);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    record TEXT NOT NULL,
+    expires_at TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires_at);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, status);
+CREATE TABLE IF NOT EXISTS group_month_rollups (
+    group_id TEXT NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+    month TEXT NOT NULL,
+    expense_count INTEGER NOT NULL,
+    total_amount REAL NOT NULL,
+    PRIMARY KEY (group_id, month)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS member_month_rollups (
+    group_id TEXT NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+    month TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    paid REAL NOT NULL,
+    owed REAL NOT NULL,
+    expense_count INTEGER NOT NULL,
+    PRIMARY KEY (group_id, month, user_id)
+) WITHOUT ROWID;
+"""
+
+# Full-text index of expenses (FTS5 over expenses.description and group_id, rowids shared with expenses),
+# with prefix indexes for 2 to 4 characters; the triggers keep it current on every write, including
+# the deletes cascaded from groups. group_id is indexed so a search intersects the words with the
+# caller's groups inside the index: a common word then costs about as much as the caller's groups
+# hold, not every expense containing it. VACUUM can renumber the rowids of expenses, so run
+# backend/maintenance/backfill_search_terms.py (which rebuilds the index on SQLite) after one.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS expense_search USING fts5 (
+    description, group_id, content='expenses', prefix='2 3 4', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS expenses_search_insert AFTER INSERT ON expenses BEGIN
+    INSERT INTO expense_search (rowid, description, group_id) VALUES (new.rowid, new.description, new.group_id);
+END;
+CREATE TRIGGER IF NOT EXISTS expenses_search_delete AFTER DELETE ON expenses BEGIN
+    INSERT INTO expense_search (expense_search, rowid, description, group_id) VALUES ('delete', old.rowid, old.description, old.group_id);
+END;
+CREATE TRIGGER IF NOT EXISTS expenses_search_update AFTER UPDATE OF description, group_id ON expenses BEGIN
+    INSERT INTO expense_search (expense_search, rowid, description, group_id) VALUES ('delete', old.rowid, old.description, old.group_id);
+    INSERT INTO expense_search (rowid, description, group_id) VALUES (new.rowid, new.description, new.group_id);
+END;
+"""
+# Delta sync (see services/sync_service.py): the group's version is the sequence, and every synced
+# change stores the version it advanced the group to as its sync_seq, in the same transaction.
+# Deleted expenses and removed members leave a tombstone. The sync_seq columns are added to
+# databases created before delta sync by __init__, so their indexes are created after that.
+SYNC_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tombstones (
+    group_id TEXT NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    deleted_at TEXT NOT NULL,
+    PRIMARY KEY (group_id, kind, item_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tombstones_group_seq ON tombstones (group_id, seq);
+CREATE INDEX IF NOT EXISTS tombstones_group_deleted ON tombstones (group_id, deleted_at);
+CREATE INDEX IF NOT EXISTS expenses_group_sync ON expenses (group_id, sync_seq);
+"""
+_SYNC_COLUMNS = (
+    ('groups', 'sync_seq', 'INTEGER'),
+    ('groups', 'sync_horizon', 'INTEGER NOT NULL DEFAULT 0'),
+    ('memberships', 'sync_seq', 'INTEGER'),
+    ('expenses', 'sync_seq', 'INTEGER'),
+)
+
+_SELECT_SEARCH_INDEX_EXISTS = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'expense_search'"
+_REBUILD_SEARCH_INDEX = "INSERT INTO expense_search (expense_search) VALUES ('rebuild')"
+
+# Users
+_SELECT_USER = "SELECT firebase_uid, email, username, created_at FROM users WHERE id = ?"
+_SELECT_USER_BY_FIREBASE_UID = "SELECT id, firebase_uid, email, username, created_at FROM users WHERE firebase_uid = ?"
+_INSERT_USER = ("INSERT INTO users (id, firebase_uid, email, username, created_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (firebase_uid) DO NOTHING")
+_SELECT_USER_EXISTS = "SELECT 1 FROM users WHERE id = ?"
+_SELECT_USERNAMES = "SELECT id, username FROM users WHERE id IN (SELECT value FROM json_each(?))"
+_SELECT_USERS_BY_IDS = "SELECT id, email, username, created_at, firebase_uid FROM users WHERE id IN (SELECT value FROM json_each(?))"
+_SELECT_USER_IDS_BY_FIREBASE_UIDS = "SELECT id, firebase_uid FROM users WHERE firebase_uid IN (SELECT value FROM json_each(?))"
+_SELECT_USER_PROFILES = "SELECT id, username, created_at FROM users ORDER BY created_at"
+
+# Groups and memberships
+_SELECT_GROUP = "SELECT name, description, owner_id, created_at, version FROM groups WHERE id = ?"
+_SELECT_GROUP_EXISTS = "SELECT 1 FROM groups WHERE id = ?"
+_SELECT_GROUP_OWNER_VERSION = "SELECT owner_id, version FROM groups WHERE id = ?"
+_SELECT_GROUPS_BY_IDS = "SELECT id, name, description, owner_id, created_at, version FROM groups WHERE id IN (SELECT value FROM json_each(?))"
+_SELECT_MEMBERS_OF_GROUPS = ("SELECT group_id, user_id FROM memberships WHERE group_id IN (SELECT value FROM json_each(?)) "
+                             "ORDER BY group_id, user_id")
+_SELECT_MEMBER_IDS = "SELECT user_id FROM memberships WHERE group_id = ? ORDER BY user_id"
+_SELECT_USER_GROUPS = ("SELECT g.id, g.name, g.description, g.owner_id, g.created_at, g.version "
+                       "FROM memberships m JOIN groups g ON g.id = m.group_id WHERE m.user_id = ? ORDER BY g.id")
+_SELECT_GROUP_IDS = "SELECT id FROM groups ORDER BY id"
+_SELECT_GROUP_VERSIONS = "SELECT id, version FROM groups"
+_SELECT_USER_GROUP_IDS = "SELECT group_id FROM memberships WHERE user_id = ? ORDER BY group_id"
+_SELECT_USER_GROUPS_MEMBERS = ("SELECT group_id, user_id FROM memberships "
+                               "WHERE group_id IN (SELECT group_id FROM memberships WHERE user_id = ?) ORDER BY group_id, user_id")
+_SELECT_MEMBERSHIPS = ("SELECT u.id, m.user_id IS NOT NULL FROM users u "
+                       "LEFT JOIN memberships m ON m.group_id = ? AND m.user_id = u.id "
+                       "WHERE u.id IN (SELECT value FROM json_each(?))")
+_INSERT_GROUP = "INSERT INTO groups (id, name, description, owner_id, created_at, version) VALUES (?, ?, ?, ?, ?, 0)"
+_UPDATE_GROUP = ("UPDATE groups SET name = COALESCE(?, name), description = COALESCE(?, description), "
+                 "version = version + 1, sync_seq = version + 1 WHERE id = ?")
+_BUMP_GROUP_VERSION = "UPDATE groups SET version = version + 1 WHERE id = ?"
+_SELECT_GROUP_VERSION = "SELECT version FROM groups WHERE id = ?"
+_DELETE_GROUP = "DELETE FROM groups WHERE id = ?"
+_INSERT_MEMBERSHIP = "INSERT INTO memberships (group_id, user_id, added_at) VALUES (?, ?, ?) ON CONFLICT DO NOTHING"
+_ADD_MEMBERSHIP = ("INSERT INTO memberships (group_id, user_id, added_at, sync_seq) "
+                   "SELECT id, :user_id, :added_at, version + 1 FROM groups WHERE id = :group_id ON CONFLICT DO NOTHING")
+_DELETE_MEMBERSHIP = "DELETE FROM memberships WHERE group_id = ? AND user_id = ?"
+
+# Expenses
+_EXPENSE_COLUMNS = "e.id, e.description, e.amount, e.payer_id, e.group_id, e.created_at, e.recurring_id"
+_SELECT_EXPENSE = f"SELECT {_EXPENSE_COLUMNS} FROM expenses e WHERE e.id = ?"
+_SELECT_EXPENSE_PARTICIPANTS = "SELECT expense_id, user_id, share_amount FROM expense_participants WHERE expense_id = ? ORDER BY position"
+_SELECT_GROUP_EXPENSES = f"SELECT {_EXPENSE_COLUMNS} FROM expenses e WHERE e.group_id = ? ORDER BY e.id"
+_SELECT_GROUP_PARTICIPANTS = ("SELECT p.expense_id, p.user_id, p.share_amount FROM expenses e "
+                              "JOIN expense_participants p ON p.expense_id = e.id WHERE e.group_id = ? ORDER BY p.expense_id, p.position")
+# Expenses a user paid for or takes part in, through the payer and participant indexes
+_USER_EXPENSE_IDS = ("SELECT id FROM expenses WHERE payer_id = :user_id "
+                     "UNION SELECT expense_id FROM expense_participants WHERE user_id = :user_id")
+_SELECT_USER_EXPENSES = f"SELECT {_EXPENSE_COLUMNS} FROM expenses e WHERE e.id IN ({_USER_EXPENSE_IDS}) ORDER BY e.id"
+_SELECT_USER_PARTICIPANTS = ("SELECT expense_id, user_id, share_amount FROM expense_participants "
+                             f"WHERE expense_id IN ({_USER_EXPENSE_IDS}) ORDER BY expense_id, position")
+# Keyset pagination in (created_at, id) order for exports: the first page from an inclusive start, the next ones after the last row
+_SELECT_GROUP_EXPENSE_PAGE = (f"SELECT {_EXPENSE_COLUMNS} FROM expenses e WHERE e.group_id = ? AND (e.created_at, e.id) >= (?, ?) "
+                              "ORDER BY e.created_at, e.id LIMIT ?")
+_SELECT_GROUP_EXPENSE_PAGE_AFTER = (f"SELECT {_EXPENSE_COLUMNS} FROM expenses e WHERE e.group_id = ? AND (e.created_at, e.id) > (?, ?) "
+                                    "ORDER BY e.created_at, e.id LIMIT ?")
+_SELECT_PAGE_PARTICIPANTS = ("SELECT expense_id, user_id, share_amount FROM expense_participants "
+                             "WHERE expense_id IN (SELECT value FROM json_each(?)) ORDER BY expense_id, position")
+_SELECT_EXPENSES_BY_IDS = f"SELECT {_EXPENSE_COLUMNS} FROM expenses e WHERE e.id IN (SELECT value FROM json_each(?))"
+_INSERT_EXPENSE = ("INSERT INTO expenses (id, group_id, description, amount, payer_id, created_at, updated_at, recurring_id, sync_seq) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+_INSERT_EXPENSE_IF_MISSING = _INSERT_EXPENSE + " ON CONFLICT (id) DO NOTHING"
+_INSERT_PARTICIPANT = "INSERT INTO expense_participants (expense_id, position, user_id, share_amount) VALUES (?, ?, ?, ?)"
+_UPDATE_EXPENSE = ("UPDATE expenses SET description = ?, amount = ?, payer_id = ?, updated_at = ?, sync_seq = ? WHERE id = ?")
+_DELETE_EXPENSE_PARTICIPANTS = "DELETE FROM expense_participants WHERE expense_id = ?"
+_DELETE_EXPENSE = "DELETE FROM expenses WHERE id = ?"
+
+# Delta sync
+_SELECT_SYNC_GROUP = "SELECT name, description, owner_id, created_at, version, sync_seq, sync_horizon FROM groups WHERE id = ?"
+_SELECT_EXPENSES_SINCE = f"SELECT {_EXPENSE_COLUMNS} FROM expenses e WHERE e.group_id = ? AND e.sync_seq > ? ORDER BY e.id"
+_SELECT_MEMBER_IDS_SINCE = "SELECT user_id FROM memberships WHERE group_id = ? AND sync_seq > ? ORDER BY user_id"
+_SELECT_TOMBSTONES_SINCE = "SELECT kind, item_id FROM tombstones WHERE group_id = ? AND seq > ?"
+_SELECT_EXPIRED_TOMBSTONES = "SELECT kind, item_id, seq FROM tombstones WHERE group_id = ? AND deleted_at < ? ORDER BY deleted_at LIMIT ?"
+_UPSERT_TOMBSTONE = ("INSERT INTO tombstones (group_id, kind, item_id, seq, deleted_at) VALUES (?, ?, ?, ?, ?) "
+                     "ON CONFLICT (group_id, kind, item_id) DO UPDATE SET seq = excluded.seq, deleted_at = excluded.deleted_at")
+_DELETE_TOMBSTONE = "DELETE FROM tombstones WHERE group_id = ? AND kind = ? AND item_id = ?"
+_RAISE_SYNC_HORIZON = "UPDATE groups SET sync_horizon = MAX(sync_horizon, ?) WHERE id = ?"
+
+# Per-user balances of a group: payers are credited the amount, participants debited their explicit
+# share or an equal part of what the explicit shares leave. Expenses paid by non-members and shares
+# of non-members are left out, as in settlement_service.accumulate_balances. CROSS JOIN keeps SQLite's
+# join order, so participants are looked up by the group's expense ids instead of scanned.
+_SELECT_GROUP_BALANCES = """
+WITH group_expenses AS (
+    SELECT e.id, e.amount, e.payer_id FROM expenses e
+    JOIN memberships m ON m.group_id = e.group_id AND m.user_id = e.payer_id
+    WHERE e.group_id = :group_id
+),
+splits AS (
+    SELECT p.expense_id, COALESCE(SUM(p.share_amount), 0.0) AS explicit_total,
+           COUNT(*) - COUNT(p.share_amount) AS implicit_count
+    FROM group_expenses e CROSS JOIN expense_participants p ON p.expense_id = e.id
+    GROUP BY p.expense_id
+),
+deltas AS (
+    SELECT payer_id AS user_id, amount AS delta FROM group_expenses
+    UNION ALL
+    SELECT p.user_id, -COALESCE(p.share_amount, (e.amount - s.explicit_total) / s.implicit_count)
+    FROM group_expenses e
+    CROSS JOIN splits s ON s.expense_id = e.id
+    CROSS JOIN expense_participants p ON p.expense_id = e.id
+)
+SELECT m.user_id, COALESCE(SUM(d.delta), 0.0) FROM memberships m
+LEFT JOIN deltas d ON d.user_id = m.user_id
+WHERE m.group_id = :group_id
+GROUP BY m.user_id ORDER BY m.user_id
+"""
+
+# Spending analytics rollups (see analytics_service); upserts add to the stored figures
+_ADD_GROUP_ROLLUP = ("INSERT INTO group_month_rollups (group_id, month, expense_count, total_amount) VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT (group_id, month) DO UPDATE SET expense_count = expense_count + excluded.expense_count, "
+                     "total_amount = total_amount + excluded.total_amount")
+_ADD_MEMBER_ROLLUP = ("INSERT INTO member_month_rollups (group_id, month, user_id, paid, owed, expense_count) VALUES (?, ?, ?, ?, ?, ?) "
+                      "ON CONFLICT (group_id, month, user_id) DO UPDATE SET paid = paid + excluded.paid, "
+                      "owed = owed + excluded.owed, expense_count = expense_count + excluded.expense_count")
+_SELECT_GROUP_ROLLUPS = ("SELECT month, expense_count, total_amount FROM group_month_rollups "
+                         "WHERE group_id = ? AND month >= ? AND month <= ? ORDER BY month")
+_SELECT_MEMBER_ROLLUPS = ("SELECT month, user_id, paid, owed, expense_count FROM member_month_rollups "
+                          "WHERE group_id = ? AND month >= ? AND month <= ? ORDER BY month, user_id")
+_DELETE_GROUP_ROLLUPS = "DELETE FROM group_month_rollups WHERE group_id = ?"
+_DELETE_MEMBER_ROLLUPS = "DELETE FROM member_month_rollups WHERE group_id = ?"
+
+# Recurring expense templates
+_RECURRING_COLUMNS = ("id, group_id, description, amount, payer_id, participants, frequency, interval, start_at, end_at, "
+                      "created_by, created_at, active, next_index, next_run_at, last_materialized_at")
+_SELECT_RECURRING = f"SELECT {_RECURRING_COLUMNS} FROM recurring_expenses WHERE id = ?"
+_SELECT_GROUP_RECURRING = f"SELECT {_RECURRING_COLUMNS} FROM recurring_expenses WHERE group_id = ? ORDER BY id"
+_SELECT_DUE_RECURRING = f"SELECT {_RECURRING_COLUMNS} FROM recurring_expenses WHERE active = 1 AND next_run_at <= ? ORDER BY next_run_at"
+_INSERT_RECURRING = (f"INSERT INTO recurring_expenses ({_RECURRING_COLUMNS}) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+# Advances a template only if no other scheduler advanced it since it was read
+_ADVANCE_RECURRING = ("UPDATE recurring_expenses SET next_index = ?, next_run_at = ?, last_materialized_at = ?, active = ? "
+                      "WHERE id = ? AND next_index = ?")
+_DELETE_RECURRING = "DELETE FROM recurring_expenses WHERE id = ?"
+
+# Background job records (see services/job_service.py), kept whole as JSON
+_INSERT_JOB = "INSERT INTO jobs (id, user_id, status, record, expires_at) VALUES (?, ?, ?, ?, ?)"
+_SELECT_JOB = "SELECT record FROM jobs WHERE id = ?"
+_UPDATE_JOB = "UPDATE jobs SET status = ?, record = ?, expires_at = ? WHERE id = ?"
+_DELETE_EXPIRED_JOBS = "DELETE FROM jobs WHERE expires_at < ?"
+_COUNT_LIVE_USER_JOBS = ("SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status IN ('queued', 'running') "
+                         "AND json_extract(record, '$.heartbeat_at') >= ?")
+_JOB_TIME_FIELDS = ('created_at', 'started_at', 'finished_at', 'heartbeat_at', 'expires_at')
+
+# (before, after) expense documents -> (group, member) rollup deltas; see analytics_service.rollup_deltas
+RollupDeltas = Callable[[Optional[dict], Optional[dict]], Tuple[Dict[Tuple[str, str], list], Dict[Tuple[str, str, str], list]]]
+
+def _auto_id() -> str:
+    return ''.join(random.choices(_AUTO_ID_CHARS, k=20))
+
+def to_db_time(value: Optional[datetime]) -> Optional[str]:
+    """Naive UTC text of fixed width; naive datetimes are taken as UTC."""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(_UTC).replace(tzinfo=None)
+    return value.isoformat(sep=' ', timespec='microseconds')
+
+def from_db_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value).replace(tzinfo=_UTC) if value is not None else None
+
+def _fts_string(text: str) -> str:
+    """text as an FTS5 string (matched as the phrase of its tokens)."""
+    return '"{}"'.format(text.replace('"', '""'))
+
+def _expense_documents(rows, participant_rows) -> List[Tuple[str, dict]]:
+    """Joins expense rows with their participant rows (ordered by expense id) into (id, document dict) pairs."""
+    participants: Dict[str, list] = {}
+    for expense_id, user_id, share_amount in participant_rows:
+        participants.setdefault(expense_id, []).append({'user_id': user_id, 'share_amount': share_amount})
+    return [(row[0], _expense_document(row, participants.get(row[0], []))) for row in rows]
+
+def _expense_document(row, participants: list) -> dict:
+    expense_id, description, amount, payer_id, group_id, created_at, recurring_id = row
+    document = {
+        'description': description,
+        'amount': amount,
+        'payer_id': payer_id,
+        'group_id': group_id,
+        'participants': participants,
+        'created_at': from_db_time(created_at),
+    }
+    if recurring_id is not None:
+        document['recurring_id'] = recurring_id
+    return document
+
+def _encode_job(record: dict) -> str:
+    return json.dumps({k: to_db_time(v) if k in _JOB_TIME_FIELDS else v for k, v in record.items()})
+
+def _decode_job(text: str) -> dict:
+    return {k: from_db_time(v) if k in _JOB_TIME_FIELDS else v for k, v in json.loads(text).items()}
+
+def _recurring_document(row) -> Tuple[str, dict]:
+    (recurring_id, group_id, description, amount, payer_id, participants, frequency, interval, start_at, end_at,
+     created_by, created_at, active, next_index, next_run_at, last_materialized_at) = row
+    return recurring_id, {
+        'group_id': group_id,
+        'description': description,
+        'amount': amount,
+        'payer_id': payer_id,
+        'participants': json.loads(participants),
+        'frequency': frequency,
+        'interval': interval,
+        'start_at': from_db_time(start_at),
+        'end_at': from_db_time(end_at),
+        'created_by': created_by,
+        'created_at': from_db_time(created_at),
+        'active': bool(active),
+        'next_index': next_index,
+        'next_run_at': from_db_time(next_run_at),
+        'last_materialized_at': from_db_time(last_materialized_at),
+    }
+
+class SqliteStore:
+    """
+    Storage operations the services need, on one SQLite database file.
+    Safe to share between threads and across fork: connections are per thread and per process.
+    """
+
+    def __init__(self, path: str, timeout: float = 10.0, cached_statements: int = 256):
+        self.path = path
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self.connection()
+        connection.execute("PRAGMA journal_mode=WAL") # Persistent; set once for the database file
+        connection.executescript(SCHEMA)
+        for table, column, definition in _SYNC_COLUMNS:
+            if column not in {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}:
+                connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        connection.executescript(SYNC_SCHEMA)
+        if connection.execute(_SELECT_SEARCH_INDEX_EXISTS).fetchone() is None:
+            # Indexes the expenses of databases created before search existed
+            connection.executescript(SEARCH_SCHEMA)
+            connection.execute(_REBUILD_SEARCH_INDEX)
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            # One connection per thread and process; autocommit mode, transactions are explicit
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False, cached_statements=self.cached_statements)
+            connection.execute("PRAGMA synchronous=NORMAL") # Durable across application crashes; WAL keeps the file consistent
+            connection.execute("PRAGMA foreign_keys=ON")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @contextmanager
+    def transaction(self, write: bool = True):
+        """
+        A transaction on this thread's connection. Writes take the write lock up front (BEGIN IMMEDIATE),
+        so they wait for the busy timeout instead of failing halfway; reads get one consistent snapshot.
+        """
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def ping(self):
+        self.connection().execute("SELECT 1").fetchone()
+
+    # Users
+
+    def get_user(self, user_id: str) -> Optional[dict]:
+        row = self.connection().execute(_SELECT_USER, (user_id,)).fetchone()
+        if row is None:
+            return None
+        firebase_uid, email, username, created_at = row
+        return {'firebase_uid': firebase_uid, 'email': email, 'username': username, 'created_at': from_db_time(created_at)}
+
+    def find_user_by_firebase_uid(self, firebase_uid: str) -> Optional[Tuple[str, dict]]:
+        row = self.connection().execute(_SELECT_USER_BY_FIREBASE_UID, (firebase_uid,)).fetchone()
+        if row is None:
+            return None
+        user_id, firebase_uid, email, username, created_at = row
+        return user_id, {'firebase_uid': firebase_uid, 'email': email, 'username': username, 'created_at': from_db_time(created_at)}
+
+    def create_user(self, user_data: dict) -> Tuple[str, dict]:
+        """Inserts the user unless one with the same firebase_uid exists (a concurrent registration); returns the stored user."""
+        self.connection().execute(_INSERT_USER, (_auto_id(), user_data['firebase_uid'], user_data.get('email'),
+                                                 user_data.get('username'), to_db_time(user_data['created_at'])))
+        return self.find_user_by_firebase_uid(user_data['firebase_uid'])
+
+    def user_exists(self, user_id: str) -> bool:
+        return self.connection().execute(_SELECT_USER_EXISTS, (user_id,)).fetchone() is not None
+
+    def get_usernames(self, user_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+        return dict(self.connection().execute(_SELECT_USERNAMES, (json.dumps(list(user_ids)),)).fetchall())
+
+    def memberships(self, group_id: str, user_ids: Iterable[str]) -> Tuple[Set[str], Set[str]]:
+        """(ids of the given users that exist, ids of those that are members of the group), in one query."""
+        rows = self.connection().execute(_SELECT_MEMBERSHIPS, (group_id, json.dumps(list(user_ids)))).fetchall()
+        return {user_id for user_id, _ in rows}, {user_id for user_id, member in rows if member}
+
+    # Groups
+
+    def group_exists(self, group_id: str) -> bool:
+        return self.connection().execute(_SELECT_GROUP_EXISTS, (group_id,)).fetchone() is not None
+
+    def create_group(self, group_data: dict, owner_id: str, member_firebase_uids: Iterable[str]) -> Tuple[str, List[str]]:
+        """
+        Inserts the group with the owner and the users with the given Firebase UIDs as members.
+        Returns (group id, UIDs that matched no user).
+        """
+        group_id = _auto_id()
+        member_firebase_uids = list(dict.fromkeys(member_firebase_uids))
+        with self.transaction() as connection:
+            created_at = to_db_time(group_data['created_at'])
+            connection.execute(_INSERT_GROUP, (group_id, group_data['name'], group_data.get('description'), owner_id, created_at))
+            found = dict(connection.execute(_SELECT_USER_IDS_BY_FIREBASE_UIDS, (json.dumps(member_firebase_uids),)).fetchall())
+            for user_id in dict.fromkeys([owner_id, *found]):
+                connection.execute(_INSERT_MEMBERSHIP, (group_id, user_id, created_at))
+        found_uids = set(found.values())
+        return group_id, [uid for uid in member_firebase_uids if uid not in found_uids]
+
+    def get_group(self, group_id: str) -> Optional[dict]:
+        """The group's fields plus its member ids, or None."""
+        with self.transaction(write=False) as connection:
+            row = connection.execute(_SELECT_GROUP, (group_id,)).fetchone()
+            if row is None:
+                return None
+            members = [user_id for user_id, in connection.execute(_SELECT_MEMBER_IDS, (group_id,))]
+        name, description, owner_id, created_at, version = row
+        return {'name': name, 'description': description, 'owner_id': owner_id,
+                'created_at': from_db_time(created_at), 'version': version, 'members': members}
+
+    def get_group_access(self, group_id: str) -> Optional[Tuple[str, List[str]]]:
+        """(owner id, member ids), or None if the group doesn't exist."""
+        with self.transaction(write=False) as connection:
+            row = connection.execute(_SELECT_GROUP_OWNER_VERSION, (group_id,)).fetchone()
+            if row is None:
+                return None
+            return row[0], [user_id for user_id, in connection.execute(_SELECT_MEMBER_IDS, (group_id,))]
+
+    def get_group_accesses(self, group_ids: List[str]) -> Dict[str, Tuple[str, List[str]]]:
+        """group id -> (owner id, member ids) for the groups that exist."""
+        ids = json.dumps(group_ids)
+        with self.transaction(write=False) as connection:
+            groups = {row[0]: (row[3], []) for row in connection.execute(_SELECT_GROUPS_BY_IDS, (ids,))}
+            for group_id, user_id in connection.execute(_SELECT_MEMBERS_OF_GROUPS, (ids,)):
+                groups[group_id][1].append(user_id)
+        return groups
+
+    def get_many(self, group_ids: List[str], expense_ids: List[str], user_ids: List[str]) -> Tuple[Dict[str, dict], Dict[str, dict], Dict[str, dict]]:
+        """Group (with member ids), expense and user documents by id, read in one transaction; missing ids are left out."""
+        group_ids, expense_ids = json.dumps(group_ids), json.dumps(expense_ids)
+        with self.transaction(write=False) as connection:
+            groups = {group_id: {'name': name, 'description': description, 'owner_id': owner_id,
+                                 'created_at': from_db_time(created_at), 'version': version, 'members': []}
+                      for group_id, name, description, owner_id, created_at, version in connection.execute(_SELECT_GROUPS_BY_IDS, (group_ids,))}
+            for group_id, user_id in connection.execute(_SELECT_MEMBERS_OF_GROUPS, (group_ids,)):
+                groups[group_id]['members'].append(user_id)
+            expenses = dict(_expense_documents(connection.execute(_SELECT_EXPENSES_BY_IDS, (expense_ids,)),
+                                               connection.execute(_SELECT_PAGE_PARTICIPANTS, (expense_ids,))))
+            users = {user_id: {'firebase_uid': firebase_uid, 'email': email, 'username': username, 'created_at': from_db_time(created_at)}
+                     for user_id, email, username, created_at, firebase_uid in connection.execute(_SELECT_USERS_BY_IDS, (json.dumps(user_ids),))}
+        return groups, expenses, users
+
+    def get_group_version(self, group_id: str) -> Optional[Tuple[str, int]]:
+        """(owner id, version), or None if the group doesn't exist."""
+        return self.connection().execute(_SELECT_GROUP_OWNER_VERSION, (group_id,)).fetchone()
+
+    def get_user_groups(self, user_id: str) -> List[Tuple[str, dict]]:
+        with self.transaction(write=False) as connection:
+            rows = connection.execute(_SELECT_USER_GROUPS, (user_id,)).fetchall()
+            members: Dict[str, List[str]] = {}
+            for group_id, member_id in connection.execute(_SELECT_USER_GROUPS_MEMBERS, (user_id,)):
+                members.setdefault(group_id, []).append(member_id)
+        return [(group_id, {'name': name, 'description': description, 'owner_id': owner_id,
+                            'created_at': from_db_time(created_at), 'version': version, 'members': members.get(group_id, [])})
+                for group_id, name, description, owner_id, created_at, version in rows]
+
+    def get_group_ids(self) -> List[str]:
+        return [group_id for group_id, in self.connection().execute(_SELECT_GROUP_IDS)]
+
+    def get_group_versions(self) -> Dict[str, int]:
+        """Every group's current version, by group id."""
+        return dict(self.connection().execute(_SELECT_GROUP_VERSIONS).fetchall())
+
+    def get_user_profiles(self) -> List[Tuple[str, Optional[str], datetime]]:
+        """(id, username, created_at) of every user."""
+        rows = self.connection().execute(_SELECT_USER_PROFILES)
+        return [(user_id, username, from_db_time(created_at)) for user_id, username, created_at in rows]
+
+    def get_user_group_ids(self, user_id: str) -> List[str]:
+        return [group_id for group_id, in self.connection().execute(_SELECT_USER_GROUP_IDS, (user_id,))]
+
+    def update_group(self, group_id: str, fields: dict) -> bool:
+        """Sets name/description (None keeps the current value) and bumps the version. False if the group doesn't exist."""
+        cursor = self.connection().execute(_UPDATE_GROUP, (fields.get('name'), fields.get('description'), group_id))
+        return cursor.rowcount > 0
+
+    def bump_group_version(self, group_id: str):
+        self.connection().execute(_BUMP_GROUP_VERSION, (group_id,))
+
+    @staticmethod
+    def _next_seq(connection: sqlite3.Connection, group_id: str) -> Optional[int]:
+        """Advances the group's version in the caller's write transaction; the new version is the change's sync_seq."""
+        connection.execute(_BUMP_GROUP_VERSION, (group_id,))
+        row = connection.execute(_SELECT_GROUP_VERSION, (group_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def delete_group(self, group_id: str) -> bool:
+        """Deletes the group; its memberships, expenses, participants and recurring templates go with it (ON DELETE CASCADE)."""
+        return self.connection().execute(_DELETE_GROUP, (group_id,)).rowcount > 0
+
+    def add_member(self, group_id: str, user_id: str, added_at: datetime) -> bool:
+        """False if the user already is a member."""
+        with self.transaction() as connection:
+            cursor = connection.execute(_ADD_MEMBERSHIP, {'group_id': group_id, 'user_id': user_id, 'added_at': to_db_time(added_at)})
+            if cursor.rowcount == 0:
+                return False
+            self._next_seq(connection, group_id)
+            connection.execute(_DELETE_TOMBSTONE, (group_id, 'member', user_id))
+            return True
+
+    def remove_member(self, group_id: str, user_id: str) -> bool:
+        """False if the user isn't a member."""
+        with self.transaction() as connection:
+            if connection.execute(_DELETE_MEMBERSHIP, (group_id, user_id)).rowcount == 0:
+                return False
+            seq = self._next_seq(connection, group_id)
+            connection.execute(_UPSERT_TOMBSTONE, (group_id, 'member', user_id, seq, to_db_time(datetime.utcnow())))
+            return True
+
+    # Expenses
+
+    @staticmethod
+    def _insert_expense(connection: sqlite3.Connection, expense_id: str, data: dict, sync_seq: Optional[int],
+                        if_missing: bool = False) -> bool:
+        created_at = to_db_time(data['created_at'])
+        cursor = connection.execute(_INSERT_EXPENSE_IF_MISSING if if_missing else _INSERT_EXPENSE,
+                                    (expense_id, data['group_id'], data['description'], data['amount'], data['payer_id'],
+                                     created_at, created_at, data.get('recurring_id'), sync_seq))
+        if cursor.rowcount == 0:
+            return False
+        connection.executemany(_INSERT_PARTICIPANT, [(expense_id, position, p['user_id'], p.get('share_amount'))
+                                                     for position, p in enumerate(data.get('participants') or ())])
+        return True
+
+    def add_expense(self, expense_data: dict, rollups: Optional[RollupDeltas] = None) -> Optional[str]:
+        """
+        Inserts the expense and returns its id, or None if the group doesn't exist (deleted meanwhile).
+        rollups(before, after), if given, are added to the rollups in the same transaction.
+        """
+        expense_id = _auto_id()
+        with self.transaction() as connection:
+            seq = self._next_seq(connection, expense_data['group_id'])
+            if seq is None:
+                return None # Nothing was written
+            self._insert_expense(connection, expense_id, expense_data, seq)
+            if rollups is not None:
+                self._add_rollups(connection, *rollups(None, expense_data))
+        return expense_id
+
+    def _get_expense(self, connection: sqlite3.Connection, expense_id: str) -> Optional[dict]:
+        row = connection.execute(_SELECT_EXPENSE, (expense_id,)).fetchone()
+        if row is None:
+            return None
+        return _expense_documents([row], connection.execute(_SELECT_EXPENSE_PARTICIPANTS, (expense_id,)))[0][1]
+
+    def get_expense(self, expense_id: str) -> Optional[dict]:
+        with self.transaction(write=False) as connection:
+            return self._get_expense(connection, expense_id)
+
+    def get_group_expenses(self, group_id: str) -> List[Tuple[str, dict]]:
+        with self.transaction(write=False) as connection:
+            rows = connection.execute(_SELECT_GROUP_EXPENSES, (group_id,)).fetchall()
+            return _expense_documents(rows, connection.execute(_SELECT_GROUP_PARTICIPANTS, (group_id,)))
+
+    def get_user_expenses(self, user_id: str) -> List[Tuple[str, dict]]:
+        with self.transaction(write=False) as connection:
+            rows = connection.execute(_SELECT_USER_EXPENSES, {'user_id': user_id}).fetchall()
+            return _expense_documents(rows, connection.execute(_SELECT_USER_PARTICIPANTS, {'user_id': user_id}))
+
+    def iter_group_expenses(self, group_id: str, start: Optional[Tuple[datetime, str]], page_size: int) -> Iterator[Tuple[str, dict]]:
+        """The group's expenses in (created_at, id) order from start (inclusive), read page_size at a time."""
+        created_at, expense_id = (to_db_time(start[0]), start[1]) if start else ('', '')
+        sql = _SELECT_GROUP_EXPENSE_PAGE
+        while True:
+            with self.transaction(write=False) as connection:
+                rows = connection.execute(sql, (group_id, created_at, expense_id, page_size)).fetchall()
+                ids = json.dumps([row[0] for row in rows])
+                page = _expense_documents(rows, connection.execute(_SELECT_PAGE_PARTICIPANTS, (ids,)))
+            yield from page
+            if len(rows) < page_size:
+                return
+            created_at, expense_id, sql = rows[-1][5], rows[-1][0], _SELECT_GROUP_EXPENSE_PAGE_AFTER
+
+    def update_expense(self, expense_id: str, fields: dict, rollups: Optional[RollupDeltas] = None) -> Optional[Tuple[dict, dict, str]]:
+        """
+        Applies description/amount/payer_id/participants; returns (document before, updated document,
+        update time), both read in the update's transaction, or None if missing. rollups as for add_expense.
+        """
+        with self.transaction() as connection:
+            current = self._get_expense(connection, expense_id)
+            if current is None:
+                return None
+            updated = dict(current, **{k: v for k, v in fields.items() if v is not None})
+            updated_at = to_db_time(datetime.utcnow())
+            seq = self._next_seq(connection, current['group_id'])
+            connection.execute(_UPDATE_EXPENSE, (updated['description'], updated['amount'], updated['payer_id'], updated_at, seq, expense_id))
+            if fields.get('participants') is not None:
+                connection.execute(_DELETE_EXPENSE_PARTICIPANTS, (expense_id,))
+                connection.executemany(_INSERT_PARTICIPANT, [(expense_id, position, p['user_id'], p.get('share_amount'))
+                                                             for position, p in enumerate(fields['participants'])])
+            updated = self._get_expense(connection, expense_id)
+            if rollups is not None:
+                self._add_rollups(connection, *rollups(current, updated))
+            return current, updated, updated_at
+
+    def delete_expense(self, expense_id: str, rollups: Optional[RollupDeltas] = None) -> Optional[dict]:
+        """
+        Deletes the expense, leaving a tombstone; returns the deleted document, or None if it didn't
+        exist. rollups as for add_expense.
+        """
+        with self.transaction() as connection:
+            current = self._get_expense(connection, expense_id)
+            if current is not None:
+                connection.execute(_DELETE_EXPENSE, (expense_id,))
+                seq = self._next_seq(connection, current['group_id'])
+                connection.execute(_UPSERT_TOMBSTONE, (current['group_id'], 'expense', expense_id, seq, to_db_time(datetime.utcnow())))
+                if rollups is not None:
+                    self._add_rollups(connection, *rollups(current, None))
+            return current
+
+    def expense_stats(self, group_id: str, payer_id: Optional[str] = None,
+                      start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[int, float]:
+        """(count, total amount) of the group's expenses, optionally of one payer and with created_at in [start, end)."""
+        conditions, parameters = ["group_id = ?"], [group_id]
+        if payer_id:
+            conditions.append("payer_id = ?")
+            parameters.append(payer_id)
+        if start:
+            conditions.append("created_at >= ?")
+            parameters.append(to_db_time(start))
+        if end:
+            conditions.append("created_at < ?")
+            parameters.append(to_db_time(end))
+        # At most eight distinct statements, each cached once prepared
+        sql = f"SELECT COUNT(*), COALESCE(SUM(amount), 0.0) FROM expenses WHERE {' AND '.join(conditions)}"
+        return tuple(self.connection().execute(sql, parameters).fetchone())
+
+    def group_balances(self, group_id: str) -> Optional[Dict[str, float]]:
+        """Unrounded balance (paid minus owed) of every member, or None if the group doesn't exist."""
+        with self.transaction(write=False) as connection:
+            if connection.execute(_SELECT_GROUP_EXISTS, (group_id,)).fetchone() is None:
+                return None
+            return dict(connection.execute(_SELECT_GROUP_BALANCES, {'group_id': group_id}).fetchall())
+
+    def rebuild_search_index(self):
+        with self.transaction() as connection:
+            connection.execute(_REBUILD_SEARCH_INDEX)
+
+    def search_expenses(self, words: List[str], user_id: str, group_id: Optional[str] = None,
+                        start: Optional[datetime] = None, end: Optional[datetime] = None,
+                        min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+                        limit: int = 20, offset: int = 0, max_matches: int = 1000) -> Tuple[List[Tuple[str, dict]], int, bool]:
+        """
+        Expenses whose description has a word starting with each of words, in group_id or else in the
+        user's groups: (page of (id, document) by bm25 rank then newest first, matches, complete).
+        Like the Firestore search, only the newest max_matches matches are ranked.
+        """
+        with self.transaction(write=False) as connection:
+            group_ids = [group_id] if group_id else [row[0] for row in connection.execute(_SELECT_USER_GROUP_IDS, (user_id,))]
+            if not group_ids:
+                return [], 0, True
+            # The tokenizer folds case, so the group terms only narrow the matches; e.group_id decides
+            match = '{} AND group_id : ({})'.format(' AND '.join(f'description : {_fts_string(word)}*' for word in words),
+                                                    ' OR '.join(_fts_string(group) for group in group_ids))
+            matches = self._search(connection, match, json.dumps(group_ids), start, end, min_amount, max_amount, max_matches)
+            # Best rank first (bm25 is lower for better matches); the stable sort keeps equal ranks newest first
+            matches.sort(key=lambda row: row[2])
+            page_ids = [expense_id for expense_id, _, _ in matches[offset:offset + limit]]
+            if not page_ids:
+                return [], len(matches), len(matches) < max_matches
+            ids = json.dumps(page_ids)
+            documents = dict(_expense_documents(connection.execute(_SELECT_EXPENSES_BY_IDS, (ids,)),
+                                                connection.execute(_SELECT_PAGE_PARTICIPANTS, (ids,))))
+        return [(expense_id, documents[expense_id]) for expense_id in page_ids if expense_id in documents], len(matches), len(matches) < max_matches
+
+    @staticmethod
+    def _search(connection: sqlite3.Connection, match: str, group_ids: str, start: Optional[datetime], end: Optional[datetime],
+                min_amount: Optional[float], max_amount: Optional[float], max_matches: int) -> List[tuple]:
+        """(id, created_at, rank) of the newest max_matches expenses matching, in the groups and ranges."""
+        conditions = ["expense_search MATCH ?", "e.group_id IN (SELECT value FROM json_each(?))"]
+        parameters = [match, group_ids]
+        for condition, value in (("e.created_at >= ?", to_db_time(start) if start else None),
+                                 ("e.created_at < ?", to_db_time(end) if end else None),
+                                 ("e.amount >= ?", min_amount), ("e.amount <= ?", max_amount)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        # At most sixteen distinct statements, each cached once prepared; the rank weighs the description only
+        sql = (f"SELECT e.id, e.created_at, bm25(expense_search, 1.0, 0.0) FROM expense_search JOIN expenses e ON e.rowid = expense_search.rowid "
+               f"WHERE {' AND '.join(conditions)} ORDER BY e.created_at DESC LIMIT ?")
+        return connection.execute(sql, parameters + [max_matches]).fetchall()
+
+    # Spending analytics rollups
+
+    @staticmethod
+    def _add_rollups(connection: sqlite3.Connection, groups: Dict[Tuple[str, str], list], members: Dict[Tuple[str, str, str], list]):
+        """Adds (group_id, month) -> [count, total] and (group_id, month, user_id) -> [paid, owed, count] to the rollups."""
+        # Rollups of a group deleted meanwhile would fail the foreign key; there is nothing left to count
+        existing = {group_id for group_id, _ in groups} | {group_id for group_id, _, _ in members}
+        existing = {group_id for group_id in existing if connection.execute(_SELECT_GROUP_EXISTS, (group_id,)).fetchone()}
+        connection.executemany(_ADD_GROUP_ROLLUP, [(group_id, month, count, total)
+                                                   for (group_id, month), (count, total) in groups.items() if group_id in existing])
+        connection.executemany(_ADD_MEMBER_ROLLUP, [(group_id, month, user_id, paid, owed, count)
+                                                    for (group_id, month, user_id), (paid, owed, count) in members.items() if group_id in existing])
+
+    def replace_rollups(self, group_id: str, groups: Dict[Tuple[str, str], list], members: Dict[Tuple[str, str, str], list]):
+        with self.transaction() as connection:
+            connection.execute(_DELETE_GROUP_ROLLUPS, (group_id,))
+            connection.execute(_DELETE_MEMBER_ROLLUPS, (group_id,))
+            self._add_rollups(connection, groups, members)
+
+    def get_rollups(self, group_id: str, start_month: Optional[str], end_month: Optional[str]) -> Tuple[List[tuple], List[tuple]]:
+        """([(month, count, total)], [(month, user_id, paid, owed, count)]) for the months in [start_month, end_month]."""
+        bounds = (group_id, start_month or '', end_month or '9999-99')
+        with self.transaction(write=False) as connection:
+            return (connection.execute(_SELECT_GROUP_ROLLUPS, bounds).fetchall(),
+                    connection.execute(_SELECT_MEMBER_ROLLUPS, bounds).fetchall())
+
+    # Recurring expense templates
+
+    def add_recurring(self, recurring_data: dict) -> str:
+        recurring_id = _auto_id()
+        data = recurring_data
+        self.connection().execute(_INSERT_RECURRING, (
+            recurring_id, data['group_id'], data['description'], data['amount'], data['payer_id'],
+            json.dumps(data['participants']), data['frequency'], data.get('interval') or 1,
+            to_db_time(data['start_at']), to_db_time(data.get('end_at')), data.get('created_by'), to_db_time(data['created_at']),
+            int(data.get('active', True)), data.get('next_index', 0), to_db_time(data.get('next_run_at')), None))
+        return recurring_id
+
+    def get_recurring(self, recurring_id: str) -> Optional[dict]:
+        row = self.connection().execute(_SELECT_RECURRING, (recurring_id,)).fetchone()
+        return _recurring_document(row)[1] if row is not None else None
+
+    def get_group_recurring(self, group_id: str) -> List[Tuple[str, dict]]:
+        return [_recurring_document(row) for row in self.connection().execute(_SELECT_GROUP_RECURRING, (group_id,))]
+
+    def get_due_recurring(self, now: datetime) -> List[Tuple[str, dict]]:
+        return [_recurring_document(row) for row in self.connection().execute(_SELECT_DUE_RECURRING, (to_db_time(now),))]
+
+    def delete_recurring(self, recurring_id: str) -> bool:
+        return self.connection().execute(_DELETE_RECURRING, (recurring_id,)).rowcount > 0
+
+    def materialize_recurring(self, plans: List[tuple], rollups: Optional[RollupDeltas] = None) -> Tuple[list, list]:
+        """
+        Writes planned occurrences in one transaction. plans are (recurring_id, read next_index,
+        occurrences, template update) as built by recurring_service; a template whose next_index
+        changed since it was read is skipped with its occurrences. rollups as for add_expense.
+        Returns (applied plans, skipped plans).
+        """
+        applied, skipped = [], []
+        with self.transaction() as connection:
+            for plan in plans:
+                recurring_id, read_index, occurrences, update = plan
+                cursor = connection.execute(_ADVANCE_RECURRING, (
+                    update['next_index'], to_db_time(update['next_run_at']), to_db_time(update['last_materialized_at']),
+                    int(update.get('active', True)), recurring_id, read_index))
+                if cursor.rowcount == 0:
+                    skipped.append(plan)
+                    continue
+                if occurrences:
+                    seq = self._next_seq(connection, occurrences[0][2]['group_id'])
+                    for expense_id, _, data in occurrences:
+                        if self._insert_expense(connection, expense_id, data, seq, if_missing=True) and rollups is not None:
+                            self._add_rollups(connection, *rollups(None, data))
+                applied.append(plan)
+        return applied, skipped
+
+    # Delta sync
+
+    def get_changes(self, group_id: str, since: Optional[int]) -> Optional[Tuple[dict, List[Tuple[str, dict]], List[str], List[dict]]]:
+        """
+        (group fields with all member ids, expenses, member ids, tombstones) changed after since, or
+        the whole group without tombstones when since is None; one snapshot. None if the group doesn't exist.
+        """
+        with self.transaction(write=False) as connection:
+            row = connection.execute(_SELECT_SYNC_GROUP, (group_id,)).fetchone()
+            if row is None:
+                return None
+            name, description, owner_id, created_at, version, sync_seq, sync_horizon = row
+            members = [user_id for user_id, in connection.execute(_SELECT_MEMBER_IDS, (group_id,))]
+            group = {'name': name, 'description': description, 'owner_id': owner_id, 'created_at': from_db_time(created_at),
+                     'version': version, 'sync_seq': sync_seq, 'sync_horizon': sync_horizon, 'members': members}
+            if since is None:
+                rows = connection.execute(_SELECT_GROUP_EXPENSES, (group_id,)).fetchall()
+                return group, _expense_documents(rows, connection.execute(_SELECT_GROUP_PARTICIPANTS, (group_id,))), members, []
+            rows = connection.execute(_SELECT_EXPENSES_SINCE, (group_id, since)).fetchall()
+            ids = json.dumps([row[0] for row in rows])
+            expenses = _expense_documents(rows, connection.execute(_SELECT_PAGE_PARTICIPANTS, (ids,)))
+            member_ids = [user_id for user_id, in connection.execute(_SELECT_MEMBER_IDS_SINCE, (group_id, since))]
+            tombstones = [{'kind': kind, 'item_id': item_id} for kind, item_id in connection.execute(_SELECT_TOMBSTONES_SINCE, (group_id, since))]
+            return group, expenses, member_ids, tombstones
+
+    def purge_tombstones(self, group_id: str, cutoff: datetime, limit: int) -> int:
+        """Deletes up to limit of the group's tombstones from before cutoff and raises its sync_horizon past them."""
+        with self.transaction() as connection:
+            rows = connection.execute(_SELECT_EXPIRED_TOMBSTONES, (group_id, to_db_time(cutoff), limit)).fetchall()
+            if not rows:
+                return 0
+            connection.execute(_RAISE_SYNC_HORIZON, (max(seq for _, _, seq in rows), group_id))
+            connection.executemany(_DELETE_TOMBSTONE, [(group_id, kind, item_id) for kind, item_id, _ in rows])
+            return len(rows)
+
+    # Background jobs
+
+    def create_job(self, record: dict, user_limit: Optional[int] = None, alive_since: Optional[datetime] = None) -> Optional[str]:
+        """
+        Stores a job record; None instead if the user already has user_limit queued or running jobs
+        with a heartbeat at or after alive_since. The count and the insert share one write transaction.
+        """
+        job_id = _auto_id()
+        with self.transaction() as connection:
+            # Finished jobs are kept until they expire; clearing them here needs no separate cleanup task
+            connection.execute(_DELETE_EXPIRED_JOBS, (to_db_time(datetime.utcnow()),))
+            if user_limit is not None:
+                live, = connection.execute(_COUNT_LIVE_USER_JOBS, (record['user_id'], to_db_time(alive_since))).fetchone()
+                if live >= user_limit:
+                    return None
+            connection.execute(_INSERT_JOB, (job_id, record['user_id'], record['status'], _encode_job(record),
+                                             to_db_time(record.get('expires_at'))))
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        row = self.connection().execute(_SELECT_JOB, (job_id,)).fetchone()
+        return _decode_job(row[0]) if row is not None else None
+
+    def update_job(self, job_id: str, fields: dict):
+        with self.transaction() as connection:
+            row = connection.execute(_SELECT_JOB, (job_id,)).fetchone()
+            if row is None:
+                return
+            record = dict(_decode_job(row[0]), **fields)
+            connection.execute(_UPDATE_JOB, (record['status'], _encode_job(record), to_db_time(record.get('expires_at')), job_id))